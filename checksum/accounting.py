@@ -0,0 +1,130 @@
+"""
+Resources used by the commands of the jobs: CPU time, bytes read, peak
+resident set size and wall time.
+
+A command is accounted for when it is reaped. Its CPU time and peak
+resident set size are those reported by `os.wait4`, and include the
+processes it started and waited for, e.g. the worker processes of the
+verifier or the checkers run by `checksum.sharded`. The bytes it read are
+taken from `/proc/<pid>/io` just before, while the exited command is a
+zombie, and include those of the same processes. They are unknown on
+systems without `/proc`.
+"""
+import collections
+import os
+import sys
+import threading
+import time
+
+
+# Resources used by a command.
+#
+# user_seconds, system_seconds: CPU time spent in user and kernel mode
+# bytes_read: bytes returned by read system calls, whether they were served
+#     from the page cache or not, None if unknown
+# storage_bytes_read: bytes the command caused to be fetched from storage,
+#     None if unknown
+# peak_rss: largest resident set size of the command or of any process it
+#     waited for, in bytes
+# wall_seconds: time from the start of the command to its exit
+ResourceUsage = collections.namedtuple(
+        "ResourceUsage",
+        [
+            "user_seconds", "system_seconds", "bytes_read",
+            "storage_bytes_read", "peak_rss", "wall_seconds",
+        ])
+
+# Unit of `ru_maxrss`: kilobytes on Linux, bytes on macOS.
+_MAXRSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+
+def read_io(pid):
+    """
+    Returns the number of bytes read by the process `pid` through read
+    system calls, and from storage, or Nones if they cannot be read.
+    """
+    try:
+        with open(f"/proc/{pid}/io") as f:
+            counters = dict(line.split(": ") for line in f.read().splitlines())
+        return int(counters["rchar"]), int(counters["read_bytes"])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+def reap(pid, started_at, block=True):
+    """
+    Reap the child process `pid` once it exits, with the resources it used.
+
+    Parameters
+    ----------
+    pid: int
+        a child process of this process, that was not reaped yet
+    started_at: float
+        when the process was started, as returned by `time.monotonic`
+    block: bool
+        if False, return right away if the process has not exited
+
+    Raises
+    ------
+    ChildProcessError
+        if the process is not a child of this process, or was reaped
+
+    Returns
+    -------
+    (int, ResourceUsage)
+        exit code of the process, negative if it was killed by a signal, and
+        the resources it used. None if `block` is False and the process has
+        not exited.
+    """
+    options = os.WEXITED | os.WNOWAIT
+    if not block:
+        options |= os.WNOHANG
+    if os.waitid(os.P_PID, pid, options) is None:
+        return None
+    bytes_read, storage_bytes_read = read_io(pid)
+    _, status, rusage = os.wait4(pid, 0)
+    return os.waitstatus_to_exitcode(status), ResourceUsage(
+            user_seconds=rusage.ru_utime,
+            system_seconds=rusage.ru_stime,
+            bytes_read=bytes_read,
+            storage_bytes_read=storage_bytes_read,
+            peak_rss=rusage.ru_maxrss * _MAXRSS_UNIT,
+            wall_seconds=time.monotonic() - started_at)
+
+
+class ResourceTotals:
+    """
+    Resources used by all the commands accounted for since the service
+    started, possibly from several threads.
+
+    Methods
+    -------
+    add(usage)
+        account for the `ResourceUsage` of a command
+    to_dict()
+        returns the number of commands accounted for, and the sums of their
+        resources. Bytes read are only summed over the commands they are
+        known for.
+    """
+
+    def __init__(self):
+        self.n_jobs = 0
+        self._sums = dict.fromkeys(ResourceUsage._fields, 0)
+        self._peak_rss = 0
+        self._lock = threading.Lock()
+
+    def add(self, usage):
+        with self._lock:
+            self.n_jobs += 1
+            for field, value in usage._asdict().items():
+                if value is not None:
+                    self._sums[field] += value
+            self._peak_rss = max(self._peak_rss, usage.peak_rss)
+
+    def to_dict(self):
+        with self._lock:
+            totals = {"n_jobs": self.n_jobs}
+            totals.update(self._sums)
+            # The peak of all jobs, rather than the sum of their peaks.
+            totals["peak_rss"] = self._peak_rss
+        return totals
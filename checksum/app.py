@@ -1,11 +1,24 @@
 
+import os
+
+from tornado.ioloop import IOLoop
 from tornado.web import URLSpec as url
 
+from arteria.exceptions import ArteriaUsageException
 from arteria.web.app import AppService
 
 from checksum.checksum_handlers import VersionHandler, StartHandler,\
-        StatusHandler, StopHandler
+        StatusHandler, StopHandler, MetricsHandler, ScrubHandler,\
+        BatchStartHandler, GroupStatusHandler, GroupStopHandler, LogHandler,\
+        PlanHandler, MerkleHandler, CHECKER_ALGORITHMS, DEFAULT_CHECKER_TOOL
 from checksum.runner_service import RunnerService
+from checksum.runfolder_index import RunfolderIndex
+from checksum.scrub import ScrubScheduler
+from checksum.webhooks import WebhookService
+from checksum.config import get_or_default
+from checksum.logs import compress_finished_log
+from checksum.planning import ThroughputHistory
+from checksum.verifier import DEFAULT_BLOCK_SIZE
 
 
 def routes(**kwargs):
@@ -22,18 +35,106 @@ def routes(**kwargs):
             name="version", kwargs=kwargs),
         url(r"/api/1.0/start/([\w_-]+)", StartHandler,
             name="start", kwargs=kwargs),
+        url(r"/api/1.0/start_batch", BatchStartHandler,
+            name="start_batch", kwargs=kwargs),
+        url(r"/api/1.0/plan/([\w_-]+)", PlanHandler,
+            name="plan", kwargs=kwargs),
         url(r"/api/1.0/status/(\d*)", StatusHandler,
             name="status", kwargs=kwargs),
         url(r"/api/1.0/stop/([\d|all]*)", StopHandler,
             name="stop", kwargs=kwargs),
+        url(r"/api/1.0/log/(\d+)", LogHandler,
+            name="log", kwargs=kwargs),
+        url(r"/api/1.0/merkle/(\d+)", MerkleHandler,
+            name="merkle", kwargs=kwargs),
+        url(r"/api/1.0/group/(\d+)", GroupStatusHandler,
+            name="group", kwargs=kwargs),
+        url(r"/api/1.0/group/(\d+)/stop", GroupStopHandler,
+            name="stop_group", kwargs=kwargs),
+        url(r"/api/1.0/metrics", MetricsHandler,
+            name="metrics", kwargs=kwargs),
+        url(r"/api/1.0/scrub", ScrubHandler,
+            name="scrub", kwargs=kwargs),
     ]
 
 
+def compose_scrub_scheduler(config, runner_service):
+    """
+    Instanciates the scheduler scrubbing `scrub_roots`, or returns None if
+    none are configured.
+    """
+    roots = get_or_default(config, "scrub_roots")
+    if not roots:
+        return None
+    # The md5sum files are checked with `checker_tool` by jobs, and so are
+    # in its algorithm.
+    checker_tool = get_or_default(
+            config, "checker_tool", DEFAULT_CHECKER_TOOL)
+    algorithm = CHECKER_ALGORITHMS.get(os.path.basename(checker_tool))
+    if algorithm is None:
+        raise ArteriaUsageException(
+                f"Runfolders checked with {checker_tool} cannot be scrubbed")
+    return ScrubScheduler(
+            runner_service,
+            config["monitored_directory"],
+            roots,
+            config["scrub_cache"],
+            config["md5_log_directory"],
+            config["scrub_bytes_per_day"],
+            slice_seconds=get_or_default(config, "scrub_slice_seconds", 3600),
+            manifest_pattern=get_or_default(
+                config, "scrub_md5sum_files", "*/md5_checksums"),
+            block_size=get_or_default(
+                config, "read_block_size", DEFAULT_BLOCK_SIZE),
+            algorithm=algorithm)
+
+
+def compose_finished_callback(config, throughput_history):
+    """
+    Returns the callback run by the runner service for every finished job:
+    learning the throughput of its storage device, then compressing its log
+    if `compress_logs` is on.
+    """
+    compress_logs = get_or_default(config, "compress_logs", False)
+
+    def finished(job):
+        throughput_history.job_finished(job)
+        if compress_logs:
+            compress_finished_log(job)
+
+    return finished
+
+
 def compose_application(config):
     """Instanciates all services"""
+    throughput_history = ThroughputHistory(
+            config["monitored_directory"],
+            storage_url=get_or_default(config, "storage_url"),
+            path=get_or_default(config, "throughput_history"))
+    runner_service = RunnerService(
+            history_len=config["history_len"],
+            max_running_jobs=get_or_default(config, "max_running_jobs"),
+            priority_aging=get_or_default(config, "priority_aging", 600),
+            preempt=get_or_default(config, "preempt_low_priority", False),
+            memory_budget=get_or_default(config, "memory_budget"),
+            poll_interval=get_or_default(config, "poll_interval", 1),
+            finished_callback=compose_finished_callback(
+                config, throughput_history))
     return {
         "config": config,
-        "runner_service": RunnerService(history_len=config["history_len"]),
+        "runner_service": runner_service,
+        "runfolder_index": RunfolderIndex(
+            config["monitored_directory"],
+            ttl=get_or_default(config, "runfolder_index_ttl", 30)),
+        "webhooks": WebhookService(
+            spool_path=get_or_default(config, "webhook_spool"),
+            max_attempts=get_or_default(config, "webhook_max_attempts", 10),
+            retry_delay=get_or_default(config, "webhook_retry_delay", 1),
+            max_retry_delay=get_or_default(
+                config, "webhook_max_retry_delay", 300),
+            batch_size=get_or_default(config, "webhook_batch_size", 50)),
+        "scrub_scheduler": compose_scrub_scheduler(config, runner_service),
+        "throughput_history": throughput_history,
         }
 
 
@@ -45,5 +146,10 @@ def start():
     config = app_svc.config_svc
 
     composed_service = compose_application(config)
+    # Send the notifications left pending by a previous run once the
+    # service is up.
+    IOLoop.current().add_callback(composed_service["webhooks"].resume)
+    if composed_service["scrub_scheduler"] is not None:
+        IOLoop.current().add_callback(composed_service["scrub_scheduler"].start)
 
     app_svc.start(routes(**composed_service))
@@ -0,0 +1,189 @@
+"""
+Accounting of the memory used for read buffers.
+
+The service hands every job a lease on a share of a global `MemoryBudget`
+before it starts, and the verifier of each job allocates its read buffers
+from a `BufferPool` bounded by that lease.
+"""
+import logging
+import mmap
+import threading
+
+
+log = logging.getLogger(__name__)
+
+# Buffers are page aligned, as required for O_DIRECT reads.
+ALIGNMENT = mmap.PAGESIZE
+
+
+def align(n_bytes):
+    """
+    Round `n_bytes` up to a multiple of `ALIGNMENT`.
+    """
+    return -(-n_bytes // ALIGNMENT) * ALIGNMENT
+
+
+class MemoryBudget:
+    """
+    Keeps track of memory leased by jobs against a fixed budget.
+
+    Attributes
+    ----------
+    budget: int
+        number of bytes that can be leased at the same time
+    in_use: int
+        number of bytes currently leased
+
+    Methods
+    -------
+    try_lease(owner, n_bytes)
+        lease memory if the budget allows it
+    release(owner)
+        release the memory leased by `owner`
+    usage()
+        returns the current usage of the budget
+    """
+
+    def __init__(self, budget):
+        """
+        Parameters
+        ----------
+        budget: int
+            number of bytes that can be leased at the same time
+        """
+        self.budget = budget
+        self.in_use = 0
+        self._leases = {}
+
+    def try_lease(self, owner, n_bytes):
+        """
+        Lease `n_bytes` to `owner`, unless that would exceed the budget.
+
+        Parameters
+        ----------
+        owner: hashable
+            who the memory is leased to, typically a job id. An owner holds
+            at most one lease.
+        n_bytes: int
+            number of bytes to lease
+
+        Raises
+        ------
+        ValueError
+            if `n_bytes` exceeds the whole budget, since such a lease could
+            never be granted
+
+        Returns
+        -------
+        bool
+            True if the lease was granted
+        """
+        if n_bytes > self.budget:
+            raise ValueError(
+                f"{n_bytes} bytes exceed the memory budget of "
+                f"{self.budget} bytes")
+        if owner in self._leases:
+            return True
+        if self.in_use + n_bytes > self.budget:
+            return False
+        self._leases[owner] = n_bytes
+        self.in_use += n_bytes
+        return True
+
+    def release(self, owner):
+        """
+        Release the memory leased by `owner`, if any.
+        """
+        self.in_use -= self._leases.pop(owner, 0)
+
+    def lease_of(self, owner):
+        """
+        Returns the number of bytes leased by `owner`.
+        """
+        return self._leases.get(owner, 0)
+
+    def usage(self):
+        """
+        Returns
+        -------
+        dict
+            the "budget", the number of bytes "in_use" and the number of
+            active "leases"
+        """
+        return {
+            "budget": self.budget,
+            "in_use": self.in_use,
+            "leases": len(self._leases),
+            }
+
+
+class BufferPool:
+    """
+    Pool of reusable, page aligned read buffers of one block size.
+
+    At most `limit` bytes of buffers are handed out at the same time. Callers
+    asking for a buffer while the pool is exhausted wait until one is
+    returned.
+
+    Methods
+    -------
+    acquire()
+        get a buffer
+    release(buf)
+        return a buffer to the pool
+    close()
+        free all buffers
+    """
+
+    def __init__(self, block_size, limit=None):
+        """
+        Parameters
+        ----------
+        block_size: int
+            size of each buffer, rounded up to `ALIGNMENT`
+        limit: int
+            maximum number of bytes of buffers handed out at the same time.
+            At least one buffer is always available. Unlimited if None.
+        """
+        self.block_size = align(block_size)
+        if limit is None:
+            self.max_buffers = None
+        else:
+            self.max_buffers = max(1, limit // self.block_size)
+        self._free = []
+        self._n_allocated = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """
+        Get a buffer, waiting for one to be released if the pool is exhausted.
+
+        Returns
+        -------
+        mmap.mmap
+        """
+        with self._cond:
+            while not self._free and self._n_allocated == self.max_buffers:
+                self._cond.wait()
+            if self._free:
+                return self._free.pop()
+            self._n_allocated += 1
+        return mmap.mmap(-1, self.block_size)
+
+    def release(self, buf):
+        """
+        Return a buffer obtained from `acquire` to the pool.
+        """
+        with self._cond:
+            self._free.append(buf)
+            self._cond.notify()
+
+    def close(self):
+        """
+        Free the buffers currently in the pool.
+        """
+        with self._cond:
+            for buf in self._free:
+                buf.close()
+            self._n_allocated -= len(self._free)
+            self._free = []
@@ -0,0 +1,152 @@
+"""
+Persistent record of the checksums computed for files.
+
+For every file verified with it, the cache remembers the digest computed, the
+size and modification time of the file at the time, when it was verified and
+with which result. It is a SQLite database, so that the verifiers of several
+jobs and the service may use it at the same time.
+"""
+import os
+import sqlite3
+import time
+
+
+# Maximum number of parameters bound in one query.
+_QUERY_CHUNK = 500
+
+
+def _key(path):
+    """
+    Returns the key of a file: its absolute path, or its URL as is. The bytes
+    of names that are not valid UTF-8, decoded with surrogate escapes, are
+    backslash-escaped, as SQLite only stores valid UTF-8 text.
+    """
+    if "://" not in path:
+        path = os.path.abspath(path)
+    return path.encode("utf-8", "surrogateescape").decode(
+            "utf-8", "backslashreplace")
+
+
+class ChecksumCache:
+    """
+    Checksums computed for files, keyed by absolute path, or by URL for
+    files read from remote storage.
+
+    Methods
+    -------
+    get(path)
+        returns what is known of a file
+    record(path, digest, size, mtime, result, verified_at=None)
+        record the verification of a file
+    last_verified(paths)
+        returns when each of the given files was last verified
+    close()
+        close the database
+    """
+
+    def __init__(self, path, timeout=30):
+        """
+        Parameters
+        ----------
+        path: str
+            path to the database, created if it does not exist
+        timeout: float
+            number of seconds to wait for another process writing to the
+            database
+        """
+        self._conn = sqlite3.connect(path, timeout=timeout)
+        # Readers do not block the writer, and the other way round.
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " path TEXT PRIMARY KEY,"
+            " digest TEXT,"
+            " size INTEGER,"
+            " mtime REAL,"
+            " verified_at REAL NOT NULL,"
+            " result TEXT NOT NULL)")
+        self._conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._conn.close()
+
+    def get(self, path):
+        """
+        Returns
+        -------
+        dict
+            the "digest", "size", "mtime", "verified_at" and "result" of the
+            last verification of the file, or None if it was never verified
+        """
+        row = self._conn.execute(
+            "SELECT digest, size, mtime, verified_at, result FROM files"
+            " WHERE path = ?",
+            (_key(path),)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(
+            ("digest", "size", "mtime", "verified_at", "result"), row))
+
+    def record(self, path, digest, size, mtime, result, verified_at=None):
+        """
+        Record the verification of a file, replacing the previous one. The
+        record is committed right away, so that it survives the verifier
+        being stopped.
+
+        Parameters
+        ----------
+        path: str
+            path to the file, or its URL
+        digest: str
+            digest computed, None if the file could not be read
+        size: int
+            size of the file when it was verified
+        mtime: float
+            modification time of the file when it was verified
+        result: str
+            result of the verification, e.g. "OK"
+        verified_at: float
+            time of the verification, in seconds since the epoch. Defaults
+            to now.
+        """
+        self._conn.execute(
+            "INSERT OR REPLACE INTO files"
+            " (path, digest, size, mtime, verified_at, result)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                _key(path), digest, size, mtime,
+                verified_at if verified_at is not None else time.time(),
+                result))
+        self._conn.commit()
+
+    def last_verified(self, paths):
+        """
+        Parameters
+        ----------
+        paths: [str]
+            absolute paths or URLs of files
+
+        Returns
+        -------
+        {str: float}
+            time each file was last verified, in seconds since the epoch.
+            Files never verified are left out.
+        """
+        paths_by_key = {_key(path): path for path in paths}
+        keys = list(paths_by_key)
+        last = {}
+        for i in range(0, len(keys), _QUERY_CHUNK):
+            chunk = keys[i:i + _QUERY_CHUNK]
+            last.update(
+                (paths_by_key[key], verified_at)
+                for key, verified_at in self._conn.execute(
+                    "SELECT path, verified_at FROM files WHERE path IN"
+                    f" ({', '.join('?' * len(chunk))})",
+                    chunk))
+        return last
@@ -1,36 +1,96 @@
 
+import collections
 import json
+import hashlib
 import logging
 import os
+import re
 import datetime
-import subprocess
+import glob
+import sys
+import urllib.parse
 
 
 from arteria.exceptions import ArteriaUsageException
 from arteria.web.state import State
 from arteria.web.handlers import BaseRestHandler
+from tornado.escape import json_encode, utf8
+from tornado.ioloop import IOLoop
 
 from checksum import __version__ as version
+from checksum.config import get_or_default
+from checksum.runner_service import PRIORITIES, PRIORITY_NORMAL
+from checksum.buffers import align
+from checksum.decompress import window_memory
+from checksum.logs import READ_SIZE, LogReader
+from checksum.merkle import MerkleTree
+from checksum.planning import plan, storage_device
+from checksum.storage import (
+        DEFAULT_CONNECTIONS, DEFAULT_RANGE_SIZE, http_buffer_memory)
+from checksum.verifier import (
+        READ_MODES, READ_MODE_CACHED, DEFAULT_BLOCK_SIZE, EXECUTORS,
+        EXECUTOR_THREADS, open_storage)
+from checksum.walker import DEFAULT_WALK_WORKERS
 
 log = logging.getLogger(__name__)
 
+# Size of the buffer `md5sum` reads files through.
+MD5SUM_BUFFER_SIZE = 32 * 1024
+
+DEFAULT_CHECKER_TOOL = "md5sum"
+
+# Digest algorithm of the verifier checking the same manifests as each
+# external checker, for jobs the checker cannot run.
+CHECKER_ALGORITHMS = {
+    "md5sum": "md5",
+    "sha1sum": "sha1",
+    "sha224sum": "sha224",
+    "sha256sum": "sha256",
+    "sha384sum": "sha384",
+    "sha512sum": "sha512",
+    }
+
 
 class BaseChecksumHandler(BaseRestHandler):
     """
     Base handler for checksum.
     """
 
-    def initialize(self, config, runner_service):
+    def initialize(
+            self, config, runner_service, runfolder_index, webhooks,
+            scrub_scheduler=None, throughput_history=None):
         """
         Ensures that any parameters feed to this are available
         to subclasses.
 
         :param: config configuration used by the service
         :param: runner_service to use.
+        :param: runfolder_index index of the runfolders in the monitored
+        directory
+        :param: webhooks service delivering notifications to callback URLs
+        :param: scrub_scheduler scheduler re-verifying archived runfolders,
+        None if scrubbing is not enabled
+        :param: throughput_history read throughput of past jobs, by storage
+        device, None if it is not kept
 
         """
         self.config = config
         self.runner_service = runner_service
+        self.runfolder_index = runfolder_index
+        self.webhooks = webhooks
+        self.scrub_scheduler = scrub_scheduler
+        self.throughput_history = throughput_history
+
+    @staticmethod
+    def run_blocking(fn, *args):
+        """
+        Run a function that may block, e.g. on the file system, in a worker
+        thread so that other requests are not held up.
+        :param: fn function to run
+        :param: args arguments passed to `fn`
+        :return: a future resolving to the result of `fn`
+        """
+        return IOLoop.current().run_in_executor(None, fn, *args)
 
 
 class VersionHandler(BaseChecksumHandler):
@@ -50,18 +110,12 @@ class StartHandler(BaseChecksumHandler):
     """
     Validate that the runfolder exists under monitored directories
     :param runfolder: The runfolder to check for
-    :param monitored_dir: The root in which the runfolder should exist
+    :param runfolder_index: Index of the runfolders in the monitored directory
     :return: True if this is a valid runfolder
     """
     @staticmethod
-    def _validate_runfolder_exists(runfolder, monitored_dir):
-        if os.path.isdir(monitored_dir):
-            sub_folders = [
-                    name for name in os.listdir(monitored_dir)
-                    if os.path.isdir(os.path.join(monitored_dir, name))]
-            return runfolder in sub_folders
-        else:
-            return False
+    def _validate_runfolder_exists(runfolder, runfolder_index):
+        return runfolder_index.contains(runfolder)
 
     @staticmethod
     def _validate_md5sum_path(runfolder, md5sum_file_path):
@@ -76,6 +130,50 @@ class StartHandler(BaseChecksumHandler):
 
         return is_sub_dir and os.path.isfile(md5sum_file_path)
 
+    @staticmethod
+    def _expand_md5sum_paths(monitored_dir, runfolder, requested):
+        """
+        Expand the md5sum files requested for a job: a path, a glob
+        pattern, or a list of them, relative to the runfolder. Patterns
+        must only match files in the runfolder, once symbolic links and
+        `..` are resolved.
+        :param: monitored_dir the monitored directory
+        :param: runfolder name of the runfolder
+        :param: requested the "path_to_md5_sum_file" of the request
+        :return: list of (path, path relative to the monitored directory)
+        of each md5sum file, without duplicates
+        """
+        if isinstance(requested, str):
+            requested = [requested]
+        if not requested or not all(isinstance(p, str) for p in requested):
+            raise ArteriaUsageException(
+                    "path_to_md5_sum_file should be a path or a list of paths")
+
+        path_to_runfolder = os.path.join(monitored_dir, runfolder)
+        real_runfolder = os.path.realpath(path_to_runfolder)
+        paths = []
+        for pattern in requested:
+            if glob.has_magic(pattern):
+                matches = sorted(glob.glob(
+                    os.path.join(glob.escape(path_to_runfolder), pattern)))
+                if not matches:
+                    raise ArteriaUsageException(
+                            f"No md5sum file matches {pattern}")
+                for match in matches:
+                    real_match = os.path.realpath(match)
+                    if not real_match.startswith(real_runfolder + os.sep):
+                        raise ArteriaUsageException(
+                                f"{pattern} matches {match}, which is not "
+                                f"in {runfolder}")
+                paths += [
+                    (match, os.path.relpath(match, monitored_dir))
+                    for match in matches]
+            else:
+                paths.append((
+                    os.path.join(path_to_runfolder, pattern),
+                    os.path.join(runfolder, pattern)))
+        return list(dict.fromkeys(paths))
+
     @staticmethod
     def _is_valid_log_dir(log_dir):
         """
@@ -85,70 +183,758 @@ class StartHandler(BaseChecksumHandler):
         """
         return os.path.isdir(log_dir)
 
-    async def post(self, runfolder):
+    def _get_read_mode(self, request_data):
         """
-        Start a checksumming process.
+        Get the read mode requested for this job, falling back on the
+        `read_mode` set in the app config.
+        :param: request_data body of the request
+        :return: one of `checksum.verifier.READ_MODES`
+        """
+        read_mode = request_data.get(
+                "read_mode",
+                get_or_default(self.config, "read_mode", READ_MODE_CACHED))
+        if read_mode not in READ_MODES:
+            raise ArteriaUsageException(
+                    f"Unknown read mode {read_mode}, "
+                    f"should be one of {READ_MODES}")
+        return read_mode
 
-        The request needs to pass the path the md5 sum file to check in
-        "path_to_md5_sum_file". This path has to point to a file in the
-        runfolder.
+    @staticmethod
+    def _hash_manifest(md5sum_file_paths):
+        """
+        Hash the content of the md5sum files, so that requests for the same
+        paths with a different content are never coalesced.
+        :param: md5sum_file_paths paths to the md5sum files
+        :return: hex digest of the content
+        """
+        digest = hashlib.sha256()
+        for md5sum_file_path in md5sum_file_paths:
+            with open(md5sum_file_path, mode='rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(block)
+        return digest.hexdigest()
 
-        :param runfolder: name of the runfolder we want to start checksumming
-        for.
+    @staticmethod
+    def _get_priority(request_data):
+        """
+        Get the priority requested for this job.
+        :param: request_data body of the request
+        :return: one of `checksum.runner_service.PRIORITIES`
+        """
+        priority = request_data.get("priority", PRIORITY_NORMAL)
+        if priority not in PRIORITIES:
+            raise ArteriaUsageException(
+                    f"Unknown priority {priority}, "
+                    f"should be one of {tuple(PRIORITIES)}")
+        return priority
 
+    @staticmethod
+    def _get_callback_url(request_data):
+        """
+        Get the URL to notify when the job is finished, if any.
+        :param: request_data body of the request
+        :return: the URL, or None
         """
+        callback_url = request_data.get("callback_url")
+        if callback_url is None:
+            return None
+        parsed = urllib.parse.urlparse(str(callback_url))
+        if parsed.scheme not in ("http", "https") or not parsed.netloc:
+            raise ArteriaUsageException(
+                    f"{callback_url} is not a valid http(s) callback URL")
+        return callback_url
 
-        monitored_dir = self.config["monitored_directory"]
+    def _status_link(self, job_id):
+        """
+        Build the link to the status of a job.
+        :param: job_id id of the job
+        :return: the absolute URL of the status end point of the job
+        """
+        return "{0}://{1}{2}".format(
+            self.request.protocol,
+            self.request.host,
+            self.reverse_url("status", job_id))
+
+    def _notify_callback(self, callback_url, runfolder):
+        """
+        Build the function notifying `callback_url` once a job is finished.
+        :param: callback_url URL to notify
+        :param: runfolder name of the runfolder checked by the job
+        :return: a function taking the finished `Job`
+        """
+        # Do not hold on to the handler until the job is finished.
+        webhooks = self.webhooks
+        base_url = f"{self.request.protocol}://{self.request.host}"
+        reverse_url = self.application.reverse_url
+
+        def notify(job):
+            webhooks.notify(callback_url, {
+                "job_id": job.job_id,
+                "state": job.get_status(),
+                "runfolder": runfolder,
+                "returncode": job.returncode,
+                "md5sum_log": job.log_path,
+                "link": base_url + reverse_url("status", job.job_id),
+                "service_version": version,
+                })
+
+        return notify
+
+    @staticmethod
+    def _build_command(
+            relative_paths_to_md5sum_files, read_mode,
+            report_path=None, profile=False, cprofile_path=None,
+            block_size=DEFAULT_BLOCK_SIZE, memory_limit=None,
+            decompress=False, inflate_threads=None, workers=1,
+            storage_url=None, storage_connections=DEFAULT_CONNECTIONS,
+            storage_range_size=DEFAULT_RANGE_SIZE,
+            checker_tool=DEFAULT_CHECKER_TOOL, checker_shards=1,
+            completeness_root=None, walk_workers=DEFAULT_WALK_WORKERS,
+            executor=EXECUTOR_THREADS, merkle_path=None, merkle_root=None):
+        """
+        Build the command checking the md5sum files. Jobs checking files on
+        the local file system, using the default read mode without profiling
+        or decompression, are handed to the external checker: `<tool> -c`
+        for a single md5sum file, or `checksum.sharded` running it on
+        `checker_shards` shards at once. Others are handed to the in-process
+        verifier, which reads files listed by several md5sum files once.
+        :param: relative_paths_to_md5sum_files paths to the md5sum files,
+        relative to the monitored directory
+        :param: read_mode one of `checksum.verifier.READ_MODES`
+        :param: report_path where the verifier writes its JSON report
+        :param: profile True to record where time is spent in the report
+        :param: cprofile_path where to dump cProfile statistics, if any
+        :param: block_size size of the reads of the verifier
+        :param: memory_limit bytes of read buffers the verifier may use
+        :param: decompress True to check gzip files against the digest of
+        their decompressed content
+        :param: inflate_threads number of threads inflating gzip files
+        :param: workers number of threads or processes of the verifier
+        hashing small files in batches
+        :param: storage_url URL of the object store the listed files are
+        read from, if they are not on the local file system
+        :param: storage_connections maximum number of connections to the
+        object store
+        :param: storage_range_size size of the ranges large objects are
+        fetched in
+        :param: checker_tool external checker, e.g. md5sum, sha256sum or
+        b3sum
+        :param: checker_shards number of external checkers run at once
+        :param: completeness_root directory walked for files that are not
+        listed, if any
+        :param: walk_workers number of threads walking `completeness_root`
+        :param: executor whether the workers of the verifier are threads
+        or processes, one of `checksum.verifier.EXECUTORS`
+        :param: merkle_path where to write the Merkle tree of the files, if
+        anywhere
+        :param: merkle_root directory the Merkle tree is rooted at
+        :return: the command as a list of arguments
+        """
+        external = (
+            not storage_url
+            and not completeness_root
+            and read_mode == READ_MODE_CACHED
+            and not profile
+            and not cprofile_path
+            and not decompress
+            and not merkle_path
+        )
+        if external and checker_shards > 1:
+            cmd = [sys.executable, "-m", "checksum.sharded"]
+            cmd += ["--tool", checker_tool]
+            cmd += ["--shards", str(checker_shards)]
+            if report_path:
+                cmd += ["--report", report_path]
+            return cmd + relative_paths_to_md5sum_files
+        if external and len(relative_paths_to_md5sum_files) == 1:
+            return [checker_tool, "-c", relative_paths_to_md5sum_files[0]]
+
+        algorithm = CHECKER_ALGORITHMS.get(os.path.basename(checker_tool))
+        if algorithm is None:
+            raise ArteriaUsageException(
+                    "Jobs with these options cannot be checked with "
+                    f"{checker_tool}")
+
+        cmd = [sys.executable, "-m", "checksum.verifier"]
+        if algorithm != "md5":
+            cmd += ["--algorithm", algorithm]
+        cmd += ["--read-mode", read_mode]
+        cmd += ["--block-size", str(block_size)]
+        if memory_limit:
+            cmd += ["--memory-limit", str(memory_limit)]
+        if workers > 1:
+            cmd += ["--workers", str(workers)]
+            if executor != EXECUTOR_THREADS:
+                cmd += ["--executor", executor]
+        if storage_url:
+            cmd += ["--storage", storage_url]
+            cmd += ["--storage-connections", str(storage_connections)]
+            cmd += ["--storage-range-size", str(storage_range_size)]
+        if completeness_root:
+            cmd += ["--completeness", completeness_root]
+            cmd += ["--walk-workers", str(walk_workers)]
+        if merkle_path:
+            cmd += ["--merkle", merkle_path]
+            if merkle_root:
+                cmd += ["--merkle-root", merkle_root]
+        if report_path:
+            cmd += ["--report", report_path]
+        if profile:
+            cmd += ["--profile"]
+        if cprofile_path:
+            cmd += ["--cprofile", cprofile_path]
+        if decompress:
+            cmd += ["--decompress"]
+            if inflate_threads:
+                cmd += ["--inflate-threads", str(inflate_threads)]
+        cmd += relative_paths_to_md5sum_files
+        return cmd
+
+    @staticmethod
+    def _buffer_memory(cmd, block_size, inflate_threads=None, workers=1,
+                       storage_connections=DEFAULT_CONNECTIONS,
+                       storage_range_size=DEFAULT_RANGE_SIZE):
+        """
+        Estimate the memory used for read buffers by a command built by
+        `_build_command`, including the data in flight while inflating
+        gzip files or fetching objects from an object store.
+        :param: cmd the command
+        :param: block_size size of the reads of the verifier
+        :param: inflate_threads number of threads inflating gzip files
+        :param: workers number of threads or processes of the verifier,
+        each reading through a buffer of its own. Processes also inflate
+        gzip files and fetch objects on their own.
+        :param: storage_connections maximum number of connections to the
+        object store
+        :param: storage_range_size size of the ranges large objects are
+        fetched in
+        :return: number of bytes
+        """
+        if "checksum.sharded" in cmd:
+            return MD5SUM_BUFFER_SIZE * int(cmd[cmd.index("--shards") + 1])
+        if "checksum.verifier" not in cmd:
+            return MD5SUM_BUFFER_SIZE
+        memory = align(block_size) * workers
+        # Worker processes share the inflate threads, and each fetch
+        # objects on its own connections.
+        n_copies = workers if "--executor" in cmd else 1
+        if "--decompress" in cmd:
+            inflate_threads = inflate_threads or os.cpu_count() or 1
+            memory += window_memory(
+                    max(1, inflate_threads // n_copies)) * n_copies
+        if "--storage" in cmd:
+            memory += http_buffer_memory(
+                    storage_connections, storage_range_size) * n_copies
+        return memory
+
+    @staticmethod
+    def _merkle_path(log_path):
+        """
+        Get where the Merkle tree of a job is written.
+        :param: log_path the log of the job
+        :return: the path to the tree, next to the log
+        """
+        return f"{log_path}.merkle.json"
+
+    @staticmethod
+    def _validate_job(monitored_dir, runfolder, runfolder_index, requested,
+                      hash_manifests):
+        """
+        Validate the runfolder and md5sum files of a job. Blocks on the file
+        system.
+        :param: monitored_dir the monitored directory
+        :param: runfolder name of the runfolder
+        :param: runfolder_index index of the runfolders in the monitored
+        directory
+        :param: requested the "path_to_md5_sum_file" of the request
+        :param: hash_manifests True to hash the content of the md5sum files
+        :return: the md5sum files, see `_expand_md5sum_paths`, and the digest
+        of their content, or None
+        """
         if not StartHandler._validate_runfolder_exists(
-                runfolder, monitored_dir):
+                runfolder, runfolder_index):
             raise ArteriaUsageException(
                     f"{runfolder} does not exist under {monitored_dir}!")
 
-        request_data = json.loads(self.request.body)
-
         path_to_runfolder = os.path.join(monitored_dir, runfolder)
-        path_to_md5_sum_file = os.path.join(
-                monitored_dir, runfolder, request_data["path_to_md5_sum_file"])
+        md5sum_files = StartHandler._expand_md5sum_paths(
+                monitored_dir, runfolder, requested)
+        for path_to_md5_sum_file, _ in md5sum_files:
+            if not StartHandler._validate_md5sum_path(
+                    path_to_runfolder, path_to_md5_sum_file):
+                raise ArteriaUsageException(
+                        f"{path_to_md5_sum_file} is not a valid file!")
 
-        if not StartHandler._validate_md5sum_path(
-                path_to_runfolder, path_to_md5_sum_file):
-            raise ArteriaUsageException(
-                    f"{path_to_md5_sum_file} is not a valid file!")
+        manifest_digest = None
+        if hash_manifests:
+            manifest_digest = StartHandler._hash_manifest(
+                    [path for path, _ in md5sum_files])
+        return md5sum_files, manifest_digest
 
+    def _prepare_job(self, runfolder, request_data, md5sum_files,
+                     manifest_digest):
+        """
+        Build the command of a validated job and the arguments it is
+        submitted to the runner service with.
+        :param: runfolder name of the runfolder
+        :param: request_data options of the job
+        :param: md5sum_files the md5sum files, see `_expand_md5sum_paths`
+        :param: manifest_digest digest of the content of the md5sum files,
+        None if requests are not coalesced
+        :return: the command, and the keyword arguments of
+        `RunnerService.submit`
+        """
+        monitored_dir = self.config["monitored_directory"]
         md5sum_log_dir = self.config["md5_log_directory"]
+        relative_paths_to_md5sum_files = [
+                relative_path for _, relative_path in md5sum_files]
 
-        if not StartHandler._is_valid_log_dir(md5sum_log_dir):
+        read_mode = self._get_read_mode(request_data)
+        priority = StartHandler._get_priority(request_data)
+        callback_url = StartHandler._get_callback_url(request_data)
+        profile = bool(request_data.get("profile", False))
+        cprofile = bool(request_data.get("cprofile", False))
+        decompress = bool(request_data.get("decompress", False))
+        completeness = bool(request_data.get("completeness", False))
+        merkle = bool(request_data.get("merkle", False))
+        inflate_threads = get_or_default(self.config, "inflate_threads")
+        workers = get_or_default(self.config, "verify_workers", 1)
+        executor = get_or_default(
+                self.config, "verify_executor", EXECUTOR_THREADS)
+        if executor not in EXECUTORS:
             raise ArteriaUsageException(
-                    f"{md5sum_log_dir} is not a directory.!")
+                    f"Unknown verify executor {executor}, "
+                    f"should be one of {EXECUTORS}")
+        storage_url = get_or_default(self.config, "storage_url")
+        storage_connections = get_or_default(
+                self.config, "storage_connections", DEFAULT_CONNECTIONS)
+        storage_range_size = get_or_default(
+                self.config, "storage_range_size", DEFAULT_RANGE_SIZE)
+        checker_tool = get_or_default(
+                self.config, "checker_tool", DEFAULT_CHECKER_TOOL)
+        checker_shards = get_or_default(self.config, "checker_shards", 1)
+        if completeness and storage_url:
+            raise ArteriaUsageException(
+                    "Completeness can only be checked on the local file "
+                    "system")
 
         date = datetime.datetime.now().isoformat()
+        md5sum_log_path = f"{md5sum_log_dir}/{runfolder}_{date}"
+        report_path = None
+        if (
+            profile or cprofile or len(md5sum_files) > 1
+            or checker_shards > 1 or completeness
+        ):
+            report_path = f"{md5sum_log_path}.report.json"
 
-        relative_path_to_md5sum_file = os.path.join(
-                runfolder, request_data["path_to_md5_sum_file"])
+        block_size = get_or_default(
+                self.config, "read_block_size", DEFAULT_BLOCK_SIZE)
 
-        cmd = ["md5sum",  "-c", relative_path_to_md5sum_file]
+        cmd = StartHandler._build_command(
+                relative_paths_to_md5sum_files,
+                read_mode,
+                report_path=report_path,
+                profile=profile,
+                cprofile_path=f"{md5sum_log_path}.prof" if cprofile else None,
+                block_size=block_size,
+                memory_limit=align(block_size) * workers,
+                decompress=decompress,
+                inflate_threads=inflate_threads,
+                workers=workers,
+                storage_url=storage_url,
+                storage_connections=storage_connections,
+                storage_range_size=storage_range_size,
+                checker_tool=checker_tool,
+                checker_shards=checker_shards,
+                completeness_root=runfolder if completeness else None,
+                walk_workers=get_or_default(
+                    self.config, "walk_workers", DEFAULT_WALK_WORKERS),
+                executor=executor,
+                merkle_path=(
+                    StartHandler._merkle_path(md5sum_log_path) if merkle
+                    else None),
+                merkle_root=runfolder)
 
-        with open(f"{md5sum_log_dir}/{runfolder}_{date}", mode='w') as md5sum_log_file:
-            job_id = await self.runner_service.start(
-                    cmd,
-                    cwd=monitored_dir,
-                    stdout=md5sum_log_file,
-                    stderr=subprocess.STDOUT)
+        key = None
+        if manifest_digest is not None:
+            key = (
+                tuple(relative_paths_to_md5sum_files),
+                manifest_digest,
+                read_mode,
+                profile,
+                cprofile,
+                completeness,
+                merkle,
+                decompress,
+                )
 
-        status_end_point = "{0}://{1}{2}".format(
-            self.request.protocol,
-            self.request.host,
-            self.reverse_url("status", job_id))
+        on_finished = None
+        if callback_url:
+            on_finished = self._notify_callback(callback_url, runfolder)
+
+        return cmd, {
+                "key": key,
+                "report_path": report_path,
+                "log_path": md5sum_log_path,
+                "priority": priority,
+                "memory": StartHandler._buffer_memory(
+                    cmd, block_size, inflate_threads, workers,
+                    storage_connections, storage_range_size),
+                "tags": {"runfolder": runfolder},
+                "on_finished": on_finished,
+                "cwd": monitored_dir,
+                # The checkers run by `checksum.sharded`, and the worker
+                # processes of the verifier, are stopped and suspended along
+                # with them.
+                "process_group": (
+                    "checksum.sharded" in cmd or "--executor" in cmd),
+                }
+
+    def _job_response(self, job_id, created, log_path, md5sum_files,
+                      priority):
+        """
+        Build the response describing a submitted job.
+        :param: job_id id of the job
+        :param: created False if the request was coalesced with a job in
+        flight
+        :param: log_path the log the job would have had if it was created
+        :param: md5sum_files the md5sum files, see `_expand_md5sum_paths`
+        :param: priority requested for the job
+        :return: the response as a dict
+        """
+        # Jobs that are not waiting for a slot have been started, even if
+        # they already ran to completion.
+        state = self.runner_service.status(job_id)
+        if state != State.PENDING:
+            state = State.STARTED
 
-        response_data = {
+        return {
                 "job_id": job_id,
                 "service_version": version,
-                "link": status_end_point,
-                "state": State.STARTED,
-                "md5sum_log": md5sum_log_file.name}
+                "link": self._status_link(job_id),
+                "state": state,
+                "priority": priority,
+                "coalesced": not created,
+                "md5sum_files": [
+                    relative_path for _, relative_path in md5sum_files],
+                "md5sum_log": (
+                    log_path if created
+                    else self.runner_service.log_path(job_id))}
+
+    async def post(self, runfolder):
+        """
+        Start a checksumming process.
+
+        The request needs to pass the path the md5 sum file to check in
+        "path_to_md5_sum_file". This path has to point to a file in the
+        runfolder. It can also be a glob pattern, or a list of paths and
+        patterns, to check several md5sum files in one job. Files listed by
+        more than one of them are then read once, and the status of the job
+        has the results of each md5sum file.
+
+        The optional "read_mode" selects how files are read: "cached" reads
+        through the page cache, "uncached" bypasses it with O_DIRECT (or drops
+        each block from it once read). Defaults to `read_mode` in the config.
+
+        Setting "decompress" to true checks gzip (including BGZF) files
+        against the digest of their decompressed content, for manifests
+        listing the checksums of uncompressed data. Other files are checked
+        as they are.
+
+        Setting "completeness" to true also walks the runfolder while files
+        are hashed, and reports the files in it that no md5sum file lists,
+        and the listed files missing from it, see the status endpoint.
+
+        Setting "profile" to true records where the job spends its time, see
+        the status endpoint. Setting "cprofile" to true also dumps cProfile
+        statistics next to the job log.
+
+        Setting "merkle" to true also rolls the digests of the files up into
+        a Merkle tree of the runfolder, see the merkle endpoint.
+
+        The optional "priority" is one of "high", "normal" (default) or "low".
+        When the service limits the number of running jobs, waiting jobs are
+        started by priority.
+
+        If a "callback_url" is given, the final state of the job is POSTed to
+        it once the job is finished, see the README for the format.
+
+        If an identical job is already pending or running, i.e. one checking
+        the same md5sum file, with the same content, and the same options,
+        its id is returned instead of starting a new one, and "coalesced" is
+        true in the response. This can be turned off with
+        `coalesce_requests` in the config.
+
+        :param runfolder: name of the runfolder we want to start checksumming
+        for.
+
+        """
+
+        request_data = json.loads(self.request.body)
+
+        md5sum_files, manifest_digest = await self.run_blocking(
+                StartHandler._validate_job,
+                self.config["monitored_directory"],
+                runfolder,
+                self.runfolder_index,
+                request_data.get("path_to_md5_sum_file"),
+                get_or_default(self.config, "coalesce_requests", True))
+
+        md5sum_log_dir = self.config["md5_log_directory"]
+
+        if not await self.run_blocking(
+                StartHandler._is_valid_log_dir, md5sum_log_dir):
+            raise ArteriaUsageException(
+                    f"{md5sum_log_dir} is not a directory.!")
+
+        cmd, kwargs = self._prepare_job(
+                runfolder, request_data, md5sum_files, manifest_digest)
+
+        try:
+            job_id, created = await self.runner_service.submit(
+                    cmd, **kwargs)
+        except ValueError as e:
+            raise ArteriaUsageException(str(e))
 
         self.set_status(202, reason="started processing")
-        self.write_object(response_data)
+        self.write_object(self._job_response(
+                job_id, created, kwargs["log_path"], md5sum_files,
+                kwargs["priority"]))
+
+
+class BatchStartHandler(StartHandler):
+    """
+    Start checksumming several runfolders as one group of jobs.
+    """
+
+    @staticmethod
+    def _validate_batch(monitored_dir, runfolder_index, log_dir, requests,
+                        hash_manifests, storage_url=None):
+        """
+        Validate the runfolders and md5sum files of all the jobs of a batch
+        in one go. Blocks on the file system.
+        :param: monitored_dir the monitored directory
+        :param: runfolder_index index of the runfolders in the monitored
+        directory
+        :param: log_dir directory the logs of the jobs are written to
+        :param: requests the options of each job
+        :param: hash_manifests True to hash the content of the md5sum files
+        :param: storage_url URL of the object store the files are read from,
+        if any
+        :return: for each job, its md5sum files, the digest of their content
+        (or None), and the storage device it reads from
+        """
+        errors = []
+        if not StartHandler._is_valid_log_dir(log_dir):
+            errors.append(f"{log_dir} is not a directory.!")
+
+        validated = []
+        for i, request in enumerate(requests):
+            runfolder = request["runfolder"]
+            try:
+                md5sum_files, manifest_digest = StartHandler._validate_job(
+                        monitored_dir, runfolder, runfolder_index,
+                        request.get("path_to_md5_sum_file"), hash_manifests)
+                device = storage_device(
+                        monitored_dir, runfolder, storage_url)
+            except (ArteriaUsageException, OSError) as e:
+                errors.append(f"jobs[{i}]: {e}")
+                continue
+            validated.append((md5sum_files, manifest_digest, device))
+
+        if errors:
+            raise ArteriaUsageException("; ".join(errors))
+        return validated
+
+    @staticmethod
+    def _interleave(devices):
+        """
+        Order jobs so that consecutive jobs read from different storage
+        devices where possible, keeping the requested order on each device.
+        :param: devices the device each job reads from
+        :return: the indexes of the jobs, in the order to submit them
+        """
+        by_device = collections.defaultdict(collections.deque)
+        for i, device in enumerate(devices):
+            by_device[device].append(i)
+        order = []
+        while by_device:
+            for device in list(by_device):
+                order.append(by_device[device].popleft())
+                if not by_device[device]:
+                    del by_device[device]
+        return order
+
+    async def post(self):
+        """
+        Start checksumming several runfolders in one request.
+
+        The request passes the jobs to start in "jobs", a list of objects
+        with the "runfolder" and "path_to_md5_sum_file" of each job, and any
+        of the options of the start end point. Options given next to "jobs"
+        apply to every job that does not set them.
+
+        All the jobs are validated before any is started: if one of them
+        is invalid, none is started and the errors of all of them are
+        returned. The jobs are started as one group, ordered so that
+        consecutive jobs read from different storage devices, and the
+        group can be followed and stopped as a whole, see the group end
+        points.
+
+        :return: the "group_id" and the "link" to the status of the group,
+        and the jobs as returned by the start end point, in the order they
+        were requested.
+        """
+        request_data = json.loads(self.request.body)
+        jobs = request_data.pop("jobs", None)
+        if not jobs or not isinstance(jobs, list) or not all(
+                isinstance(job, dict) for job in jobs):
+            raise ArteriaUsageException("jobs should be a list of jobs")
+
+        requests = [{**request_data, **job} for job in jobs]
+        errors = []
+        for i, request in enumerate(requests):
+            if not isinstance(request.get("runfolder"), str):
+                errors.append(f"jobs[{i}]: runfolder is missing")
+                continue
+            try:
+                self._get_read_mode(request)
+                StartHandler._get_priority(request)
+                StartHandler._get_callback_url(request)
+            except ArteriaUsageException as e:
+                errors.append(f"jobs[{i}]: {e}")
+        if errors:
+            raise ArteriaUsageException("; ".join(errors))
+
+        validated = await self.run_blocking(
+                BatchStartHandler._validate_batch,
+                self.config["monitored_directory"],
+                self.runfolder_index,
+                self.config["md5_log_directory"],
+                requests,
+                get_or_default(self.config, "coalesce_requests", True),
+                get_or_default(self.config, "storage_url"))
+
+        prepared = [
+                self._prepare_job(
+                    request["runfolder"], request, md5sum_files,
+                    manifest_digest)
+                for request, (md5sum_files, manifest_digest, _) in zip(
+                    requests, validated)]
+        order = BatchStartHandler._interleave(
+                [device for *_, device in validated])
+
+        try:
+            group_id, submitted = await self.runner_service.submit_group(
+                    [prepared[i] for i in order])
+        except (RuntimeError, ValueError) as e:
+            raise ArteriaUsageException(str(e))
+
+        responses = [None] * len(requests)
+        for i, (job_id, created) in zip(order, submitted):
+            _, kwargs = prepared[i]
+            responses[i] = {
+                    "runfolder": requests[i]["runfolder"],
+                    **self._job_response(
+                        job_id, created, kwargs["log_path"], validated[i][0],
+                        kwargs["priority"]),
+                    }
+
+        self.set_status(202, reason="started processing")
+        self.write_object({
+                "group_id": group_id,
+                "service_version": version,
+                "link": "{0}://{1}{2}".format(
+                    self.request.protocol,
+                    self.request.host,
+                    self.reverse_url("group", group_id)),
+                "jobs": responses,
+                })
+
+
+class PlanHandler(BaseChecksumHandler):
+    """
+    Estimate what checksumming a runfolder would take, without starting it.
+    """
+
+    @staticmethod
+    def _plan(monitored_dir, runfolder, md5sum_file_paths, history,
+              cache_path, storage_url, storage_connections,
+              storage_range_size):
+        """
+        Plan the job of a validated request. Blocks on the file system.
+        :param: monitored_dir the monitored directory
+        :param: runfolder name of the runfolder
+        :param: md5sum_file_paths paths to the md5sum files
+        :param: history read throughput of past jobs, or None
+        :param: cache_path checksum cache to look files up in, or None
+        :param: storage_url URL of the object store the listed files are
+        read from, if they are not on the local file system
+        :param: storage_connections maximum number of connections to the
+        object store
+        :param: storage_range_size size of the ranges large objects are
+        fetched in
+        :return: the plan, see `checksum.planning.plan`
+        """
+        device = storage_device(monitored_dir, runfolder, storage_url)
+        storage = None
+        if storage_url:
+            storage = open_storage(
+                    storage_url, storage_connections, storage_range_size)
+        try:
+            return plan(
+                    md5sum_file_paths, monitored_dir, device, history,
+                    cache_path, storage)
+        finally:
+            if storage is not None:
+                storage.close()
+
+    async def post(self, runfolder):
+        """
+        Plan a checksumming job without starting it or reading any of the
+        files it would check.
+
+        The request takes the same body as the start endpoint. The md5sum
+        files are parsed, and the files they list are stat'ed and looked up
+        in the checksum cache (`scrub_cache` in the config).
+
+        Returns the number of files listed ("n_files"), how many of them
+        are missing ("n_missing"), the number of improperly formatted lines
+        ("n_improper"), the "bytes" to read, the number of files and bytes
+        "unchanged" since they were last verified OK (null without a
+        cache), the storage "device" the files are read from, its read
+        throughput in "bytes_per_second" learned from past jobs
+        ("n_jobs_learned" of them), and the "estimated_seconds" of the job
+        (null until a job read from the device).
+
+        :param runfolder: name of the runfolder to plan checksumming for.
+        """
+        request_data = json.loads(self.request.body)
+        monitored_dir = self.config["monitored_directory"]
+
+        md5sum_files, _ = await self.run_blocking(
+                StartHandler._validate_job,
+                monitored_dir,
+                runfolder,
+                self.runfolder_index,
+                request_data.get("path_to_md5_sum_file"),
+                False)
+
+        result = await self.run_blocking(
+                PlanHandler._plan,
+                monitored_dir,
+                runfolder,
+                [path for path, _ in md5sum_files],
+                self.throughput_history,
+                get_or_default(self.config, "scrub_cache"),
+                get_or_default(self.config, "storage_url"),
+                get_or_default(
+                    self.config, "storage_connections", DEFAULT_CONNECTIONS),
+                get_or_default(
+                    self.config, "storage_range_size", DEFAULT_RANGE_SIZE))
+        result["md5sum_files"] = [
+                relative_path for _, relative_path in md5sum_files]
+        self.write_object(result)
 
 
 class StatusHandler(BaseChecksumHandler):
@@ -156,30 +942,492 @@ class StatusHandler(BaseChecksumHandler):
     Get the status of one or all jobs.
     """
 
-    def get(self, job_id):
+    FINAL_STATES = (State.DONE, State.ERROR, State.CANCELLED, State.NONE)
+
+    # Arguments asking for a page of the listing of all jobs, rather than
+    # the status of all jobs by id.
+    LISTING_ARGUMENTS = (
+            "state", "runfolder", "since", "until", "cursor", "limit",
+            "fields")
+
+    LISTING_STATES = (
+            State.PENDING, State.STARTED, State.DONE, State.ERROR,
+            State.CANCELLED)
+
+    @staticmethod
+    def _format_times(job):
         """
-        Get the status of the specified job_id, or if now id is given, the
-        status of all jobs.
-        :param job_id: to check status for (set to empty to get status for all)
+        Format the times of a job listed by the runner service as ISO 8601.
+        :param job: the job as a dict
+        :return: the job, with "created_at" and "finished_at" formatted
+        """
+        for key in ("created_at", "finished_at"):
+            if job.get(key) is not None:
+                job[key] = datetime.datetime.fromtimestamp(
+                        job[key]).isoformat()
+        return job
+
+    def _get_time_argument(self, name):
+        """
+        Get a time from the query, either as ISO 8601 or in seconds since
+        the epoch.
+        :param name: of the argument
+        :return: seconds since the epoch, or None if not given
+        """
+        value = self.get_argument(name, None)
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            pass
+        try:
+            return datetime.datetime.fromisoformat(value).timestamp()
+        except ValueError:
+            raise ArteriaUsageException(
+                    f"{name} should be an ISO 8601 date or a number of "
+                    f"seconds since the epoch")
+
+    def _get_int_argument(self, name):
+        """
+        Get a positive integer from the query.
+        :param name: of the argument
+        :return: the integer, or None if not given
+        """
+        value = self.get_argument(name, None)
+        if not value:
+            return None
+        try:
+            value = int(value)
+        except ValueError:
+            value = 0
+        if value < 1:
+            raise ArteriaUsageException(f"{name} should be a positive integer")
+        return value
+
+    def _get_list_argument(self, name):
+        """
+        Get the comma-separated values of an argument, which may be repeated.
+        :param name: of the argument
+        :return: the values, or None if not given
+        """
+        values = [
+                value
+                for argument in self.get_arguments(name)
+                for value in argument.split(",")
+                if value]
+        return values or None
+
+    def _list_jobs(self):
+        """
+        Build a page of the listing of all jobs, filtered by the arguments of
+        the request.
+        :return: the page as a dict
         """
+        states = self._get_list_argument("state")
+        if states is not None:
+            unknown = set(states) - set(StatusHandler.LISTING_STATES)
+            if unknown:
+                raise ArteriaUsageException(
+                        f"Unknown state(s): {', '.join(sorted(unknown))}")
+        runfolder = self.get_argument("runfolder", None)
 
+        page_size = get_or_default(self.config, "status_page_size", 100)
+        max_page_size = get_or_default(
+                self.config, "status_max_page_size", 1000)
+        limit = min(
+                self._get_int_argument("limit") or page_size, max_page_size)
+
+        jobs, next_cursor = self.runner_service.list_jobs(
+                states=states,
+                tags={"runfolder": runfolder} if runfolder else None,
+                since=self._get_time_argument("since"),
+                until=self._get_time_argument("until"),
+                cursor=self._get_int_argument("cursor"),
+                limit=limit)
+
+        fields = self._get_list_argument("fields")
+        if fields is not None:
+            jobs = [
+                    {
+                        key: value
+                        for key, value in job.items()
+                        if key == "job_id" or key in fields}
+                    for job in jobs]
+        return {
+                "jobs": [StatusHandler._format_times(job) for job in jobs],
+                "next_cursor": next_cursor,
+                }
+
+    async def _get_status(self, job_id):
+        """
+        Build the status returned for one or all jobs.
+        :param job_id: to check status for (set to empty to get status for all)
+        :return: the status as a dict
+        """
         if job_id:
             status = {"state": self.runner_service.status(int(job_id))}
+            status.update(self.runner_service.details(int(job_id)))
+            report = await self.runner_service.report(int(job_id)) or {}
+            if "manifests" in report:
+                status["manifests"] = report["manifests"]
+            if "completeness" in report:
+                status["completeness"] = report["completeness"]
+            if self.get_argument("profile", "0") not in ("", "0", "false"):
+                status["profile"] = report.get("profile")
+        elif any(
+                name in self.request.arguments
+                for name in StatusHandler.LISTING_ARGUMENTS):
+            status = self._list_jobs()
         else:
-            all_status = self.runner_service.status_all()
+            jobs, _ = self.runner_service.list_jobs()
             status = {
-                    k: {"state": v} for k, v in all_status.items()
+                    job.pop("job_id"): StatusHandler._format_times(job)
+                    for job in jobs
                     }
+        return status
+
+    def _get_wait(self):
+        """
+        Get the number of seconds a long-poll may be held, capped by
+        `long_poll_max_wait` in the config.
+        :return: number of seconds, 0 if the client does not want to wait
+        """
+        try:
+            wait = float(self.get_argument("wait", 0))
+        except ValueError:
+            raise ArteriaUsageException("wait should be a number of seconds")
+        max_wait = get_or_default(self.config, "long_poll_max_wait", 60)
+        return min(max(wait, 0), max_wait)
+
+    def _is_known_to_client(self, status):
+        """
+        Check whether the client already has this status, i.e. it sent no
+        If-None-Match header or one matching the ETag of the status.
+        :param status: the status as a dict
+        :return: True if the status would not tell the client anything new
+        """
+        if "If-None-Match" not in self.request.headers:
+            return True
+        etag = hashlib.sha1(utf8(json_encode(status))).hexdigest()
+        self.set_header("Etag", f'"{etag}"')
+        is_known = self.check_etag_header()
+        self.clear_header("Etag")
+        return is_known
+
+    async def get(self, job_id):
+        """
+        Get the status of the specified job_id, or if now id is given, the
+        status of all jobs. Along with its state, each job comes with its
+        priority and, while it waits to be dispatched, its queue position.
+
+        Jobs checking several md5sum files also come with the number of
+        files OK, failed and unreadable for each md5sum file, and jobs
+        started with "completeness" with the files of the runfolder that
+        are not listed ("untracked") and the listed files it lacks
+        ("missing").
+
+        Without a job id, the jobs can be filtered by `state` (comma
+        separated), `runfolder`, and creation time with `since` and `until`
+        (ISO 8601 or seconds since the epoch). The response is then a page
+        of at most `limit` jobs, newest first: {"jobs": [...],
+        "next_cursor": <id>}. Pass `cursor=<next_cursor>` to get the next
+        page, which is null after the last one. `fields` (comma separated)
+        selects the fields returned for each job.
+
+        Pass `profile=1` to also get where a job started with profiling
+        enabled spends its time: cumulative timings and histograms for
+        stat, open, read, hash and write, and the slowest files.
+
+        Responses carry an ETag: a request with a matching If-None-Match
+        header gets a 304 if the status did not change. Pass `wait=<seconds>`
+        to hold the request until the state of the job changes or the time
+        runs out, instead of polling.
+        :param job_id: to check status for (set to empty to get status for all)
+        """
+        wait = self._get_wait()
+
+        if job_id:
+            # Read the version first, so that a change happening while the
+            # status is built is not missed.
+            version = self.runner_service.version(int(job_id))
+        status = await self._get_status(job_id)
+
+        if (
+            job_id
+            and wait
+            and status["state"] not in StatusHandler.FINAL_STATES
+            and self._is_known_to_client(status)
+        ):
+            changed = await self.runner_service.wait_for_change(
+                    int(job_id), version, wait)
+            if changed:
+                status = await self._get_status(job_id)
 
         self.write_json(status)
 
 
+class LogHandler(BaseChecksumHandler):
+    """
+    Get the log of a job.
+    """
+
+    BYTE_RANGE = re.compile(r"bytes=(\d*)-(\d*)")
+
+    @staticmethod
+    def _parse_range(range_header, size):
+        """
+        Parse the Range header of a request for a log. Only single byte
+        ranges are supported, the whole log is served otherwise.
+        :param range_header: value of the Range header
+        :param size: number of bytes in the log
+        :return: the offsets of the first byte of the range and of the byte
+        after it, or None to serve the whole log
+        :raises ValueError: if the range is not satisfiable
+        """
+        match = LogHandler.BYTE_RANGE.fullmatch(range_header.strip())
+        if match is None or match.groups() == ("", ""):
+            return None
+        first, last = match.groups()
+        if not first:
+            # The last bytes of the log.
+            if not int(last) or not size:
+                raise ValueError("empty range")
+            return max(0, size - int(last)), size
+        start = int(first)
+        if last and int(last) < start:
+            return None
+        if start >= size:
+            raise ValueError("range starts after the end of the log")
+        end = int(last) + 1 if last else size
+        return start, min(end, size)
+
+    def _get_tail(self):
+        """
+        Get the number of lines requested from the end of the log.
+        :return: number of lines, None to serve the log by range
+        """
+        tail = self.get_argument("tail", None)
+        if tail is None:
+            return None
+        try:
+            tail = int(tail)
+        except ValueError:
+            raise ArteriaUsageException("tail should be a number of lines")
+        if tail < 0:
+            raise ArteriaUsageException("tail should be a number of lines")
+        return tail
+
+    def _log_truncated(self, job_id, offset, nothing_sent):
+        """
+        Give up serving a log that got shorter than the length announced,
+        e.g. because it was truncated or replaced while it was read.
+        :param job_id: id of the job
+        :param offset: offset in the log where reading came up short
+        :param nothing_sent: True if no part of the body was sent yet
+        """
+        log.warning(
+            f"Log of job {job_id} ended at byte {offset} while it was served")
+        if nothing_sent:
+            self.send_error(
+                    500, reason=f"Log of job {job_id} changed while read")
+        else:
+            # The length was sent with the headers: closing the connection
+            # is the only way to tell the client the body is incomplete.
+            self.request.connection.stream.close()
+
+    async def get(self, job_id):
+        """
+        Get the log of the job with the given id, as text, whether the job
+        is running or its log was compressed once it finished. The log is
+        streamed, a chunk at a time.
+
+        Pass `tail=<n>` to get the last n lines of the log only, or a Range
+        header (a single byte range, e.g. `bytes=1000-` or `bytes=-1000`)
+        to get part of it, answered with 206 Partial Content.
+        :param job_id: id of the job
+        """
+        tail = self._get_tail()
+        log_path = self.runner_service.log_path(int(job_id))
+        try:
+            if log_path is None:
+                raise FileNotFoundError()
+            reader = await self.run_blocking(LogReader, log_path)
+        except FileNotFoundError:
+            self.send_error(404, reason=f"No log found for job {job_id}")
+            return
+
+        try:
+            self.set_header("Content-Type", "text/plain; charset=UTF-8")
+            self.set_header("Accept-Ranges", "bytes")
+            start, end = 0, reader.size
+            range_header = self.request.headers.get("Range")
+            if tail is not None:
+                start = await self.run_blocking(reader.tail_offset, tail)
+            elif range_header:
+                try:
+                    byte_range = LogHandler._parse_range(
+                            range_header, reader.size)
+                except ValueError:
+                    self.set_status(416)
+                    self.set_header("Content-Range", f"bytes */{reader.size}")
+                    self.finish()
+                    return
+                if byte_range is not None:
+                    start, end = byte_range
+                    self.set_status(206)
+                    self.set_header(
+                            "Content-Range",
+                            f"bytes {start}-{end - 1}/{reader.size}")
+
+            self.set_header("Content-Length", end - start)
+            offset = start
+            while offset < end:
+                chunk = await self.run_blocking(
+                        reader.read, offset, min(READ_SIZE, end - offset))
+                if not chunk:
+                    self._log_truncated(job_id, offset, offset == start)
+                    return
+                self.write(chunk)
+                await self.flush()
+                offset += len(chunk)
+        finally:
+            reader.close()
+
+
+class MerkleHandler(BaseChecksumHandler):
+    """
+    Get the Merkle tree of the files of a runfolder, as checked by a job.
+    """
+
+    async def get(self, job_id):
+        """
+        Get the Merkle tree of the files checked by a job started with
+        "merkle", once it is finished: the digest of the runfolder, rolled
+        up from the digests of its files, directory by directory.
+
+        Pass `path=<path>`, relative to the runfolder, to get the digest of
+        a subtree. The response has the "path", "type" ("file" or
+        "directory") and "digest" of the node and, for a directory, the
+        number of files under it ("n_files") and the "children" it holds,
+        each with its "name", "type" and "digest", along with the
+        "algorithm" of the digests of the files. Comparing the digests of
+        the children of two copies of a runfolder tells which subtrees
+        differ, the others hold the same files.
+        :param job_id: id of the job
+        """
+        path = self.get_argument("path", "")
+        log_path = self.runner_service.log_path(int(job_id))
+        try:
+            if log_path is None:
+                raise FileNotFoundError()
+            merkle = await self.run_blocking(
+                    MerkleTree.load, StartHandler._merkle_path(log_path))
+        except FileNotFoundError:
+            self.send_error(
+                    404, reason=f"No Merkle tree found for job {job_id}")
+            return
+        except (OSError, ValueError) as e:
+            # E.g. a truncated or corrupt tree file.
+            self.send_error(
+                    500,
+                    reason=f"Cannot read the Merkle tree of job {job_id}: "
+                    f"{e}")
+            return
+
+        try:
+            subtree = merkle.subtree(path)
+        except KeyError:
+            self.send_error(
+                    404, reason=f"{path} is not in the Merkle tree")
+            return
+        subtree["algorithm"] = merkle.algorithm
+        self.write_object(subtree)
+
+
+class MetricsHandler(BaseChecksumHandler):
+    """
+    Get service-wide metrics.
+    """
+
+    def get(self):
+        """
+        Returns the number of jobs in each state, the usage of the memory
+        budget for read buffers, and the resources used by the jobs
+        finished since the service started.
+        """
+        self.write_object(self.runner_service.metrics())
+
+
+class ScrubHandler(BaseChecksumHandler):
+    """
+    Get the state of the scrubbing of archived runfolders.
+    """
+
+    def get(self):
+        """
+        Returns whether scrubbing is "running", "waiting" for the next slice
+        to be due or "paused" while other jobs run ("disabled" if no
+        `scrub_roots` are configured), the last slices of files verified,
+        and the files whose digest changed since they were last verified.
+        """
+        if self.scrub_scheduler is None:
+            self.write_object({"state": "disabled"})
+        else:
+            self.write_object(self.scrub_scheduler.status())
+
+
+class GroupStatusHandler(BaseChecksumHandler):
+    """
+    Get the status of a group of jobs started together.
+    """
+
+    def get(self, group_id):
+        """
+        Get the state of the group of jobs with the given id: "pending"
+        while all its jobs wait, "started" while any of them is in flight,
+        and once all of them are finished "error" if any failed, "cancelled"
+        if any was stopped, and "done" otherwise ("none" if the group is not
+        known). Along with it come the number of jobs in each state, and the
+        status of each job.
+        :param group_id: id of the group
+        """
+        status = self.runner_service.group_status(int(group_id))
+        if status is None:
+            status = {
+                    "group_id": int(group_id),
+                    "state": State.NONE,
+                    "jobs": []}
+        else:
+            status["created_at"] = datetime.datetime.fromtimestamp(
+                    status["created_at"]).isoformat()
+            status["jobs"] = [
+                    StatusHandler._format_times(job)
+                    for job in status["jobs"]]
+        self.write_json(status)
+
+
+class GroupStopHandler(BaseChecksumHandler):
+    """
+    Stop the jobs of a group.
+    """
+
+    async def post(self, group_id):
+        """
+        Stops all the jobs of the group with the given id.
+        :param group_id: id of the group
+        """
+        log.info(f"Attempting to stop group: {group_id}")
+        await self.runner_service.async_stop_group(int(group_id))
+        self.set_status(200)
+
+
 class StopHandler(BaseChecksumHandler):
     """
     Stop one or all jobs.
     """
 
-    def post(self, job_id):
+    async def post(self, job_id):
         """
         Stops the job with the specified id.
         :param job_id: of job to stop, or set to "all" to stop all jobs
@@ -187,12 +1435,12 @@ class StopHandler(BaseChecksumHandler):
         try:
             if job_id == "all":
                 log.info("Attempting to stop all jobs.")
-                self.runner_service.stop_all()
+                await self.runner_service.async_stop_all()
                 log.info("Stopped all jobs!")
                 self.set_status(200)
             elif job_id:
                 log.info("Attempting to stop job: {}".format(job_id))
-                self.runner_service.stop(int(job_id))
+                await self.runner_service.async_stop(int(job_id))
                 self.set_status(200)
             else:
                 ArteriaUsageException("Unknown job to stop")
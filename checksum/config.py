@@ -0,0 +1,17 @@
+def get_or_default(config, key, default=None):
+    """
+    Look up an optional key in the app config.
+
+    The arteria `ConfigurationService` only supports item access and raises
+    `KeyError` for keys that are absent from `app.config`.
+
+    :param config: configuration used by the service
+    :param key: key to look up
+    :param default: value returned when `key` is not configured
+    :return: the configured value, or `default`
+    """
+    try:
+        value = config[key]
+    except KeyError:
+        return default
+    return default if value is None else value
@@ -0,0 +1,308 @@
+"""
+Digests of the decompressed content of gzip files.
+
+Compressed data is fed to an `InflatingDigest`, like to any hashlib hash
+object, and the decompressed stream is hashed without being written
+anywhere. Inflation runs in worker threads, zlib and hashlib both release
+the GIL on large buffers, so that it overlaps with reading and hashing:
+
+* BGZF files (e.g. BAM, or bgzip compressed FASTQ) are made of small gzip
+  members whose sizes are stored in their headers. Batches of members are
+  inflated in parallel by a shared pool of workers.
+* Other gzip files, including multi-member ones, can only be inflated from
+  start to end since member boundaries are not known in advance. Their
+  inflation is pipelined with hashing in a dedicated worker.
+"""
+import collections
+import concurrent.futures
+import os
+import struct
+import zlib
+
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+# Size of the fixed part of a gzip member header.
+_GZIP_HEADER_SIZE = 10
+_FEXTRA = 0x04
+_BGZF_SUBFIELD = b"BC"
+
+# Number of bytes of compressed data inflated by one task.
+BATCH_SIZE = 1024 * 1024
+
+# Number of tasks in flight per worker. Bounds the memory used for
+# compressed and inflated data that has not been hashed yet.
+TASKS_PER_WORKER = 2
+
+# Typical ratio between the size of inflated and compressed data, used to
+# estimate the memory used by inflation.
+EXPANSION_RATIO = 4
+
+
+class DecompressError(ValueError):
+    """
+    Raised when data fed to an `InflatingDigest` is not valid gzip.
+    """
+    pass
+
+
+def window_memory(n_workers):
+    """
+    Returns an estimate of the number of bytes used by the data in flight of
+    one `InflatingDigest`.
+    """
+    return n_workers * TASKS_PER_WORKER * BATCH_SIZE * (1 + EXPANSION_RATIO)
+
+
+def _bgzf_block_size(header):
+    """
+    Returns the total size of the BGZF block starting with `header`, or None
+    if it is not a BGZF block.
+
+    Parameters
+    ----------
+    header: bytes
+        the start of a gzip member, at least up to the end of its extra
+        field
+    """
+    if header[:2] != GZIP_MAGIC or not header[3] & _FEXTRA:
+        return None
+    xlen, = struct.unpack_from("<H", header, _GZIP_HEADER_SIZE)
+    extra = header[_GZIP_HEADER_SIZE + 2:_GZIP_HEADER_SIZE + 2 + xlen]
+    offset = 0
+    while offset + 4 <= len(extra):
+        subfield = extra[offset:offset + 2]
+        slen, = struct.unpack_from("<H", extra, offset + 2)
+        if subfield == _BGZF_SUBFIELD and slen == 2:
+            bsize, = struct.unpack_from("<H", extra, offset + 4)
+            return bsize + 1
+        offset += 4 + slen
+    return None
+
+
+def _inflate_members(members):
+    """
+    Inflate complete gzip members, checking their CRC and size.
+    """
+    try:
+        return b"".join(zlib.decompress(member, 31) for member in members)
+    except zlib.error as e:
+        raise DecompressError(f"corrupt BGZF block: {e}")
+
+
+class _GzipStream:
+    """
+    Inflates a stream of concatenated gzip members from start to end.
+    """
+
+    def __init__(self):
+        self._inflater = None
+        self._n_members = 0
+
+    def inflate(self, data):
+        out = []
+        try:
+            while data:
+                if self._inflater is None:
+                    self._inflater = zlib.decompressobj(31)
+                    self._n_members += 1
+                out.append(self._inflater.decompress(data))
+                if not self._inflater.eof:
+                    break
+                data = self._inflater.unused_data
+                self._inflater = None
+        except zlib.error as e:
+            raise DecompressError(f"corrupt gzip data: {e}")
+        return b"".join(out)
+
+    def finish(self):
+        if self._inflater is not None or not self._n_members:
+            raise DecompressError("truncated gzip data")
+
+
+class InflatingDigest:
+    """
+    Hash-like object hashing the decompressed content of the gzip data it is
+    fed.
+
+    Data that does not start with the gzip magic number is hashed as is, so
+    that manifests may mix compressed and plain files.
+
+    Methods
+    -------
+    update(data)
+        feed compressed data
+    hexdigest()
+        wait for all data to be inflated and hashed, and return the digest
+        of the decompressed content
+    close()
+        release the resources of a digest that will not be finished
+    """
+
+    def __init__(self, digest, executor, n_workers):
+        """
+        Parameters
+        ----------
+        digest: hashlib hash object
+            digest of the decompressed content
+        executor: concurrent.futures.Executor
+            pool inflating BGZF blocks
+        n_workers: int
+            number of workers of `executor`
+        """
+        self._digest = digest
+        self._executor = executor
+        self._window = max(1, n_workers * TASKS_PER_WORKER)
+        self._in_flight = collections.deque()
+        self._buffer = bytearray()
+        # One of None (not known yet), "plain", "bgzf" or "gzip".
+        self._format = None
+        self._stream = None
+        self._stream_executor = None
+
+    def _detect_format(self):
+        """
+        Detect the format from the start of the data, once enough is
+        buffered. Returns False if more data is needed.
+        """
+        if len(self._buffer) < 2:
+            return False
+        if bytes(self._buffer[:2]) != GZIP_MAGIC:
+            self._format = "plain"
+            return True
+        if len(self._buffer) < _GZIP_HEADER_SIZE + 2:
+            return False
+        if self._buffer[3] & _FEXTRA:
+            xlen, = struct.unpack_from("<H", self._buffer, _GZIP_HEADER_SIZE)
+            if len(self._buffer) < _GZIP_HEADER_SIZE + 2 + xlen:
+                return False
+        if _bgzf_block_size(self._buffer) is not None:
+            self._format = "bgzf"
+        else:
+            self._format = "gzip"
+            self._stream = _GzipStream()
+            self._stream_executor = concurrent.futures.ThreadPoolExecutor(1)
+        return True
+
+    def _submit(self, executor, fn, *args):
+        self._in_flight.append(executor.submit(fn, *args))
+        while len(self._in_flight) > self._window:
+            self._digest.update(self._in_flight.popleft().result())
+
+    def _split_bgzf_blocks(self):
+        """
+        Submit the complete BGZF blocks buffered so far, in batches of about
+        `BATCH_SIZE` bytes.
+        """
+        blocks = []
+        n_bytes = 0
+        offset = 0
+        with memoryview(self._buffer) as view:
+            while len(view) - offset >= _GZIP_HEADER_SIZE + 2:
+                xlen, = struct.unpack_from(
+                        "<H", view, offset + _GZIP_HEADER_SIZE)
+                header_end = offset + _GZIP_HEADER_SIZE + 2 + xlen
+                if header_end > len(view):
+                    break
+                block_size = _bgzf_block_size(bytes(view[offset:header_end]))
+                if block_size is None:
+                    raise DecompressError("corrupt BGZF data")
+                if offset + block_size > len(view):
+                    break
+                blocks.append(bytes(view[offset:offset + block_size]))
+                offset += block_size
+                n_bytes += block_size
+                if n_bytes >= BATCH_SIZE:
+                    self._submit(self._executor, _inflate_members, blocks)
+                    blocks = []
+                    n_bytes = 0
+        if blocks:
+            self._submit(self._executor, _inflate_members, blocks)
+        del self._buffer[:offset]
+
+    def update(self, data):
+        """
+        Feed compressed data. `data` may be reused by the caller once this
+        returns.
+        """
+        if self._format is None:
+            self._buffer += data
+            if not self._detect_format():
+                return
+            data = bytes(self._buffer)
+            self._buffer = bytearray()
+
+        if self._format == "plain":
+            self._digest.update(data)
+        elif self._format == "gzip":
+            self._submit(self._stream_executor, self._stream.inflate,
+                         bytes(data))
+        else:
+            self._buffer += data
+            if len(self._buffer) >= BATCH_SIZE:
+                self._split_bgzf_blocks()
+
+    def hexdigest(self):
+        """
+        Wait for the data in flight, and return the digest of the
+        decompressed content.
+
+        Raises
+        ------
+        DecompressError
+            if the data is not valid gzip, or is truncated
+        """
+        try:
+            if self._format is None:
+                # Less than a gzip header: hash whatever there is as is.
+                self._format = "plain"
+                self._digest.update(bytes(self._buffer))
+            elif self._format == "bgzf":
+                self._split_bgzf_blocks()
+                if self._buffer:
+                    raise DecompressError("truncated BGZF data")
+            while self._in_flight:
+                self._digest.update(self._in_flight.popleft().result())
+            if self._stream is not None:
+                self._stream.finish()
+            return self._digest.hexdigest()
+        finally:
+            self.close()
+
+    def close(self):
+        for future in self._in_flight:
+            future.cancel()
+        self._in_flight.clear()
+        if self._stream_executor is not None:
+            self._stream_executor.shutdown(wait=False)
+            self._stream_executor = None
+
+
+class Inflater:
+    """
+    Pool of workers shared by the `InflatingDigest`s of a verification.
+
+    Methods
+    -------
+    wrap(digest)
+        returns an `InflatingDigest` feeding `digest`
+    close()
+        stop the workers
+    """
+
+    def __init__(self, n_workers=None):
+        """
+        Parameters
+        ----------
+        n_workers: int
+            number of worker threads. Defaults to the number of CPUs.
+        """
+        self.n_workers = n_workers or os.cpu_count() or 1
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+                self.n_workers, thread_name_prefix="inflate")
+
+    def wrap(self, digest):
+        return InflatingDigest(digest, self._executor, self.n_workers)
+
+    def close(self):
+        self._executor.shutdown()
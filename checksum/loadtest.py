@@ -0,0 +1,295 @@
+"""
+Load generator for the REST API of the checksum service.
+
+Many concurrent clients start jobs, poll their status and stop them, while
+a probe keeps asking for the version of the service. The latency of each
+kind of request is reported, so that a stalled event loop shows up as a
+high p99, in particular on the probe.
+
+Usage::
+
+    python -m checksum.loadtest --url http://localhost:9999 \\
+        --runfolder <runfolder> --md5sum-file <path> --jobs 500 --clients 100
+
+Identical requests are coalesced into a single job by the service, turn
+`coalesce_requests` off in its config to run as many jobs as requests.
+"""
+import argparse
+import asyncio
+import collections
+import json
+import math
+import sys
+import time
+
+from tornado.escape import json_encode
+from tornado.httpclient import AsyncHTTPClient, HTTPClientError
+
+
+PROG = "checksum-ws-loadtest"
+
+API_BASE = "/api/1.0"
+
+OPERATIONS = ("start", "status", "stop", "probe")
+
+PERCENTILES = (50, 90, 99)
+
+
+def percentile(sorted_values, p):
+    """
+    Returns the `p`th percentile of `sorted_values`, by the nearest-rank
+    method, or None if there are no values.
+    """
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class LatencyRecorder:
+    """
+    Latencies and errors of the requests made for each operation.
+
+    Methods
+    -------
+    add(operation, seconds, ok=True)
+        record one request
+    summary()
+        returns the count, errors and latency percentiles of each operation
+    """
+
+    def __init__(self):
+        self._latencies = collections.defaultdict(list)
+        self._errors = collections.Counter()
+
+    def add(self, operation, seconds, ok=True):
+        self._latencies[operation].append(seconds)
+        if not ok:
+            self._errors[operation] += 1
+
+    def summary(self):
+        """
+        Returns
+        -------
+        dict
+            for each operation, the number of requests ("count"), of failed
+            requests ("errors"), and the latency percentiles and maximum in
+            milliseconds ("p50", "p90", "p99", "max")
+        """
+        summary = {}
+        for operation in OPERATIONS:
+            latencies = sorted(self._latencies[operation])
+            stats = {
+                "count": len(latencies),
+                "errors": self._errors[operation],
+                }
+            for p in PERCENTILES:
+                value = percentile(latencies, p)
+                stats[f"p{p}"] = value * 1000 if value is not None else None
+            stats["max"] = latencies[-1] * 1000 if latencies else None
+            summary[operation] = stats
+        return summary
+
+
+async def _request(client, recorder, operation, url, **kwargs):
+    """
+    Make one request and record its latency.
+
+    Returns
+    -------
+    dict
+        the decoded JSON body, or None if the request failed
+    """
+    start = time.perf_counter()
+    try:
+        response = await client.fetch(url, **kwargs)
+    except (HTTPClientError, OSError):
+        recorder.add(operation, time.perf_counter() - start, ok=False)
+        return None
+    recorder.add(operation, time.perf_counter() - start)
+    return json.loads(response.body) if response.body else {}
+
+
+async def _client(
+        client, recorder, url, runfolder, body, jobs, n_polls, poll_interval):
+    """
+    Start, poll and stop jobs until there are none left to run.
+    """
+    while True:
+        try:
+            jobs.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+
+        started = await _request(
+                client, recorder, "start",
+                f"{url}{API_BASE}/start/{runfolder}",
+                method="POST", body=json_encode(body))
+        if started is None:
+            continue
+        job_id = started["job_id"]
+
+        for _ in range(n_polls):
+            await _request(
+                    client, recorder, "status",
+                    f"{url}{API_BASE}/status/{job_id}")
+            await asyncio.sleep(poll_interval)
+
+        await _request(
+                client, recorder, "stop",
+                f"{url}{API_BASE}/stop/{job_id}",
+                method="POST", body="")
+
+
+async def _probe(client, recorder, url, interval, done):
+    """
+    Ask for the version of the service every `interval` seconds until
+    `done` is set.
+    """
+    while not done.is_set():
+        await _request(client, recorder, "probe", f"{url}{API_BASE}/version")
+        try:
+            await asyncio.wait_for(done.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run_load_test(
+        url, runfolder, md5sum_file, n_jobs=100, n_clients=10, n_polls=5,
+        poll_interval=0.1, probe_interval=0.05, extra_body=None):
+    """
+    Run a load test against a running service.
+
+    Parameters
+    ----------
+    url: str
+        base URL of the service, e.g. http://localhost:9999
+    runfolder: str
+        runfolder to start jobs for
+    md5sum_file: str
+        path to the md5sum file, relative to the runfolder
+    n_jobs: int
+        number of jobs to start
+    n_clients: int
+        number of concurrent clients
+    n_polls: int
+        number of status requests made for each job before stopping it
+    poll_interval: float
+        number of seconds between two status requests of a client
+    probe_interval: float
+        number of seconds between two requests of the probe
+    extra_body: dict
+        options added to the body of the start requests
+
+    Returns
+    -------
+    dict
+        the summary of `LatencyRecorder`, and the "wall_seconds" the test
+        took
+    """
+    body = {"path_to_md5_sum_file": md5sum_file, **(extra_body or {})}
+    jobs = asyncio.Queue()
+    for i in range(n_jobs):
+        jobs.put_nowait(i)
+
+    # One more connection for the probe, so it never waits for the clients.
+    client = AsyncHTTPClient(force_instance=True, max_clients=n_clients + 1)
+    recorder = LatencyRecorder()
+    done = asyncio.Event()
+    start = time.perf_counter()
+    try:
+        probe = asyncio.ensure_future(
+                _probe(client, recorder, url, probe_interval, done))
+        await asyncio.gather(*(
+            _client(
+                client, recorder, url, runfolder, body, jobs, n_polls,
+                poll_interval)
+            for _ in range(n_clients)))
+        done.set()
+        await probe
+    finally:
+        client.close()
+
+    return {
+        "wall_seconds": time.perf_counter() - start,
+        **recorder.summary(),
+        }
+
+
+def format_summary(summary):
+    """
+    Returns the summary of a load test as a table.
+    """
+    columns = ["count", "errors", *(f"p{p}" for p in PERCENTILES), "max"]
+    lines = [
+        "{:<8}".format("") + "".join(f"{c:>10}" for c in columns)]
+    for operation in OPERATIONS:
+        stats = summary[operation]
+        cells = []
+        for column in columns:
+            value = stats[column]
+            if value is None:
+                cells.append(f"{'-':>10}")
+            elif isinstance(value, float):
+                cells.append(f"{value:>10.1f}")
+            else:
+                cells.append(f"{value:>10}")
+        lines.append(f"{operation:<8}" + "".join(cells))
+    lines.append(f"latencies in ms, {summary['wall_seconds']:.1f}s in total")
+    return "\n".join(lines)
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(
+        prog=PROG,
+        description=(
+            "Measure the latency of the REST API of the checksum service "
+            "under many concurrent jobs and clients."))
+    parser.add_argument(
+        "--url", default="http://localhost:9999",
+        help="base URL of the service (default: %(default)s)")
+    parser.add_argument(
+        "--runfolder", required=True,
+        help="runfolder to start jobs for")
+    parser.add_argument(
+        "--md5sum-file", required=True,
+        help="path to the md5sum file, relative to the runfolder")
+    parser.add_argument(
+        "--jobs", type=int, default=100,
+        help="number of jobs to start (default: %(default)s)")
+    parser.add_argument(
+        "--clients", type=int, default=10,
+        help="number of concurrent clients (default: %(default)s)")
+    parser.add_argument(
+        "--polls", type=int, default=5,
+        help=(
+            "number of status requests for each job before stopping it "
+            "(default: %(default)s)"))
+    parser.add_argument(
+        "--poll-interval", type=float, default=0.1,
+        help="seconds between status requests (default: %(default)s)")
+    parser.add_argument(
+        "--json", action="store_true",
+        help="print the results as JSON")
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    args = parse_args(args)
+    summary = asyncio.run(run_load_test(
+        args.url,
+        args.runfolder,
+        args.md5sum_file,
+        n_jobs=args.jobs,
+        n_clients=args.clients,
+        n_polls=args.polls,
+        poll_interval=args.poll_interval))
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print(format_summary(summary))
+    return int(any(summary[operation]["errors"] for operation in OPERATIONS))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,261 @@
+"""
+Logs of the jobs, compressed once their job is finished, and read by range.
+
+The log of a finished job is compressed next to it, as `<log>.gz`, in the
+BGZF format: a gzip file made of independent members of at most 64 KiB of
+data, each recording its compressed size in its header and its data size
+in its trailer. Compressed logs stay readable with `zcat`, and any range of
+their content is read by inflating only the members holding it, so that
+neither plain nor compressed logs are ever loaded whole.
+"""
+import asyncio
+import bisect
+import logging
+import os
+import struct
+import zlib
+
+
+log = logging.getLogger(__name__)
+
+
+COMPRESSED_SUFFIX = ".gz"
+
+# Size of the chunks logs are read and served in.
+READ_SIZE = 64 * 1024
+
+# Number of bytes of data in each member of a compressed log, as `bgzip`.
+BGZF_BLOCK_SIZE = 65280
+
+# Header of a BGZF member: gzip magic, deflate, FEXTRA, no mtime, no extra
+# flags, unknown OS, and an extra field holding the "BC" subfield with the
+# size of the member minus one.
+_BGZF_HEADER = struct.Struct("<4sIBBH2sHH")
+_BGZF_PREFIX = b"\x1f\x8b\x08\x04"
+_BGZF_TRAILER = struct.Struct("<II")
+
+# Empty member ending BGZF files.
+BGZF_EOF = bytes.fromhex(
+        "1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+
+def _bgzf_member(data):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    cdata = compressor.compress(data) + compressor.flush()
+    size = _BGZF_HEADER.size + len(cdata) + _BGZF_TRAILER.size
+    return b"".join((
+        _BGZF_HEADER.pack(
+            _BGZF_PREFIX, 0, 0, 0xff, 6, b"BC", 2, size - 1),
+        cdata,
+        _BGZF_TRAILER.pack(zlib.crc32(data), len(data)),
+        ))
+
+
+def compress_log(path):
+    """
+    Compress a log to `<path>.gz` and remove it. Blocks on the file system.
+
+    The compressed log is written under a temporary name first, so that the
+    log can be read, compressed or not, all along.
+
+    Returns
+    -------
+    str
+        path to the compressed log
+    """
+    compressed_path = path + COMPRESSED_SUFFIX
+    tmp_path = compressed_path + ".tmp"
+    try:
+        with open(path, "rb") as src, open(tmp_path, "wb") as dst:
+            while True:
+                data = src.read(BGZF_BLOCK_SIZE)
+                if not data:
+                    break
+                dst.write(_bgzf_member(data))
+            dst.write(BGZF_EOF)
+            stat = os.fstat(src.fileno())
+        os.utime(tmp_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        os.replace(tmp_path, compressed_path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    os.unlink(path)
+    return compressed_path
+
+
+def compress_finished_log(job):
+    """
+    Compress the log of a finished job in a worker thread, see
+    `checksum.runner_service.RunnerService`. Jobs without a log are left
+    alone.
+    """
+    if not job.log_path:
+        return
+
+    def compress():
+        try:
+            compress_log(job.log_path)
+        except FileNotFoundError:
+            # The job never started, or its log is already compressed.
+            pass
+        except OSError as e:
+            log.warning(f"Could not compress log of job {job.job_id}: {e}")
+
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        compress()
+    else:
+        loop.run_in_executor(None, compress)
+
+
+class _PlainLog:
+    def __init__(self, f):
+        self._f = f
+        self.size = os.fstat(f.fileno()).st_size
+
+    def read(self, offset, length):
+        self._f.seek(offset)
+        return self._f.read(length)
+
+    def close(self):
+        self._f.close()
+
+
+class _CompressedLog:
+    """
+    A log compressed by `compress_log`, whose members are found by walking
+    their headers and trailers.
+    """
+
+    def __init__(self, f):
+        self._f = f
+        # Offset of each member in the file, and of its data in the log.
+        self._members = []
+        self._offsets = []
+        self.size = 0
+        end = os.fstat(f.fileno()).st_size
+        offset = 0
+        while offset < end:
+            f.seek(offset)
+            header = f.read(_BGZF_HEADER.size)
+            if len(header) < _BGZF_HEADER.size or not header.startswith(
+                    _BGZF_PREFIX):
+                raise ValueError(f"{f.name} is not a compressed log")
+            member_size = _BGZF_HEADER.unpack(header)[-1] + 1
+            f.seek(offset + member_size - _BGZF_TRAILER.size)
+            _, data_size = _BGZF_TRAILER.unpack(
+                    f.read(_BGZF_TRAILER.size))
+            if data_size:
+                self._members.append((offset, member_size))
+                self._offsets.append(self.size)
+                self.size += data_size
+            offset += member_size
+        self._cached = (None, b"")
+
+    def _inflate(self, index):
+        if self._cached[0] != index:
+            offset, member_size = self._members[index]
+            self._f.seek(offset)
+            self._cached = (
+                index, zlib.decompress(self._f.read(member_size), 31))
+        return self._cached[1]
+
+    def read(self, offset, length):
+        chunks = []
+        end = min(offset + length, self.size)
+        index = bisect.bisect_right(self._offsets, offset) - 1
+        while offset < end:
+            data = self._inflate(index)
+            start = offset - self._offsets[index]
+            chunk = data[start:start + end - offset]
+            chunks.append(chunk)
+            offset += len(chunk)
+            index += 1
+        return b"".join(chunks)
+
+    def close(self):
+        self._f.close()
+
+
+class LogReader:
+    """
+    Reads a log by range, whether it was compressed or not.
+
+    Attributes
+    ----------
+    size: int
+        number of bytes in the log
+    compressed: bool
+        whether the log was compressed by `compress_log`
+    """
+
+    def __init__(self, path):
+        """
+        Open the log at `path`, or its compressed version. Blocks on the
+        file system.
+
+        Raises
+        ------
+        FileNotFoundError
+            if there is neither
+        ValueError
+            if the compressed log is corrupt
+        """
+        try:
+            self._log = _PlainLog(open(path, "rb"))
+            self.compressed = False
+        except FileNotFoundError:
+            f = open(path + COMPRESSED_SUFFIX, "rb")
+            try:
+                self._log = _CompressedLog(f)
+            except BaseException:
+                f.close()
+                raise
+            self.compressed = True
+        self.size = self._log.size
+
+    def read(self, offset, length=READ_SIZE):
+        """
+        Returns up to `length` bytes of the log, from `offset`. Blocks on
+        the file system.
+        """
+        return self._log.read(offset, length)
+
+    def tail_offset(self, n_lines):
+        """
+        Returns the offset of the last `n_lines` lines of the log, reading
+        it backwards from its end. Blocks on the file system.
+        """
+        if n_lines <= 0:
+            return self.size
+        to_skip = n_lines
+        offset = self.size
+        while offset > 0:
+            start = max(0, offset - READ_SIZE)
+            chunk = self._log.read(start, offset - start)
+            end = len(chunk)
+            if offset == self.size and chunk.endswith(b"\n"):
+                # The newline ending the last line does not start a line.
+                end -= 1
+            while True:
+                end = chunk.rfind(b"\n", 0, end)
+                if end < 0:
+                    break
+                to_skip -= 1
+                if to_skip == 0:
+                    return start + end + 1
+            offset = start
+        return 0
+
+    def close(self):
+        self._log.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,244 @@
+"""
+Merkle trees of the files of a runfolder.
+
+The digests of the files are rolled up, directory by directory, into the
+digest of the root: the digest of a directory is the SHA-256 of the type,
+digest and name of each of its entries, sorted by name. Two copies of a
+runfolder, e.g. at the source and at the destination of a transfer, hold
+the same files with the same content if their root digests are equal.
+Where they are not, comparing the digests of the entries of the root tells
+which subtrees differ, and only those need to be walked down.
+
+The leaves are the digests of the content of the files, in the algorithm of
+the manifests, so that trees are only comparable if they were built with
+the same algorithm.
+"""
+import hashlib
+import json
+import os
+
+
+# Digest algorithm of the directories of the tree.
+NODE_ALGORITHM = "sha256"
+
+TYPE_FILE = "file"
+TYPE_DIRECTORY = "directory"
+
+
+def _new_directory():
+    return {"n_files": 0, "children": {}}
+
+
+def _is_directory(node):
+    return "children" in node
+
+
+class MerkleTree:
+    """
+    Digests of the files under a root directory, and of every directory
+    under it.
+
+    Nodes are kept as dicts: files have a "digest", and directories the
+    number of files under them ("n_files") and their entries by name
+    ("children"). The digests of directories are computed when asked for,
+    and kept until a file is added under them.
+
+    Methods
+    -------
+    add(path, digest)
+        add the digest of the file at `path`
+    digest()
+        returns the digest of the root
+    subtree(path)
+        returns the digest of a file or directory, and of its entries
+    to_dict()
+        returns the whole tree, JSON serializable
+    save(path)
+        write the tree to a JSON file
+    """
+
+    def __init__(self, root=os.curdir, algorithm="md5"):
+        """
+        Parameters
+        ----------
+        root: str
+            directory the tree is rooted at, relative to the current
+            directory like the paths of manifests
+        algorithm: str
+            digest algorithm of the files
+        """
+        self.root = os.path.normpath(root)
+        self.algorithm = algorithm
+        self._tree = _new_directory()
+
+    def _names(self, path):
+        """
+        Returns the names leading from the root to the normalized `path`,
+        or raises ValueError if it is not under the root.
+        """
+        if os.path.isabs(path) != os.path.isabs(self.root):
+            raise ValueError(f"{path} is not under {self.root}")
+        relative = os.path.relpath(path, self.root)
+        if relative == os.pardir or relative.startswith(os.pardir + os.sep):
+            raise ValueError(f"{path} is not under {self.root}")
+        if relative == os.curdir:
+            return []
+        return relative.split(os.sep)
+
+    def add(self, path, digest):
+        """
+        Add the digest of a file, replacing the one it had if it was added
+        before.
+
+        Raises
+        ------
+        ValueError
+            if `path` is not under the root, or if it, or one of the
+            directories leading to it, was added as a file of another type
+        """
+        names = self._names(os.path.normpath(path))
+        if not names:
+            raise ValueError(f"{path} is the root of the tree")
+        directories = [self._tree]
+        for name in names[:-1]:
+            node = directories[-1]["children"].setdefault(
+                    name, _new_directory())
+            if not _is_directory(node):
+                raise ValueError(f"{path}: {name} is not a directory")
+            directories.append(node)
+        known = directories[-1]["children"].get(names[-1])
+        if known is not None and _is_directory(known):
+            raise ValueError(f"{path} is a directory")
+        directories[-1]["children"][names[-1]] = {"digest": digest}
+        for directory in directories:
+            directory.pop("digest", None)
+            if known is None:
+                directory["n_files"] += 1
+
+    @staticmethod
+    def _digest(node):
+        if "digest" not in node:
+            h = hashlib.new(NODE_ALGORITHM)
+            for name in sorted(node["children"]):
+                child = node["children"][name]
+                kind = "d" if _is_directory(child) else "f"
+                # Names cannot contain NUL, and digests spaces.
+                h.update(
+                    f"{kind} {MerkleTree._digest(child)} ".encode()
+                    + os.fsencode(name) + b"\0")
+            node["digest"] = h.hexdigest()
+        return node["digest"]
+
+    def digest(self):
+        return MerkleTree._digest(self._tree)
+
+    def subtree(self, path=""):
+        """
+        Parameters
+        ----------
+        path: str
+            path relative to the root, the root itself if empty
+
+        Raises
+        ------
+        KeyError
+            if there is no file or directory at `path` in the tree
+
+        Returns
+        -------
+        dict
+            the "path", "type" and "digest" of the file or directory, and
+            for a directory the number of files under it ("n_files") and
+            the name, type, digest (and number of files, for directories)
+            of each of its "children", sorted by name
+        """
+        node = self._tree
+        names = os.path.normpath(path).split(os.sep) if path else []
+        for name in names:
+            if name == os.curdir:
+                continue
+            if not _is_directory(node) or name not in node["children"]:
+                raise KeyError(path)
+            node = node["children"][name]
+
+        if not _is_directory(node):
+            return {
+                "path": path,
+                "type": TYPE_FILE,
+                "digest": node["digest"],
+                }
+        children = []
+        for name in sorted(node["children"]):
+            child = node["children"][name]
+            summary = {
+                "name": name,
+                "type": (
+                    TYPE_DIRECTORY if _is_directory(child) else TYPE_FILE),
+                "digest": MerkleTree._digest(child),
+                }
+            if _is_directory(child):
+                summary["n_files"] = child["n_files"]
+            children.append(summary)
+        return {
+            "path": path,
+            "type": TYPE_DIRECTORY,
+            "digest": MerkleTree._digest(node),
+            "n_files": node["n_files"],
+            "children": children,
+            }
+
+    def to_dict(self):
+        """
+        Returns
+        -------
+        dict
+            the "root" directory, the "algorithm" of the files, the
+            "node_algorithm" of the directories, and the "tree" of nodes
+        """
+        self.digest()
+        return {
+            "root": self.root,
+            "algorithm": self.algorithm,
+            "node_algorithm": NODE_ALGORITHM,
+            "tree": self._tree,
+            }
+
+    @classmethod
+    def from_dict(cls, tree):
+        """
+        Returns the tree returned by `to_dict`.
+        """
+        if tree["node_algorithm"] != NODE_ALGORITHM:
+            raise ValueError(
+                    f"Unsupported node algorithm {tree['node_algorithm']}")
+        merkle = cls(tree["root"], tree["algorithm"])
+        merkle._tree = tree["tree"]
+        return merkle
+
+    def save(self, path):
+        """
+        Atomically write the tree to the JSON file at `path`.
+        """
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.to_dict(), f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Returns the tree saved to the JSON file at `path`.
+
+        Raises
+        ------
+        OSError
+            if the file cannot be read
+        ValueError
+            if it does not hold a tree
+        """
+        with open(path) as f:
+            tree = json.load(f)
+        try:
+            return cls.from_dict(tree)
+        except (KeyError, TypeError) as e:
+            raise ValueError(f"{path} does not hold a Merkle tree: {e}")
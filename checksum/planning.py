@@ -0,0 +1,263 @@
+"""
+Dry-run planning of checksumming jobs.
+
+A plan parses the md5sum files of a job, stats the files they list, looks
+them up in the checksum cache, and estimates how long the job would take
+from the read throughput of past jobs on the same storage device, without
+reading any of the files.
+
+The throughput of a device is learned from the jobs of runfolders on it
+that succeeded, as the bytes their command read per second of wall time,
+see `checksum.accounting`.
+"""
+import asyncio
+import json
+import logging
+import os
+import threading
+
+from arteria.web.state import State
+
+from checksum.checksum_cache import ChecksumCache
+from checksum.verifier import LocalStorage, parse_manifest
+
+
+log = logging.getLogger(__name__)
+
+# Weight of the last job in the throughput of its device, against that of
+# the jobs before it.
+DEFAULT_WEIGHT = 0.3
+
+# Jobs reading fewer bytes mostly measure the startup of their command, and
+# are not learned from.
+MIN_LEARNED_BYTES = 64 * 1024 * 1024
+
+
+def storage_device(monitored_dir, runfolder, storage_url=None):
+    """
+    Returns the storage device the files of a runfolder are read from: the
+    object store at `storage_url` if any, or the device holding the
+    runfolder. Blocks on the file system.
+    """
+    if storage_url:
+        return storage_url
+    return os.stat(os.path.join(monitored_dir, runfolder)).st_dev
+
+
+class ThroughputHistory:
+    """
+    Read throughput of past jobs, by storage device, as a moving average
+    weighted towards the last jobs. It is kept in a JSON file if a path is
+    given, so that it survives restarts.
+
+    Methods
+    -------
+    record(device, n_bytes, seconds)
+        learn from a job that read `n_bytes` in `seconds` from `device`
+    throughput(device)
+        returns the throughput learned for `device`
+    job_finished(job)
+        learn from a finished job, see `RunnerService`
+    """
+
+    def __init__(self, monitored_dir, storage_url=None, path=None,
+                 weight=DEFAULT_WEIGHT, min_bytes=MIN_LEARNED_BYTES):
+        """
+        Parameters
+        ----------
+        monitored_dir: str
+            directory holding the runfolders
+        storage_url: str
+            URL of the object store files are read from, if they are not
+            read from the local file system
+        path: str
+            JSON file the history is kept in, if any. Blocks on the file
+            system.
+        weight: float
+            weight of the last job, between 0 and 1
+        min_bytes: int
+            number of bytes a job must read to be learned from
+        """
+        self._monitored_dir = monitored_dir
+        self._storage_url = storage_url
+        self._path = path
+        self._weight = weight
+        self._min_bytes = min_bytes
+        self._lock = threading.Lock()
+        # Throughput and number of jobs learned from, by device.
+        self._devices = {}
+        if path is not None:
+            try:
+                with open(path) as f:
+                    self._devices = json.load(f)
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError) as e:
+                log.warning(f"Could not read throughput history {path}: {e}")
+
+    def _save(self):
+        tmp_path = f"{self._path}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(self._devices, f)
+            os.replace(tmp_path, self._path)
+        except OSError as e:
+            log.warning(
+                f"Could not write throughput history {self._path}: {e}")
+
+    def record(self, device, n_bytes, seconds):
+        """
+        Learn from a job that read `n_bytes` from `device` in `seconds`.
+        Blocks on the file system if the history is kept in a file.
+        """
+        if seconds <= 0:
+            return
+        bytes_per_second = n_bytes / seconds
+        with self._lock:
+            known = self._devices.get(str(device))
+            if known is not None:
+                bytes_per_second = (
+                    self._weight * bytes_per_second
+                    + (1 - self._weight) * known["bytes_per_second"])
+            self._devices[str(device)] = {
+                "bytes_per_second": bytes_per_second,
+                "n_jobs": known["n_jobs"] + 1 if known is not None else 1,
+                }
+            if self._path is not None:
+                self._save()
+
+    def throughput(self, device):
+        """
+        Returns
+        -------
+        (float, int)
+            bytes read per second from `device`, and the number of jobs it
+            was learned from. None and 0 if no job read from it yet.
+        """
+        with self._lock:
+            known = self._devices.get(str(device))
+        if known is None:
+            return None, 0
+        return known["bytes_per_second"], known["n_jobs"]
+
+    def job_finished(self, job):
+        """
+        Learn from a job that finished, in a worker thread since finding
+        the device of its runfolder blocks on the file system. Only jobs of
+        runfolders that succeeded and read at least `min_bytes` are learned
+        from.
+        """
+        usage = job.usage
+        runfolder = job.tags.get("runfolder")
+        if (
+            job.state != State.DONE
+            or runfolder is None
+            or usage is None
+            or usage.bytes_read is None
+            or usage.bytes_read < self._min_bytes
+        ):
+            return
+
+        def learn():
+            try:
+                device = storage_device(
+                        self._monitored_dir, runfolder, self._storage_url)
+            except OSError:
+                # The runfolder was moved away since.
+                return
+            self.record(device, usage.bytes_read, usage.wall_seconds)
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            learn()
+        else:
+            loop.run_in_executor(None, learn)
+
+
+def plan(md5sum_file_paths, root, device, history=None, cache_path=None,
+         storage=None):
+    """
+    Estimate what checking md5sum files would take, without reading the
+    files they list. Blocks on the file system.
+
+    Files listed more than once are counted once, as the in-process
+    verifier reads them once.
+
+    Parameters
+    ----------
+    md5sum_file_paths: [str]
+        paths to the md5sum files
+    root: str
+        directory the paths of the md5sum files are relative to, on the
+        local file system
+    device: str or int
+        storage device the files are read from, see `storage_device`
+    history: ThroughputHistory
+        throughput of past jobs, if any
+    cache_path: str
+        checksum cache to look the files up in, if any
+    storage: checksum.storage.Storage
+        where the files are read from, if not the local file system. The
+        paths of the md5sum files are then relative to it.
+
+    Returns
+    -------
+    dict
+        number of files listed ("n_files"), how many of them cannot be
+        stat'ed ("n_missing"), number of improperly formatted lines
+        ("n_improper"), "bytes" to read, the files "unchanged" since they
+        were last verified OK according to the cache (None without a
+        cache), the "device", its throughput in "bytes_per_second" and the
+        number of jobs it was learned from ("n_jobs_learned"), and the
+        "estimated_seconds" of the job (None without a throughput)
+    """
+    paths = set()
+    n_improper = 0
+    for md5sum_file_path in md5sum_file_paths:
+        entries, n_entry_improper = parse_manifest(md5sum_file_path)
+        paths.update(os.path.normpath(entry.path) for entry in entries)
+        n_improper += n_entry_improper
+
+    if storage is None:
+        storage = LocalStorage()
+        paths = {os.path.join(root, path) for path in paths}
+    stats = {}
+    for path in sorted(paths):
+        try:
+            stats[path] = storage.stat(path)
+        except OSError:
+            stats[path] = None
+    n_bytes = sum(st.st_size for st in stats.values() if st is not None)
+
+    unchanged = None
+    if cache_path is not None and os.path.exists(cache_path):
+        unchanged = {"n_files": 0, "bytes": 0}
+        with ChecksumCache(cache_path) as cache:
+            for path, st in stats.items():
+                if st is None:
+                    continue
+                known = cache.get(storage.location(path))
+                if (
+                    known is not None
+                    and known["result"] == "OK"
+                    and known["size"] == st.st_size
+                    and known["mtime"] == st.st_mtime
+                ):
+                    unchanged["n_files"] += 1
+                    unchanged["bytes"] += st.st_size
+
+    bytes_per_second, n_jobs = (
+        history.throughput(device) if history is not None else (None, 0))
+    return {
+        "n_files": len(stats),
+        "n_missing": sum(st is None for st in stats.values()),
+        "n_improper": n_improper,
+        "bytes": n_bytes,
+        "unchanged": unchanged,
+        "device": str(device),
+        "bytes_per_second": bytes_per_second,
+        "n_jobs_learned": n_jobs,
+        "estimated_seconds": (
+            n_bytes / bytes_per_second if bytes_per_second else None),
+        }
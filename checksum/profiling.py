@@ -0,0 +1,147 @@
+"""
+Instrumentation of the in-process verifier.
+
+Profiling is opt-in: the verifier only takes timings when it is handed a
+`Profile`, so jobs that are not profiled pay for nothing more than a few
+`is None` checks per block.
+"""
+import bisect
+import heapq
+import math
+import threading
+import time
+
+
+PHASES = ("stat", "open", "read", "hash", "write")
+
+# Upper bounds, in seconds, of the histogram buckets.
+HISTOGRAM_BOUNDS = (1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1, 10, math.inf)
+
+DEFAULT_N_SLOWEST = 10
+
+
+class PhaseTimings:
+    """
+    Cumulative time and histogram of the calls made in one phase.
+
+    Attributes
+    ----------
+    count: int
+        number of calls
+    total: float
+        cumulative time spent in the phase, in seconds
+    histogram: [int]
+        number of calls falling in each bucket of `HISTOGRAM_BOUNDS`
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.
+        self.histogram = [0] * len(HISTOGRAM_BOUNDS)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.histogram[bisect.bisect_left(HISTOGRAM_BOUNDS, seconds)] += 1
+
+    def merge(self, other):
+        """
+        Add the calls recorded by another `PhaseTimings`.
+        """
+        self.count += other.count
+        self.total += other.total
+        self.histogram = [
+            a + b for a, b in zip(self.histogram, other.histogram)]
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "total_seconds": self.total,
+            "histogram": {
+                str(bound): n
+                for bound, n in zip(HISTOGRAM_BOUNDS, self.histogram)
+                },
+            }
+
+
+class Profile:
+    """
+    Timings collected while verifying a manifest, possibly from several
+    threads.
+
+    Methods
+    -------
+    clock()
+        returns the current time, to be passed back to `add`
+    add(phase, start)
+        record a call to `phase` that started at `start`
+    add_file(path, n_bytes, seconds)
+        record the total time spent on one file
+    merge(phases)
+        add the timings recorded by another profile, e.g. in a worker
+        process
+    to_dict()
+        returns the profile in a JSON serializable form
+    """
+
+    clock = staticmethod(time.perf_counter)
+
+    def __init__(self, n_slowest=DEFAULT_N_SLOWEST):
+        """
+        Parameters
+        ----------
+        n_slowest: int
+            number of slowest files to keep track of
+        """
+        self.phases = {phase: PhaseTimings() for phase in PHASES}
+        self._n_slowest = n_slowest
+        self._slowest = []
+        self._started = self.clock()
+        self._lock = threading.Lock()
+
+    def add(self, phase, start):
+        """
+        Record a call to `phase` that started at `start` and ends now.
+
+        Returns
+        -------
+        float
+            the current time, so that consecutive phases can be chained
+        """
+        now = self.clock()
+        with self._lock:
+            self.phases[phase].add(now - start)
+        return now
+
+    def add_file(self, path, n_bytes, seconds):
+        """
+        Record the total time spent on one file.
+        """
+        item = (seconds, path, n_bytes)
+        with self._lock:
+            if len(self._slowest) < self._n_slowest:
+                heapq.heappush(self._slowest, item)
+            elif self._n_slowest:
+                heapq.heappushpop(self._slowest, item)
+
+    def merge(self, phases):
+        """
+        Add the timings of `phases`, the `phases` of another `Profile`.
+        """
+        with self._lock:
+            for phase, timings in phases.items():
+                self.phases[phase].merge(timings)
+
+    def to_dict(self):
+        return {
+            "wall_seconds": self.clock() - self._started,
+            "phases": {
+                phase: timings.to_dict()
+                for phase, timings in self.phases.items()
+                },
+            "slowest_files": [
+                {"path": path, "bytes": n_bytes, "seconds": seconds}
+                for seconds, path, n_bytes in sorted(
+                    self._slowest, reverse=True)
+                ],
+            }
@@ -0,0 +1,138 @@
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+
+
+log = logging.getLogger(__name__)
+
+
+Runfolder = namedtuple("Runfolder", ["name", "path"])
+
+
+class RunfolderIndex:
+    """
+    In-memory index of the runfolders found in the monitored directory.
+
+    Listing a monitored directory holding thousands of runfolders over NFS
+    is slow, so the listing is cached. It is refreshed when it is older than
+    `ttl` seconds and the modification time of the monitored directory
+    changed, which it does whenever a runfolder is added or removed. A
+    runfolder missing from the index also triggers a refresh if the
+    directory changed, so new runfolders can be used right away.
+
+    Methods
+    -------
+    contains(name)
+        returns True if the runfolder exists
+    get(name)
+        returns the `Runfolder` with the given name
+    runfolders()
+        returns all runfolders
+    refresh()
+        rescan the monitored directory
+    """
+
+    def __init__(self, monitored_dir, ttl=30):
+        """
+        Parameters
+        ----------
+        monitored_dir: str
+            directory containing the runfolders
+        ttl: float
+            number of seconds a listing is trusted without checking the
+            modification time of `monitored_dir`
+        """
+        self.monitored_dir = monitored_dir
+        self._ttl = ttl
+        self._runfolders = {}
+        self._mtime = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def _dir_mtime(self):
+        try:
+            return os.stat(self.monitored_dir).st_mtime_ns
+        except OSError:
+            return None
+
+    def refresh(self):
+        """
+        Rescan the monitored directory.
+        """
+        with self._lock:
+            self._refresh()
+
+    def _refresh(self):
+        mtime = self._dir_mtime()
+        runfolders = {}
+        if mtime is not None:
+            try:
+                with os.scandir(self.monitored_dir) as entries:
+                    for entry in entries:
+                        if entry.is_dir():
+                            runfolders[entry.name] = Runfolder(
+                                entry.name, entry.path)
+            except OSError as e:
+                log.warning(f"Could not list {self.monitored_dir}: {e}")
+        log.debug(
+            f"Indexed {len(runfolders)} runfolders in {self.monitored_dir}")
+        self._runfolders = runfolders
+        self._mtime = mtime
+        self._checked_at = time.monotonic()
+
+    def _refresh_if_changed(self, force_check=False):
+        """
+        Rescan the monitored directory if it changed since the last scan.
+        Unless `force_check` is set, the modification time is only checked
+        once the listing is older than the TTL.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._checked_at is None:
+                self._refresh()
+                return
+            if not force_check and now - self._checked_at < self._ttl:
+                return
+            if self._dir_mtime() != self._mtime:
+                self._refresh()
+            else:
+                self._checked_at = now
+
+    def get(self, name):
+        """
+        Returns the runfolder with the given name.
+
+        Parameters
+        ----------
+        name: str
+            name of the runfolder
+
+        Returns
+        -------
+        Runfolder
+            the runfolder, or None if it does not exist
+        """
+        self._refresh_if_changed()
+        runfolder = self._runfolders.get(name)
+        if runfolder is None:
+            self._refresh_if_changed(force_check=True)
+            runfolder = self._runfolders.get(name)
+        return runfolder
+
+    def contains(self, name):
+        """
+        Returns True if a runfolder with the given name exists.
+        """
+        return self.get(name) is not None
+
+    def runfolders(self):
+        """
+        Returns
+        -------
+        [Runfolder]
+            all runfolders in the monitored directory
+        """
+        self._refresh_if_changed()
+        return list(self._runfolders.values())
@@ -3,11 +3,40 @@ import logging
 import subprocess
 import collections
 import asyncio
+import json
+import math
+import os
+import signal
+import threading
+import time
+
+from checksum.accounting import ResourceTotals, reap
+from checksum.buffers import MemoryBudget
 
 
 log = logging.getLogger(__name__)
 
 
+PRIORITY_HIGH = "high"
+PRIORITY_NORMAL = "normal"
+PRIORITY_LOW = "low"
+
+# Rank of each priority class, lower ranks are dispatched first.
+PRIORITIES = {
+    PRIORITY_HIGH: 0,
+    PRIORITY_NORMAL: 1,
+    PRIORITY_LOW: 2,
+    }
+
+# Jobs submitted together by `RunnerService.submit_group`, and when.
+JobGroup = collections.namedtuple(
+        "JobGroup", ["group_id", "job_ids", "created_at"])
+
+# States a job never leaves.
+FINAL_STATES = (
+    arteria_state.DONE, arteria_state.ERROR, arteria_state.CANCELLED)
+
+
 class Job:
     """
     Class used to run a command and keep track of its status
@@ -18,18 +47,59 @@ class Job:
         id of the job
     cmd: [str]
         command to run
+    report_path: str
+        path to the JSON report written by the command, if any
+    log_path: str
+        path to the file receiving the output of the command, if any
+    priority: str
+        one of `PRIORITIES`
+    memory: int
+        number of bytes of read buffers the command uses
+    tags: dict
+        labels the job can be listed by, e.g. its runfolder
+    state: arteria.web.state.State
+        last known state, as of the last call to `get_status`
+    created_at: float
+        time the job was created, in seconds since the epoch
+    finished_at: float
+        time the job was found finished, None until then
+    suspended: bool
+        True while the command is stopped to make room for more urgent jobs
+    version: int
+        incremented whenever the state of the job changes
+    returncode: int
+        exit status of the command, None while it runs
+    usage: checksum.accounting.ResourceUsage
+        resources used by the command, None until it is found finished
 
     Methods
     -------
+    start()
+        start the command of a queued job
+    start_in_executor()
+        start the command of a queued job from a worker thread
     get_status()
         returns current status
+    get_report()
+        returns the report written by the command
     wait()
         wait for job to complete
     cancel()
         cancel current job
+    async_cancel()
+        cancel current job without blocking the event loop
+    suspend()
+        stop the command until it is resumed
+    resume()
+        resume a suspended command
+    add_done_callback(fn)
+        call `fn` with the job once it is finished
     """
 
-    def __init__(self, job_id, cmd, **kwargs):
+    def __init__(
+            self, job_id, cmd, report_path=None, log_path=None,
+            priority=PRIORITY_NORMAL, memory=0, tags=None, queued=False,
+            process_group=False, **kwargs):
         """
         Parameters
         ----------
@@ -37,51 +107,335 @@ class Job:
             id of the job
         cmd: [str]
             command to run
+        report_path: str
+            path to the JSON report written by the command, if any
+        log_path: str
+            path to a file receiving both stdout and stderr of the command.
+            It is only created when the command starts.
+        priority: str
+            one of `PRIORITIES`
+        memory: int
+            number of bytes of read buffers the command uses
+        tags: dict
+            labels the job can be listed by. Values must be hashable.
+        queued: bool
+            if True, the job is `PENDING` until `start` is called, otherwise
+            the command is started right away
+        process_group: bool
+            if True, the command is run in a new session, and signals are
+            sent to its whole process group, so that they reach the
+            processes it starts
         **kwargs:
             arguments to be forwarded to subprocess.Popen
         """
         self.job_id = job_id
         self.cmd = cmd
-        self._status = arteria_state.STARTED
-        log.info(f"Starting:\n job id: {job_id}\n cmd: {cmd}")
-        log.debug(f"kwargs: {kwargs}")
+        self.report_path = report_path
+        self.log_path = log_path
+        self.priority = priority
+        self.memory = memory
+        self.tags = dict(tags or {})
+        self.created_at = time.time()
+        self.finished_at = None
+        # Set by `RunnerService.submit` to coalesce identical requests.
+        self.key = None
+        self.suspended = False
+        self.queued_at = time.monotonic()
+        # Rank the job had when it was last dispatched, see `RunnerService`.
+        self.dispatch_rank = PRIORITIES[priority]
+        self.process_group = process_group
+        if process_group:
+            kwargs["start_new_session"] = True
+        self._kwargs = kwargs
+        self._proc = None
+        self._spawn_done = threading.Event()
+        self._started_at = None
+        # Held while reaping the process, see `_reap`.
+        self._reap_lock = threading.Lock()
+        self.usage = None
+        self._status = None
+        # Incremented whenever the state of the job changes.
+        self.version = 0
+        self._done_callbacks = []
+        # Called with the job, its previous and its new state on every
+        # change of state, see `RunnerService`.
+        self.status_listener = None
+        # Called with the resources used by the command once it is reaped,
+        # possibly from a worker thread and after the job is cancelled.
+        self.usage_listener = None
+
+        if queued:
+            self._set_status(arteria_state.PENDING)
+            log.info(
+                f"Queuing:\n job id: {job_id}\n priority: {priority}"
+                f"\n cmd: {cmd}")
+        else:
+            self.start()
+
+    def _set_status(self, status):
+        if status != self._status:
+            previous, self._status = self._status, status
+            self.version += 1
+            if status in FINAL_STATES:
+                self.finished_at = time.time()
+            if self.status_listener is not None:
+                self.status_listener(self, previous, status)
+            if status in FINAL_STATES:
+                self._run_done_callbacks()
+
+    @property
+    def state(self):
+        return self._status
+
+    def _run_done_callbacks(self):
+        callbacks, self._done_callbacks = self._done_callbacks, []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception:
+                log.exception(f"Callback of job {self.job_id} failed")
+
+    @property
+    def returncode(self):
+        return self._proc.returncode if self._proc is not None else None
+
+    @property
+    def has_done_callbacks(self):
+        return bool(self._done_callbacks)
+
+    def add_done_callback(self, fn):
+        """
+        Call `fn` with the job once it reaches one of `FINAL_STATES`, right
+        away if it already has.
+
+        The state of running jobs is only updated when it is queried, so
+        `fn` is called on the next call to `get_status` after the command
+        exits.
+        """
+        if self._status in FINAL_STATES:
+            fn(self)
+        else:
+            self._done_callbacks.append(fn)
+
+    def _spawn(self):
+        """
+        Create the log file and the process. Both may block, on a slow file
+        system or while forking a large process.
+        """
+        self._started_at = time.monotonic()
         try:
-            self._proc = subprocess.Popen(self.cmd, **kwargs)
+            if self.log_path:
+                with open(self.log_path, mode='w') as log_file:
+                    self._proc = subprocess.Popen(
+                            self.cmd,
+                            stdout=log_file,
+                            stderr=subprocess.STDOUT,
+                            **self._kwargs)
+            else:
+                self._proc = subprocess.Popen(self.cmd, **self._kwargs)
+        finally:
+            self._spawn_done.set()
+
+    def _signal(self, sig):
+        """
+        Send `sig` to the process, or to its process group, unless it was
+        reaped.
+
+        `Popen.send_signal` is not used as it polls the process first,
+        which would reap it behind `_reap` and lose the resources it used.
+        """
+        if self._proc.returncode is not None:
+            return
+        kill = os.killpg if self.process_group else os.kill
+        try:
+            kill(self._proc.pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def _reap(self, block=False):
+        """
+        Reap the process once it exits, and record the resources it used.
+
+        Returns
+        -------
+        int
+            exit status of the process, None while it runs, or while
+            another thread waits for it if `block` is False
+        """
+        if (
+            self._proc.returncode is None
+            and self._reap_lock.acquire(blocking=block)
+        ):
+            try:
+                if self._proc.returncode is None:
+                    reaped = reap(self._proc.pid, self._started_at, block)
+                    if reaped is not None:
+                        self._proc.returncode, self.usage = reaped
+                        if self.usage_listener is not None:
+                            self.usage_listener(self.usage)
+            except ChildProcessError:
+                # Reaped by `subprocess.Popen` itself.
+                self._proc.poll()
+            finally:
+                self._reap_lock.release()
+        return self._proc.returncode
+
+    def _starting(self):
+        self._set_status(arteria_state.STARTED)
+        log.info(f"Starting:\n job id: {self.job_id}\n cmd: {self.cmd}")
+        log.debug(f"kwargs: {self._kwargs}")
+
+    def _failed_to_start(self, e):
+        self._set_status(arteria_state.ERROR)
+        log.error(e)
+
+    def start(self):
+        """
+        Start the command.
+
+        Raises
+        ------
+        Exception
+            any exception raised by subprocess.Popen. The job is then in
+            `ERROR`.
+        """
+        self._starting()
+        try:
+            self._spawn()
         except Exception as e:
-            log.error(e)
+            self._failed_to_start(e)
             raise
 
+    def start_in_executor(self):
+        """
+        Start the command from a worker thread, so that the event loop does
+        not wait on the file system or on fork. The job is `STARTED` right
+        away. Must be called from the event loop.
+
+        Returns
+        -------
+        asyncio.Future
+            resolved once the process is created, or failed with any
+            exception raised by subprocess.Popen, in which case the job is
+            in `ERROR`
+        """
+        self._starting()
+        future = asyncio.get_running_loop().run_in_executor(
+                None, self._spawn)
+        future.add_done_callback(self._spawned)
+        return future
+
+    def _spawned(self, future):
+        """
+        Keep track of a process created by `start_in_executor`, and apply
+        what was asked of the job in the meantime.
+        """
+        if future.cancelled():
+            self._failed_to_start("Starting the job was cancelled")
+            return
+        if future.exception() is not None:
+            self._failed_to_start(future.exception())
+            return
+
+        if self._status == arteria_state.CANCELLED:
+            self._signal(signal.SIGTERM)
+            asyncio.get_running_loop().run_in_executor(
+                    None, self._reap, True)
+        elif self.suspended:
+            self._signal(signal.SIGSTOP)
+
+    @property
+    def _spawning(self):
+        return self._status == arteria_state.STARTED and self._proc is None
+
     def get_status(self):
         """
         Get job status.
 
         Can be one of the following from `arteria.web.state.State`:
+            * `PENDING`
             * `STARTED`
             * `DONE`
             * `ERROR`
             * `CANCELLED`
         """
-        if self._status == arteria_state.STARTED:
-            return_code = self._proc.poll()
+        if self._status == arteria_state.STARTED and not self._spawning:
+            return_code = self._reap()
 
             if return_code is None:
-                self._status = arteria_state.STARTED
+                self._set_status(arteria_state.STARTED)
             elif return_code == 0:
-                self._status = arteria_state.DONE
+                self.suspended = False
+                self._set_status(arteria_state.DONE)
                 log.info(
                     f"Job {self.job_id} completed successfully")
             else:
-                self._status = arteria_state.ERROR
+                self.suspended = False
+                self._set_status(arteria_state.ERROR)
                 log.error(
                     f"Job {self.job_id} failed with status code {return_code}")
 
         return self._status
 
+    def get_report(self):
+        """
+        Get the report written by the command.
+
+        Running commands may update their report as they progress.
+
+        Returns
+        -------
+        dict
+            the report, or None if the job has no report or it has not been
+            written yet
+        """
+        if self.report_path is None:
+            return None
+        try:
+            with open(self.report_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            log.warning(f"Could not read report of job {self.job_id}: {e}")
+            return None
+
     def wait(self):
         """
-        Wait for the job to complete.
+        Wait for the job to complete, including for its process to be
+        created if it is being started from a worker thread.
         """
-        self._proc.wait()
+        if self._status == arteria_state.STARTED:
+            self._spawn_done.wait()
+        if self._proc is not None:
+            self._reap(block=True)
+
+    def _terminate(self):
+        """
+        Ask the command of an unfinished job to stop.
+
+        Returns
+        -------
+        bool
+            True if the caller must wait for the process to exit and then
+            mark the job `CANCELLED`
+        """
+        status = self.get_status()
+        if status not in (arteria_state.PENDING, arteria_state.STARTED):
+            return False
+
+        log.info(f"Cancelling job {self.job_id} (`{self.cmd}`)")
+        if status == arteria_state.PENDING or self._spawning:
+            # A process still being created is terminated once it exists.
+            self._set_status(arteria_state.CANCELLED)
+            return False
+
+        self._signal(signal.SIGTERM)
+        if self.suspended:
+            # A stopped process only handles SIGTERM once continued.
+            self._signal(signal.SIGCONT)
+            self.suspended = False
+        return True
 
     def cancel(self):
         """
@@ -94,13 +448,49 @@ class Job:
             OBS: if the job was in `DONE` or `ERROR` before it will still be
             in that state.
         """
-        if self.get_status() == arteria_state.STARTED:
-            log.info(f"Cancelling job {self.job_id} (`{self.cmd}`)")
-            self._proc.terminate()
-            self._proc.wait()
-            self._status = arteria_state.CANCELLED
+        if self._terminate():
+            self._reap(block=True)
+            self._set_status(arteria_state.CANCELLED)
         return self._status
 
+    async def async_cancel(self):
+        """
+        Cancel the job, waiting for the process to exit from a worker
+        thread. Must be called from the event loop.
+
+        Returns
+        -------
+        Current state
+            see `cancel`
+        """
+        if self._terminate():
+            await asyncio.get_running_loop().run_in_executor(
+                    None, self._reap, True)
+            self._set_status(arteria_state.CANCELLED)
+        return self._status
+
+    def suspend(self):
+        """
+        Stop the command, with SIGSTOP, until `resume` is called.
+        """
+        if self.get_status() == arteria_state.STARTED and not self.suspended:
+            log.info(f"Suspending job {self.job_id}")
+            if not self._spawning:
+                self._signal(signal.SIGSTOP)
+            self.suspended = True
+            self.version += 1
+
+    def resume(self):
+        """
+        Resume a command stopped by `suspend`.
+        """
+        if self.get_status() == arteria_state.STARTED and self.suspended:
+            log.info(f"Resuming job {self.job_id}")
+            if not self._spawning:
+                self._signal(signal.SIGCONT)
+            self.suspended = False
+            self.version += 1
+
 
 class RunnerService:
     """
@@ -110,39 +500,187 @@ class RunnerService:
     queue is full, the oldest job is removed (provided it is not still
     running).
 
+    When the number of running jobs or the memory they may use for read
+    buffers is limited, new jobs wait in `PENDING` until they are dispatched.
+    A job is only dispatched once its read buffers fit in the memory budget
+    shared by all jobs. Waiting jobs are dispatched by priority, and
+    the longer a job waits the more urgent it becomes, so that low priority
+    jobs are not starved. If preemption is enabled, running jobs of lower
+    priority are suspended to make room for more urgent ones, and resumed
+    when a slot frees up.
+
+    Jobs are indexed by id, state and tags, and the index is updated as jobs
+    change state, so that looking jobs up and listing them only needs to
+    poll the running ones.
+
     Methods
     -------
     start(cmd, **kwargs):
         start a new job
+    submit(cmd, key, **kwargs):
+        start a new job, or join an identical job in flight
+    submit_group(jobs, tags):
+        start several jobs as one group
     stop(job_id):
         stop job with given id
     stop_all:
         stop all running jobs
+    async_stop(job_id):
+        stop job with given id without blocking the event loop
+    async_stop_all:
+        stop all running jobs without blocking the event loop
+    async_stop_group(group_id):
+        stop the jobs of a group without blocking the event loop
     status:
         return the status of the job with the given id
     status_all:
         return status of all jobs in the history
+    list_jobs:
+        return a page of the jobs matching filters on state, tags and time
+    group_status:
+        return the state of a group and of each of its jobs
+    report:
+        return the report of the job with the given id
+    details:
+        return the priority and queue position of the job with the given id
+    metrics:
+        return service-wide counters
+    version:
+        return the version of the job with the given id
+    wait_for_change:
+        wait until the job with the given id changes
     """
 
-    def __init__(self, history_len=100):
+    def __init__(
+            self, history_len=100, max_running_jobs=None,
+            priority_aging=600, preempt=False, poll_interval=1,
+            memory_budget=None, finished_callback=None):
         """
         Parameters
         ----------
         history_len: int
             maximum number of jobs to keep track of.
+        max_running_jobs: int
+            maximum number of jobs running at the same time. If None, jobs
+            are started as soon as they are submitted.
+        priority_aging: float
+            number of seconds a job needs to wait to be dispatched as if it
+            was one priority class higher. If 0, jobs do not age.
+        preempt: bool
+            if True, running jobs are suspended to make room for waiting jobs
+            of higher priority, as long as these fit in the memory budget
+        poll_interval: float
+            number of seconds between checks for finished jobs, while jobs
+            are waiting to be dispatched or clients are waiting for changes
+        memory_budget: int
+            maximum number of bytes of read buffers used by all running jobs
+            together. Unlimited if None.
+        finished_callback: callable
+            if given, called with every job once it is finished, e.g. to
+            compress its log, see `checksum.logs.compress_finished_log`
         """
         self._job_history = collections.deque(maxlen=history_len)
+        self._jobs = {}
+        self._jobs_by_state = collections.defaultdict(set)
+        self._jobs_by_tag = collections.defaultdict(set)
         self._next_id = 1
+        self._groups = collections.OrderedDict()
+        self._next_group_id = 1
         self._lock = asyncio.Lock()
+        self._max_running_jobs = max_running_jobs
+        self._priority_aging = priority_aging
+        self._preempt = preempt
+        self._poll_interval = poll_interval
+        self._monitor = None
+        self._watchers = collections.defaultdict(list)
+        self._memory = (
+            MemoryBudget(memory_budget) if memory_budget is not None else None)
+        self._leased_jobs = {}
+        self._queued = (
+            max_running_jobs is not None or memory_budget is not None)
+        self._finished_callback = finished_callback
+        self._usage = ResourceTotals()
 
     async def _generate_next_id(self):
         """
         Returns a valid job id
         """
         async with self._lock:
-            next_id = self._next_id
-            self._next_id += 1
-            return next_id
+            return self._take_next_id()
+
+    def _take_next_id(self):
+        """
+        Returns a valid job id. The caller must hold `_lock`.
+        """
+        next_id = self._next_id
+        self._next_id += 1
+        return next_id
+
+    def _find_in_flight(self, key):
+        """
+        Returns the pending or running job submitted with the given key, or
+        None.
+        """
+        in_flight = (
+            self._jobs_by_state[arteria_state.PENDING]
+            | self._jobs_by_state[arteria_state.STARTED])
+        return next(
+            (
+                job
+                for job in map(self._jobs.get, sorted(in_flight))
+                if job.key == key and job.get_status() in (
+                    arteria_state.PENDING, arteria_state.STARTED)
+            ),
+            None)
+
+    def _add_job(self, job):
+        """
+        Add a job to the history and the index, removing the oldest job if
+        the history is full.
+        """
+        if len(self._job_history) == self._job_history.maxlen:
+            self._remove_job(self._job_history.pop())
+        self._job_history.appendleft(job)
+        self._jobs[job.job_id] = job
+        self._jobs_by_state[job.state].add(job.job_id)
+        for tag in job.tags.items():
+            self._jobs_by_tag[tag].add(job.job_id)
+        job.status_listener = self._on_status_change
+        job.usage_listener = self._usage.add
+
+    def _remove_job(self, job):
+        """
+        Remove a job dropped from the history from the index.
+        """
+        job.status_listener = None
+        job.usage_listener = None
+        del self._jobs[job.job_id]
+        self._jobs_by_state[job.state].discard(job.job_id)
+        for tag in job.tags.items():
+            self._jobs_by_tag[tag].discard(job.job_id)
+            if not self._jobs_by_tag[tag]:
+                del self._jobs_by_tag[tag]
+
+    def _on_status_change(self, job, previous, status):
+        self._jobs_by_state[previous].discard(job.job_id)
+        self._jobs_by_state[status].add(job.job_id)
+
+    def _jobs_in_state(self, state):
+        """
+        Returns the jobs last known to be in the given state, oldest first.
+        """
+        return [
+            self._jobs[job_id]
+            for job_id in sorted(self._jobs_by_state[state])
+            ]
+
+    def _poll_running(self):
+        """
+        Update the state of the running jobs, the only ones whose state may
+        change without the service being told.
+        """
+        for job in self._jobs_in_state(arteria_state.STARTED):
+            job.get_status()
 
     def _get_job(self, job_id):
         """
@@ -165,15 +703,180 @@ class RunnerService:
             job with the given job id
         """
         try:
-            return next(
-                job
-                for job in self._job_history
-                if job.job_id == job_id)
-        except StopIteration:
+            return self._jobs[job_id]
+        except KeyError:
             msg = f"job {job_id} not found"
             log.warning(msg)
             raise IndexError(msg)
 
+    def _rank(self, job, now):
+        """
+        Returns the rank of a waiting job: its priority rank, lowered by one
+        for every `priority_aging` seconds it has been waiting.
+        """
+        rank = PRIORITIES[job.priority]
+        if self._priority_aging:
+            rank -= (now - job.queued_at) / self._priority_aging
+        return rank
+
+    def _waiting_jobs(self):
+        """
+        Returns the pending and suspended jobs, in dispatch order.
+        """
+        self._poll_running()
+        now = time.monotonic()
+        waiting = self._jobs_in_state(arteria_state.PENDING) + [
+            job
+            for job in self._jobs_in_state(arteria_state.STARTED)
+            if job.suspended
+            ]
+        return sorted(
+            waiting, key=lambda job: (self._rank(job, now), job.job_id))
+
+    def _lease_memory(self, job):
+        """
+        Lease the memory of a job from the budget.
+
+        Returns
+        -------
+        bool
+            True if the job may be started
+        """
+        if self._memory is None:
+            return True
+        if not self._memory.try_lease(job.job_id, job.memory):
+            return False
+        self._leased_jobs[job.job_id] = job
+        return True
+
+    def _release_memory(self):
+        """
+        Release the memory leased by jobs that are no longer running.
+        """
+        for job_id, job in list(self._leased_jobs.items()):
+            if job.get_status() != arteria_state.STARTED:
+                self._memory.release(job_id)
+                del self._leased_jobs[job_id]
+
+    def _dispatch(self):
+        """
+        Start or resume waiting jobs while there are free slots and memory,
+        and preempt running jobs of lower priority if enabled.
+
+        Jobs are dispatched strictly in order: when the next job does not fit
+        in the memory budget, the jobs behind it wait as well.
+
+        Preemption only frees slots. A suspended process keeps its read
+        buffers, so its job keeps its lease, and a job that does not fit in
+        the memory budget waits for running jobs to finish rather than
+        preempting them.
+        """
+        if not self._queued:
+            return
+
+        if self._memory is not None:
+            self._release_memory()
+
+        now = time.monotonic()
+        self._poll_running()
+        running = [
+            job
+            for job in self._jobs_in_state(arteria_state.STARTED)
+            if not job.suspended
+            ]
+        if self._max_running_jobs is None:
+            n_free = math.inf
+        else:
+            n_free = self._max_running_jobs - len(running)
+
+        for job in self._waiting_jobs():
+            rank = self._rank(job, now)
+            victim = None
+            if n_free <= 0:
+                if not self._preempt or not running:
+                    break
+                victim = max(
+                    running, key=lambda job: (job.dispatch_rank, job.job_id))
+                if victim.dispatch_rank <= rank:
+                    break
+
+            # Suspended jobs hold on to their memory.
+            if not job.suspended and not self._lease_memory(job):
+                break
+
+            if victim is not None:
+                victim.suspend()
+                victim.queued_at = now
+                running.remove(victim)
+                n_free += 1
+
+            job.dispatch_rank = rank
+            if job.suspended:
+                job.resume()
+            else:
+                try:
+                    self._start_job(job)
+                except Exception:
+                    continue
+            running.append(job)
+            n_free -= 1
+
+    @staticmethod
+    def _start_job(job):
+        """
+        Start a job from a worker thread when running in an event loop.
+
+        Returns
+        -------
+        asyncio.Future
+            resolved once the process is created, or None if it was started
+            synchronously
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            job.start()
+            return None
+        return job.start_in_executor()
+
+    def _notify_watchers(self):
+        """
+        Wake up the clients waiting for jobs that changed.
+        """
+        for job_id, watchers in list(self._watchers.items()):
+            version = self.version(job_id)
+            for known_version, future in watchers:
+                if version != known_version and not future.done():
+                    future.set_result(None)
+
+    def _watched_jobs(self):
+        """
+        Returns the jobs with callbacks waiting for them to finish.
+        """
+        return [job for job in self._job_history if job.has_done_callbacks]
+
+    async def _monitor_loop(self):
+        """
+        Dispatch waiting jobs as slots free up, notify clients waiting for
+        changes and run the callbacks of finished jobs, until no job or
+        client is waiting.
+        """
+        while self._waiting_jobs() or self._watchers or self._watched_jobs():
+            await asyncio.sleep(self._poll_interval)
+            self._dispatch()
+            self._notify_watchers()
+            for job in self._watched_jobs():
+                job.get_status()
+
+    def _ensure_monitor(self):
+        """
+        Make sure waiting jobs will be dispatched when slots free up, waiting
+        clients notified and callbacks run.
+        """
+        if self._monitor is None or self._monitor.done():
+            self._monitor = asyncio.get_running_loop().create_task(
+                    self._monitor_loop())
+
     async def start(self, cmd, **kwargs):
         """
         Start executing a new command.
@@ -183,20 +886,199 @@ class RunnerService:
         cmd: [str]
             command to be executed
         **kwargs:
-            keyword arguments to be forwarded to subprocess.Popen
+            see `submit`
+
+        Returns
+        -------
+        job_id: int
+        """
+        job_id, _ = await self.submit(cmd, **kwargs)
+        return job_id
+
+    async def submit(
+            self, cmd, key=None, report_path=None, log_path=None,
+            priority=PRIORITY_NORMAL, memory=0, tags=None, on_finished=None,
+            **kwargs):
+        """
+        Start executing a new command, unless an identical one is already in
+        flight.
+
+        Parameters
+        ----------
+        cmd: [str]
+            command to be executed
+        key: hashable
+            identifies what the command does. If a pending or running job
+            was submitted with the same key, it is returned instead of
+            starting a new one, and its priority is raised to `priority` if
+            that is more urgent. If None, a new job is always started.
+        report_path: str
+            path to the JSON report written by the command, if any
+        log_path: str
+            path to a file receiving both stdout and stderr of the command
+        priority: str
+            one of `PRIORITIES`
+        memory: int
+            number of bytes of read buffers the command uses
+        tags: dict
+            labels the job can be listed by, see `list_jobs`
+        on_finished: callable
+            called with the `Job` once it is finished, including when the
+            request is coalesced with a job in flight
+        **kwargs:
+            keyword arguments to be forwarded to `Job`, e.g.
+            `process_group`, and to subprocess.Popen
 
         Raises
         ------
         RuntimeError
             if the history is full and the oldest job is still running
+        ValueError
+            if the priority is unknown, or the job needs more memory than
+            the whole budget
 
         Returns
         -------
-        job_id: int
+        (int, bool)
+            id of the job, and True if a new job was created or False if
+            the request was coalesced with a job in flight
         """
+        self._check_submission(priority, memory)
+
+        async with self._lock:
+            job = self._coalesce(cmd, key, priority, on_finished)
+            if job is not None:
+                return job.job_id, False
+
+            self._check_capacity(1)
+            job = self._create_job(
+                    cmd, key, on_finished,
+                    report_path=report_path,
+                    log_path=log_path,
+                    priority=priority,
+                    memory=memory,
+                    tags=tags,
+                    **kwargs)
+            if not self._queued:
+                started = job.start_in_executor()
+
+        if not self._queued:
+            await started
+        else:
+            self._dispatch()
         if (
-            self._job_history.maxlen == len(self._job_history)
-            and self._job_history[-1].get_status() == arteria_state.STARTED
+            self._queued or on_finished is not None
+            or self._finished_callback is not None
+        ):
+            self._ensure_monitor()
+
+        return job.job_id, True
+
+    async def submit_group(self, jobs, tags=None):
+        """
+        Start several jobs as one group: either all of them are submitted,
+        or none if one of them cannot be.
+
+        The jobs of a group are queued at the same time, so that they are
+        dispatched in the order they are given in when slots are limited.
+        Jobs coalesced with a job in flight are part of the group all the
+        same.
+
+        Parameters
+        ----------
+        jobs: [([str], dict)]
+            command of each job, and the keyword arguments passed to
+            `submit` for it
+        tags: dict
+            tags given to every job created, on top of its own
+
+        Raises
+        ------
+        RuntimeError
+            if the history cannot hold the new jobs without dropping jobs
+            in flight
+        ValueError
+            if the priority of a job is unknown, or a job needs more memory
+            than the whole budget
+
+        Returns
+        -------
+        (int, [(int, bool)])
+            id of the group, and the id of each job with True if it was
+            created or False if it was coalesced with a job in flight
+        """
+        for _, kwargs in jobs:
+            self._check_submission(
+                    kwargs.get("priority", PRIORITY_NORMAL),
+                    kwargs.get("memory", 0))
+
+        async with self._lock:
+            self._check_capacity(sum(
+                kwargs.get("key") is None
+                or self._find_in_flight(kwargs["key"]) is None
+                for _, kwargs in jobs))
+
+            group_id = self._next_group_id
+            self._next_group_id += 1
+            group_tags = {"group": group_id, **(tags or {})}
+            queued_at = time.monotonic()
+            submitted = []
+            started = []
+            for cmd, kwargs in jobs:
+                kwargs = dict(kwargs)
+                key = kwargs.pop("key", None)
+                on_finished = kwargs.pop("on_finished", None)
+                job = self._coalesce(
+                        cmd, key, kwargs.get("priority", PRIORITY_NORMAL),
+                        on_finished)
+                created = job is None
+                if created:
+                    kwargs["tags"] = {
+                        **(kwargs.get("tags") or {}), **group_tags}
+                    job = self._create_job(cmd, key, on_finished, **kwargs)
+                    job.queued_at = queued_at
+                    if not self._queued:
+                        started.append(job.start_in_executor())
+                submitted.append((job.job_id, created))
+
+            self._groups[group_id] = JobGroup(
+                    group_id,
+                    [job_id for job_id, _ in submitted],
+                    time.time())
+            self._forget_groups()
+            log.info(f"Submitted group {group_id} of {len(jobs)} jobs")
+
+        await asyncio.gather(*started)
+        self._dispatch()
+        if self._queued or self._finished_callback is not None or any(
+                kwargs.get("on_finished") is not None for _, kwargs in jobs):
+            self._ensure_monitor()
+
+        return group_id, submitted
+
+    def _check_submission(self, priority, memory):
+        """
+        Raise a ValueError if a job cannot be submitted with the given
+        priority and memory.
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority: {priority}")
+        if self._memory is not None and memory > self._memory.budget:
+            raise ValueError(
+                f"The job needs {memory} bytes of buffers, more than the "
+                f"memory budget of {self._memory.budget} bytes")
+
+    def _check_capacity(self, n_jobs):
+        """
+        Raise a RuntimeError if adding `n_jobs` jobs to the history would
+        drop a job in flight. The caller must hold `_lock`.
+        """
+        n_dropped = len(self._job_history) + n_jobs - self._job_history.maxlen
+        if n_dropped <= 0:
+            return
+        if n_dropped > len(self._job_history) or any(
+            job.get_status() in (arteria_state.STARTED, arteria_state.PENDING)
+            for job in list(self._job_history)[-n_dropped:]
         ):
             msg = (
                 "Could not start a new job because the history is full "
@@ -205,13 +1087,49 @@ class RunnerService:
             log.error(msg)
             raise RuntimeError(msg)
 
-        job_id = await self._generate_next_id()
-        job = Job(job_id, cmd, **kwargs)
+    def _coalesce(self, cmd, key, priority, on_finished):
+        """
+        Returns the job in flight submitted with the given key, if any,
+        after raising its priority to `priority` if that is more urgent and
+        adding `on_finished` to its callbacks. The caller must hold `_lock`.
+        """
+        if key is None:
+            return None
+        job = self._find_in_flight(key)
+        if job is None:
+            return None
+        log.info(f"Coalescing request for `{cmd}` with job {job.job_id}")
+        if PRIORITIES[priority] < PRIORITIES[job.priority]:
+            job.priority = priority
+            # A running job is as hard to preempt as its new priority.
+            job.dispatch_rank = min(job.dispatch_rank, PRIORITIES[priority])
+            job.version += 1
+        if on_finished is not None:
+            job.add_done_callback(on_finished)
+            self._ensure_monitor()
+        return job
 
-        async with self._lock:
-            self._job_history.appendleft(job)
+    def _create_job(self, cmd, key, on_finished, **kwargs):
+        """
+        Create a queued job and add it to the history. Its process is
+        created later, off the event loop. The caller must hold `_lock`.
+        """
+        job = Job(self._take_next_id(), cmd, queued=True, **kwargs)
+        job.key = key
+        if on_finished is not None:
+            job.add_done_callback(on_finished)
+        if self._finished_callback is not None:
+            job.add_done_callback(self._finished_callback)
+        self._add_job(job)
+        return job
 
-        return job.job_id
+    def _forget_groups(self):
+        """
+        Forget the groups none of whose jobs are left in the history.
+        """
+        for group_id, group in list(self._groups.items()):
+            if not any(job_id in self._jobs for job_id in group.job_ids):
+                del self._groups[group_id]
 
     def stop(self, job_id):
         """
@@ -228,6 +1146,7 @@ class RunnerService:
             self._get_job(job_id).cancel()
         except IndexError:
             pass
+        self._dispatch()
 
     def stop_all(self):
         """
@@ -236,11 +1155,59 @@ class RunnerService:
         for job in self._job_history:
             job.cancel()
 
+    async def async_stop(self, job_id):
+        """
+        Stop the job with the given id, without blocking the event loop
+        while the process exits.
+
+        If no job with the given id is found, nothing is done.
+
+        Parameters
+        ----------
+        job_id: int
+            id of job to stop
+        """
+        try:
+            await self._get_job(job_id).async_cancel()
+        except IndexError:
+            pass
+        self._dispatch()
+
+    async def async_stop_all(self):
+        """
+        Stop all currently running jobs, without blocking the event loop
+        while the processes exit.
+        """
+        await asyncio.gather(
+            *(job.async_cancel() for job in list(self._job_history)))
+
+    async def async_stop_group(self, group_id):
+        """
+        Stop the jobs of the group with the given id, without blocking the
+        event loop while the processes exit.
+
+        If no group with the given id is found, nothing is done.
+
+        Parameters
+        ----------
+        group_id: int
+            id of the group to stop
+        """
+        group = self._groups.get(group_id)
+        if group is None:
+            return
+        await asyncio.gather(*(
+            self._jobs[job_id].async_cancel()
+            for job_id in group.job_ids
+            if job_id in self._jobs))
+        self._dispatch()
+
     def status(self, job_id):
         """
         Return the current status of the job with the given id.
 
         Can be one of the following from `arteria.web.state.State`:
+            * `PENDING`
             * `STARTED`
             * `DONE`
             * `ERROR`
@@ -270,7 +1237,313 @@ class RunnerService:
         -------
         {int: arteria.web.state.State}
         """
+        self._poll_running()
+        return {job.job_id: job.state for job in self._job_history}
+
+    def list_jobs(
+            self, states=None, tags=None, since=None, until=None,
+            cursor=None, limit=None):
+        """
+        Return the jobs matching the given filters, newest first.
+
+        The jobs are looked up in the index, only running jobs are polled.
+
+        Parameters
+        ----------
+        states: [arteria.web.state.State]
+            only list jobs in one of these states. All states if None.
+        tags: dict
+            only list jobs with all of these tags
+        since: float
+            only list jobs created at or after this time, in seconds since
+            the epoch
+        until: float
+            only list jobs created before this time, in seconds since the
+            epoch
+        cursor: int
+            only list jobs older than the job with this id, i.e. the cursor
+            returned with the previous page
+        limit: int
+            maximum number of jobs to return. Unlimited if None.
+
+        Returns
+        -------
+        ([dict], int)
+            for each job, its "job_id", "state", "created_at",
+            "finished_at", tags and `details`, and the cursor of the next
+            page, None if this is the last one
+        """
+        self._poll_running()
+        if states is None:
+            job_ids = set(self._jobs)
+        else:
+            job_ids = set().union(
+                *(self._jobs_by_state.get(state, ()) for state in states))
+        for tag in (tags or {}).items():
+            job_ids &= self._jobs_by_tag.get(tag, set())
+        if cursor is not None:
+            job_ids = {job_id for job_id in job_ids if job_id < cursor}
+
+        matching = []
+        for job_id in sorted(job_ids, reverse=True):
+            job = self._jobs[job_id]
+            if since is not None and job.created_at < since:
+                continue
+            if until is not None and job.created_at >= until:
+                continue
+            if limit is not None and len(matching) == limit:
+                return self._summaries(matching), matching[-1].job_id
+            matching.append(job)
+        return self._summaries(matching), None
+
+    def _summaries(self, jobs):
+        """
+        Returns the state, times, tags and details of the given jobs.
+        """
+        positions = self._queue_positions()
+        return [
+            {
+                "job_id": job.job_id,
+                "state": job.state,
+                "created_at": job.created_at,
+                "finished_at": job.finished_at,
+                **job.tags,
+                **self._details(job, positions),
+            }
+            for job in jobs
+            ]
+
+    def group_status(self, group_id):
+        """
+        Return the state of the group with the given id and of its jobs.
+
+        The group is `PENDING` while all its jobs are, `STARTED` while any
+        of them is in flight, and once all are finished `ERROR` if any
+        failed, `CANCELLED` if any was stopped, and `DONE` otherwise.
+
+        Parameters
+        ----------
+        group_id: int
+            id of the desired group
+
+        Returns
+        -------
+        dict
+            "group_id", "state" and "created_at" of the group, the number of
+            jobs in each state ("counts"), and the "jobs" as listed by
+            `list_jobs`, in the order they were submitted. Jobs dropped from
+            the history are in state `NONE`. None if the group was not
+            found.
+        """
+        group = self._groups.get(group_id)
+        if group is None:
+            return None
+        self._poll_running()
+        summaries = {
+            summary["job_id"]: summary
+            for summary in self._summaries([
+                self._jobs[job_id]
+                for job_id in group.job_ids
+                if job_id in self._jobs])
+            }
+        jobs = [
+            summaries.get(
+                job_id, {"job_id": job_id, "state": arteria_state.NONE})
+            for job_id in group.job_ids
+            ]
+        counts = collections.Counter(job["state"] for job in jobs)
+        if counts.keys() == {arteria_state.PENDING}:
+            state = arteria_state.PENDING
+        elif counts[arteria_state.PENDING] or counts[arteria_state.STARTED]:
+            state = arteria_state.STARTED
+        elif counts[arteria_state.ERROR]:
+            state = arteria_state.ERROR
+        elif counts[arteria_state.CANCELLED]:
+            state = arteria_state.CANCELLED
+        elif counts.keys() == {arteria_state.DONE}:
+            state = arteria_state.DONE
+        else:
+            state = arteria_state.NONE
         return {
-            job.job_id: job.get_status()
-            for job in self._job_history
+            "group_id": group_id,
+            "state": state,
+            "created_at": group.created_at,
+            "counts": dict(counts),
+            "jobs": jobs,
             }
+
+    async def report(self, job_id):
+        """
+        Return the report of the job with the given id. The report is read
+        from a worker thread.
+
+        Parameters
+        ----------
+        job_id: int
+            id of the desired job
+
+        Returns
+        -------
+        dict
+            the report, or None if the job was not found or has no report
+        """
+        try:
+            job = self._get_job(job_id)
+        except IndexError:
+            return None
+        if job.report_path is None:
+            return None
+        return await asyncio.get_running_loop().run_in_executor(
+                None, job.get_report)
+
+    def details(self, job_id):
+        """
+        Return the priority and queue position of the job with the given id.
+
+        Parameters
+        ----------
+        job_id: int
+            id of the desired job
+
+        Returns
+        -------
+        dict
+            "priority" of the job, "queue_position" (1 for the next job to be
+            dispatched, None if the job is not waiting), whether the job is
+            "suspended", the "resources" its command used once it is
+            finished (see `checksum.accounting.ResourceUsage`) and, if
+            memory is budgeted, its "memory_lease" in bytes. Empty if the
+            job was not found.
+        """
+        try:
+            job = self._get_job(job_id)
+        except IndexError:
+            return {}
+
+        return self._details(job, self._queue_positions())
+
+    def _queue_positions(self):
+        """
+        Returns the position of each waiting job in the queue, by id.
+        """
+        return {
+            job.job_id: position
+            for position, job in enumerate(self._waiting_jobs(), start=1)
+            }
+
+    def _details(self, job, positions):
+        details = {
+            "priority": job.priority,
+            "queue_position": positions.get(job.job_id),
+            "suspended": job.suspended,
+            "resources": (
+                job.usage._asdict() if job.usage is not None else None),
+            }
+        if self._memory is not None:
+            details["memory_lease"] = self._memory.lease_of(job.job_id)
+        return details
+
+    def metrics(self):
+        """
+        Return service-wide counters.
+
+        Returns
+        -------
+        dict
+            number of "jobs" in the history in each state, the usage of the
+            "memory" budget (None if unlimited), and the "resources" used by
+            all the jobs finished since the service started, see
+            `checksum.accounting.ResourceTotals`
+        """
+        self._dispatch()
+        self._poll_running()
+        return {
+            "jobs": {
+                state: len(job_ids)
+                for state, job_ids in self._jobs_by_state.items()
+                if job_ids
+                },
+            "memory": (
+                self._memory.usage() if self._memory is not None else None),
+            "resources": self._usage.to_dict(),
+            }
+
+    def log_path(self, job_id):
+        """
+        Return the path to the log of the job with the given id.
+
+        Parameters
+        ----------
+        job_id: int
+            id of the desired job
+
+        Returns
+        -------
+        str
+            the path, or None if the job was not found or has no log file
+        """
+        try:
+            return self._get_job(job_id).log_path
+        except IndexError:
+            return None
+
+    def version(self, job_id):
+        """
+        Return the version of the job with the given id, which changes
+        whenever the state of the job changes.
+
+        Parameters
+        ----------
+        job_id: int
+            id of the desired job
+
+        Returns
+        -------
+        int
+            the version, or None if the job was not found
+        """
+        try:
+            job = self._get_job(job_id)
+        except IndexError:
+            return None
+        job.get_status()
+        return job.version
+
+    async def wait_for_change(self, job_id, version, timeout):
+        """
+        Wait until the version of the job with the given id differs from
+        `version`, or `timeout` seconds have passed.
+
+        Finished jobs are checked every `poll_interval` seconds, by a single
+        task shared by all waiting clients.
+
+        Parameters
+        ----------
+        job_id: int
+            id of the desired job
+        version: int
+            version of the job known to the client
+        timeout: float
+            maximum number of seconds to wait
+
+        Returns
+        -------
+        bool
+            True if the job changed, False on timeout
+        """
+        if self.version(job_id) != version:
+            return True
+
+        future = asyncio.get_running_loop().create_future()
+        watcher = (version, future)
+        self._watchers[job_id].append(watcher)
+        self._ensure_monitor()
+        try:
+            await asyncio.wait_for(future, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._watchers[job_id].remove(watcher)
+            if not self._watchers[job_id]:
+                del self._watchers[job_id]
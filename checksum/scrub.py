@@ -0,0 +1,367 @@
+"""
+Background scrubbing of archived runfolders.
+
+A `ScrubScheduler` regularly re-verifies the files listed by the md5sum files
+found under configured roots, to catch bit rot. Files are verified in slices,
+as low priority jobs run with the lowest CPU and I/O priority, so that a
+target number of bytes is verified per day. The least recently verified
+files, according to the `checksum.checksum_cache.ChecksumCache`, come first,
+so that the scheduler cycles through the roots. Files whose digest changed
+since they were last verified are reported as drift.
+
+Scrubbing pauses while any other job is pending or running: the slice in
+flight is stopped, and what it verified so far is kept in the cache.
+"""
+import asyncio
+import collections
+import datetime
+import glob
+import logging
+import math
+import os
+import shutil
+import sys
+import time
+
+from arteria.web.state import State
+
+from checksum.buffers import align
+from checksum.checksum_cache import ChecksumCache
+from checksum.runner_service import FINAL_STATES, PRIORITY_LOW
+from checksum.verifier import (
+        DEFAULT_BLOCK_SIZE, READ_MODE_UNCACHED, DriftReport,
+        format_manifest_line, parse_manifest)
+
+
+log = logging.getLogger(__name__)
+
+
+# Tags of the jobs started by the scheduler, see `RunnerService.submit`.
+SCRUB_TAGS = {"origin": "scrub"}
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+def idle_priority_prefix():
+    """
+    Returns the command prefix running a command with the lowest CPU
+    priority and, where `ionice` is available, in the idle I/O class.
+    """
+    prefix = ["nice", "-n", "19"]
+    if shutil.which("ionice"):
+        prefix += ["ionice", "-c", "3"]
+    return prefix
+
+
+class ScrubScheduler:
+    """
+    Re-verifies archived runfolders in the background.
+
+    Methods
+    -------
+    start()
+        start scrubbing, from the event loop
+    stop()
+        stop scrubbing, and the slice in flight
+    tick()
+        run one step of the scheduler
+    status()
+        returns the state of the scheduler, its last slices and the drift
+        found
+    """
+
+    def __init__(
+            self, runner_service, monitored_dir, roots, cache_path, log_dir,
+            bytes_per_day, slice_seconds=3600, check_interval=10,
+            manifest_pattern="*/md5_checksums",
+            block_size=DEFAULT_BLOCK_SIZE, history_len=20, algorithm="md5"):
+        """
+        Parameters
+        ----------
+        runner_service: checksum.runner_service.RunnerService
+            service running the slices
+        monitored_dir: str
+            directory the paths in md5sum files are relative to
+        roots: [str]
+            directories to scrub, relative to `monitored_dir`
+        cache_path: str
+            path to the checksum cache
+        log_dir: str
+            where the md5sum file, log and report of each slice are written
+        bytes_per_day: int
+            number of bytes to verify per day
+        slice_seconds: float
+            a slice is started once the bytes of that many seconds of
+            scrubbing are due
+        check_interval: float
+            number of seconds between two steps of the scheduler
+        manifest_pattern: str
+            glob pattern of the md5sum files, relative to each root
+        block_size: int
+            size of the reads of the verifier
+        history_len: int
+            number of slices kept track of
+        algorithm: str
+            digest algorithm of the md5sum files, see `checker_tool`
+        """
+        self.runner_service = runner_service
+        self._monitored_dir = monitored_dir
+        self._roots = list(roots)
+        self._cache_path = cache_path
+        self._log_dir = log_dir
+        self._bytes_per_day = bytes_per_day
+        self._slice_bytes = max(
+                1, bytes_per_day * slice_seconds / SECONDS_PER_DAY)
+        self._check_interval = check_interval
+        self._manifest_pattern = manifest_pattern
+        self._block_size = block_size
+        self._algorithm = algorithm
+        # Number of bytes due, accrued at `bytes_per_day` and capped at one
+        # day worth, so that a long pause does not end with a burst.
+        self._allowance = self._slice_bytes
+        self._last_accrual = time.monotonic()
+        self._paused = False
+        self._slice = None
+        self._slices = collections.deque(maxlen=history_len)
+        self._drift = collections.deque(maxlen=DriftReport.MAX_LISTED_FILES)
+        self._n_drifted = 0
+        self._task = None
+
+    def start(self):
+        """
+        Start scrubbing. Must be called from the event loop.
+        """
+        if self._task is None or self._task.done():
+            self._last_accrual = time.monotonic()
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def stop(self):
+        """
+        Stop scrubbing, and the slice in flight.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._slice is not None:
+            await self.runner_service.async_stop(self._slice["job_id"])
+            await self._finish(State.CANCELLED)
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.tick()
+            except Exception:
+                log.exception("Scrubbing failed")
+            await asyncio.sleep(self._check_interval)
+
+    def _accrue(self):
+        now = time.monotonic()
+        self._allowance = min(
+                self._allowance
+                + self._bytes_per_day * (now - self._last_accrual)
+                / SECONDS_PER_DAY,
+                max(self._bytes_per_day, self._slice_bytes))
+        self._last_accrual = now
+
+    def _other_jobs_in_flight(self):
+        jobs, _ = self.runner_service.list_jobs(
+                states=[State.PENDING, State.STARTED])
+        return any(
+            job.get("origin") != SCRUB_TAGS["origin"] for job in jobs)
+
+    async def tick(self):
+        """
+        Collect the results of the slice in flight once it is finished,
+        pause or resume scrubbing, and start the next slice when it is due.
+        """
+        self._accrue()
+
+        if self._slice is not None:
+            state = self.runner_service.status(self._slice["job_id"])
+            if state in FINAL_STATES or state == State.NONE:
+                await self._finish(state)
+
+        paused = self._other_jobs_in_flight()
+        if paused != self._paused:
+            log.info(
+                "Pausing scrubbing while other jobs run" if paused
+                else "Resuming scrubbing")
+            self._paused = paused
+        if paused:
+            if self._slice is not None:
+                await self.runner_service.async_stop(self._slice["job_id"])
+                await self._finish(State.CANCELLED)
+            return
+
+        if self._slice is None and self._allowance >= self._slice_bytes:
+            await self._start_slice()
+
+    def _find_entries(self):
+        """
+        Returns the entries of the md5sum files under the roots, by
+        absolute path.
+        """
+        entries = {}
+        for root in self._roots:
+            root_path = os.path.join(self._monitored_dir, root)
+            if not os.path.isdir(root_path):
+                log.warning(f"Scrub root {root_path} is not a directory")
+                continue
+            manifests = glob.glob(os.path.join(
+                glob.escape(root_path), self._manifest_pattern))
+            for manifest in sorted(manifests):
+                try:
+                    manifest_entries, _ = parse_manifest(manifest)
+                except (OSError, UnicodeDecodeError) as e:
+                    log.warning(f"Could not read {manifest}: {e}")
+                    continue
+                for entry in manifest_entries:
+                    path = os.path.abspath(
+                            os.path.join(self._monitored_dir, entry.path))
+                    entries.setdefault(path, entry)
+        return entries
+
+    def _plan_slice(self, budget, manifest_path):
+        """
+        Write the md5sum file of the next slice: the least recently verified
+        files, up to `budget` bytes, and at least one file. Blocks on the
+        file system.
+
+        Returns
+        -------
+        (int, int)
+            number of files and of bytes in the slice, None if there is
+            nothing to scrub
+        """
+        entries = self._find_entries()
+        if not entries:
+            return None
+        with ChecksumCache(self._cache_path) as cache:
+            last_verified = cache.last_verified(entries)
+        order = sorted(
+                entries,
+                key=lambda path: (last_verified.get(path, -math.inf), path))
+
+        selected = []
+        n_bytes = 0
+        for path in order:
+            try:
+                size = os.stat(path).st_size
+            except OSError:
+                # Verified all the same, to be reported as unreadable.
+                size = 0
+            if selected and n_bytes + size > budget:
+                break
+            selected.append(entries[path])
+            n_bytes += size
+
+        with open(manifest_path, mode='w') as f:
+            for entry in selected:
+                f.write(format_manifest_line(entry) + "\n")
+        return len(selected), n_bytes
+
+    async def _start_slice(self):
+        date = datetime.datetime.now().isoformat()
+        log_path = os.path.join(self._log_dir, f"scrub_{date}")
+        manifest_path = os.path.abspath(f"{log_path}.md5")
+        report_path = f"{log_path}.report.json"
+
+        plan = await asyncio.get_running_loop().run_in_executor(
+                None, self._plan_slice, self._allowance, manifest_path)
+        if plan is None:
+            log.debug("Nothing to scrub")
+            return
+        n_files, n_bytes = plan
+
+        cmd = idle_priority_prefix() + [
+                sys.executable, "-m", "checksum.verifier",
+                "--algorithm", self._algorithm,
+                "--read-mode", READ_MODE_UNCACHED,
+                "--block-size", str(self._block_size),
+                "--cache", os.path.abspath(self._cache_path),
+                "--report", report_path,
+                manifest_path]
+        try:
+            job_id, _ = await self.runner_service.submit(
+                    cmd,
+                    report_path=report_path,
+                    log_path=log_path,
+                    priority=PRIORITY_LOW,
+                    memory=align(self._block_size),
+                    tags=SCRUB_TAGS,
+                    cwd=self._monitored_dir)
+        except (RuntimeError, ValueError) as e:
+            log.warning(f"Could not start scrubbing: {e}")
+            return
+
+        log.info(
+            f"Scrubbing {n_files} files ({n_bytes} bytes) in job {job_id}")
+        self._allowance -= n_bytes
+        self._slice = {
+            "job_id": job_id,
+            "started_at": date,
+            "files": n_files,
+            "bytes": n_bytes,
+            "md5sum_file": manifest_path,
+            }
+
+    async def _finish(self, state):
+        """
+        Record the results of the slice in flight.
+        """
+        current, self._slice = self._slice, None
+        report = await self.runner_service.report(current["job_id"]) or {}
+        results = report.get("manifests", {}).get(current["md5sum_file"], {})
+        drift = report.get("drift", {"n_files": 0, "files": []})
+
+        for drifted in drift["files"]:
+            verified_at = datetime.datetime.fromtimestamp(
+                    drifted["previous_verified_at"]).isoformat()
+            how = "" if drifted["modified"] else " without being modified"
+            log.warning(
+                f"Digest of {drifted['path']} changed since it was verified "
+                f"on {verified_at}{how}")
+        self._drift.extendleft(drift["files"])
+        self._n_drifted += drift["n_files"]
+
+        if state == State.CANCELLED:
+            # Verified again by the next slices, least recent first.
+            self._allowance += current["bytes"]
+
+        self._slices.appendleft({
+            **current,
+            "state": state,
+            "finished_at": datetime.datetime.now().isoformat(),
+            "failed": results.get("failed"),
+            "unreadable": results.get("unreadable"),
+            "not_ok": results.get("not_ok", []),
+            "drifted": drift["n_files"],
+            })
+
+    def status(self):
+        """
+        Returns
+        -------
+        dict
+            "state" of the scheduler, one of "paused", "running" or
+            "waiting", the "roots" scrubbed, the "bytes_per_day" target, the
+            number of bytes due ("allowance"), the slice in flight
+            ("current"), the last "slices", and the files found to have
+            drifted ("drift")
+        """
+        self._accrue()
+        if self._paused:
+            state = "paused"
+        elif self._slice is not None:
+            state = "running"
+        else:
+            state = "waiting"
+        return {
+            "state": state,
+            "roots": self._roots,
+            "bytes_per_day": self._bytes_per_day,
+            "allowance": int(self._allowance),
+            "current": self._slice,
+            "slices": list(self._slices),
+            "drift": {"n_files": self._n_drifted, "files": list(self._drift)},
+            }
@@ -0,0 +1,401 @@
+"""
+Check md5sum-style manifests with an external checker, split in shards.
+
+Some hosts must check files with the coreutils binaries, but `md5sum -c`
+only uses one core. This wrapper splits the entries of the manifests into
+shards of about the same number of bytes, runs `<tool> -c` on all shards at
+once, and merges their outputs as if a single checker had run:
+
+    python -m checksum.sharded --tool md5sum --shards 4 <manifest>...
+
+Result lines are passed through as the checkers print them, followed by one
+summary for all shards, and the exit code is that of `md5sum -c`. With
+`--report`, the results of each manifest and the size of each shard are
+written as JSON, see `checksum.verifier.write_report`.
+
+The checkers are children of the wrapper, so the wrapper should be run in a
+process group of its own and signalled as a group, see
+`checksum.runner_service.Job`.
+"""
+import argparse
+import collections
+import heapq
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from checksum.verifier import (
+        REPORT_INTERVAL, ManifestEntry, ManifestResults, format_manifest_line,
+        parse_manifest, print_summary, write_report)
+
+
+PROG = "checksum-sharded"
+
+DEFAULT_TOOL = "md5sum"
+
+RESULT_OK = "OK"
+RESULT_FAILED = "FAILED"
+RESULT_UNREADABLE = "FAILED open or read"
+
+# Results printed by `<tool> -c` after the path of each file.
+RESULTS = (RESULT_OK, RESULT_FAILED, RESULT_UNREADABLE)
+
+
+def plan_shards(sizes, n_shards):
+    """
+    Split files into at most `n_shards` shards of about the same number of
+    bytes, handing the largest remaining file to the lightest shard.
+
+    Parameters
+    ----------
+    sizes: [int]
+        size of each file
+    n_shards: int
+        maximum number of shards
+
+    Returns
+    -------
+    [[int]]
+        the indexes of the files of each shard, in increasing order. Empty
+        shards are left out.
+    """
+    totals = [(0, shard) for shard in range(n_shards)]
+    shards = [[] for _ in range(n_shards)]
+    for index in sorted(range(len(sizes)), key=lambda i: (-sizes[i], i)):
+        total, shard = heapq.heappop(totals)
+        shards[shard].append(index)
+        heapq.heappush(totals, (total + sizes[index], shard))
+    return [sorted(shard) for shard in shards if shard]
+
+
+def _printed_paths(path):
+    """
+    Returns the ways `<tool> -c` may print the path of a file: as it is,
+    or escaped if it contains a backslash or a newline.
+    """
+    line = format_manifest_line(ManifestEntry("", path))
+    if line.startswith("\\"):
+        return (path, "\\" + line[3:])
+    return (path,)
+
+
+def _parse_result(line):
+    """
+    Returns the path and result of a line printed by `<tool> -c`, or
+    (None, None) if it is not a result.
+    """
+    for result in RESULTS:
+        suffix = f": {result}"
+        if line.endswith(suffix):
+            return line[:-len(suffix)], result
+    return None, None
+
+
+class _ShardedCheck:
+    """
+    Checks files in shards, each with its own `<tool> -c` process, and
+    merges the outputs of the processes.
+    """
+
+    def __init__(self, entries, tool, out, err, manifests, results,
+                 progress):
+        self._tool = tool
+        self._prog = os.path.basename(tool)
+        self._out = out
+        self._err = err
+        self._manifests = manifests
+        self._results = results
+        self._progress = progress
+        self._lock = threading.Lock()
+        self.counts = collections.Counter()
+        # Each file is checked once per digest, for all the entries listing
+        # it with that digest.
+        checks = {}
+        for i, entry in enumerate(entries):
+            key = (os.path.normpath(entry.path), entry.digest)
+            checks.setdefault(key, (entry, []))[1].append(i)
+        self.checks = list(checks.values())
+        self._entries = entries
+
+    def _record(self, check, result):
+        entry, indexes = check
+        self.counts[result] += 1
+        if self._results is not None:
+            for i in indexes:
+                self._results.add(
+                        self._manifests[i], self._entries[i].path, result)
+        if self._progress is not None:
+            self._progress()
+
+    def read_results(self, shard, stream):
+        """
+        Pass through the output of the checker of `shard`, recording the
+        result of each of its files.
+        """
+        position = 0
+        for line in stream:
+            path, result = _parse_result(line.rstrip("\n"))
+            with self._lock:
+                if result is not None:
+                    # Entries the checker found improperly formatted have
+                    # no result line.
+                    match = next(
+                        (
+                            i for i in range(position, len(shard))
+                            if path in _printed_paths(
+                                self.checks[shard[i]][0].path)
+                        ),
+                        None)
+                    if match is not None:
+                        self.counts["skipped"] += match - position
+                        self._record(self.checks[shard[match]], result)
+                        position = match + 1
+                self._out.write(line)
+                self._out.flush()
+        with self._lock:
+            self.counts["skipped"] += len(shard) - position
+
+    def read_errors(self, stream):
+        """
+        Pass through the errors of a checker, but its final warnings, which
+        are replaced by the summary of all shards.
+        """
+        warning = f"{self._prog}: WARNING:"
+        for line in stream:
+            if line.startswith(warning):
+                continue
+            with self._lock:
+                self._err.write(line)
+                self._err.flush()
+
+
+def check(entries, tool=DEFAULT_TOOL, n_shards=1, out=None, err=None,
+          n_improper=0, manifests=None, results=None, progress=None,
+          tmp_dir=None):
+    """
+    Check the files listed in `entries` with `<tool> -c`, in up to
+    `n_shards` shards checked at the same time, and report the results the
+    way `<tool> -c` does.
+
+    Parameters
+    ----------
+    entries: [checksum.verifier.ManifestEntry]
+        files to check, relative to the current directory
+    tool: str
+        checker to run, e.g. md5sum, sha256sum or b3sum
+    n_shards: int
+        maximum number of checkers run at the same time
+    out: file
+        where the per-file results are written (default: stdout)
+    err: file
+        where read errors and the summary warnings are written
+        (default: stderr)
+    n_improper: int
+        number of improperly formatted manifest lines, reported in the summary
+    manifests: [str]
+        manifest each entry comes from, required if `results` is given
+    results: checksum.verifier.ManifestResults
+        if given, where the results of each manifest are recorded
+    progress: callable
+        if given, called without arguments after each file has been checked
+    tmp_dir: str
+        where the shards are written (default: the temporary directory)
+
+    Returns
+    -------
+    (int, [dict])
+        0 if all files matched, 1 otherwise, and the number of "files" and
+        of "bytes" of each shard, and the "returncode" of its checker
+    """
+    out = out or sys.stdout
+    err = err or sys.stderr
+
+    if not entries:
+        print(
+            f"{PROG}: no properly formatted checksum lines found", file=err)
+        return 1, []
+
+    sharded = _ShardedCheck(
+            entries, tool, out, err, manifests, results, progress)
+    sizes = []
+    for entry, _ in sharded.checks:
+        try:
+            sizes.append(os.stat(entry.path).st_size)
+        except OSError:
+            # Reported as unreadable by the checker.
+            sizes.append(0)
+    shards = plan_shards(sizes, n_shards)
+
+    procs = []
+    readers = []
+    with tempfile.TemporaryDirectory(
+            prefix="checksum-shards-", dir=tmp_dir) as shard_dir:
+        try:
+            for number, shard in enumerate(shards):
+                shard_path = os.path.join(shard_dir, f"shard_{number}")
+                with open(shard_path, "w", errors="surrogateescape") as f:
+                    for index in shard:
+                        f.write(format_manifest_line(
+                            sharded.checks[index][0]) + "\n")
+                proc = subprocess.Popen(
+                        [tool, "-c", shard_path],
+                        stdout=subprocess.PIPE,
+                        stderr=subprocess.PIPE,
+                        errors="surrogateescape",
+                        text=True)
+                procs.append(proc)
+                readers.append(threading.Thread(
+                    target=sharded.read_results, args=(shard, proc.stdout)))
+                readers.append(threading.Thread(
+                    target=sharded.read_errors, args=(proc.stderr,)))
+                readers[-2].start()
+                readers[-1].start()
+
+            for proc in procs:
+                proc.wait()
+            for reader in readers:
+                reader.join()
+        finally:
+            for proc in procs:
+                if proc.poll() is None:
+                    proc.terminate()
+                    proc.wait()
+
+    n_mismatch = sharded.counts[RESULT_FAILED]
+    n_unreadable = sharded.counts[RESULT_UNREADABLE]
+    print_summary(
+            n_improper + sharded.counts["skipped"], n_unreadable, n_mismatch,
+            err, prog=os.path.basename(tool))
+
+    shard_stats = [
+        {
+            "files": len(shard),
+            "bytes": sum(sizes[index] for index in shard),
+            "returncode": proc.returncode,
+        }
+        for shard, proc in zip(shards, procs)
+        ]
+    failed = n_mismatch or n_unreadable or any(
+            stats["returncode"] for stats in shard_stats)
+    return int(bool(failed)), shard_stats
+
+
+class _ReportWriter:
+    """
+    Writes the report of a running check, at most once every `interval`
+    seconds.
+    """
+
+    def __init__(self, path, results, interval=REPORT_INTERVAL):
+        self._path = path
+        self._results = results
+        self._interval = interval
+        self._last_write = time.monotonic()
+
+    def __call__(self):
+        now = time.monotonic()
+        if now - self._last_write >= self._interval:
+            self._last_write = now
+            self.write()
+
+    def write(self, shards=None):
+        report = {"manifests": self._results.to_dict()}
+        if shards is not None:
+            report["shards"] = shards
+        write_report(self._path, report)
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(
+            prog=PROG,
+            description=(
+                "Check files against md5sum-style manifests with an external "
+                "checker, run on several shards of the files at once."))
+    parser.add_argument("manifests", nargs="+", metavar="manifest")
+    parser.add_argument(
+            "--tool", default=DEFAULT_TOOL,
+            help=(
+                "checker run with -c on each shard, e.g. md5sum, sha256sum "
+                "or b3sum (default: %(default)s)"))
+    parser.add_argument(
+            "--shards", type=int, default=os.cpu_count() or 1,
+            help=(
+                "number of checkers run at the same time "
+                "(default: one per CPU)"))
+    parser.add_argument(
+            "--report",
+            help=(
+                "where to write a JSON report of the check, with the results "
+                "of each manifest and the size of each shard"))
+    parser.add_argument(
+            "--tmp-dir",
+            help=(
+                "where to write the shards "
+                "(default: the temporary directory)"))
+    args = parser.parse_args(argv)
+    if args.shards < 1:
+        parser.error("--shards must be at least 1")
+    return args
+
+
+def _exit_on_sigterm(signum, frame):
+    # Stop the checkers and remove the shards on the way out.
+    raise SystemExit(128 + signum)
+
+
+def main(argv=None):
+    args = _parse_args(argv)
+    signal.signal(signal.SIGTERM, _exit_on_sigterm)
+    for stream in (sys.stdout, sys.stderr):
+        stream.reconfigure(errors="surrogateescape")
+
+    entries = []
+    manifests = []
+    n_improper = 0
+    n_unreadable_manifests = 0
+    for manifest in args.manifests:
+        try:
+            manifest_entries, manifest_n_improper = parse_manifest(manifest)
+        except (OSError, ValueError) as e:
+            message = getattr(e, "strerror", None) or str(e)
+            print(f"{PROG}: {manifest}: {message}", file=sys.stderr)
+            n_unreadable_manifests += 1
+            continue
+        entries += manifest_entries
+        manifests += [manifest] * len(manifest_entries)
+        n_improper += manifest_n_improper
+    if n_unreadable_manifests == len(args.manifests):
+        return 1
+
+    results = None
+    report_writer = None
+    if args.report:
+        results = ManifestResults(args.manifests)
+        report_writer = _ReportWriter(args.report, results)
+
+    try:
+        return_code, shards = check(
+                entries,
+                tool=args.tool,
+                n_shards=args.shards,
+                n_improper=n_improper,
+                manifests=manifests,
+                results=results,
+                progress=report_writer,
+                tmp_dir=args.tmp_dir)
+    except OSError as e:
+        print(f"{PROG}: {args.tool}: {e.strerror}", file=sys.stderr)
+        return 1
+
+    if report_writer is not None:
+        report_writer.write(shards)
+
+    return max(return_code, int(bool(n_unreadable_manifests)))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
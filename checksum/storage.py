@@ -0,0 +1,401 @@
+"""
+Storage backends the verifier reads files from.
+
+The paths listed by manifests are relative to the root of a backend.
+`checksum.verifier.LocalStorage` reads them from the local file system,
+relative to the current directory. `HTTPStorage` reads them as objects under
+a base URL, from an HTTP server or an S3-compatible object store.
+
+Large objects are fetched with concurrent ranged GETs over a pool of
+persistent connections, and their ranges are fed in order into the digest,
+so that hashing a single object is not bound by the latency of one stream.
+"""
+import concurrent.futures
+import email.utils
+import errno
+import hashlib
+import http.client
+import os
+import re
+import stat
+import threading
+import urllib.parse
+
+
+# Size, in bytes, of the ranges large objects are fetched in.
+DEFAULT_RANGE_SIZE = 8 * 1024 * 1024
+
+DEFAULT_CONNECTIONS = 8
+
+# Number of fetched ranges that may wait to be hashed, per connection.
+RANGES_PER_CONNECTION = 2
+
+_CONTENT_RANGE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+
+
+def http_buffer_memory(connections, range_size=DEFAULT_RANGE_SIZE):
+    """
+    Returns the number of bytes of ranges an `HTTPStorage` holds at most,
+    besides the read buffers of the verifier.
+    """
+    return connections * RANGES_PER_CONNECTION * range_size
+
+
+class Storage:
+    """
+    Where the files listed by manifests are read from.
+
+    Methods
+    -------
+    stat(path)
+        returns the status of a file
+    hash_file(path, algorithm, read_mode, profile, buf, inflater)
+        returns the hex digest of a file
+    location(path)
+        returns the absolute location of a file, e.g. to key the checksum
+        cache with
+    close()
+        release the resources of the backend
+    """
+
+    def stat(self, path):
+        """
+        Returns
+        -------
+        os.stat_result
+
+        Raises
+        ------
+        OSError
+            if the file does not exist or cannot be reached
+        """
+        raise NotImplementedError
+
+    def hash_file(self, path, algorithm="md5", read_mode=None, profile=None,
+                  buf=None, inflater=None):
+        """
+        Compute the hex digest of a file, see `checksum.verifier.hash_file`.
+
+        Raises
+        ------
+        OSError
+            if the file cannot be read
+        checksum.decompress.DecompressError
+            if a file is digested decompressed and is not valid gzip
+        """
+        raise NotImplementedError
+
+    def location(self, path):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class _ConnectionPool:
+    """
+    At most `size` persistent connections to one host, shared by threads.
+    """
+
+    def __init__(self, scheme, netloc, size, timeout):
+        self._connection_class = (
+                http.client.HTTPSConnection if scheme == "https"
+                else http.client.HTTPConnection)
+        self._netloc = netloc
+        self._timeout = timeout
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Returns an idle connection, or a new one, blocking while `size`
+        connections are in use.
+        """
+        self._slots.acquire()
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return self._connection_class(self._netloc, timeout=self._timeout)
+
+    def release(self, conn, reusable=True):
+        if reusable:
+            with self._lock:
+                self._idle.append(conn)
+        else:
+            conn.close()
+        self._slots.release()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+class HTTPStorage(Storage):
+    """
+    Objects under a base URL, e.g. a bucket of an S3-compatible object store
+    or a prefix of it. Requests are not signed: the objects must be readable
+    anonymously, or through a presigning proxy.
+
+    Objects that fit in one range are fetched with a single GET, on the
+    thread hashing them. Larger objects are fetched in ranges of
+    `range_size` by up to `connections` threads, and at most
+    `RANGES_PER_CONNECTION` ranges per connection wait to be hashed, see
+    `http_buffer_memory`.
+    """
+
+    def __init__(self, base_url, connections=DEFAULT_CONNECTIONS,
+                 range_size=DEFAULT_RANGE_SIZE, timeout=60, retries=2):
+        """
+        Parameters
+        ----------
+        base_url: str
+            http or https URL the paths of the files are relative to
+        connections: int
+            maximum number of connections open to the server
+        range_size: int
+            size of the ranges large objects are fetched in
+        timeout: float
+            number of seconds to wait for the server
+        retries: int
+            number of times a request failing on a broken connection, e.g.
+            closed by the server while idle, is retried on a new one
+        """
+        parsed = urllib.parse.urlsplit(base_url)
+        if parsed.scheme not in ("http", "https") or not parsed.netloc:
+            raise ValueError(f"not an http(s) URL: {base_url}")
+        if connections < 1 or range_size < 1:
+            raise ValueError(
+                    "connections and range_size must be positive")
+        self._args = (base_url, connections, range_size, timeout, retries)
+        self._base_url = base_url.rstrip("/")
+        self._prefix = parsed.path.rstrip("/")
+        self._range_size = range_size
+        self._retries = retries
+        self._pool = _ConnectionPool(
+                parsed.scheme, parsed.netloc, connections, timeout)
+        self._fetcher = concurrent.futures.ThreadPoolExecutor(
+                connections, thread_name_prefix="fetch")
+        # Ranges fetched or being fetched, and not hashed yet.
+        self._buffered = threading.BoundedSemaphore(
+                connections * RANGES_PER_CONNECTION)
+
+    def close(self):
+        self._fetcher.shutdown(cancel_futures=True)
+        self._pool.close()
+
+    def __reduce__(self):
+        # A copy sent to a worker process of the verifier opens connections
+        # and fetch threads of its own.
+        return type(self), self._args
+
+    @staticmethod
+    def _key(path):
+        return os.path.normpath(path).lstrip("/")
+
+    def location(self, path):
+        return f"{self._base_url}/{self._key(path)}"
+
+    def _request(self, method, path, headers=None, read=None):
+        """
+        Send a request for the object at `path`, and read the response
+        with `read`, called with the response. The body is read to the end
+        so that the connection can be reused.
+
+        Raises
+        ------
+        OSError
+            on error responses and failed connections
+
+        Returns
+        -------
+        (http.client.HTTPResponse, object)
+            the response and what `read` returned
+        """
+        url = urllib.parse.quote(f"{self._prefix}/{self._key(path)}")
+        for attempt in range(self._retries + 1):
+            conn = self._pool.acquire()
+            reusable = False
+            try:
+                try:
+                    conn.request(method, url, headers=headers or {})
+                    response = conn.getresponse()
+                except (ConnectionError, http.client.BadStatusLine):
+                    # Persistent connections may have been closed by the
+                    # server while idle. Nothing was read yet, so the
+                    # request can be sent again.
+                    if attempt == self._retries:
+                        raise
+                    continue
+                result = None
+                if 200 <= response.status < 300 and read is not None:
+                    result = read(response)
+                response.read()
+                reusable = not response.will_close
+                break
+            except http.client.HTTPException as e:
+                raise OSError(errno.EIO, f"{type(e).__name__}: {e}") from e
+            finally:
+                self._pool.release(conn, reusable)
+
+        if response.status in (404, 410):
+            raise FileNotFoundError(
+                    errno.ENOENT, "No such file or directory", path)
+        if response.status in (401, 403):
+            raise PermissionError(errno.EACCES, "Permission denied", path)
+        if response.status == 416 and method == "GET":
+            return response, result
+        if not 200 <= response.status < 300:
+            raise OSError(
+                    errno.EIO, f"HTTP {response.status} {response.reason}",
+                    path)
+        return response, result
+
+    def stat(self, path):
+        response, _ = self._request("HEAD", path)
+        size = response.getheader("Content-Length")
+        if size is None:
+            raise OSError(errno.EIO, "Size of the object unknown", path)
+        mtime = 0
+        last_modified = response.getheader("Last-Modified")
+        if last_modified:
+            try:
+                mtime = email.utils.parsedate_to_datetime(
+                        last_modified).timestamp()
+            except (TypeError, ValueError):
+                pass
+        return os.stat_result((
+            stat.S_IFREG | 0o444, 0, 0, 1, 0, 0, int(size), mtime, mtime,
+            mtime))
+
+    @staticmethod
+    def _read_range(response, start, end):
+        """
+        Returns the body of the response to a GET of the bytes `start` to
+        `end` (inclusive) of an object.
+        """
+        data = response.read()
+        if len(data) != end - start + 1:
+            raise OSError(
+                    errno.EIO,
+                    f"Expected {end - start + 1} bytes at {start}, "
+                    f"got {len(data)}")
+        return data
+
+    def _fetch(self, path, start, end):
+        _, data = self._request(
+                "GET", path,
+                headers={"Range": f"bytes={start}-{end}"},
+                read=lambda response: self._read_range(response, start, end))
+        return data
+
+    def hash_file(self, path, algorithm="md5", read_mode=None, profile=None,
+                  buf=None, inflater=None):
+        """
+        Compute the hex digest of an object. The read mode is ignored:
+        nothing goes through the local page cache.
+        """
+        digest = hashlib.new(algorithm)
+        if inflater is not None:
+            digest = inflater.wrap(digest)
+        try:
+            self._hash_object(path, digest, profile, buf)
+            return digest.hexdigest()
+        finally:
+            close = getattr(digest, "close", None)
+            if close is not None:
+                close()
+
+    def _hash_object(self, path, digest, profile, buf):
+        if buf is None:
+            buf = bytearray(min(self._range_size, 1024 * 1024))
+
+        def read_first_range(response):
+            # Servers ignoring the range send the whole object.
+            n_bytes = 0
+            with memoryview(buf) as view:
+                while True:
+                    if profile is not None:
+                        start = profile.clock()
+                    n_read = response.readinto(view)
+                    if profile is not None:
+                        start = profile.add("read", start)
+                    if not n_read:
+                        return n_bytes
+                    digest.update(view[:n_read])
+                    if profile is not None:
+                        profile.add("hash", start)
+                    n_bytes += n_read
+
+        if profile is not None:
+            start = profile.clock()
+        # The first range is hashed as it arrives, and tells the size of
+        # the object.
+        response, n_bytes = self._request(
+                "GET", path,
+                headers={"Range": f"bytes=0-{self._range_size - 1}"},
+                read=read_first_range)
+        if profile is not None:
+            profile.add("open", start)
+        if response.status != 206:
+            # The whole object, or an empty one (416).
+            return
+
+        match = _CONTENT_RANGE.fullmatch(
+                response.getheader("Content-Range", ""))
+        if match is None or match.group(3) == "*":
+            raise OSError(errno.EIO, "Size of the object unknown", path)
+        size = int(match.group(3))
+        if n_bytes != int(match.group(2)) + 1:
+            raise OSError(errno.EIO, "Short read", path)
+
+        self._hash_ranges(path, digest, profile, n_bytes, size)
+
+    def _hash_ranges(self, path, digest, profile, offset, size):
+        """
+        Fetch the bytes of the object from `offset` to `size` in concurrent
+        ranges, and feed them in order into `digest`.
+        """
+        pending = []
+        try:
+            while pending or offset < size:
+                # Only block on the memory of the ranges when none of this
+                # object is in flight, so that hashing always progresses.
+                while offset < size and self._buffered.acquire(
+                        blocking=not pending):
+                    end = min(offset + self._range_size, size) - 1
+                    try:
+                        future = self._fetcher.submit(
+                                self._fetch, path, offset, end)
+                    except BaseException:
+                        self._buffered.release()
+                        raise
+                    pending.append(future)
+                    offset = end + 1
+
+                if profile is not None:
+                    start = profile.clock()
+                future = pending.pop(0)
+                try:
+                    data = future.result()
+                finally:
+                    self._buffered.release()
+                if profile is not None:
+                    start = profile.add("read", start)
+                digest.update(data)
+                if profile is not None:
+                    profile.add("hash", start)
+        finally:
+            for future in pending:
+                future.cancel()
+            for future in pending:
+                concurrent.futures.wait([future])
+                self._buffered.release()
@@ -0,0 +1,1358 @@
+"""
+In-process checker for md5sum-style manifests.
+
+The verifier is a drop-in replacement for `md5sum -c` that gives the service
+control over how files are read. It is meant to be run as a subprocess, in the
+same way as `md5sum`, from the directory the manifest paths are relative to:
+
+    python -m checksum.verifier --read-mode uncached <manifest>
+
+Its output and exit code follow those of `md5sum -c`.
+
+With `--storage`, files are read from an HTTP server or an S3-compatible
+object store instead, see `checksum.storage`.
+
+With `--cache`, every file verified is recorded in a
+`checksum.checksum_cache.ChecksumCache`, and files whose digest changed since
+they were last verified are reported as drift.
+
+With `--merkle`, the digests computed are rolled up into a
+`checksum.merkle.MerkleTree` of the files, saved once they are all checked.
+"""
+import argparse
+import collections
+import concurrent.futures
+import cProfile
+import errno
+import functools
+import hashlib
+import json
+import mmap
+import multiprocessing
+import os
+import stat
+import sys
+import time
+
+from checksum.buffers import BufferPool, align
+from checksum.checksum_cache import ChecksumCache
+from checksum.decompress import DecompressError, Inflater
+from checksum.merkle import MerkleTree
+from checksum.profiling import Profile, DEFAULT_N_SLOWEST
+from checksum.storage import (
+        DEFAULT_CONNECTIONS, DEFAULT_RANGE_SIZE, HTTPStorage, Storage)
+from checksum.walker import DEFAULT_WALK_WORKERS, CompletenessReport
+
+
+PROG = "checksum-verifier"
+
+READ_MODE_CACHED = "cached"
+READ_MODE_UNCACHED = "uncached"
+READ_MODES = (READ_MODE_CACHED, READ_MODE_UNCACHED)
+
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+
+# Minimum number of seconds between two writes of the report of a running
+# verification.
+REPORT_INTERVAL = 5
+
+# Files of at most this many bytes, and at most one block, are small: opening
+# them and seeking to them costs more than reading and hashing them.
+SMALL_FILE_SIZE = 256 * 1024
+
+# Number of small files hashed by a worker in one go.
+SMALL_FILE_BATCH = 256
+
+# Number of files stat'ed by a thread in one go, in path order so that the
+# files of a directory are stat'ed together.
+STAT_BATCH = 64
+
+# Files are hashed by worker threads, or by worker processes, which do not
+# contend for the GIL while running the Python code spent on each file and
+# block, at the cost of a buffer and an inflater of their own.
+EXECUTOR_THREADS = "threads"
+EXECUTOR_PROCESSES = "processes"
+EXECUTORS = (EXECUTOR_THREADS, EXECUTOR_PROCESSES)
+
+# Worker processes are forked by default from a fork server, a process that
+# only imported the verifier, rather than from the verifier itself, which
+# may hold threads and buffers by then.
+START_METHOD_FORKSERVER = "forkserver"
+START_METHODS = ("fork", START_METHOD_FORKSERVER, "spawn")
+
+
+ManifestEntry = collections.namedtuple("ManifestEntry", ["digest", "path"])
+
+
+class ManifestFormatError(ValueError):
+    """
+    Raised when a manifest line cannot be parsed.
+    """
+    pass
+
+
+def _unescape(path):
+    """
+    Undo the escaping `md5sum` applies to file names containing a backslash
+    or a newline.
+    """
+    out = []
+    chars = iter(path)
+    for char in chars:
+        if char == "\\":
+            escaped = next(chars, "")
+            if escaped == "n":
+                out.append("\n")
+            elif escaped == "\\":
+                out.append("\\")
+            else:
+                raise ManifestFormatError(f"invalid escape in {path!r}")
+        else:
+            out.append(char)
+    return "".join(out)
+
+
+def parse_manifest_line(line):
+    """
+    Parse one line of a manifest in the GNU coreutils format.
+
+    Parameters
+    ----------
+    line: str
+        line without its trailing newline
+
+    Raises
+    ------
+    ManifestFormatError
+        if the line is not properly formatted
+
+    Returns
+    -------
+    ManifestEntry
+    """
+    escaped = line.startswith("\\")
+    if escaped:
+        line = line[1:]
+
+    digest, sep, path = line.partition(" ")
+    if not sep or not path or path[0] not in " *":
+        raise ManifestFormatError(f"improperly formatted line: {line!r}")
+    path = path[1:]
+
+    try:
+        int(digest, 16)
+    except ValueError:
+        raise ManifestFormatError(f"invalid digest: {digest!r}")
+    if not path:
+        raise ManifestFormatError(f"missing path: {line!r}")
+
+    if escaped:
+        path = _unescape(path)
+
+    return ManifestEntry(digest.lower(), path)
+
+
+def format_manifest_line(entry):
+    """
+    Format a manifest entry the way `md5sum` does, escaping file names
+    containing a backslash or a newline.
+
+    Parameters
+    ----------
+    entry: ManifestEntry
+
+    Returns
+    -------
+    str
+        the line, without its trailing newline
+    """
+    if "\\" in entry.path or "\n" in entry.path:
+        path = entry.path.replace("\\", "\\\\").replace("\n", "\\n")
+        return f"\\{entry.digest}  {path}"
+    return f"{entry.digest}  {entry.path}"
+
+
+def parse_manifest(manifest):
+    """
+    Parse a manifest file.
+
+    File names that are not valid UTF-8 are decoded with surrogate escapes,
+    as `os.fsdecode` does, so that they name the same files when opened and
+    are written back as they were by `format_manifest_line`.
+
+    Parameters
+    ----------
+    manifest: str
+        path to the manifest
+
+    Returns
+    -------
+    ([ManifestEntry], int)
+        parsed entries in manifest order, and the number of improperly
+        formatted lines that were skipped
+    """
+    entries = []
+    n_improper = 0
+    with open(manifest, "r", errors="surrogateescape") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if not line.strip():
+                continue
+            try:
+                entries.append(parse_manifest_line(line))
+            except ManifestFormatError:
+                n_improper += 1
+    return entries, n_improper
+
+
+def _open(path, flags=0):
+    """
+    Open `path` for reading without updating its access time where
+    possible, which would cost a metadata write per file.
+    """
+    o_noatime = getattr(os, "O_NOATIME", 0)
+    if o_noatime:
+        try:
+            return os.open(path, os.O_RDONLY | o_noatime | flags)
+        except PermissionError:
+            # Only the owner of a file may open it with O_NOATIME.
+            pass
+    return os.open(path, os.O_RDONLY | flags)
+
+
+def _open_direct(path):
+    """
+    Open `path` for direct I/O, or return None if the file system does not
+    support it.
+    """
+    o_direct = getattr(os, "O_DIRECT", None)
+    if o_direct is None:
+        return None
+    try:
+        return _open(path, o_direct)
+    except OSError as e:
+        if e.errno == errno.EINVAL:
+            return None
+        raise
+
+
+def _hash_blocks(fd, digest, buf, direct=False, drop_cache=False,
+                 profile=None):
+    """
+    Feed the content of `fd` into `digest`, reading it into `buf` one block
+    at a time.
+
+    Parameters
+    ----------
+    fd: int
+        file descriptor to read from
+    digest: hashlib hash object
+        digest to update
+    buf: writable buffer
+        buffer reused for every read. Its length is the block size.
+    direct: bool
+        if True, `fd` was opened with O_DIRECT, and a short read means the
+        end of the file has been reached
+    drop_cache: bool
+        if True, drop every block from the page cache once it has been read
+    profile: checksum.profiling.Profile
+        if given, where read and hash timings are recorded
+    """
+    block_size = len(buf)
+    offset = 0
+    with memoryview(buf) as view:
+        while True:
+            if profile is not None:
+                start = profile.clock()
+            n_read = os.readv(fd, [buf])
+            if profile is not None:
+                start = profile.add("read", start)
+            if n_read == 0:
+                return
+            digest.update(view[:n_read])
+            if profile is not None:
+                profile.add("hash", start)
+            if drop_cache:
+                os.posix_fadvise(
+                        fd, offset, n_read, os.POSIX_FADV_DONTNEED)
+            offset += n_read
+            if direct and n_read < block_size:
+                return
+
+
+def hash_file(path, algorithm="md5", read_mode=READ_MODE_CACHED,
+              block_size=DEFAULT_BLOCK_SIZE, profile=None, buf=None,
+              inflater=None):
+    """
+    Compute the hex digest of a file.
+
+    Parameters
+    ----------
+    path: str
+        file to hash
+    algorithm: str
+        any algorithm supported by `hashlib.new`
+    read_mode: str
+        one of `READ_MODES`. In `uncached` mode the file is read with
+        O_DIRECT, falling back to `POSIX_FADV_DONTNEED` after each block on
+        file systems that do not support direct I/O, so that verifying large
+        runfolders does not evict everything else from the page cache.
+    block_size: int
+        size of each read, rounded up to the direct I/O alignment. Ignored
+        if `buf` is given.
+    profile: checksum.profiling.Profile
+        if given, where open, read and hash timings are recorded
+    buf: mmap.mmap
+        page aligned buffer to read into, e.g. from a
+        `checksum.buffers.BufferPool`. A buffer of `block_size` is allocated
+        for this file if not given.
+    inflater: checksum.decompress.Inflater
+        if given, gzip files are digested decompressed, see
+        `checksum.decompress.InflatingDigest`
+
+    Raises
+    ------
+    OSError
+        if the file cannot be opened or read
+    checksum.decompress.DecompressError
+        if a file is digested decompressed and is not valid gzip
+
+    Returns
+    -------
+    str
+    """
+    if read_mode not in READ_MODES:
+        raise ValueError(f"unknown read mode: {read_mode}")
+
+    if buf is None:
+        with mmap.mmap(-1, align(block_size)) as buf:
+            return hash_file(
+                    path, algorithm=algorithm, read_mode=read_mode,
+                    profile=profile, buf=buf, inflater=inflater)
+
+    def new_digest():
+        digest = hashlib.new(algorithm)
+        return inflater.wrap(digest) if inflater is not None else digest
+
+    if read_mode == READ_MODE_UNCACHED:
+        if profile is not None:
+            start = profile.clock()
+        try:
+            fd = _open_direct(path)
+        finally:
+            if profile is not None:
+                profile.add("open", start)
+        if fd is not None:
+            digest = new_digest()
+            try:
+                _hash_blocks(
+                        fd, digest, buf, direct=True, profile=profile)
+                return digest.hexdigest()
+            except OSError as e:
+                # Some file systems accept O_DIRECT at open time but reject
+                # the reads. Start over without it.
+                if e.errno != errno.EINVAL:
+                    raise
+            finally:
+                os.close(fd)
+                _close_digest(digest)
+
+    if profile is not None:
+        start = profile.clock()
+    try:
+        fd = _open(path)
+    finally:
+        if profile is not None:
+            profile.add("open", start)
+    digest = new_digest()
+    try:
+        _hash_blocks(
+                fd, digest, buf,
+                drop_cache=read_mode == READ_MODE_UNCACHED,
+                profile=profile)
+        return digest.hexdigest()
+    finally:
+        os.close(fd)
+        _close_digest(digest)
+
+
+def _close_digest(digest):
+    """
+    Release what an `InflatingDigest` may still hold after an error.
+    """
+    close = getattr(digest, "close", None)
+    if close is not None:
+        close()
+
+
+class LocalStorage(Storage):
+    """
+    Files on the local file system, relative to the current directory, read
+    with `hash_file`.
+    """
+
+    def stat(self, path):
+        return os.stat(path)
+
+    def hash_file(self, path, algorithm="md5", read_mode=READ_MODE_CACHED,
+                  profile=None, buf=None, inflater=None):
+        return hash_file(
+                path, algorithm=algorithm, read_mode=read_mode,
+                profile=profile, buf=buf, inflater=inflater)
+
+    def location(self, path):
+        return os.path.abspath(path)
+
+
+def open_storage(url=None, connections=DEFAULT_CONNECTIONS,
+                 range_size=DEFAULT_RANGE_SIZE):
+    """
+    Returns the storage backend at `url`: the local file system if it is
+    None, an `HTTPStorage` otherwise.
+
+    Raises
+    ------
+    ValueError
+        if the URL is not an http(s) URL
+    """
+    if url is None:
+        return LocalStorage()
+    return HTTPStorage(url, connections=connections, range_size=range_size)
+
+
+def _plural(n, singular, plural):
+    return singular if n == 1 else plural
+
+
+def _hash_path(path, buf, algorithm, read_mode, profile, inflater, storage):
+    """
+    Returns the hex digest of a file, or the error raised while reading it.
+    """
+    try:
+        return storage.hash_file(
+                path,
+                algorithm=algorithm,
+                read_mode=read_mode,
+                profile=profile,
+                buf=buf,
+                inflater=inflater)
+    except (OSError, DecompressError) as e:
+        return e
+
+
+def _hash_batch(paths, buffers, algorithm, read_mode, profile, inflater,
+                storage):
+    """
+    Hash a batch of files in turn, through a single buffer.
+
+    Returns
+    -------
+    {str: (str or Exception, float)}
+        for each path, the hex digest of the file or the error raised while
+        reading it, and the number of seconds it took
+    """
+    results = {}
+    buf = buffers.acquire()
+    try:
+        for path in paths:
+            start = time.perf_counter()
+            actual = _hash_path(
+                    path, buf, algorithm, read_mode, profile, inflater,
+                    storage)
+            results[path] = actual, time.perf_counter() - start
+    finally:
+        buffers.release(buf)
+    return results
+
+
+class _HashingThreads:
+    """
+    Hashes the tasks of `_plan_tasks` on worker threads sharing the read
+    buffers, the inflater and the storage of the verification.
+
+    Methods
+    -------
+    submit(paths)
+        hash a task, returns a future
+    collect(future)
+        returns the results of a task, see `_hash_batch`
+    close()
+        cancel the tasks not started, and wait for the others
+    """
+
+    def __init__(self, workers, buffers, algorithm, read_mode, profile,
+                 inflater, storage):
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+                workers, thread_name_prefix="verify")
+        self._args = (
+            buffers, algorithm, read_mode, profile, inflater, storage)
+
+    def submit(self, paths):
+        return self._executor.submit(_hash_batch, paths, *self._args)
+
+    def collect(self, future):
+        return future.result()
+
+    def close(self):
+        self._executor.shutdown(cancel_futures=True)
+
+
+# Buffers, inflater and storage of a worker process of `_HashingProcesses`.
+_worker_state = None
+
+
+def _init_worker(block_size, algorithm, read_mode, profiled,
+                 inflate_threads, storage):
+    global _worker_state
+    _worker_state = (
+        BufferPool(block_size, block_size),
+        algorithm,
+        read_mode,
+        profiled,
+        Inflater(inflate_threads) if inflate_threads else None,
+        storage,
+        )
+
+
+def _hash_in_worker(paths):
+    """
+    Hash a task in a worker process.
+
+    Returns
+    -------
+    ({str: (str or Exception, float)}, {str: PhaseTimings})
+        the results of `_hash_batch`, and the timings of each phase if the
+        verification is profiled, None otherwise
+    """
+    buffers, algorithm, read_mode, profiled, inflater, storage = (
+        _worker_state)
+    profile = Profile(n_slowest=0) if profiled else None
+    results = _hash_batch(
+            paths, buffers, algorithm, read_mode, profile, inflater, storage)
+    return results, profile.phases if profile is not None else None
+
+
+# Modules imported once by the fork server rather than by every worker: what
+# the verifier imports, but not the verifier itself, which a worker runs as
+# its main module first when the verifier is run with `python -m`.
+_FORKSERVER_PRELOAD = [
+    "checksum.buffers", "checksum.checksum_cache", "checksum.decompress",
+    "checksum.merkle", "checksum.profiling", "checksum.storage",
+    "checksum.walker"]
+
+
+class _HashingProcesses:
+    """
+    Hashes the tasks of `_plan_tasks` in worker processes, each reading
+    through a buffer, and inflating through an `Inflater`, of its own.
+
+    Each worker is sent the paths of a task, and sends back their digests
+    and the timings of the task, through the pipes of a
+    `concurrent.futures.ProcessPoolExecutor`. Workers are started as the
+    first tasks are submitted, and stop when the pool is closed.
+
+    Methods
+    -------
+    submit(paths)
+        hash a task, returns a future
+    collect(future)
+        returns the results of a task, see `_hash_batch`, after adding its
+        timings to the profile of the verification
+    close()
+        cancel the tasks not started, and wait for the others
+    """
+
+    def __init__(self, workers, block_size, algorithm, read_mode, profile,
+                 inflate_threads, storage,
+                 start_method=START_METHOD_FORKSERVER):
+        """
+        Parameters
+        ----------
+        workers: int
+            number of worker processes
+        inflate_threads: int
+            number of threads inflating gzip files in each worker, None if
+            gzip files are checked as they are
+        storage: checksum.storage.Storage
+            where the files are read from. Each worker reads through a copy
+            of its own.
+        start_method: str
+            how the workers are started, see `multiprocessing`
+        """
+        context = multiprocessing.get_context(start_method)
+        if start_method == START_METHOD_FORKSERVER:
+            context.set_forkserver_preload(_FORKSERVER_PRELOAD)
+        self._profile = profile
+        self._executor = concurrent.futures.ProcessPoolExecutor(
+                workers,
+                mp_context=context,
+                initializer=_init_worker,
+                initargs=(
+                    block_size, algorithm, read_mode, profile is not None,
+                    inflate_threads, storage))
+
+    def submit(self, paths):
+        return self._executor.submit(_hash_in_worker, paths)
+
+    def collect(self, future):
+        results, phases = future.result()
+        if phases is not None:
+            self._profile.merge(phases)
+        return results
+
+    def close(self):
+        self._executor.shutdown(cancel_futures=True)
+
+
+def _stat_entries(entries, profile, storage, completeness=None, workers=1):
+    """
+    Stat the file of every entry, directory by directory, on `workers`
+    threads, so that stat'ing many files over NFS is bound by the number of
+    requests in flight rather than by their latency. The status found by
+    the walk of `completeness` is reused for the files whose directory it
+    already listed, the others are stat'ed without waiting for the walk.
+
+    Returns
+    -------
+    {str: os.stat_result}
+        the status of each file, by normalized path, None if it cannot be
+        stat'ed
+    """
+    def stat_batch(paths):
+        stats = {}
+        for path in paths:
+            if profile is not None:
+                start = profile.clock()
+            try:
+                if completeness is None:
+                    raise KeyError(path)
+                stats[path] = completeness.stat(path, block=False)
+            except KeyError:
+                try:
+                    stats[path] = storage.stat(path)
+                except OSError:
+                    stats[path] = None
+            if profile is not None:
+                profile.add("stat", start)
+        return stats
+
+    # Sorting the paths groups the files of each directory together.
+    paths = sorted({os.path.normpath(entry.path) for entry in entries})
+    batches = [
+        paths[i:i + STAT_BATCH] for i in range(0, len(paths), STAT_BATCH)]
+    stats = {}
+    if workers > 1 and len(batches) > 1:
+        with concurrent.futures.ThreadPoolExecutor(
+                workers, thread_name_prefix="stat") as executor:
+            for batch_stats in executor.map(stat_batch, batches):
+                stats.update(batch_stats)
+    else:
+        for batch in batches:
+            stats.update(stat_batch(batch))
+    return stats
+
+
+def _small_file_batches(stats, max_size):
+    """
+    Split the small regular files into batches, in the order they are
+    likely laid out on disk: by file system, directory and inode.
+
+    Returns
+    -------
+    [[str]]
+        the paths of the files in each batch
+    """
+    small = sorted(
+        (st.st_dev, path.rpartition(os.sep)[0], st.st_ino, path)
+        for path, st in stats.items()
+        if st is not None
+        and stat.S_ISREG(st.st_mode)
+        and st.st_size <= max_size)
+    paths = [path for *_, path in small]
+    return [
+        paths[i:i + SMALL_FILE_BATCH]
+        for i in range(0, len(paths), SMALL_FILE_BATCH)
+        ]
+
+
+def _plan_tasks(stats, max_small_size):
+    """
+    Split the files into the tasks of the workers, longest first, so that
+    no large file is left to be hashed alone at the end: large files one by
+    one, by decreasing size, then the batches of small files.
+
+    Returns
+    -------
+    [[str]]
+        the paths of the files of each task, in the order they should be
+        started
+    """
+    batches = _small_file_batches(stats, max_small_size)
+    small = {path for batch in batches for path in batch}
+    large = sorted(
+        (
+            (st.st_size if st is not None else 0, path)
+            for path, st in stats.items()
+            if path not in small
+        ),
+        key=lambda item: (-item[0], item[1]))
+    return [[path] for _, path in large] + batches
+
+
+def _record(cache, drift, entry, actual, result, st, err, location):
+    """
+    Record the verification of a file in the cache, at its `location`, and
+    report its drift if its digest changed since it was last verified.
+    """
+    size, mtime = (st.st_size, st.st_mtime) if st is not None else (None, None)
+    previous = cache.get(location)
+    digest = actual if not isinstance(actual, Exception) else None
+    if (
+        previous is not None
+        and previous["digest"] is not None
+        and digest is not None
+        and previous["digest"] != digest
+    ):
+        print(
+            f"{PROG}: {entry.path}: digest changed since it was last "
+            "verified",
+            file=err, flush=True)
+        drift.add(entry.path, previous, digest, size, mtime)
+    cache.record(location, digest, size, mtime, result)
+
+
+def _add_to_tree(merkle, path, digest, err):
+    """
+    Add the digest computed for a file to the Merkle tree, warning about
+    files that cannot be added.
+    """
+    try:
+        merkle.add(path, digest)
+    except ValueError as e:
+        print(
+            f"{PROG}: {e}, not added to the Merkle tree", file=err,
+            flush=True)
+
+
+def _verify_entries(
+        entries, out, err, hashing, max_small_size, profile, progress,
+        manifests, results, cache=None, drift=None, storage=None,
+        completeness=None, merkle=None, workers=1):
+    """
+    Check each entry in turn, see `verify`.
+
+    Files listed more than once, e.g. by overlapping manifests, are only
+    read the first time. Their digest is kept until the last time they are
+    listed.
+
+    All files are stat'ed first, on `workers` threads, and hashed by the
+    workers of `hashing`, longest first: large files by decreasing size,
+    then small files of at most `max_small_size` bytes in batches sorted by
+    directory and inode. Results are reported in manifest order.
+
+    Returns
+    -------
+    (int, int)
+        number of mismatching and of unreadable files
+    """
+    n_mismatch = 0
+    n_unreadable = 0
+    remaining = collections.Counter(
+            os.path.normpath(entry.path) for entry in entries)
+    known = {}
+    stats = _stat_entries(entries, profile, storage, completeness, workers)
+
+    # Task of each file whose result was not collected yet, and results of
+    # the tasks already collected.
+    tasks = {}
+    hashed = {}
+    for paths in _plan_tasks(stats, max_small_size):
+        tasks.update(dict.fromkeys(paths, hashing.submit(paths)))
+
+    try:
+        for i, entry in enumerate(entries):
+            if profile is not None:
+                file_start = profile.clock()
+
+            key = os.path.normpath(entry.path)
+            is_known = key in known
+            if is_known:
+                actual = known[key]
+            else:
+                if key not in hashed:
+                    hashed.update(hashing.collect(tasks[key]))
+                actual, seconds = hashed.pop(key)
+                del tasks[key]
+                if profile is not None:
+                    file_start = profile.clock() - seconds
+            remaining[key] -= 1
+            if remaining[key]:
+                known[key] = actual
+            else:
+                known.pop(key, None)
+
+            if isinstance(actual, Exception):
+                n_unreadable += 1
+                message = getattr(actual, "strerror", None) or str(actual)
+                print(
+                    f"{PROG}: {entry.path}: {message}", file=err, flush=True)
+                result = "FAILED open or read"
+            elif actual == entry.digest:
+                result = "OK"
+            else:
+                n_mismatch += 1
+                result = "FAILED"
+
+            if cache is not None and not is_known:
+                _record(
+                        cache, drift, entry, actual, result, stats[key], err,
+                        storage.location(key))
+            if (
+                merkle is not None
+                and not is_known
+                and not isinstance(actual, Exception)
+            ):
+                _add_to_tree(merkle, key, actual, err)
+
+            if profile is not None:
+                start = profile.clock()
+            print(f"{entry.path}: {result}", file=out, flush=True)
+            if profile is not None:
+                size = stats[key].st_size if stats[key] is not None else None
+                profile.add_file(
+                        entry.path, size,
+                        profile.add("write", start) - file_start)
+
+            if results is not None:
+                results.add(manifests[i], entry.path, result)
+
+            if progress is not None:
+                progress()
+    finally:
+        hashing.close()
+
+    if completeness is not None:
+        completeness.finish(stats, exclude=set(manifests or ()))
+
+    return n_mismatch, n_unreadable
+
+
+class ManifestResults:
+    """
+    Results of a verification, for each manifest.
+
+    Methods
+    -------
+    add(manifest, path, result)
+        record the result of one file
+    to_dict()
+        returns the number of files "ok", "failed" and "unreadable" in each
+        manifest, and the paths of at most `MAX_LISTED_FILES` files that
+        are not OK
+    """
+
+    MAX_LISTED_FILES = 100
+
+    def __init__(self, manifests):
+        """
+        Parameters
+        ----------
+        manifests: [str]
+            names of the manifests, in the order they are reported
+        """
+        self._results = {
+            manifest: {"ok": 0, "failed": 0, "unreadable": 0, "not_ok": []}
+            for manifest in manifests
+            }
+
+    def add(self, manifest, path, result):
+        results = self._results[manifest]
+        if result == "OK":
+            results["ok"] += 1
+            return
+        if result == "FAILED":
+            results["failed"] += 1
+        else:
+            results["unreadable"] += 1
+        if len(results["not_ok"]) < self.MAX_LISTED_FILES:
+            results["not_ok"].append(path)
+
+    def to_dict(self):
+        return {
+            manifest: dict(results)
+            for manifest, results in self._results.items()
+            }
+
+
+class DriftReport:
+    """
+    Files whose digest changed since they were last verified.
+
+    Methods
+    -------
+    add(path, previous, digest, size, mtime)
+        record a file whose digest changed
+    to_dict()
+        returns the number of files that drifted, and at most
+        `MAX_LISTED_FILES` of them
+    """
+
+    MAX_LISTED_FILES = 100
+
+    def __init__(self):
+        self._n_files = 0
+        self._files = []
+
+    def add(self, path, previous, digest, size, mtime):
+        """
+        Parameters
+        ----------
+        path: str
+            path to the file
+        previous: dict
+            last verification of the file, see `ChecksumCache.get`
+        digest: str
+            digest just computed
+        size: int
+            current size of the file
+        mtime: float
+            current modification time of the file
+        """
+        self._n_files += 1
+        if len(self._files) < self.MAX_LISTED_FILES:
+            self._files.append({
+                "path": path,
+                "previous_digest": previous["digest"],
+                "digest": digest,
+                "previous_verified_at": previous["verified_at"],
+                # A file changed without being modified has rotted.
+                "modified": (
+                    (previous["size"], previous["mtime"]) != (size, mtime)),
+                })
+
+    def to_dict(self):
+        return {"n_files": self._n_files, "files": list(self._files)}
+
+
+def verify(entries, out=None, err=None, algorithm="md5",
+           read_mode=READ_MODE_CACHED, block_size=DEFAULT_BLOCK_SIZE,
+           n_improper=0, profile=None, progress=None, memory_limit=None,
+           decompress=False, inflate_threads=None, manifests=None,
+           results=None, cache=None, drift=None, workers=1, storage=None,
+           completeness=None, executor=EXECUTOR_THREADS,
+           start_method=START_METHOD_FORKSERVER, merkle=None):
+    """
+    Check the files listed in `entries` and report the results the way
+    `md5sum -c` does.
+
+    A file listed several times, e.g. by several manifests, is only read
+    once.
+
+    Parameters
+    ----------
+    entries: [ManifestEntry]
+        files to check, relative to the current directory
+    out: file
+        where the per-file results are written (default: stdout)
+    err: file
+        where read errors and the summary warnings are written
+        (default: stderr)
+    algorithm: str
+        digest algorithm used by the manifest
+    read_mode: str
+        see `hash_file`
+    block_size: int
+        see `hash_file`
+    n_improper: int
+        number of improperly formatted manifest lines, reported in the summary
+    profile: checksum.profiling.Profile
+        if given, where the time spent on each file is recorded
+    progress: callable
+        if given, called without arguments after each file has been checked
+    memory_limit: int
+        maximum number of bytes of read buffers in use at the same time
+    decompress: bool
+        if True, gzip files are checked against the digest of their
+        decompressed content, inflated by `inflate_threads` workers
+        (default: one per CPU). Other files are checked as they are.
+    inflate_threads: int
+        see `decompress`
+    manifests: [str]
+        manifest each entry comes from, required if `results` is given
+    results: ManifestResults
+        if given, where the results of each manifest are recorded
+    cache: checksum.checksum_cache.ChecksumCache
+        if given, where the verification of each file is recorded
+    drift: DriftReport
+        where files whose digest changed since they were last verified are
+        recorded, required if `cache` is given
+    workers: int
+        number of threads or processes hashing files, largest first, and
+        of threads stat'ing them beforehand. All hashing threads share the
+        read buffers bounded by `memory_limit`. There are no more processes
+        than buffers within `memory_limit`, and the `inflate_threads` are
+        split between them.
+    storage: checksum.storage.Storage
+        where the files are read from (default: the local file system)
+    completeness: checksum.walker.CompletenessReport
+        if given, the tree it covers is walked while files are hashed, and
+        compared with the files listed
+    executor: str
+        whether files are hashed by worker threads or processes, one of
+        `EXECUTORS`
+    start_method: str
+        how worker processes are started, one of `START_METHODS`
+    merkle: checksum.merkle.MerkleTree
+        if given, where the digest computed for each file under its root is
+        added, whether it matches or not. Files that cannot be read are
+        left out.
+
+    Returns
+    -------
+    int
+        0 if all files matched, 1 otherwise. Files found by the walk that
+        are not listed do not make the verification fail.
+    """
+    out = out or sys.stdout
+    err = err or sys.stderr
+
+    if not entries:
+        print(f"{PROG}: no properly formatted checksum lines found", file=err)
+        return 1
+
+    if completeness is not None:
+        completeness.start()
+    storage = storage or LocalStorage()
+    buffers = BufferPool(block_size, memory_limit)
+    inflater = None
+    if executor == EXECUTOR_PROCESSES:
+        workers = min(workers, buffers.max_buffers or workers)
+        worker_inflate_threads = None
+        if decompress:
+            worker_inflate_threads = max(
+                    1, (inflate_threads or os.cpu_count() or 1) // workers)
+        hashing = _HashingProcesses(
+                workers, buffers.block_size, algorithm, read_mode, profile,
+                worker_inflate_threads, storage, start_method)
+    else:
+        inflater = Inflater(inflate_threads) if decompress else None
+        hashing = _HashingThreads(
+                workers, buffers, algorithm, read_mode, profile, inflater,
+                storage)
+    try:
+        n_mismatch, n_unreadable = _verify_entries(
+                entries, out, err, hashing,
+                min(SMALL_FILE_SIZE, buffers.block_size), profile, progress,
+                manifests, results, cache, drift, storage, completeness,
+                merkle, workers)
+    finally:
+        buffers.close()
+        if inflater is not None:
+            inflater.close()
+
+    print_summary(n_improper, n_unreadable, n_mismatch, err)
+    if completeness is not None:
+        _print_completeness(completeness, err)
+
+    return int(bool(n_mismatch or n_unreadable))
+
+
+def print_summary(n_improper, n_unreadable, n_mismatch, err, prog=PROG):
+    """
+    Print the warnings `md5sum -c` ends with, on `err`, as printed by
+    `prog`.
+    """
+    if n_improper:
+        print(
+            f"{prog}: WARNING: {n_improper} "
+            f"{_plural(n_improper, 'line is', 'lines are')} "
+            "improperly formatted",
+            file=err)
+    if n_unreadable:
+        print(
+            f"{prog}: WARNING: {n_unreadable} listed "
+            f"{_plural(n_unreadable, 'file', 'files')} could not be read",
+            file=err)
+    if n_mismatch:
+        print(
+            f"{prog}: WARNING: {n_mismatch} computed "
+            f"{_plural(n_mismatch, 'checksum', 'checksums')} did NOT match",
+            file=err)
+
+
+def _print_completeness(completeness, err):
+    """
+    Print the files found by the walk that are not listed, and the
+    directories that could not be walked.
+    """
+    for directory, message in completeness.walker.errors:
+        print(f"{PROG}: {directory}: {message}", file=err)
+    n_untracked = len(completeness.untracked)
+    if n_untracked:
+        print(
+            f"{PROG}: WARNING: {n_untracked} "
+            f"{_plural(n_untracked, 'file', 'files')} under "
+            f"{completeness.walker.root} "
+            f"{_plural(n_untracked, 'is', 'are')} not listed",
+            file=err)
+
+
+def write_report(path, report):
+    """
+    Atomically write the JSON report of a verification, so that the service
+    never reads a partially written report.
+
+    Parameters
+    ----------
+    path: str
+        where to write the report
+    report: dict
+        JSON serializable report
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(report, f)
+    os.replace(tmp_path, path)
+
+
+class _ReportWriter:
+    """
+    Writes the report of a running verification, at most once every
+    `interval` seconds, and once more when it is done.
+    """
+
+    def __init__(self, path, profile, results=None, drift=None,
+                 completeness=None, interval=REPORT_INTERVAL):
+        self._path = path
+        self._profile = profile
+        self._results = results
+        self._drift = drift
+        self._completeness = completeness
+        self._interval = interval
+        self._last_write = time.monotonic()
+
+    def __call__(self):
+        now = time.monotonic()
+        if now - self._last_write >= self._interval:
+            self._last_write = now
+            self.write()
+
+    def write(self):
+        report = {}
+        if self._profile is not None:
+            report["profile"] = self._profile.to_dict()
+        if self._results is not None:
+            report["manifests"] = self._results.to_dict()
+        if self._drift is not None:
+            report["drift"] = self._drift.to_dict()
+        if self._completeness is not None:
+            report["completeness"] = self._completeness.to_dict()
+        write_report(self._path, report)
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(
+            prog=PROG,
+            description=(
+                "Check files against md5sum-style manifests. Files listed "
+                "by several manifests are read once."))
+    parser.add_argument("manifests", nargs="+", metavar="manifest")
+    parser.add_argument(
+            "--algorithm", default="md5",
+            help="digest algorithm used by the manifest (default: md5)")
+    parser.add_argument(
+            "--read-mode", choices=READ_MODES, default=READ_MODE_CACHED)
+    parser.add_argument(
+            "--block-size", type=int, default=DEFAULT_BLOCK_SIZE)
+    parser.add_argument(
+            "--memory-limit", type=int,
+            help="maximum number of bytes of read buffers")
+    parser.add_argument(
+            "--workers", type=int, default=1,
+            help=(
+                "number of threads or processes hashing files, largest "
+                "first (default: %(default)s)"))
+    parser.add_argument(
+            "--executor", choices=EXECUTORS, default=EXECUTOR_THREADS,
+            help=(
+                "whether files are hashed by threads or by processes "
+                "(default: %(default)s)"))
+    parser.add_argument(
+            "--start-method", choices=START_METHODS,
+            default=START_METHOD_FORKSERVER,
+            help="how worker processes are started (default: %(default)s)")
+    parser.add_argument(
+            "--storage",
+            help=(
+                "http(s) URL of the HTTP server or object store bucket the "
+                "paths of the files are relative to (default: the current "
+                "directory)"))
+    parser.add_argument(
+            "--storage-connections", type=int, default=DEFAULT_CONNECTIONS,
+            help=(
+                "maximum number of connections to the storage "
+                "(default: %(default)s)"))
+    parser.add_argument(
+            "--storage-range-size", type=int, default=DEFAULT_RANGE_SIZE,
+            help=(
+                "size of the ranges large objects are fetched in "
+                "(default: %(default)s)"))
+    parser.add_argument(
+            "--decompress", action="store_true",
+            help=(
+                "check gzip files against the digest of their decompressed "
+                "content"))
+    parser.add_argument(
+            "--inflate-threads", type=int,
+            help="number of threads inflating gzip files (default: one per CPU)")
+    parser.add_argument(
+            "--report",
+            help=(
+                "where to write a JSON report of the verification, with the "
+                "results of each manifest"))
+    parser.add_argument(
+            "--cache",
+            help=(
+                "checksum cache to record the verification of each file in. "
+                "Files whose digest changed since they were last verified "
+                "are listed in the report."))
+    parser.add_argument(
+            "--completeness", metavar="DIRECTORY",
+            help=(
+                "walk DIRECTORY while files are hashed, and report the files "
+                "under it that are not listed"))
+    parser.add_argument(
+            "--walk-workers", type=int, default=DEFAULT_WALK_WORKERS,
+            help=(
+                "number of threads walking the directory of --completeness "
+                "(default: %(default)s)"))
+    parser.add_argument(
+            "--merkle", metavar="PATH",
+            help=(
+                "where to write a JSON Merkle tree of the digests of the "
+                "files, rolled up by directory"))
+    parser.add_argument(
+            "--merkle-root", metavar="DIRECTORY", default=os.curdir,
+            help=(
+                "directory the Merkle tree is rooted at, files outside of it "
+                "are left out (default: the current directory)"))
+    parser.add_argument(
+            "--profile", action="store_true",
+            help="record where time is spent, in the report")
+    parser.add_argument(
+            "--n-slowest", type=int, default=DEFAULT_N_SLOWEST,
+            help="number of slowest files to include in the profile")
+    parser.add_argument(
+            "--cprofile",
+            help="where to dump cProfile statistics of the verification")
+    args = parser.parse_args(argv)
+    if args.profile and not args.report:
+        parser.error("--profile requires --report")
+    if args.completeness and args.storage:
+        parser.error(
+                "--completeness requires files on the local file system")
+    if args.walk_workers < 1:
+        parser.error("--walk-workers must be at least 1")
+    return args
+
+
+def main(argv=None):
+    args = _parse_args(argv)
+    # Print the file names that are not valid UTF-8 as they were listed.
+    for stream in (sys.stdout, sys.stderr):
+        if hasattr(stream, "reconfigure"):
+            stream.reconfigure(errors="surrogateescape")
+
+    entries = []
+    manifests = []
+    n_improper = 0
+    n_unreadable_manifests = 0
+    for manifest in args.manifests:
+        try:
+            manifest_entries, manifest_n_improper = parse_manifest(manifest)
+        except (OSError, ValueError) as e:
+            message = getattr(e, "strerror", None) or str(e)
+            print(f"{PROG}: {manifest}: {message}", file=sys.stderr)
+            n_unreadable_manifests += 1
+            continue
+        entries += manifest_entries
+        manifests += [manifest] * len(manifest_entries)
+        n_improper += manifest_n_improper
+    if n_unreadable_manifests == len(args.manifests):
+        return 1
+
+    try:
+        storage = open_storage(
+                args.storage, args.storage_connections,
+                args.storage_range_size)
+    except ValueError as e:
+        print(f"{PROG}: {e}", file=sys.stderr)
+        return 1
+
+    profile = Profile(args.n_slowest) if args.profile else None
+    report_writer = None
+    results = None
+    cache = ChecksumCache(args.cache) if args.cache else None
+    drift = DriftReport() if cache is not None else None
+    completeness = None
+    if args.completeness:
+        completeness = CompletenessReport(
+                args.completeness, args.walk_workers)
+    merkle = None
+    if args.merkle:
+        merkle = MerkleTree(args.merkle_root, args.algorithm)
+    if args.report:
+        results = ManifestResults(args.manifests)
+        report_writer = _ReportWriter(
+                args.report, profile, results, drift, completeness)
+
+    run = functools.partial(
+            verify,
+            entries,
+            algorithm=args.algorithm,
+            read_mode=args.read_mode,
+            block_size=args.block_size,
+            n_improper=n_improper,
+            profile=profile,
+            progress=report_writer,
+            memory_limit=args.memory_limit,
+            decompress=args.decompress,
+            inflate_threads=args.inflate_threads,
+            manifests=manifests,
+            results=results,
+            cache=cache,
+            drift=drift,
+            workers=args.workers,
+            storage=storage,
+            completeness=completeness,
+            executor=args.executor,
+            start_method=args.start_method,
+            merkle=merkle)
+
+    try:
+        if args.cprofile:
+            profiler = cProfile.Profile()
+            try:
+                return_code = profiler.runcall(run)
+            finally:
+                profiler.dump_stats(args.cprofile)
+        else:
+            return_code = run()
+    finally:
+        if cache is not None:
+            cache.close()
+        storage.close()
+
+    if report_writer is not None:
+        report_writer.write()
+    if merkle is not None:
+        merkle.save(args.merkle)
+
+    return max(return_code, int(bool(n_unreadable_manifests)))
+
+
+if __name__ == "__main__":
+    # Run as `checksum.verifier` rather than `__main__`, so that the worker
+    # processes, which do not run `__main__`, can find what they are sent.
+    from checksum.verifier import main
+    sys.exit(main())
@@ -0,0 +1,297 @@
+"""
+Completeness of a runfolder: files missing from its manifests, and listed
+files missing from it.
+
+A `TreeWalker` lists a directory tree with `os.scandir` on several threads,
+one directory at a time, and stats every file it finds, so that walking a
+runfolder over NFS is bound by the number of requests in flight rather
+than by their latency. The walk runs alongside the verification: the
+verifier reuses the status of the listed files whose directory was already
+listed, stats the others itself rather than waiting for the walk, and
+compares the files found with the listed ones once both are done.
+"""
+import os
+import queue
+import stat
+import threading
+
+
+DEFAULT_WALK_WORKERS = 8
+
+
+class TreeWalker:
+    """
+    Walks a directory tree on `workers` threads.
+
+    Directories are not followed through symbolic links: symbolic links to
+    directories are recorded in `linked_directories` rather than as files.
+    Files are stat'ed following them, as they are read.
+
+    Methods
+    -------
+    start()
+        start walking
+    stat(path, block=True)
+        returns the status of a file found by the walk, waiting until its
+        directory has been listed if `block`
+    join()
+        wait for the walk to finish
+    files()
+        returns the status of every file found, by path
+    """
+
+    def __init__(self, root, workers=DEFAULT_WALK_WORKERS):
+        """
+        Parameters
+        ----------
+        root: str
+            directory to walk, relative to the current directory like the
+            paths of manifests
+        workers: int
+            number of threads listing directories
+        """
+        self.root = os.path.normpath(root)
+        self.errors = []
+        self.linked_directories = []
+        self._workers = workers
+        self._queue = queue.SimpleQueue()
+        self._cond = threading.Condition()
+        # Number of directories queued or being listed.
+        self._pending = 0
+        # Status of the files of each directory listed, by name, and the
+        # names of its subdirectories.
+        self._listed = {}
+        self._subdirectories = {}
+        # Directories that could not be listed.
+        self._unlisted = set()
+        self._done = False
+        self._threads = []
+
+    def start(self):
+        self._push(self.root)
+        for i in range(self._workers):
+            thread = threading.Thread(
+                    target=self._run, name=f"walk-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _push(self, directory):
+        with self._cond:
+            self._pending += 1
+        self._queue.put(directory)
+
+    def _list(self, directory):
+        """
+        Returns the status of the files in `directory`, by name, its
+        subdirectories, and its symbolic links to directories.
+        """
+        files = {}
+        subdirectories = []
+        linked_directories = []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                except OSError:
+                    is_dir = False
+                if is_dir:
+                    subdirectories.append(os.path.normpath(entry.path))
+                    continue
+                try:
+                    st = entry.stat()
+                except OSError:
+                    # E.g. a dangling symbolic link.
+                    st = None
+                if st is not None and stat.S_ISDIR(st.st_mode):
+                    linked_directories.append(os.path.normpath(entry.path))
+                    continue
+                files[entry.name] = st
+        return files, subdirectories, linked_directories
+
+    def _run(self):
+        while True:
+            directory = self._queue.get()
+            if directory is None:
+                return
+            try:
+                files, subdirectories, linked_directories = self._list(
+                        directory)
+            except OSError as e:
+                files, subdirectories, linked_directories = None, [], []
+                with self._cond:
+                    self.errors.append((directory, e.strerror))
+            for subdirectory in subdirectories:
+                self._push(subdirectory)
+            with self._cond:
+                self.linked_directories.extend(linked_directories)
+                if files is not None:
+                    self._listed[directory] = files
+                    self._subdirectories[directory] = {
+                        os.path.basename(subdirectory)
+                        for subdirectory in subdirectories}
+                else:
+                    self._unlisted.add(directory)
+                self._pending -= 1
+                if not self._pending:
+                    self._done = True
+                    for _ in range(self._workers):
+                        self._queue.put(None)
+                self._cond.notify_all()
+
+    def covers(self, path):
+        """
+        Returns whether the normalized `path` is under the walked root.
+        """
+        if self.root == os.curdir:
+            return not os.path.isabs(path) and not (
+                path == os.pardir or path.startswith(os.pardir + os.sep))
+        return path.startswith(self.root + os.sep)
+
+    def _never_listed(self, directory):
+        """
+        Returns whether the walk already knows it will not list `directory`,
+        a directory under the root: one of the directories leading to it
+        could not be listed, or does not hold it as a subdirectory, e.g.
+        because it is a symbolic link. The caller must hold `_cond`.
+        """
+        while directory != self.root:
+            parent = os.path.dirname(directory) or os.curdir
+            if parent in self._unlisted:
+                return True
+            if (
+                parent in self._subdirectories
+                and os.path.basename(directory)
+                not in self._subdirectories[parent]
+            ):
+                return True
+            directory = parent
+        return False
+
+    def stat(self, path, block=True):
+        """
+        Returns the status of the file at the normalized `path`, None if it
+        does not exist, once its directory has been listed.
+
+        Parameters
+        ----------
+        path: str
+            normalized path to the file
+        block: bool
+            if False, do not wait for the directory of the file to be listed
+
+        Raises
+        ------
+        KeyError
+            if the walk does not tell: the file is not under the root, its
+            directory will not be listed, e.g. because it is reached
+            through a symbolic link, or it was not listed yet and `block`
+            is False
+        """
+        if not self.covers(path):
+            raise KeyError(path)
+        directory, name = os.path.split(path)
+        with self._cond:
+            def answered():
+                return (
+                    directory in self._listed
+                    or self._done
+                    or self._never_listed(directory))
+
+            if block:
+                self._cond.wait_for(answered)
+            files = self._listed.get(directory)
+        if files is None:
+            raise KeyError(path)
+        return files.get(name)
+
+    def join(self):
+        with self._cond:
+            self._cond.wait_for(lambda: self._done)
+        for thread in self._threads:
+            thread.join()
+
+    def files(self):
+        """
+        Returns
+        -------
+        {str: os.stat_result}
+            status of every file found by the walk, by normalized path,
+            None if it cannot be stat'ed. Only complete once the walk is
+            finished.
+        """
+        with self._cond:
+            listed = list(self._listed.items())
+        return {
+            os.path.normpath(os.path.join(directory, name)): st
+            for directory, files in listed
+            for name, st in files.items()
+            }
+
+
+class CompletenessReport:
+    """
+    Compares the files found under a root with the files listed by the
+    manifests.
+
+    Methods
+    -------
+    start()
+        start walking the root
+    stat(path, block=True)
+        see `TreeWalker.stat`
+    finish(stats, exclude)
+        wait for the walk, and compare its files with the listed ones
+    to_dict()
+        returns the numbers of files found, "untracked" and "missing", and
+        at most `MAX_LISTED_FILES` of each, and the symbolic links to
+        directories that were not followed
+    """
+
+    MAX_LISTED_FILES = 100
+
+    def __init__(self, root, workers=DEFAULT_WALK_WORKERS):
+        self.walker = TreeWalker(root, workers)
+        self.untracked = []
+        self.missing = []
+        self._n_files = 0
+
+    def start(self):
+        self.walker.start()
+
+    def stat(self, path, block=True):
+        return self.walker.stat(path, block)
+
+    def finish(self, stats, exclude=()):
+        """
+        Parameters
+        ----------
+        stats: {str: os.stat_result}
+            status of each listed file, by normalized path, None if it
+            cannot be stat'ed
+        exclude: [str]
+            files found that are not expected to be listed, e.g. the
+            manifests themselves
+        """
+        self.walker.join()
+        found = self.walker.files()
+        excluded = {os.path.normpath(path) for path in exclude}
+        self._n_files = len(found)
+        self.untracked = sorted(
+                path for path in found
+                if path not in stats and path not in excluded)
+        self.missing = sorted(
+                path for path, st in stats.items()
+                if st is None and self.walker.covers(path))
+
+    def to_dict(self):
+        return {
+            "root": self.walker.root,
+            "n_files": self._n_files,
+            "n_untracked": len(self.untracked),
+            "untracked": self.untracked[:self.MAX_LISTED_FILES],
+            "n_missing": len(self.missing),
+            "missing": self.missing[:self.MAX_LISTED_FILES],
+            "unreadable_directories": [
+                directory for directory, _ in self.walker.errors],
+            "linked_directories": sorted(self.walker.linked_directories),
+            }
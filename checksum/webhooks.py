@@ -0,0 +1,255 @@
+"""
+Delivery of notifications to callback URLs.
+
+Notifications are handed to a `WebhookService`, which queues them and sends
+them from a background task, so that neither the jobs nor the request
+handlers ever wait on a slow receiver.
+"""
+import asyncio
+import collections
+import json
+import logging
+import os
+import time
+
+from tornado.escape import json_encode
+from tornado.httpclient import AsyncHTTPClient, HTTPRequest
+
+
+log = logging.getLogger(__name__)
+
+
+class WebhookService:
+    """
+    Sends JSON notifications to callback URLs in the background.
+
+    Notifications due for the same URL are sent together, in a single POST
+    with the body `{"notifications": [...]}`. Failed deliveries are retried
+    with exponential backoff, up to `max_attempts` times. Pending deliveries
+    are saved to `spool_path`, if given, so that they survive a restart of
+    the service.
+
+    Methods
+    -------
+    notify(url, payload)
+        queue a notification
+    resume()
+        start sending the deliveries loaded from the spool
+    pending()
+        returns the number of pending deliveries
+    join()
+        wait until all pending deliveries are sent or given up on
+    """
+
+    def __init__(
+            self, spool_path=None, max_attempts=10, retry_delay=1,
+            max_retry_delay=300, batch_size=50, max_clients=10,
+            request_timeout=30):
+        """
+        Parameters
+        ----------
+        spool_path: str
+            file pending deliveries are saved to. Not saved if None.
+        max_attempts: int
+            number of attempts after which a delivery is given up on
+        retry_delay: float
+            number of seconds before the first retry, doubled for every
+            following one
+        max_retry_delay: float
+            maximum number of seconds between two attempts
+        batch_size: int
+            maximum number of notifications sent in one request
+        max_clients: int
+            maximum number of requests in flight at the same time
+        request_timeout: float
+            number of seconds after which a request is considered failed
+        """
+        self._spool_path = spool_path
+        self._max_attempts = max_attempts
+        self._retry_delay = retry_delay
+        self._max_retry_delay = max_retry_delay
+        self._batch_size = batch_size
+        self._max_clients = max_clients
+        self._request_timeout = request_timeout
+        self._client = None
+        self._sender = None
+        self._wakeup = None
+        self._save_lock = None
+        self._dirty = False
+        self._pending = self._load()
+
+    def _load(self):
+        """
+        Returns the deliveries saved in the spool.
+        """
+        if self._spool_path is None:
+            return []
+        try:
+            with open(self._spool_path) as f:
+                pending = json.load(f)
+        except FileNotFoundError:
+            return []
+        except (OSError, ValueError) as e:
+            log.warning(f"Could not load webhook spool {self._spool_path}: {e}")
+            return []
+        log.info(f"Loaded {len(pending)} pending webhook deliveries")
+        return pending
+
+    def _write_spool(self, content):
+        tmp_path = f"{self._spool_path}.tmp"
+        with open(tmp_path, mode='w') as f:
+            f.write(content)
+        os.replace(tmp_path, self._spool_path)
+
+    async def _save(self):
+        """
+        Save the pending deliveries to the spool, from a worker thread.
+        """
+        self._dirty = False
+        if self._spool_path is None:
+            return
+        if self._save_lock is None:
+            self._save_lock = asyncio.Lock()
+        async with self._save_lock:
+            content = json.dumps(self._pending)
+            try:
+                await asyncio.get_running_loop().run_in_executor(
+                        None, self._write_spool, content)
+            except OSError as e:
+                log.warning(
+                    f"Could not save webhook spool {self._spool_path}: {e}")
+
+    def _get_client(self):
+        if self._client is None:
+            self._client = AsyncHTTPClient(
+                    force_instance=True, max_clients=self._max_clients)
+        return self._client
+
+    def _batches(self, deliveries):
+        """
+        Group deliveries by URL, in batches of at most `batch_size`.
+        """
+        by_url = collections.defaultdict(list)
+        for delivery in deliveries:
+            by_url[delivery["url"]].append(delivery)
+        for url, deliveries in by_url.items():
+            for i in range(0, len(deliveries), self._batch_size):
+                yield url, deliveries[i:i + self._batch_size]
+
+    async def _send(self, url, batch):
+        """
+        Send a batch of deliveries to `url`, and schedule a retry of the
+        batch if it fails.
+        """
+        request = HTTPRequest(
+                url,
+                method="POST",
+                headers={"Content-Type": "application/json"},
+                body=json_encode({
+                    "notifications": [
+                        delivery["payload"] for delivery in batch]}),
+                request_timeout=self._request_timeout)
+        try:
+            await self._get_client().fetch(request)
+        except Exception as e:
+            log.warning(
+                f"Could not deliver {len(batch)} notifications to {url}: {e}")
+            for delivery in batch:
+                delivery["attempts"] += 1
+                if delivery["attempts"] >= self._max_attempts:
+                    log.error(
+                        f"Giving up on notification to {url} after "
+                        f"{delivery['attempts']} attempts: "
+                        f"{delivery['payload']}")
+                    self._pending.remove(delivery)
+                else:
+                    delay = self._retry_delay * 2 ** (delivery["attempts"] - 1)
+                    delivery["due"] = (
+                        time.time() + min(delay, self._max_retry_delay))
+        else:
+            log.info(f"Delivered {len(batch)} notifications to {url}")
+            for delivery in batch:
+                self._pending.remove(delivery)
+        self._dirty = True
+
+    async def _send_loop(self):
+        """
+        Send due deliveries until none are pending.
+        """
+        while True:
+            if self._dirty:
+                await self._save()
+            if not self._pending:
+                return
+
+            now = time.time()
+            due = [
+                delivery
+                for delivery in self._pending
+                if delivery["due"] <= now
+                ]
+            if due:
+                await asyncio.gather(*(
+                    self._send(url, batch)
+                    for url, batch in self._batches(due)))
+                continue
+
+            next_due = min(delivery["due"] for delivery in self._pending)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), next_due - now)
+            except asyncio.TimeoutError:
+                pass
+
+    def _ensure_sender(self):
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        self._wakeup.set()
+        if self._sender is None or self._sender.done():
+            self._sender = asyncio.get_running_loop().create_task(
+                    self._send_loop())
+
+    def notify(self, url, payload):
+        """
+        Queue a notification. It is sent in the background, this never
+        blocks.
+
+        Parameters
+        ----------
+        url: str
+            URL to POST the notification to
+        payload: dict
+            JSON serializable notification
+        """
+        self._pending.append({
+            "url": url,
+            "payload": payload,
+            "attempts": 0,
+            "due": time.time(),
+            })
+        self._dirty = True
+        self._ensure_sender()
+
+    def resume(self):
+        """
+        Start sending the deliveries loaded from the spool. Must be called
+        from the event loop.
+        """
+        if self._pending:
+            self._ensure_sender()
+
+    def pending(self):
+        """
+        Returns
+        -------
+        int
+            number of deliveries not sent yet
+        """
+        return len(self._pending)
+
+    async def join(self):
+        """
+        Wait until all pending deliveries are sent or given up on.
+        """
+        if self._sender is not None:
+            await self._sender
@@ -24,6 +24,9 @@ setup(
     packages=find_packages(),
     include_package_data=True,
     entry_points={
-        'console_scripts': ['checksum-ws = checksum.app:start']
+        'console_scripts': [
+            'checksum-ws = checksum.app:start',
+            'checksum-ws-loadtest = checksum.loadtest:main',
+            ]
     },
 )
@@ -1,3 +1,5 @@
+import gzip
+import hashlib
 import json
 import logging
 import os
@@ -7,21 +9,36 @@ import time
 import yaml
 
 from tornado.testing import AsyncHTTPTestCase
-from tornado.web import Application
+from tornado.web import Application, RequestHandler
 from tornado.escape import json_encode
+from tornado import gen
 
 from arteria.web.app import AppService
 from arteria.web.state import State
 
 from checksum.app import routes as app_routes, compose_application
 
-from tests.test_utils import DUMMY_CONFIG, gen_dummy_data
+from tests.test_utils import DUMMY_CONFIG, bgzf_compress, gen_dummy_data
 
 log = logging.getLogger(__name__)
 
 
+class CallbackReceiver(RequestHandler):
+    """
+    Stand-in for a client receiving the notifications of finished jobs.
+    """
+
+    def initialize(self, received):
+        self.received = received
+
+    def post(self):
+        self.received.extend(json.loads(self.request.body)["notifications"])
+
+
 class TestIntegration(AsyncHTTPTestCase):
     API_BASE = "/api/1.0"
+    # Settings of the service, on top of DUMMY_CONFIG.
+    APP_CONFIG = {}
 
     def get_app(self):
         path_to_this_file = os.path.abspath(
@@ -29,7 +46,7 @@ class TestIntegration(AsyncHTTPTestCase):
 
         self.config = tempfile.TemporaryDirectory()
         with open(f"{self.config.name}/app.config", mode='w') as f:
-            f.write(yaml.dump(DUMMY_CONFIG))
+            f.write(yaml.dump({**DUMMY_CONFIG, **self.APP_CONFIG}))
         shutil.copyfile(
                 f"{path_to_this_file}/../../config/logger.config",
                 f"{self.config.name}/logger.config")
@@ -43,6 +60,10 @@ class TestIntegration(AsyncHTTPTestCase):
         composed_application = compose_application(config)
         routes = app_routes(**composed_application)
 
+        self.received = []
+        routes.append(
+                (r"/callback", CallbackReceiver, {"received": self.received}))
+
         return Application(routes)
 
     def _test_checksum_folder(self, url, body):
@@ -57,12 +78,18 @@ class TestIntegration(AsyncHTTPTestCase):
         status_as_json = json.loads(status.body)
 
         while status_as_json["state"] == State.STARTED:
-            time.sleep(0.5)
-            status = self.fetch(response_as_json["link"])
-            status_as_json = json.loads(status.body)
+            status = self.fetch(
+                    response_as_json["link"] + "?wait=5",
+                    headers={"If-None-Match": status.headers["Etag"]})
+            if status.code != 304:
+                status_as_json = json.loads(status.body)
 
-        with open(response_as_json['md5sum_log'], 'r') as md5sum_log_file:
-            assert md5sum_log_file.read()
+        # The log may be compressed once the job is finished, and is
+        # served either way.
+        md5sum_log = self.fetch(
+                self.API_BASE + f"/log/{response_as_json['job_id']}")
+        assert md5sum_log.code == 200
+        assert md5sum_log.body
 
         return status_as_json["state"]
 
@@ -83,6 +110,90 @@ class TestIntegrationSmall(TestIntegration):
 
         assert self._test_checksum_folder(url, body) == State.DONE
 
+    def test_log_kept(self):
+        """
+        Test the log of a finished job is left at the path returned by
+        default.
+        """
+        url = self.API_BASE + f"/start/{self.foldername}"
+        body = {"path_to_md5_sum_file": self.checksum_file}
+        response = json.loads(
+                self.fetch(url, method="POST", body=json_encode(body)).body)
+        status = response
+        while status["state"] == State.STARTED:
+            status = json.loads(self.fetch(response["link"] + "?wait=5").body)
+
+        assert status["state"] == State.DONE
+        assert os.path.exists(response["md5sum_log"])
+        assert not os.path.exists(response["md5sum_log"] + ".gz")
+
+    def test_checksum_profile(self):
+        """
+        Test profiling a job and getting its profile from the status.
+        """
+        url = self.API_BASE + f"/start/{self.foldername}"
+        body = {
+                "path_to_md5_sum_file": self.checksum_file,
+                "profile": True,
+                "cprofile": True}
+
+        response = self.fetch(url, method="POST", body=json_encode(body))
+        response_as_json = json.loads(response.body)
+
+        status = json.loads(self.fetch(response_as_json["link"]).body)
+        while status["state"] == State.STARTED:
+            time.sleep(0.5)
+            status = json.loads(self.fetch(response_as_json["link"]).body)
+        assert status["state"] == State.DONE
+
+        status = json.loads(
+                self.fetch(response_as_json["link"] + "?profile=1").body)
+        assert status["profile"]["phases"]["read"]["count"] > 0
+        assert len(status["profile"]["slowest_files"]) == 5
+        assert os.path.exists(response_as_json["md5sum_log"] + ".prof")
+
+    def test_checksum_completeness(self):
+        """
+        Test files of the runfolder that are not listed are reported in the
+        status.
+        """
+        with open(os.path.join(self.folder.name, "untracked"), "w") as f:
+            f.write("untracked")
+        url = self.API_BASE + f"/start/{self.foldername}"
+        body = {
+                "path_to_md5_sum_file": self.checksum_file,
+                "completeness": True}
+
+        response = json.loads(
+                self.fetch(url, method="POST", body=json_encode(body)).body)
+        status = json.loads(self.fetch(response["link"]).body)
+        while status["state"] == State.STARTED:
+            status = json.loads(self.fetch(response["link"] + "?wait=5").body)
+        assert status["state"] == State.DONE
+        assert status["completeness"]["untracked"] == [
+                f"{self.foldername}/untracked"]
+        assert status["completeness"]["missing"] == []
+
+    def test_checksum_callback(self):
+        """
+        Test the final state of a job is POSTed to its callback URL.
+        """
+        url = self.API_BASE + f"/start/{self.foldername}"
+        body = {
+                "path_to_md5_sum_file": self.checksum_file,
+                "callback_url": self.get_url("/callback")}
+
+        assert self._test_checksum_folder(url, body) == State.DONE
+
+        deadline = time.monotonic() + 10
+        while not self.received and time.monotonic() < deadline:
+            self.io_loop.run_sync(lambda: gen.sleep(0.1))
+
+        assert len(self.received) == 1
+        assert self.received[0]["state"] == State.DONE
+        assert self.received[0]["runfolder"] == self.foldername
+        assert self.received[0]["returncode"] == 0
+
     def test_checksum_corrupt(self):
         """
         Test checking a corrupt file returns an error.
@@ -95,6 +206,79 @@ class TestIntegrationSmall(TestIntegration):
 
         assert self._test_checksum_folder(url, body) == State.ERROR
 
+    def test_checksum_uncached(self):
+        """
+        Test checking files without going through the page cache.
+        """
+        url = self.API_BASE + f"/start/{self.foldername}"
+        body = {
+                "path_to_md5_sum_file": self.checksum_file,
+                "read_mode": "uncached"}
+
+        assert self._test_checksum_folder(url, body) == State.DONE
+
+        with open("/".join([self.folder.name, "file0.bin"]), 'wb') as f:
+            f.write(os.urandom(10))
+
+        assert self._test_checksum_folder(url, body) == State.ERROR
+
+    def test_checksum_decompress(self):
+        """
+        Test checking gzip files against the checksums of their content.
+        """
+        content = os.urandom(10**4) * 10
+        with open("/".join([self.folder.name, "reads.fastq.gz"]), 'wb') as f:
+            f.write(gzip.compress(content))
+        with open("/".join([self.folder.name, "reads.bam"]), 'wb') as f:
+            f.write(bgzf_compress(content))
+        with open("/".join([self.folder.name, "uncompressed_md5"]), 'w') as f:
+            for name in ("reads.fastq.gz", "reads.bam"):
+                f.write(
+                    f"{hashlib.md5(content).hexdigest()}  "
+                    f"{self.foldername}/{name}\n")
+
+        url = self.API_BASE + f"/start/{self.foldername}"
+        body = {"path_to_md5_sum_file": "uncompressed_md5"}
+        assert self._test_checksum_folder(url, body) == State.ERROR
+
+        body["decompress"] = True
+        assert self._test_checksum_folder(url, body) == State.DONE
+
+    def test_checksum_several_md5sum_files(self):
+        """
+        Test checking overlapping md5sum files in one job, with results for
+        each of them.
+        """
+        with open("/".join([self.folder.name, self.checksum_file])) as f:
+            lines = f.readlines()
+        os.mkdir("/".join([self.folder.name, "Project"]))
+        with open("/".join([self.folder.name, "Project", "md5_a"]), 'w') as f:
+            f.writelines(lines[:3])
+        with open("/".join([self.folder.name, "Project", "md5_b"]), 'w') as f:
+            f.writelines(lines[2:])
+        with open("/".join([self.folder.name, "file4.bin"]), 'wb') as f:
+            f.write(os.urandom(10))
+
+        url = self.API_BASE + f"/start/{self.foldername}"
+        body = {"path_to_md5_sum_file": [self.checksum_file, "Project/md5_*"]}
+        response = json.loads(
+                self.fetch(url, method="POST", body=json_encode(body)).body)
+        assert response["md5sum_files"] == [
+                f"{self.foldername}/{name}"
+                for name in [self.checksum_file, "Project/md5_a",
+                             "Project/md5_b"]]
+
+        status = json.loads(self.fetch(response["link"]).body)
+        while status["state"] == State.STARTED:
+            time.sleep(0.1)
+            status = json.loads(self.fetch(response["link"]).body)
+        assert status["state"] == State.ERROR
+        manifests = status["manifests"]
+        assert manifests[f"{self.foldername}/Project/md5_a"]["ok"] == 3
+        assert manifests[f"{self.foldername}/Project/md5_b"]["failed"] == 1
+        assert manifests[f"{self.foldername}/{self.checksum_file}"][
+                "not_ok"] == [f"{self.foldername}/file4.bin"]
+
     def test_multiple_checksum(self):
         """
         Test multiple jobs can be launched simultaneously and jobs can still be
@@ -135,17 +319,39 @@ class TestIntegrationSmall(TestIntegration):
         url = self.API_BASE + f"/start/{self.foldername}"
         body = {"path_to_md5_sum_file": self.checksum_file}
         n_jobs = 10
-        for _ in range(n_jobs):
-            self.fetch(url, method="POST", body=json_encode(body))
+        job_ids = {
+                json.loads(self.fetch(
+                    url, method="POST", body=json_encode(body)).body)["job_id"]
+                for _ in range(n_jobs)}
 
         url = self.API_BASE + "/status/"
         status_as_json = json.loads(self.fetch(url, method="GET").body)
-        assert len(status_as_json) == n_jobs
+        assert set(map(int, status_as_json)) == job_ids
         assert all(
             job["state"] in [State.DONE, State.STARTED]
             for job in json.loads(
                 self.fetch(url, method="GET").body).values())
 
+    def test_list_jobs(self):
+        """
+        Test listing the jobs of a runfolder, page by page.
+        """
+        url = self.API_BASE + f"/start/{self.foldername}"
+        body = {"path_to_md5_sum_file": self.checksum_file}
+        response = self.fetch(url, method="POST", body=json_encode(body))
+        job_id = json.loads(response.body)["job_id"]
+
+        url = (
+            self.API_BASE
+            + f"/status/?runfolder={self.foldername}&limit=1&fields=runfolder")
+        page = json.loads(self.fetch(url).body)
+        assert page["jobs"] == [
+            {"job_id": job_id, "runfolder": self.foldername}]
+
+        url = self.API_BASE + "/status/?runfolder=unknown"
+        assert json.loads(self.fetch(url).body) == {
+            "jobs": [], "next_cursor": None}
+
     def test_start_checksum_with_shell_injection(self):
         """
         Test shell injections are intercepted.
@@ -159,6 +365,41 @@ class TestIntegrationSmall(TestIntegration):
         assert response.code == 500
 
 
+class TestIntegrationCompressedLogs(TestIntegration):
+    APP_CONFIG = {"compress_logs": True}
+
+    def setUp(self):
+        super().setUp()
+
+        self.folder, self.checksum_file = gen_dummy_data(10**4)  # 10KB
+        self.foldername = self.folder.name.split('/')[-1]
+
+    def test_log_compressed(self):
+        """
+        Test the log of a finished job is compressed, and still served.
+        """
+        url = self.API_BASE + f"/start/{self.foldername}"
+        body = {"path_to_md5_sum_file": self.checksum_file}
+        response = json.loads(
+                self.fetch(url, method="POST", body=json_encode(body)).body)
+        status = response
+        while status["state"] == State.STARTED:
+            status = json.loads(self.fetch(response["link"] + "?wait=5").body)
+
+        for _ in range(500):
+            if os.path.exists(response["md5sum_log"] + ".gz"):
+                break
+            time.sleep(0.01)
+        assert not os.path.exists(response["md5sum_log"])
+        with gzip.open(response["md5sum_log"] + ".gz") as f:
+            content = f.read()
+        assert content.endswith(b": OK\n")
+
+        md5sum_log = self.fetch(
+                self.API_BASE + f"/log/{response['job_id']}?tail=1")
+        assert md5sum_log.body == content.splitlines(True)[-1]
+
+
 class TestIntegrationBig(TestIntegration):
     def setUp(self):
         super().setUp()
@@ -175,6 +416,31 @@ class TestIntegrationBig(TestIntegration):
 
         assert self._test_checksum_folder(url, body) == State.DONE
 
+    def test_coalesce_duplicates(self):
+        """
+        Test identical requests in flight share one job, unless the md5sum
+        file changed in between.
+        """
+        url = self.API_BASE + f"/start/{self.foldername}"
+        body = {"path_to_md5_sum_file": self.checksum_file}
+
+        first, second = [
+                json.loads(self.fetch(
+                    url, method="POST", body=json_encode(body)).body)
+                for _ in range(2)]
+        assert not first["coalesced"]
+        assert second["coalesced"]
+        assert second["job_id"] == first["job_id"]
+        assert second["md5sum_log"] == first["md5sum_log"]
+
+        with open("/".join([self.folder.name, self.checksum_file]), 'a') as f:
+            f.write("\n")
+        third = json.loads(
+                self.fetch(url, method="POST", body=json_encode(body)).body)
+        assert not third["coalesced"]
+
+        self.fetch(self.API_BASE + "/stop/all", method="POST", body="")
+
     def test_stop(self):
         url = self.API_BASE + f"/start/{self.foldername}"
         body = {"path_to_md5_sum_file": self.checksum_file}
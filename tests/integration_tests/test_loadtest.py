@@ -0,0 +1,36 @@
+from checksum.loadtest import OPERATIONS, format_summary, run_load_test
+
+from tests.integration_tests.test_integration import TestIntegration
+from tests.test_utils import gen_dummy_data
+
+
+class TestLoadTest(TestIntegration):
+    def setUp(self):
+        super().setUp()
+
+        self.folder, self.checksum_file = gen_dummy_data(10**4)
+        self.foldername = self.folder.name.split('/')[-1]
+
+    def test_load_test(self):
+        """
+        Test the load generator exercises every endpoint without errors.
+        """
+        summary = self.io_loop.run_sync(lambda: run_load_test(
+            self.get_url(""),
+            self.foldername,
+            self.checksum_file,
+            n_jobs=12,
+            n_clients=4,
+            n_polls=2,
+            poll_interval=0.01,
+            probe_interval=0.01))
+
+        assert summary["start"]["count"] == 12
+        assert summary["status"]["count"] == 24
+        assert summary["stop"]["count"] == 12
+        assert summary["probe"]["count"] > 0
+        assert all(summary[op]["errors"] == 0 for op in OPERATIONS)
+        assert all(
+            summary[op]["p50"] <= summary[op]["p99"] <= summary[op]["max"]
+            for op in OPERATIONS)
+        assert "probe" in format_summary(summary)
@@ -1,7 +1,14 @@
+import email.utils
+import http.server
 import os
 import pytest
+import re
+import struct
 import subprocess
 import tempfile
+import threading
+import urllib.parse
+import zlib
 
 
 DUMMY_CONFIG = {
@@ -49,3 +56,132 @@ def gen_dummy_data(filesize=10**4, n_files=5):
                     stdout=f)
 
     return folder, "md5_checksums"
+
+
+# Last block of every BGZF file, an empty block marking the end of the file.
+BGZF_EOF = bytes.fromhex(
+        "1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+
+def bgzf_compress(data, block_size=65280):
+    """
+    Compress `data` in the BGZF format, as `bgzip` does.
+
+    Parameters
+    ----------
+    data: bytes
+        data to compress
+    block_size: int
+        number of bytes of uncompressed data in each block
+
+    Return
+    ------
+    bytes
+    """
+    out = bytearray()
+    for i in range(0, len(data), block_size):
+        chunk = data[i:i + block_size]
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+        cdata = compressor.compress(chunk) + compressor.flush()
+        # Size of the whole block minus one: header, extra field, compressed
+        # data, CRC and size.
+        bsize = 18 + len(cdata) + 8 - 1
+        out += b"\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff"
+        out += struct.pack("<H2sHH", 6, b"BC", 2, bsize)
+        out += cdata
+        out += struct.pack("<II", zlib.crc32(chunk), len(chunk))
+    return bytes(out + BGZF_EOF)
+
+
+class ObjectStoreHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves the files of a directory as objects, with HEAD requests and
+    single ranges, the way S3 does.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _object_path(self):
+        key = urllib.parse.unquote(urllib.parse.urlsplit(self.path).path)
+        prefix = self.server.prefix
+        if not key.startswith(prefix):
+            return None
+        return os.path.join(self.server.root, key[len(prefix):].lstrip("/"))
+
+    def _send_headers(self):
+        self.server.requests.append((self.command, self.path, dict(
+            self.headers)))
+        path = self._object_path()
+        if path is None or not os.path.isfile(path):
+            self.send_error(404)
+            return None
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+        match = re.fullmatch(r"bytes=(\d+)-(\d+)", self.headers.get(
+            "Range", ""))
+        if match and self.server.ranges:
+            start, end = int(match.group(1)), min(int(match.group(2)), size - 1)
+            if start >= size:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return None
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Last-Modified", email.utils.formatdate(
+            os.path.getmtime(path), usegmt=True))
+        self.end_headers()
+        return path, start, end
+
+    def do_HEAD(self):
+        self._send_headers()
+
+    def do_GET(self):
+        served = self._send_headers()
+        if served is not None:
+            path, start, end = served
+            with open(path, "rb") as f:
+                f.seek(start)
+                self.wfile.write(f.read(end - start + 1))
+
+
+class ObjectStore:
+    """
+    Stand-in for an S3-compatible object store serving the files under
+    `root` at `url`, run in a background thread.
+
+    Attributes
+    ----------
+    url: str
+        base URL of the objects
+    requests: [(str, str, dict)]
+        method, path and headers of every request received
+    """
+
+    def __init__(self, root, prefix="/bucket", ranges=True):
+        self._server = http.server.ThreadingHTTPServer(
+                ("127.0.0.1", 0), ObjectStoreHandler)
+        self._server.daemon_threads = True
+        self._server.root = root
+        self._server.prefix = prefix
+        self._server.ranges = ranges
+        self._server.requests = []
+        self.requests = self._server.requests
+        host, port = self._server.server_address
+        self.url = f"http://{host}:{port}{prefix}"
+        self._thread = threading.Thread(
+                target=self._server.serve_forever, args=(0.01,), daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,70 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from checksum.accounting import ResourceTotals, ResourceUsage, read_io, reap
+
+
+PROC_IO = os.path.exists(f"/proc/{os.getpid()}/io")
+
+
+def test_reap():
+    """
+    Test the resources used by a command include those of the processes it
+    waited for.
+    """
+    started_at = time.monotonic()
+    child = (
+        "b = bytearray(64 * 1024 * 1024);"
+        "open(sys.executable, 'rb').read()")
+    code = (
+        "import subprocess, sys;"
+        f"subprocess.run([sys.executable, '-c', {child!r}]);"
+        "sys.exit(3)")
+    proc = subprocess.Popen([sys.executable, "-c", code])
+
+    returncode, usage = reap(proc.pid, started_at)
+
+    assert returncode == 3
+    assert usage.user_seconds + usage.system_seconds > 0
+    assert usage.peak_rss > 64 * 1024 * 1024
+    assert usage.wall_seconds > 0
+    if PROC_IO:
+        assert usage.bytes_read > os.path.getsize(sys.executable)
+    with pytest.raises(ChildProcessError):
+        reap(proc.pid, started_at)
+    proc.returncode = returncode
+
+
+def test_reap_without_blocking():
+    proc = subprocess.Popen(["sleep", "10"])
+    try:
+        assert reap(proc.pid, time.monotonic(), block=False) is None
+    finally:
+        proc.kill()
+    returncode, _ = reap(proc.pid, time.monotonic())
+    assert returncode == -9
+    proc.returncode = returncode
+
+
+def test_read_io_unknown():
+    assert read_io(-1) == (None, None)
+
+
+def test_totals():
+    totals = ResourceTotals()
+    totals.add(ResourceUsage(1, 2, 100, 10, 1000, 5))
+    totals.add(ResourceUsage(3, 4, None, None, 3000, 6))
+
+    assert totals.to_dict() == {
+        "n_jobs": 2,
+        "user_seconds": 4,
+        "system_seconds": 6,
+        "bytes_read": 100,
+        "storage_bytes_read": 10,
+        "peak_rss": 3000,
+        "wall_seconds": 11,
+        }
@@ -0,0 +1,75 @@
+import threading
+
+import pytest
+
+from checksum.buffers import ALIGNMENT, BufferPool, MemoryBudget, align
+
+
+def test_align():
+    assert align(1) == ALIGNMENT
+    assert align(ALIGNMENT) == ALIGNMENT
+    assert align(ALIGNMENT + 1) == 2 * ALIGNMENT
+
+
+class TestMemoryBudget:
+    def test_lease(self):
+        """
+        Test leases are granted while they fit, and can be released.
+        """
+        budget = MemoryBudget(100)
+
+        assert budget.try_lease(1, 60)
+        assert budget.try_lease(1, 60)
+        assert not budget.try_lease(2, 60)
+        assert budget.lease_of(1) == 60
+        assert budget.usage() == {"budget": 100, "in_use": 60, "leases": 1}
+
+        budget.release(1)
+        budget.release(3)
+
+        assert budget.try_lease(2, 60)
+        assert budget.usage() == {"budget": 100, "in_use": 60, "leases": 1}
+
+    def test_lease_too_large(self):
+        with pytest.raises(ValueError):
+            MemoryBudget(100).try_lease(1, 101)
+
+
+class TestBufferPool:
+    def test_reuse(self):
+        """
+        Test buffers are aligned and reused.
+        """
+        pool = BufferPool(ALIGNMENT + 1)
+        buf = pool.acquire()
+        assert len(buf) == 2 * ALIGNMENT
+
+        pool.release(buf)
+        assert pool.acquire() is buf
+
+    def test_limit(self):
+        """
+        Test callers wait for a buffer when the pool is exhausted.
+        """
+        pool = BufferPool(ALIGNMENT, limit=ALIGNMENT)
+        buf = pool.acquire()
+        acquired = []
+
+        thread = threading.Thread(
+                target=lambda: acquired.append(pool.acquire()))
+        thread.start()
+        thread.join(0.1)
+        assert not acquired
+
+        pool.release(buf)
+        thread.join(1)
+        assert acquired == [buf]
+
+    def test_close(self):
+        pool = BufferPool(ALIGNMENT)
+        buf = pool.acquire()
+        pool.release(buf)
+        pool.close()
+
+        assert buf.closed
+        assert pool.acquire() is not buf
@@ -0,0 +1,59 @@
+import os
+import tempfile
+
+import pytest
+
+from checksum.checksum_cache import ChecksumCache
+
+
+@pytest.fixture
+def cache():
+    with tempfile.TemporaryDirectory() as folder:
+        with ChecksumCache(os.path.join(folder, "cache.db")) as cache:
+            yield cache
+
+
+class TestChecksumCache:
+    def test_record(self, cache):
+        assert cache.get("/a") is None
+
+        cache.record("/a", "digest", 10, 1., "OK", verified_at=2.)
+        assert cache.get("/a") == {
+                "digest": "digest", "size": 10, "mtime": 1.,
+                "verified_at": 2., "result": "OK"}
+
+        cache.record("/a", None, 10, 1., "FAILED open or read", verified_at=3.)
+        assert cache.get("/a")["digest"] is None
+        assert cache.get("/a")["verified_at"] == 3.
+
+    def test_relative_paths(self, cache):
+        """
+        Test files are recorded by absolute path.
+        """
+        cache.record("a", "digest", 10, 1., "OK")
+        assert cache.get(os.path.abspath("a"))["digest"] == "digest"
+
+    def test_last_verified(self, cache):
+        for i in range(1200):
+            cache.record(f"/{i}", "digest", 1, 1., "OK", verified_at=i)
+
+        last = cache.last_verified(["/0", "/1100", "/unknown"])
+        assert last == {"/0": 0, "/1100": 1100}
+        assert len(cache.last_verified(f"/{i}" for i in range(1200))) == 1200
+
+    def test_non_utf8_paths(self, cache):
+        path = os.fsdecode(b"/f\xe9")
+        cache.record(path, "digest", 10, 1., "OK", verified_at=2.)
+        assert cache.get(path)["digest"] == "digest"
+        assert cache.get("/f\xe9") is None
+        assert cache.last_verified([path]) == {path: 2.}
+
+    def test_shared(self):
+        """
+        Test records are seen by other connections right away.
+        """
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "cache.db")
+            with ChecksumCache(path) as cache, ChecksumCache(path) as other:
+                cache.record("/a", "digest", 10, 1., "OK")
+                assert other.get("/a")["digest"] == "digest"
@@ -1,17 +1,30 @@
+import datetime
 import os
 import json
 import mock
+import sys
+import tempfile
 
 from tornado.testing import AsyncHTTPTestCase
 from tornado.web import Application
 from tornado.escape import json_encode
+from tornado.simple_httpclient import HTTPStreamClosedError
 
+from arteria.exceptions import ArteriaUsageException
 from arteria.web.state import State
 
 from checksum.app import routes
 from checksum import __version__ as checksum_version
+from checksum import checksum_handlers
 from checksum.checksum_handlers import StartHandler
 from checksum.runner_service import RunnerService
+from checksum.runfolder_index import RunfolderIndex
+from checksum.scrub import ScrubScheduler
+from checksum.storage import http_buffer_memory
+from checksum.decompress import window_memory
+from checksum.logs import compress_log
+from checksum.merkle import MerkleTree
+from checksum.webhooks import WebhookService
 from tests.test_utils import DummyConfig
 
 
@@ -20,27 +33,31 @@ class TestChecksumHandlers(AsyncHTTPTestCase):
     API_BASE = "/api/1.0"
 
     runner_service = RunnerService()
+    runfolder_index = RunfolderIndex("tests/resources/")
+    webhooks = WebhookService()
 
     def get_app(self):
         return Application(
             routes(
                 config=DummyConfig(),
-                runner_service=self.runner_service))
+                runner_service=self.runner_service,
+                runfolder_index=self.runfolder_index,
+                webhooks=self.webhooks))
 
     ok_runfolder = "tests/resources/ok_checksums"
 
 
 class TestStartHandler(TestChecksumHandlers):
-    @mock.patch("os.path.isdir", return_value=True)
-    @mock.patch("os.listdir", return_value=["ok_checksums", "rf2", "rf3"])
-    def test__validate_runfolder_exists_ok(self, mock_listdir, mock_isdir):
-        assert StartHandler._validate_runfolder_exists(
-                "ok_checksums", "tests/resources/")
-
-    @mock.patch("os.path.isdir", return_value=False)
-    def test__validate_runfolder_exists_not_ok(self, mock_isdir):
+    def test__validate_runfolder_exists_ok(self):
+        with tempfile.TemporaryDirectory() as monitored_dir:
+            for name in ["ok_checksums", "rf2", "rf3"]:
+                os.mkdir(os.path.join(monitored_dir, name))
+            assert StartHandler._validate_runfolder_exists(
+                    "ok_checksums", RunfolderIndex(monitored_dir))
+
+    def test__validate_runfolder_exists_not_ok(self):
         assert not StartHandler._validate_runfolder_exists(
-                "invalid_checksums", "tests/resources/")
+                "invalid_checksums", RunfolderIndex("tests/resources/"))
 
     @mock.patch("os.path.isfile", return_value=True)
     def test__validate_md5sum_path_ok(self, mock_isfile):
@@ -66,8 +83,14 @@ class TestStartHandler(TestChecksumHandlers):
                     TestChecksumHandlers.ok_runfolder, "no_file"))
 
     @mock.patch(
-            "checksum.runner_service.RunnerService.start",
-            return_value=1)
+            "checksum.runner_service.RunnerService.status",
+            return_value=State.STARTED)
+    @mock.patch(
+            "checksum.checksum_handlers.StartHandler._hash_manifest",
+            return_value="digest")
+    @mock.patch(
+            "checksum.runner_service.RunnerService.submit",
+            return_value=(1, True))
     @mock.patch(
             "checksum.checksum_handlers"
             ".StartHandler._validate_runfolder_exists",
@@ -86,8 +109,10 @@ class TestStartHandler(TestChecksumHandlers):
             mock_valid_md5sum_path,
             mock_runfolder_exists,
             mock_start,
+            mock_hash_manifest,
+            mock_status,
             ):
-        job_id = mock_start.return_value
+        job_id, _ = mock_start.return_value
 
         body = {"path_to_md5_sum_file": "md5_checksums"}
         response = self.fetch(
@@ -107,6 +132,318 @@ class TestStartHandler(TestChecksumHandlers):
         self.assertEqual(response_as_json["link"], expected_link)
         self.assertEqual(response_as_json["state"], State.STARTED)
 
+    @mock.patch(
+            "checksum.checksum_handlers.StartHandler._hash_manifest",
+            return_value="digest")
+    @mock.patch(
+            "checksum.runner_service.RunnerService.submit",
+            return_value=(1, True))
+    @mock.patch(
+            "checksum.checksum_handlers"
+            ".StartHandler._validate_runfolder_exists",
+            return_value=True)
+    @mock.patch(
+            "checksum.checksum_handlers"
+            ".StartHandler._validate_md5sum_path",
+            return_value=True)
+    def test_start_checksum_options(
+            self,
+            mock_valid_md5sum_path,
+            mock_runfolder_exists,
+            mock_start,
+            mock_hash_manifest,
+            ):
+        body = {"path_to_md5_sum_file": "md5_checksums"}
+        response = self.fetch(
+            self.API_BASE + "/start/ok_checksums",
+            method="POST",
+            body=json_encode(body))
+        self.assertEqual(response.code, 202)
+        self.assertEqual(
+                mock_start.call_args[0][0],
+                ["md5sum", "-c", "ok_checksums/md5_checksums"])
+        self.assertEqual(
+                mock_start.call_args[1]["memory"],
+                checksum_handlers.MD5SUM_BUFFER_SIZE)
+
+        body["read_mode"] = "uncached"
+        response = self.fetch(
+            self.API_BASE + "/start/ok_checksums",
+            method="POST",
+            body=json_encode(body))
+        self.assertEqual(response.code, 202)
+        self.assertEqual(
+                mock_start.call_args[0][0],
+                [
+                    sys.executable, "-m", "checksum.verifier",
+                    "--read-mode", "uncached",
+                    "--block-size", "1048576",
+                    "--memory-limit", "1048576",
+                    "ok_checksums/md5_checksums"])
+        self.assertEqual(mock_start.call_args[1]["memory"], 1048576)
+
+        response = self.fetch(
+            self.API_BASE + "/start/ok_checksums",
+            method="POST",
+            body=json_encode({**body, "decompress": True}))
+        self.assertEqual(response.code, 202)
+        self.assertIn("--decompress", mock_start.call_args[0][0])
+        self.assertEqual(
+                mock_start.call_args[1]["memory"],
+                1048576 + window_memory(os.cpu_count()))
+        self.assertTrue(mock_start.call_args[1]["key"][-1])
+
+        body["priority"] = "high"
+        response = self.fetch(
+            self.API_BASE + "/start/ok_checksums",
+            method="POST",
+            body=json_encode(body))
+        self.assertEqual(response.code, 202)
+        self.assertEqual(mock_start.call_args[1]["priority"], "high")
+
+        body["priority"] = "whenever"
+        response = self.fetch(
+            self.API_BASE + "/start/ok_checksums",
+            method="POST",
+            body=json_encode(body))
+        self.assertEqual(response.code, 500)
+
+        body["priority"] = "normal"
+        body["read_mode"] = "psychic"
+        response = self.fetch(
+            self.API_BASE + "/start/ok_checksums",
+            method="POST",
+            body=json_encode(body))
+        self.assertEqual(response.code, 500)
+
+    @mock.patch(
+            "checksum.webhooks.WebhookService.notify")
+    @mock.patch(
+            "checksum.checksum_handlers.StartHandler._hash_manifest",
+            return_value="digest")
+    @mock.patch(
+            "checksum.runner_service.RunnerService.submit",
+            return_value=(1, True))
+    @mock.patch(
+            "checksum.checksum_handlers"
+            ".StartHandler._validate_runfolder_exists",
+            return_value=True)
+    @mock.patch(
+            "checksum.checksum_handlers"
+            ".StartHandler._validate_md5sum_path",
+            return_value=True)
+    def test_start_checksum_callback(
+            self,
+            mock_valid_md5sum_path,
+            mock_runfolder_exists,
+            mock_start,
+            mock_hash_manifest,
+            mock_notify,
+            ):
+        body = {"path_to_md5_sum_file": "md5_checksums"}
+        response = self.fetch(
+            self.API_BASE + "/start/ok_checksums",
+            method="POST",
+            body=json_encode(body))
+        self.assertEqual(response.code, 202)
+        self.assertIsNone(mock_start.call_args[1]["on_finished"])
+
+        body["callback_url"] = "http://example.com/hook"
+        response = self.fetch(
+            self.API_BASE + "/start/ok_checksums",
+            method="POST",
+            body=json_encode(body))
+        self.assertEqual(response.code, 202)
+
+        job = mock.Mock(job_id=1, returncode=0, log_path="/tmp/log")
+        job.get_status.return_value = State.DONE
+        mock_start.call_args[1]["on_finished"](job)
+        url, payload = mock_notify.call_args[0]
+        self.assertEqual(url, "http://example.com/hook")
+        self.assertEqual(payload["job_id"], 1)
+        self.assertEqual(payload["state"], State.DONE)
+        self.assertEqual(payload["runfolder"], "ok_checksums")
+        self.assertEqual(
+                payload["link"],
+                json.loads(response.body)["link"])
+
+        body["callback_url"] = "file:///etc/passwd"
+        response = self.fetch(
+            self.API_BASE + "/start/ok_checksums",
+            method="POST",
+            body=json_encode(body))
+        self.assertEqual(response.code, 500)
+
+    def test__expand_md5sum_paths(self):
+        with tempfile.TemporaryDirectory() as monitored_dir:
+            os.makedirs(os.path.join(monitored_dir, "rf", "Project"))
+            for name in ["md5sums", "Project/md5sums", "Project/other"]:
+                with open(os.path.join(monitored_dir, "rf", name), "w"):
+                    pass
+
+            assert StartHandler._expand_md5sum_paths(
+                    monitored_dir, "rf", "md5sums") == [(
+                        os.path.join(monitored_dir, "rf", "md5sums"),
+                        "rf/md5sums")]
+            assert [
+                relative_path
+                for _, relative_path in StartHandler._expand_md5sum_paths(
+                    monitored_dir, "rf", ["md5sums", "*/md5*", "md5sums"])
+                ] == ["rf/md5sums", "rf/Project/md5sums"]
+
+            for requested in ("*/nothing*", [], None, [1]):
+                with self.assertRaises(ArteriaUsageException):
+                    StartHandler._expand_md5sum_paths(
+                            monitored_dir, "rf", requested)
+
+    def test__expand_md5sum_paths_outside_runfolder(self):
+        """
+        Test patterns matching md5sum files outside of the runfolder, through
+        `..` or symbolic links, are rejected.
+        """
+        with tempfile.TemporaryDirectory() as monitored_dir:
+            for runfolder in ("rf", "other"):
+                os.makedirs(os.path.join(monitored_dir, runfolder))
+                with open(
+                        os.path.join(monitored_dir, runfolder, "md5sums"),
+                        "w"):
+                    pass
+            os.symlink(
+                    os.path.join(monitored_dir, "other"),
+                    os.path.join(monitored_dir, "rf", "linked"))
+
+            for requested in ("../*/md5sums", "../o*/md5sums", "*/md5sums"):
+                with self.assertRaises(ArteriaUsageException):
+                    StartHandler._expand_md5sum_paths(
+                            monitored_dir, "rf", requested)
+
+    @mock.patch(
+            "checksum.checksum_handlers.StartHandler._hash_manifest",
+            return_value="digest")
+    @mock.patch(
+            "checksum.runner_service.RunnerService.submit",
+            return_value=(1, True))
+    @mock.patch(
+            "checksum.checksum_handlers"
+            ".StartHandler._validate_runfolder_exists",
+            return_value=True)
+    @mock.patch(
+            "checksum.checksum_handlers"
+            ".StartHandler._validate_md5sum_path",
+            return_value=True)
+    def test_start_checksum_several_md5sum_files(
+            self,
+            mock_valid_md5sum_path,
+            mock_runfolder_exists,
+            mock_start,
+            mock_hash_manifest,
+            ):
+        body = {"path_to_md5_sum_file": ["md5_checksums", "other"]}
+        response = self.fetch(
+            self.API_BASE + "/start/ok_checksums",
+            method="POST",
+            body=json_encode(body))
+        self.assertEqual(response.code, 202)
+        self.assertEqual(
+                json.loads(response.body)["md5sum_files"],
+                ["ok_checksums/md5_checksums", "ok_checksums/other"])
+
+        cmd = mock_start.call_args[0][0]
+        self.assertEqual(cmd[:3], [sys.executable, "-m", "checksum.verifier"])
+        self.assertEqual(
+                cmd[-2:],
+                ["ok_checksums/md5_checksums", "ok_checksums/other"])
+        self.assertIn("--report", cmd)
+        self.assertEqual(
+                mock_start.call_args[1]["key"][0],
+                ("ok_checksums/md5_checksums", "ok_checksums/other"))
+
+    def test__build_command_workers(self):
+        cmd = StartHandler._build_command(
+                ["rf/md5sums"], "uncached", memory_limit=4096 * 4, workers=4)
+        self.assertEqual(cmd[cmd.index("--workers") + 1], "4")
+        self.assertEqual(
+                StartHandler._buffer_memory(cmd, 4096, workers=4), 4096 * 4)
+
+        cmd = StartHandler._build_command(["rf/md5sums"], "uncached")
+        self.assertNotIn("--workers", cmd)
+
+    def test__build_command_processes(self):
+        cmd = StartHandler._build_command(
+                ["rf/md5sums"], "uncached", workers=4, decompress=True,
+                inflate_threads=8, storage_url="http://s3/archive",
+                storage_connections=2, storage_range_size=4096,
+                executor="processes")
+        self.assertEqual(cmd[cmd.index("--executor") + 1], "processes")
+        # Each worker process inflates and fetches on its own.
+        self.assertEqual(
+                StartHandler._buffer_memory(cmd, 4096, 8, 4, 2, 4096),
+                4096 * 4 + window_memory(2) * 4
+                + http_buffer_memory(2, 4096) * 4)
+
+        # A single worker is run in the verifier process.
+        cmd = StartHandler._build_command(
+                ["rf/md5sums"], "uncached", executor="processes")
+        self.assertNotIn("--executor", cmd)
+
+    def test__build_command_storage(self):
+        cmd = StartHandler._build_command(
+                ["rf/md5sums"], "cached", storage_url="http://s3/archive",
+                storage_connections=2, storage_range_size=4096)
+        self.assertEqual(cmd[:3], [sys.executable, "-m", "checksum.verifier"])
+        self.assertEqual(cmd[cmd.index("--storage") + 1], "http://s3/archive")
+        self.assertEqual(cmd[cmd.index("--storage-connections") + 1], "2")
+        self.assertEqual(cmd[cmd.index("--storage-range-size") + 1], "4096")
+        self.assertEqual(
+                StartHandler._buffer_memory(cmd, 4096, None, 1, 2, 4096),
+                4096 + http_buffer_memory(2, 4096))
+
+    def test__build_command_checker(self):
+        cmd = StartHandler._build_command(
+                ["rf/md5sums"], "cached", checker_tool="sha256sum")
+        self.assertEqual(cmd, ["sha256sum", "-c", "rf/md5sums"])
+
+        cmd = StartHandler._build_command(
+                ["rf/md5sums", "rf/other"], "cached", report_path="report",
+                checker_tool="sha256sum", checker_shards=4)
+        self.assertEqual(
+                cmd,
+                [
+                    sys.executable, "-m", "checksum.sharded",
+                    "--tool", "sha256sum", "--shards", "4",
+                    "--report", "report", "rf/md5sums", "rf/other",
+                ])
+        self.assertEqual(
+                StartHandler._buffer_memory(cmd, 4096),
+                checksum_handlers.MD5SUM_BUFFER_SIZE * 4)
+
+        # Options the checker does not support are left to the verifier.
+        cmd = StartHandler._build_command(
+                ["rf/md5sums"], "uncached", checker_tool="sha256sum",
+                checker_shards=4)
+        self.assertEqual(cmd[:3], [sys.executable, "-m", "checksum.verifier"])
+        self.assertEqual(cmd[cmd.index("--algorithm") + 1], "sha256")
+
+        with self.assertRaises(ArteriaUsageException):
+            StartHandler._build_command(
+                    ["rf/md5sums"], "uncached", checker_tool="b3sum")
+
+    def test__build_command_completeness(self):
+        cmd = StartHandler._build_command(
+                ["rf/md5sums"], "cached", completeness_root="rf",
+                walk_workers=4, checker_shards=4)
+        self.assertEqual(cmd[:3], [sys.executable, "-m", "checksum.verifier"])
+        self.assertEqual(cmd[cmd.index("--completeness") + 1], "rf")
+        self.assertEqual(cmd[cmd.index("--walk-workers") + 1], "4")
+
+    def test__build_command_merkle(self):
+        cmd = StartHandler._build_command(
+                ["rf/md5sums"], "cached", merkle_path="log.merkle.json",
+                merkle_root="rf")
+        self.assertEqual(cmd[:3], [sys.executable, "-m", "checksum.verifier"])
+        self.assertEqual(cmd[cmd.index("--merkle") + 1], "log.merkle.json")
+        self.assertEqual(cmd[cmd.index("--merkle-root") + 1], "rf")
+
     def test_raise_exception_on_log_dir_problem(self):
         with mock.patch(
                 "checksum.checksum_handlers.StartHandler._is_valid_log_dir",
@@ -120,6 +457,144 @@ class TestStartHandler(TestChecksumHandlers):
             self.assertEqual(response.code, 500)
 
 
+class TestBatchStartHandler(TestChecksumHandlers):
+    def setUp(self):
+        super().setUp()
+        self.runfolders = []
+        for _ in range(2):
+            runfolder = tempfile.TemporaryDirectory(
+                    dir=DummyConfig()["monitored_directory"])
+            self.addCleanup(runfolder.cleanup)
+            with open(os.path.join(runfolder.name, "md5_checksums"), "w"):
+                pass
+            self.runfolders.append(os.path.basename(runfolder.name))
+
+    def start_batch(self, body):
+        with mock.patch(
+                "checksum.checksum_handlers"
+                ".StartHandler._validate_runfolder_exists",
+                side_effect=lambda runfolder, _: runfolder in self.runfolders):
+            return self.fetch(
+                    self.API_BASE + "/start_batch",
+                    method="POST",
+                    body=json_encode(body))
+
+    def test_start_batch(self):
+        body = {
+                "jobs": [
+                    {"runfolder": runfolder,
+                     "path_to_md5_sum_file": "md5_checksums"}
+                    for runfolder in self.runfolders],
+                "read_mode": "uncached",
+                }
+        body["jobs"][1]["priority"] = "high"
+        response = self.start_batch(body)
+        self.assertEqual(response.code, 202)
+        started = json.loads(response.body)
+        self.assertEqual(
+                [job["runfolder"] for job in started["jobs"]],
+                self.runfolders)
+        self.assertEqual(started["jobs"][1]["priority"], "high")
+        self.assertTrue(started["link"].endswith(
+                f"/api/1.0/group/{started['group_id']}"))
+        for job in started["jobs"]:
+            cmd = self.runner_service._get_job(job["job_id"]).cmd
+            self.assertEqual(cmd[cmd.index("--read-mode") + 1], "uncached")
+
+        response = self.fetch(
+                self.API_BASE + f"/group/{started['group_id']}")
+        status = json.loads(response.body)
+        self.assertEqual(
+                [job["job_id"] for job in status["jobs"]],
+                [job["job_id"] for job in started["jobs"]])
+        self.assertEqual(sum(status["counts"].values()), 2)
+
+        response = self.fetch(
+                self.API_BASE + f"/group/{started['group_id']}/stop",
+                method="POST",
+                body="")
+        self.assertEqual(response.code, 200)
+        response = self.fetch(
+                self.API_BASE + f"/group/{started['group_id']}")
+        self.assertIn(
+                json.loads(response.body)["state"],
+                (State.CANCELLED, State.ERROR, State.DONE))
+
+    def test_start_batch_invalid(self):
+        """
+        Test no job is started if one of them is invalid.
+        """
+        n_jobs = len(self.runner_service.status_all())
+        response = self.start_batch({"jobs": [
+                {"runfolder": self.runfolders[0],
+                 "path_to_md5_sum_file": "md5_checksums"},
+                {"runfolder": "missing",
+                 "path_to_md5_sum_file": "md5_checksums"},
+                ]})
+        self.assertEqual(response.code, 500)
+        self.assertEqual(len(self.runner_service.status_all()), n_jobs)
+
+        for body in ({}, {"jobs": ["a"]}, {"jobs": [{}]}, {"jobs": [{
+                "runfolder": self.runfolders[0],
+                "path_to_md5_sum_file": "md5_checksums",
+                "read_mode": "psychic"}]}):
+            self.assertEqual(self.start_batch(body).code, 500)
+        self.assertEqual(len(self.runner_service.status_all()), n_jobs)
+
+    def test__interleave(self):
+        self.assertEqual(
+                checksum_handlers.BatchStartHandler._interleave(
+                    ["a", "a", "a", "b", "c", "b"]),
+                [0, 3, 4, 1, 5, 2])
+
+    def test_unknown_group(self):
+        response = self.fetch(self.API_BASE + "/group/1234")
+        self.assertEqual(
+                json.loads(response.body),
+                {"group_id": 1234, "state": State.NONE, "jobs": []})
+
+
+class TestPlanHandler(TestChecksumHandlers):
+    def setUp(self):
+        super().setUp()
+        runfolder = tempfile.TemporaryDirectory(
+                dir=DummyConfig()["monitored_directory"])
+        self.addCleanup(runfolder.cleanup)
+        self.runfolder = os.path.basename(runfolder.name)
+        with open(os.path.join(runfolder.name, "a"), "w") as f:
+            f.write("abc")
+        with open(os.path.join(runfolder.name, "md5_checksums"), "w") as f:
+            f.write(f"{'0' * 32}  {self.runfolder}/a\n")
+            f.write(f"{'0' * 32}  {self.runfolder}/missing\n")
+
+    def plan(self, body):
+        with mock.patch(
+                "checksum.checksum_handlers"
+                ".StartHandler._validate_runfolder_exists",
+                return_value=True):
+            return self.fetch(
+                    self.API_BASE + f"/plan/{self.runfolder}",
+                    method="POST",
+                    body=json_encode(body))
+
+    def test_plan(self):
+        n_jobs = len(self.runner_service.status_all())
+        response = self.plan({"path_to_md5_sum_file": "md5_checksums"})
+        self.assertEqual(response.code, 200)
+        result = json.loads(response.body)
+        self.assertEqual(
+                result["md5sum_files"], [f"{self.runfolder}/md5_checksums"])
+        self.assertEqual(result["n_files"], 2)
+        self.assertEqual(result["n_missing"], 1)
+        self.assertEqual(result["bytes"], 3)
+        self.assertIsNone(result["estimated_seconds"])
+        self.assertEqual(len(self.runner_service.status_all()), n_jobs)
+
+    def test_plan_invalid(self):
+        response = self.plan({"path_to_md5_sum_file": "missing"})
+        self.assertEqual(response.code, 500)
+
+
 class TestStatusHandler(TestChecksumHandlers):
     def test_check_status(self):
         with mock.patch(
@@ -130,22 +605,178 @@ class TestStatusHandler(TestChecksumHandlers):
             self.assertEqual(response_as_json["state"], State.DONE)
             m.assert_called_once_with(1)
 
+    def test_check_status_details(self):
+        details = {"priority": "low", "queue_position": 2, "suspended": False}
+        with mock.patch(
+                "checksum.runner_service.RunnerService.status",
+                return_value=State.PENDING), \
+                mock.patch(
+                    "checksum.runner_service.RunnerService.details",
+                    return_value=details):
+            response = self.fetch(self.API_BASE + "/status/1")
+            self.assertEqual(
+                    json.loads(response.body),
+                    {"state": State.PENDING, **details})
+
+    def test_check_status_profile(self):
+        profile = {"wall_seconds": 1.}
+        with mock.patch(
+                "checksum.runner_service.RunnerService.status",
+                return_value=State.DONE), \
+                mock.patch(
+                    "checksum.runner_service.RunnerService.report",
+                    return_value={"profile": profile}) as m:
+            response = self.fetch(self.API_BASE + "/status/1?profile=1")
+            response_as_json = json.loads(response.body)
+            self.assertEqual(response_as_json["profile"], profile)
+            m.assert_called_once_with(1)
+
+            response = self.fetch(self.API_BASE + "/status/1")
+            self.assertNotIn("profile", json.loads(response.body))
+
+    def test_check_status_manifests(self):
+        manifests = {"rf/md5sums": {"ok": 1}}
+        with mock.patch(
+                "checksum.runner_service.RunnerService.status",
+                return_value=State.DONE), \
+                mock.patch(
+                    "checksum.runner_service.RunnerService.report",
+                    return_value={"manifests": manifests}):
+            response = self.fetch(self.API_BASE + "/status/1")
+            self.assertEqual(
+                    json.loads(response.body)["manifests"], manifests)
+
+    def test_check_status_etag(self):
+        """
+        Test unchanged statuses are not sent again.
+        """
+        with mock.patch(
+                "checksum.runner_service.RunnerService.status",
+                return_value=State.DONE):
+            response = self.fetch(self.API_BASE + "/status/1")
+            etag = response.headers["Etag"]
+
+            response = self.fetch(
+                    self.API_BASE + "/status/1",
+                    headers={"If-None-Match": etag})
+            self.assertEqual(response.code, 304)
+
+            response = self.fetch(
+                    self.API_BASE + "/status/1?wait=10",
+                    headers={"If-None-Match": etag})
+            self.assertEqual(response.code, 304)
+    def test_check_status_all(self):
+        jobs = [{
+            "job_id": 2, "state": State.DONE, "created_at": 0.,
+            "finished_at": None, "runfolder": "rf", "priority": "normal"}]
+        with mock.patch(
+                "checksum.runner_service.RunnerService.list_jobs",
+                return_value=(jobs, None)) as m:
+            response = self.fetch(self.API_BASE + "/status/")
+            m.assert_called_once_with()
+            self.assertEqual(json.loads(response.body), {"2": {
+                "state": State.DONE,
+                "created_at": datetime.datetime.fromtimestamp(0).isoformat(),
+                "finished_at": None,
+                "runfolder": "rf",
+                "priority": "normal"}})
+
+    def test_list_jobs(self):
+        jobs = [{
+            "job_id": 2, "state": State.DONE, "created_at": 0.,
+            "runfolder": "rf", "priority": "normal"}]
+        with mock.patch(
+                "checksum.runner_service.RunnerService.list_jobs",
+                return_value=(jobs, 2)) as m:
+            response = self.fetch(
+                    self.API_BASE + "/status/?state=done,error&runfolder=rf"
+                    "&since=2020-01-01T00:00:00&until=1700000000&cursor=5"
+                    "&limit=1&fields=state")
+            m.assert_called_once_with(
+                    states=[State.DONE, State.ERROR],
+                    tags={"runfolder": "rf"},
+                    since=datetime.datetime(2020, 1, 1).timestamp(),
+                    until=1700000000.,
+                    cursor=5,
+                    limit=1)
+            self.assertEqual(
+                    json.loads(response.body),
+                    {"jobs": [{"job_id": 2, "state": State.DONE}],
+                     "next_cursor": 2})
+
+    def test_list_jobs_page_size(self):
+        with mock.patch(
+                "checksum.runner_service.RunnerService.list_jobs",
+                return_value=([], None)) as m:
+            self.fetch(self.API_BASE + "/status/?limit=100000")
+            self.assertEqual(m.call_args[1]["limit"], 1000)
+            self.fetch(self.API_BASE + "/status/?runfolder=rf")
+            self.assertEqual(m.call_args[1]["limit"], 100)
+
+    def test_list_jobs_bad_arguments(self):
+        for query in ("state=unknown", "limit=0", "since=yesterday"):
+            response = self.fetch(self.API_BASE + f"/status/?{query}")
+            self.assertEqual(response.code, 500)
+
+
+class TestStatusHandlerLongPoll(TestChecksumHandlers):
+    runner_service = RunnerService(poll_interval=0.05)
+
+    def test_check_status_long_poll(self):
+        """
+        Test a long-poll returns as soon as the job changes.
+        """
+        job_id = self.io_loop.run_sync(
+                lambda: self.runner_service.start(["sleep", "0.2"]))
+
+        response = self.fetch(
+                self.API_BASE + f"/status/{job_id}?wait=10",
+                request_timeout=10)
+
+        self.assertEqual(json.loads(response.body)["state"], State.DONE)
+
+    def test_check_status_long_poll_outdated_client(self):
+        """
+        Test a long-poll returns right away if the client has an outdated
+        status.
+        """
+        job_id = self.io_loop.run_sync(
+                lambda: self.runner_service.start(["sleep", "10"]))
+
+        response = self.fetch(
+                self.API_BASE + f"/status/{job_id}?wait=10",
+                headers={"If-None-Match": '"outdated"'},
+                request_timeout=5)
+
+        self.assertEqual(json.loads(response.body)["state"], State.STARTED)
+        self.runner_service.stop_all()
 
 class TestStopHandler(TestChecksumHandlers):
     def test_stop_all_checksum(self):
-        with mock.patch("checksum.runner_service.RunnerService.stop_all") as m:
+        with mock.patch(
+                "checksum.runner_service.RunnerService.async_stop_all") as m:
             response = self.fetch(
                     self.API_BASE + "/stop/all", method="POST", body="")
             self.assertEqual(response.code, 200)
             m.assert_called_once()
 
     def test_stop_one_checksum(self):
-        with mock.patch("checksum.runner_service.RunnerService.stop") as m:
+        with mock.patch(
+                "checksum.runner_service.RunnerService.async_stop") as m:
             response = self.fetch(
                     self.API_BASE + "/stop/1", method="POST", body="")
             self.assertEqual(response.code, 200)
             m.assert_called_once_with(1)
 
+    def test_metrics(self):
+        metrics = {"jobs": {State.STARTED: 1}, "memory": None}
+        with mock.patch(
+                "checksum.runner_service.RunnerService.metrics",
+                return_value=metrics):
+            response = self.fetch(self.API_BASE + "/metrics")
+            self.assertEqual(response.code, 200)
+            self.assertEqual(json.loads(response.body), metrics)
+
     def test_version(self):
         response = self.fetch(self.API_BASE + "/version")
 
@@ -153,3 +784,190 @@ class TestStopHandler(TestChecksumHandlers):
 
         self.assertEqual(response.code, 200)
         self.assertEqual(json.loads(response.body), expected_result)
+
+    def test_scrub_disabled(self):
+        response = self.fetch(self.API_BASE + "/scrub")
+        self.assertEqual(json.loads(response.body), {"state": "disabled"})
+
+
+class TestScrubHandler(TestChecksumHandlers):
+    scrub_scheduler = ScrubScheduler(
+            TestChecksumHandlers.runner_service, "/tmp", ["archive"],
+            "/tmp/cache.db", "/tmp", bytes_per_day=86400)
+
+    def get_app(self):
+        return Application(
+            routes(
+                config=DummyConfig(),
+                runner_service=self.runner_service,
+                runfolder_index=self.runfolder_index,
+                webhooks=self.webhooks,
+                scrub_scheduler=self.scrub_scheduler))
+
+    def test_scrub_status(self):
+        response = self.fetch(self.API_BASE + "/scrub")
+        status = json.loads(response.body)
+        self.assertEqual(status["state"], "waiting")
+        self.assertEqual(status["roots"], ["archive"])
+        self.assertEqual(status["slices"], [])
+
+
+class TestLogHandler(TestChecksumHandlers):
+    def setUp(self):
+        super().setUp()
+        self.log_dir = tempfile.TemporaryDirectory()
+        self.log_path = os.path.join(self.log_dir.name, "log")
+        self.content = b"".join(
+                f"file_{i}: OK\n".encode() for i in range(20000))
+        with open(self.log_path, "wb") as f:
+            f.write(self.content)
+        patcher = mock.patch(
+                "checksum.runner_service.RunnerService.log_path",
+                return_value=self.log_path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.log_dir.cleanup)
+
+    def test_log(self):
+        response = self.fetch(self.API_BASE + "/log/1")
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.body, self.content)
+        self.assertEqual(response.headers["Accept-Ranges"], "bytes")
+
+    def test_compressed_log(self):
+        compress_log(self.log_path)
+        self.assertFalse(os.path.exists(self.log_path))
+        response = self.fetch(self.API_BASE + "/log/1")
+        self.assertEqual(response.body, self.content)
+
+        response = self.fetch(
+                self.API_BASE + "/log/1", headers={"Range": "bytes=70000-"})
+        self.assertEqual(response.code, 206)
+        self.assertEqual(response.body, self.content[70000:])
+
+    def test_range(self):
+        size = len(self.content)
+        for range_header, start, end in (
+                ("bytes=10-19", 10, 20),
+                ("bytes=100000-", 100000, size),
+                ("bytes=-5", size - 5, size),
+                ("bytes=10-100000000", 10, size)):
+            response = self.fetch(
+                    self.API_BASE + "/log/1",
+                    headers={"Range": range_header})
+            self.assertEqual(response.code, 206)
+            self.assertEqual(response.body, self.content[start:end])
+            self.assertEqual(
+                    response.headers["Content-Range"],
+                    f"bytes {start}-{end - 1}/{size}")
+
+        response = self.fetch(
+                self.API_BASE + "/log/1",
+                headers={"Range": f"bytes={size}-"})
+        self.assertEqual(response.code, 416)
+        self.assertEqual(response.headers["Content-Range"], f"bytes */{size}")
+
+        # Several ranges are not supported: the whole log is returned.
+        response = self.fetch(
+                self.API_BASE + "/log/1",
+                headers={"Range": "bytes=0-1,5-6"})
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.body, self.content)
+
+    def test_tail(self):
+        response = self.fetch(self.API_BASE + "/log/1?tail=2")
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.body, b"file_19998: OK\nfile_19999: OK\n")
+
+        response = self.fetch(self.API_BASE + "/log/1?tail=lots")
+        self.assertEqual(response.code, 500)
+
+    def test_log_shrinks(self):
+        """
+        Test a log getting shorter while it is served does not break the
+        handler: the request fails if nothing was sent yet, and the
+        connection is closed otherwise.
+        """
+        read = checksum_handlers.LogReader.read
+
+        def read_once(reader, offset, length):
+            return read(reader, offset, length) if not offset else b""
+
+        with self.assertNoLogs("tornado.application", level="ERROR"):
+            with mock.patch.object(
+                    checksum_handlers.LogReader, "read", autospec=True,
+                    return_value=b""):
+                response = self.fetch(self.API_BASE + "/log/1")
+            self.assertEqual(response.code, 500)
+
+            with mock.patch.object(
+                    checksum_handlers.LogReader, "read", autospec=True,
+                    side_effect=read_once):
+                with self.assertRaises(HTTPStreamClosedError):
+                    self.fetch(self.API_BASE + "/log/1")
+
+    def test_no_log(self):
+        os.unlink(self.log_path)
+        response = self.fetch(self.API_BASE + "/log/1")
+        self.assertEqual(response.code, 404)
+
+        with mock.patch(
+                "checksum.runner_service.RunnerService.log_path",
+                return_value=None):
+            response = self.fetch(self.API_BASE + "/log/1")
+            self.assertEqual(response.code, 404)
+
+
+class TestMerkleHandler(TestChecksumHandlers):
+    def setUp(self):
+        super().setUp()
+        self.log_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.log_dir.cleanup)
+        log_path = os.path.join(self.log_dir.name, "log")
+        self.merkle_path = StartHandler._merkle_path(log_path)
+        self.merkle = MerkleTree("rf")
+        self.merkle.add("rf/a", "1" * 32)
+        self.merkle.add("rf/sub/b", "2" * 32)
+        self.merkle.save(self.merkle_path)
+        patcher = mock.patch(
+                "checksum.runner_service.RunnerService.log_path",
+                return_value=log_path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_merkle(self):
+        response = self.fetch(self.API_BASE + "/merkle/1")
+        self.assertEqual(response.code, 200)
+        tree = json.loads(response.body)
+        self.assertEqual(tree["digest"], self.merkle.digest())
+        self.assertEqual(tree["algorithm"], "md5")
+        self.assertEqual(tree["n_files"], 2)
+        self.assertEqual(
+                [child["name"] for child in tree["children"]], ["a", "sub"])
+
+        response = self.fetch(self.API_BASE + "/merkle/1?path=sub/b")
+        self.assertEqual(json.loads(response.body)["digest"], "2" * 32)
+
+    def test_not_found(self):
+        response = self.fetch(self.API_BASE + "/merkle/1?path=missing")
+        self.assertEqual(response.code, 404)
+
+        with mock.patch(
+                "checksum.runner_service.RunnerService.log_path",
+                return_value=None):
+            response = self.fetch(self.API_BASE + "/merkle/1")
+        self.assertEqual(response.code, 404)
+
+        with mock.patch(
+                "checksum.runner_service.RunnerService.log_path",
+                return_value=os.path.join(self.log_dir.name, "other")):
+            response = self.fetch(self.API_BASE + "/merkle/1")
+        self.assertEqual(response.code, 404)
+
+    def test_corrupt(self):
+        for content in ('{"root": ', "{}"):
+            with open(self.merkle_path, "w") as f:
+                f.write(content)
+            response = self.fetch(self.API_BASE + "/merkle/1")
+            self.assertEqual(response.code, 500)
+            self.assertIn("Cannot read the Merkle tree", response.reason)
@@ -0,0 +1,62 @@
+import gzip
+import hashlib
+import os
+
+import pytest
+
+from checksum import decompress
+from checksum.decompress import DecompressError, Inflater
+from tests.test_utils import bgzf_compress
+
+
+DATA = os.urandom(100000) + b"ACGT" * 500000
+
+
+@pytest.fixture
+def inflater():
+    inflater = Inflater(4)
+    yield inflater
+    inflater.close()
+
+
+def digest(inflater, data, chunk_size=65536):
+    inflating_digest = inflater.wrap(hashlib.md5())
+    for i in range(0, len(data), chunk_size):
+        inflating_digest.update(data[i:i + chunk_size])
+    return inflating_digest.hexdigest()
+
+
+@pytest.mark.parametrize("chunk_size", [7, 65536, 10**7])
+@pytest.mark.parametrize("compress", [
+    gzip.compress,
+    lambda data: gzip.compress(data[:1000]) + gzip.compress(data[1000:]),
+    bgzf_compress,
+    ], ids=["gzip", "multi-member", "bgzf"])
+def test_digest_decompressed(inflater, compress, chunk_size):
+    assert digest(inflater, compress(DATA), chunk_size) == (
+            hashlib.md5(DATA).hexdigest())
+
+
+def test_bgzf_batches(inflater, monkeypatch):
+    """
+    Test BGZF blocks are inflated in several batches, in order.
+    """
+    monkeypatch.setattr(decompress, "BATCH_SIZE", 4096)
+    assert digest(inflater, bgzf_compress(DATA, block_size=1000)) == (
+            hashlib.md5(DATA).hexdigest())
+
+
+@pytest.mark.parametrize("data", [b"", b"\x1f", b"plain content"])
+def test_digest_plain(inflater, data):
+    assert digest(inflater, data) == hashlib.md5(data).hexdigest()
+
+
+@pytest.mark.parametrize("corrupt", [
+    lambda data: gzip.compress(data)[:-10],
+    lambda data: bgzf_compress(data)[:-100],
+    lambda data: gzip.compress(data) + b"garbage",
+    lambda data: bgzf_compress(data)[:100] + b"x" + bgzf_compress(data)[101:],
+    ], ids=["truncated gzip", "truncated bgzf", "trailing garbage", "crc"])
+def test_corrupt(inflater, corrupt):
+    with pytest.raises(DecompressError):
+        digest(inflater, corrupt(DATA))
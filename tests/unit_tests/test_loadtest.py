@@ -0,0 +1,27 @@
+from checksum.loadtest import LatencyRecorder, percentile
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile(values, 100) == 100
+    assert percentile([3], 50) == 3
+    assert percentile([], 50) is None
+
+
+def test_latency_recorder():
+    recorder = LatencyRecorder()
+    for seconds in (0.003, 0.001, 0.002):
+        recorder.add("start", seconds)
+    recorder.add("stop", 0.5, ok=False)
+
+    summary = recorder.summary()
+    assert summary["start"]["count"] == 3
+    assert summary["start"]["errors"] == 0
+    assert summary["start"]["p50"] == 2
+    assert summary["start"]["max"] == 3
+    assert summary["stop"]["errors"] == 1
+    assert summary["status"] == {
+        "count": 0, "errors": 0,
+        "p50": None, "p90": None, "p99": None, "max": None}
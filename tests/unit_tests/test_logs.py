@@ -0,0 +1,84 @@
+import gzip
+import os
+import tempfile
+
+import pytest
+
+from checksum import logs
+from checksum.logs import LogReader, compress_log
+
+
+@pytest.fixture
+def log_path():
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "log")
+        with open(path, "wb") as f:
+            f.write(CONTENT)
+        yield path
+
+
+CONTENT = b"".join(f"file_{i}: OK\n".encode() for i in range(50000))
+
+
+def lines(n):
+    return b"".join(CONTENT.splitlines(True)[-n:]) if n else b""
+
+
+class TestCompressLog:
+    def test_compress(self, log_path):
+        mtime = os.stat(log_path).st_mtime_ns
+        compressed_path = compress_log(log_path)
+        assert compressed_path == log_path + logs.COMPRESSED_SUFFIX
+        assert not os.path.exists(log_path)
+        assert os.stat(compressed_path).st_mtime_ns == mtime
+        assert os.path.getsize(compressed_path) < len(CONTENT)
+        with gzip.open(compressed_path) as f:
+            assert f.read() == CONTENT
+
+    def test_compress_empty(self, log_path):
+        open(log_path, "w").close()
+        with gzip.open(compress_log(log_path)) as f:
+            assert f.read() == b""
+        with LogReader(log_path) as reader:
+            assert reader.size == 0
+            assert reader.read(0) == b""
+            assert reader.tail_offset(10) == 0
+
+
+class TestLogReader:
+    @pytest.mark.parametrize("compressed", [False, True])
+    def test_read(self, log_path, compressed):
+        if compressed:
+            compress_log(log_path)
+        with LogReader(log_path) as reader:
+            assert reader.compressed == compressed
+            assert reader.size == len(CONTENT)
+            # Across members of compressed logs.
+            assert reader.read(65000, 200000) == CONTENT[65000:265000]
+            assert reader.read(len(CONTENT) - 3) == CONTENT[-3:]
+            assert reader.read(len(CONTENT)) == b""
+
+    @pytest.mark.parametrize("compressed", [False, True])
+    def test_tail(self, log_path, compressed):
+        if compressed:
+            compress_log(log_path)
+        with LogReader(log_path) as reader:
+            for n in (0, 1, 2, 10000, 50000, 60000):
+                assert CONTENT[reader.tail_offset(n):] == lines(n)
+
+    def test_tail_unterminated(self, log_path):
+        with open(log_path, "ab") as f:
+            f.write(b"last")
+        with LogReader(log_path) as reader:
+            offset = reader.tail_offset(2)
+            assert reader.read(offset) == b"file_49999: OK\nlast"
+
+    def test_not_found(self, log_path):
+        os.unlink(log_path)
+        with pytest.raises(FileNotFoundError):
+            LogReader(log_path)
+
+    def test_corrupt(self, log_path):
+        os.rename(log_path, log_path + logs.COMPRESSED_SUFFIX)
+        with pytest.raises(ValueError):
+            LogReader(log_path)
@@ -0,0 +1,109 @@
+import os
+import tempfile
+
+import pytest
+
+from checksum.merkle import MerkleTree
+
+
+FILES = {
+    "rf/a": "1" * 32,
+    "rf/sub/b": "2" * 32,
+    "rf/sub/deep/c": "3" * 32,
+    "rf/other/d": "4" * 32,
+    }
+
+
+def build(files, root="rf"):
+    merkle = MerkleTree(root)
+    for path, digest in files.items():
+        merkle.add(path, digest)
+    return merkle
+
+
+class TestMerkleTree:
+    def test_digest(self):
+        """
+        Test copies holding the same files have the same digest, whatever
+        the order they were added in, and that a change is found by walking
+        down the subtrees that differ only.
+        """
+        source = build(FILES)
+        assert build(dict(reversed(FILES.items()))).digest() == (
+                source.digest())
+
+        destination = build({**FILES, "rf/sub/deep/c": "5" * 32})
+        assert destination.digest() != source.digest()
+        differing = [
+            (a["name"], a["digest"] == b["digest"])
+            for a, b in zip(
+                source.subtree()["children"],
+                destination.subtree()["children"])]
+        assert differing == [("a", True), ("other", True), ("sub", False)]
+        assert source.subtree("sub/deep/c")["digest"] == "3" * 32
+        assert destination.subtree("sub/deep/c")["digest"] == "5" * 32
+
+    def test_names_and_types(self):
+        """
+        Test renaming a file, or replacing it with a directory, changes the
+        digest of the tree.
+        """
+        merkle = build({"rf/a": "1" * 32})
+        assert build({"rf/b": "1" * 32}).digest() != merkle.digest()
+        assert build({"rf/a/x": "1" * 32}).digest() != merkle.digest()
+
+    def test_add(self):
+        merkle = build(FILES)
+        digest = merkle.digest()
+        merkle.add("rf/./sub/b", "6" * 32)
+        assert merkle.digest() != digest
+        assert merkle.subtree()["n_files"] == 4
+        assert merkle.subtree("sub")["n_files"] == 2
+
+        for path in ("other/a", "/rf/a", "rf", "rf/a/x", "rf/sub"):
+            with pytest.raises(ValueError):
+                merkle.add(path, "0" * 32)
+        assert merkle.subtree()["n_files"] == 4
+
+    def test_subtree(self):
+        subtree = build(FILES).subtree("sub")
+        assert subtree["path"] == "sub"
+        assert subtree["type"] == "directory"
+        assert subtree["n_files"] == 2
+        assert subtree["children"][0] == {
+                "name": "b", "type": "file", "digest": "2" * 32}
+        assert subtree["children"][1]["name"] == "deep"
+        assert subtree["children"][1]["n_files"] == 1
+
+        assert build(FILES).subtree("a") == {
+                "path": "a", "type": "file", "digest": "1" * 32}
+        for path in ("missing", "a/b", "../rf"):
+            with pytest.raises(KeyError):
+                build(FILES).subtree(path)
+
+    def test_empty(self):
+        assert MerkleTree().subtree() == {
+                "path": "",
+                "type": "directory",
+                "digest": MerkleTree().digest(),
+                "n_files": 0,
+                "children": [],
+                }
+
+    def test_save(self):
+        merkle = build(FILES)
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "merkle.json")
+            merkle.save(path)
+            loaded = MerkleTree.load(path)
+
+            with open(path, "w") as f:
+                f.write("[]")
+            with pytest.raises(ValueError):
+                MerkleTree.load(path)
+
+        assert loaded.digest() == merkle.digest()
+        assert loaded.root == "rf"
+        assert loaded.subtree("sub") == merkle.subtree("sub")
+        loaded.add("rf/sub/e", "7" * 32)
+        assert loaded.subtree("sub")["n_files"] == 3
@@ -0,0 +1,141 @@
+import hashlib
+import os
+import tempfile
+
+import mock
+import pytest
+from arteria.web.state import State
+
+from checksum.accounting import ResourceUsage
+from checksum.checksum_cache import ChecksumCache
+from checksum.planning import ThroughputHistory, plan, storage_device
+
+
+@pytest.fixture
+def monitored_dir():
+    """
+    Monitored directory holding a runfolder "rf" and its md5sum file, which
+    lists a file twice, a missing file and an improperly formatted line.
+    """
+    with tempfile.TemporaryDirectory() as monitored_dir:
+        os.mkdir(os.path.join(monitored_dir, "rf"))
+        lines = []
+        for name, size in (("a", 1000), ("b", 3000)):
+            content = os.urandom(size)
+            with open(os.path.join(monitored_dir, "rf", name), "wb") as f:
+                f.write(content)
+            lines.append(f"{hashlib.md5(content).hexdigest()}  rf/{name}")
+        lines += [lines[0], f"{'0' * 32}  rf/missing", "not a checksum"]
+        with open(os.path.join(monitored_dir, "rf", "md5sums"), "w") as f:
+            f.write("\n".join(lines) + "\n")
+        yield monitored_dir
+
+
+def finished_job(state=State.DONE, runfolder="rf", bytes_read=10000):
+    return mock.Mock(
+        state=state,
+        tags={"runfolder": runfolder} if runfolder else {},
+        usage=ResourceUsage(1, 1, bytes_read, 0, 1000, 2))
+
+
+class TestThroughputHistory:
+    def test_record(self):
+        history = ThroughputHistory("/monitored", weight=0.5)
+        assert history.throughput(1) == (None, 0)
+
+        history.record(1, 1000, 10)
+        assert history.throughput(1) == (100, 1)
+        history.record(1, 3000, 10)
+        assert history.throughput(1) == (200, 2)
+        assert history.throughput(2) == (None, 0)
+
+    def test_persistence(self, monitored_dir):
+        path = os.path.join(monitored_dir, "throughput.json")
+        ThroughputHistory(monitored_dir, path=path).record(
+                "http://s3/archive", 1000, 10)
+
+        history = ThroughputHistory(monitored_dir, path=path)
+        assert history.throughput("http://s3/archive") == (100, 1)
+
+        with open(path, "w") as f:
+            f.write("{")
+        assert ThroughputHistory(monitored_dir, path=path).throughput(
+                "http://s3/archive") == (None, 0)
+
+    def test_job_finished(self, monitored_dir):
+        history = ThroughputHistory(monitored_dir, min_bytes=5000)
+        device = os.stat(os.path.join(monitored_dir, "rf")).st_dev
+
+        for job in (
+                finished_job(state=State.ERROR),
+                finished_job(runfolder=None),
+                finished_job(runfolder="gone"),
+                finished_job(bytes_read=100),
+                finished_job(bytes_read=None)):
+            history.job_finished(job)
+            assert history.throughput(device) == (None, 0)
+
+        history.job_finished(finished_job())
+        assert history.throughput(device) == (5000, 1)
+
+
+class TestPlan:
+    def test_plan(self, monitored_dir):
+        history = ThroughputHistory(monitored_dir)
+        history.record("disk", 4000, 2)
+
+        result = plan(
+                [os.path.join(monitored_dir, "rf", "md5sums")],
+                monitored_dir, "disk", history)
+
+        assert result == {
+                "n_files": 3,
+                "n_missing": 1,
+                "n_improper": 1,
+                "bytes": 4000,
+                "unchanged": None,
+                "device": "disk",
+                "bytes_per_second": 2000,
+                "n_jobs_learned": 1,
+                "estimated_seconds": 2,
+                }
+
+    def test_plan_without_history(self, monitored_dir):
+        result = plan(
+                [os.path.join(monitored_dir, "rf", "md5sums")],
+                monitored_dir, 1)
+        assert result["bytes_per_second"] is None
+        assert result["estimated_seconds"] is None
+
+    def test_unchanged(self, monitored_dir):
+        """
+        Test files are unchanged if they have the size and modification time
+        they had when they were last verified OK.
+        """
+        cache_path = os.path.join(monitored_dir, "cache.db")
+        with ChecksumCache(cache_path) as cache:
+            for name, result in (("a", "OK"), ("b", "OK")):
+                path = os.path.join(monitored_dir, "rf", name)
+                st = os.stat(path)
+                cache.record(path, "0" * 32, st.st_size, st.st_mtime, result)
+            os.utime(os.path.join(monitored_dir, "rf", "b"), (0, 0))
+
+        result = plan(
+                [os.path.join(monitored_dir, "rf", "md5sums")],
+                monitored_dir, 1, cache_path=cache_path)
+        assert result["unchanged"] == {"n_files": 1, "bytes": 1000}
+
+        # Caches that do not exist are not created.
+        missing_cache = os.path.join(monitored_dir, "none.db")
+        result = plan(
+                [os.path.join(monitored_dir, "rf", "md5sums")],
+                monitored_dir, 1, cache_path=missing_cache)
+        assert result["unchanged"] is None
+        assert not os.path.exists(missing_cache)
+
+
+def test_storage_device(monitored_dir):
+    assert storage_device(monitored_dir, "rf") == os.stat(monitored_dir).st_dev
+    assert storage_device(monitored_dir, "rf", "http://s3/a") == "http://s3/a"
+    with pytest.raises(OSError):
+        storage_device(monitored_dir, "gone")
@@ -0,0 +1,74 @@
+import math
+
+from checksum.profiling import Profile, PhaseTimings, PHASES
+
+
+class TestPhaseTimings:
+    def test_add(self):
+        """
+        Test timings are accumulated and put in the right bucket.
+        """
+        timings = PhaseTimings()
+        for seconds in (5e-6, 5e-3, 5e-3, 100):
+            timings.add(seconds)
+
+        as_dict = timings.to_dict()
+        assert as_dict["count"] == 4
+        assert math.isclose(as_dict["total_seconds"], 100.010005)
+        assert as_dict["histogram"]["1e-05"] == 1
+        assert as_dict["histogram"]["0.01"] == 2
+        assert as_dict["histogram"]["inf"] == 1
+
+
+class TestProfile:
+    def test_add(self):
+        """
+        Test phases can be chained.
+        """
+        profile = Profile()
+        start = profile.clock()
+        now = profile.add("read", start)
+        profile.add("hash", now)
+
+        as_dict = profile.to_dict()
+        assert set(as_dict["phases"]) == set(PHASES)
+        assert as_dict["phases"]["read"]["count"] == 1
+        assert as_dict["phases"]["hash"]["count"] == 1
+        assert as_dict["phases"]["open"]["count"] == 0
+
+    def test_slowest_files(self):
+        """
+        Test only the slowest files are kept, slowest first.
+        """
+        profile = Profile(n_slowest=2)
+        for i, seconds in enumerate([3, 1, 4, 1, 5]):
+            profile.add_file(f"file{i}", i, seconds)
+
+        assert profile.to_dict()["slowest_files"] == [
+                {"path": "file4", "bytes": 4, "seconds": 5},
+                {"path": "file2", "bytes": 2, "seconds": 4},
+                ]
+
+    def test_no_slowest_files(self):
+        profile = Profile(n_slowest=0)
+        profile.add_file("file", 0, 1)
+
+        assert profile.to_dict()["slowest_files"] == []
+
+    def test_merge(self):
+        """
+        Test the timings of another profile, e.g. of a worker process, are
+        added to those of each phase.
+        """
+        profile = Profile()
+        profile.add("read", profile.clock())
+        other = Profile()
+        other.add("read", other.clock())
+        other.add("hash", other.clock())
+
+        profile.merge(other.phases)
+
+        phases = profile.to_dict()["phases"]
+        assert phases["read"]["count"] == 2
+        assert sum(phases["read"]["histogram"].values()) == 2
+        assert phases["hash"]["count"] == 1
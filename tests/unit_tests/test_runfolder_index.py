@@ -0,0 +1,77 @@
+import os
+import tempfile
+
+import mock
+import pytest
+
+from checksum.runfolder_index import Runfolder, RunfolderIndex
+
+
+@pytest.fixture
+def monitored_dir():
+    with tempfile.TemporaryDirectory() as monitored_dir:
+        for name in ["rf1", "rf2"]:
+            os.mkdir(os.path.join(monitored_dir, name))
+        with open(os.path.join(monitored_dir, "not_a_runfolder"), "w"):
+            pass
+        yield monitored_dir
+
+
+class TestRunfolderIndex:
+    def test_contains(self, monitored_dir):
+        """
+        Test only directories are indexed.
+        """
+        index = RunfolderIndex(monitored_dir)
+
+        assert index.contains("rf1")
+        assert not index.contains("not_a_runfolder")
+        assert not index.contains("rf3")
+        assert index.get("rf2") == Runfolder(
+                "rf2", os.path.join(monitored_dir, "rf2"))
+        assert sorted(rf.name for rf in index.runfolders()) == ["rf1", "rf2"]
+
+    def test_listing_is_cached(self, monitored_dir):
+        """
+        Test the monitored directory is only listed once while it does not
+        change.
+        """
+        index = RunfolderIndex(monitored_dir, ttl=0)
+
+        with mock.patch("os.scandir", wraps=os.scandir) as scandir:
+            for _ in range(5):
+                assert index.contains("rf1")
+                assert not index.contains("rf3")
+
+        assert scandir.call_count == 1
+
+    def test_new_runfolder(self, monitored_dir):
+        """
+        Test a new runfolder is found right away, even within the TTL.
+        """
+        index = RunfolderIndex(monitored_dir, ttl=3600)
+        assert not index.contains("rf3")
+
+        os.mkdir(os.path.join(monitored_dir, "rf3"))
+        # Make sure the modification time changes on coarse file systems.
+        os.utime(monitored_dir, ns=(0, 0))
+
+        assert index.contains("rf3")
+
+    def test_removed_runfolder(self, monitored_dir):
+        """
+        Test removed runfolders disappear once the TTL expired.
+        """
+        index = RunfolderIndex(monitored_dir, ttl=0)
+        assert index.contains("rf2")
+
+        os.rmdir(os.path.join(monitored_dir, "rf2"))
+        os.utime(monitored_dir, ns=(0, 0))
+
+        assert not index.contains("rf2")
+
+    def test_missing_monitored_dir(self):
+        index = RunfolderIndex("/does/not/exist")
+
+        assert not index.contains("rf1")
+        assert index.runfolders() == []
@@ -2,10 +2,13 @@ from arteria.web.state import State as arteria_state
 from checksum.runner_service import Job, RunnerService
 
 import os
+import sys
 import tempfile
 import pytest
 import logging
 import asyncio
+import signal
+import time
 
 
 class TestJob:
@@ -72,6 +75,42 @@ class TestJob:
 
         assert caplog.records[-1].levelname == "ERROR"
 
+    def test_log_path(self):
+        """
+        Test stdout and stderr are written to the log file, which is only
+        created when the job starts.
+        """
+        with tempfile.TemporaryDirectory() as temp_dir:
+            log_path = os.path.join(temp_dir, "log")
+            job = Job(
+                    8, ["sh", "-c", "echo out; echo err >&2"],
+                    log_path=log_path, queued=True)
+            assert job.get_status() == arteria_state.PENDING
+            assert not os.path.exists(log_path)
+
+            job.start()
+            job.wait()
+
+            assert job.get_status() == arteria_state.DONE
+            with open(log_path) as f:
+                assert f.read() == "out\nerr\n"
+
+    def test_get_report(self):
+        """
+        Test the report written by the command can be read.
+        """
+        with tempfile.TemporaryDirectory() as temp_dir:
+            report_path = os.path.join(temp_dir, "report.json")
+            job = Job(6, ["true"], report_path=report_path)
+            job.wait()
+            assert job.get_report() is None
+
+            with open(report_path, "w") as f:
+                f.write('{"profile": {}}')
+            assert job.get_report() == {"profile": {}}
+
+        assert Job(7, ["true"]).get_report() is None
+
     def test_cancel(self, caplog):
         """
         Test it is possible to cancel a job and that this action is logged
@@ -90,6 +129,61 @@ class TestJob:
         assert caplog.records[-1].levelname == "INFO"
         assert caplog.records[-1].msg == f"Cancelling job {job_id} (`{cmd}`)"
 
+    def test_process_group(self):
+        """
+        Test signals reach the children of jobs run as a process group
+        """
+        def state(pid):
+            # None once the process is gone, "Z" while a zombie.
+            try:
+                with open(f"/proc/{pid}/stat") as f:
+                    return f.read().rsplit(")", 1)[1].split()[0]
+            except FileNotFoundError:
+                return None
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            pid_path = os.path.join(temp_dir, "pid")
+            job = Job(
+                    8, ["sh", "-c", f"sleep 60 & echo $! > {pid_path}; wait"],
+                    process_group=True)
+            for _ in range(500):
+                if os.path.exists(pid_path) and os.path.getsize(pid_path):
+                    break
+                time.sleep(0.01)
+            with open(pid_path) as f:
+                child = int(f.read())
+
+            job.suspend()
+            for _ in range(500):
+                if state(child) == "T":
+                    break
+                time.sleep(0.01)
+            assert state(child) == "T"
+
+            job.resume()
+            assert job.cancel() == arteria_state.CANCELLED
+            for _ in range(500):
+                if state(child) in (None, "Z"):
+                    break
+                time.sleep(0.01)
+            assert state(child) in (None, "Z")
+
+    def test_signal_exited(self):
+        """
+        Test signalling a process that exited leaves it to be reaped with
+        the resources it used.
+        """
+        job = Job(9, ["true"])
+        for _ in range(500):
+            with open(f"/proc/{job._proc.pid}/stat") as f:
+                if f.read().rsplit(")", 1)[1].split()[0] == "Z":
+                    break
+            time.sleep(0.01)
+
+        job._signal(signal.SIGCONT)
+        assert job._reap(block=True) == 0
+        assert job.usage is not None
+
 
 class TestRunnerService:
     def test_constructor(self):
@@ -250,3 +344,615 @@ class TestRunnerService:
             job_id: arteria_state.DONE
             for job_id in range(1, n_job + 1)
         }
+
+    @pytest.mark.asyncio
+    async def test_report(self):
+        """
+        Test getting the report of one job.
+        """
+        checksum_service = RunnerService(5)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            report_path = os.path.join(temp_dir, "report.json")
+            job_id = await checksum_service.start(
+                    ["sh", "-c", f"echo '{{}}' > {report_path}"],
+                    report_path=report_path)
+            checksum_service._get_job(job_id).wait()
+
+            assert await checksum_service.report(job_id) == {}
+            assert await checksum_service.report(job_id + 1) is None
+
+
+class TestPriorities:
+    @pytest.mark.asyncio
+    async def test_dispatch_by_priority(self):
+        """
+        Test waiting jobs are dispatched by priority, then submission order.
+        """
+        checksum_service = RunnerService(10, max_running_jobs=1)
+        blocker = await checksum_service.start(["sleep", "10"])
+        low = await checksum_service.start(["true"], priority="low")
+        normal = await checksum_service.start(["true"])
+        high = await checksum_service.start(["true"], priority="high")
+
+        assert checksum_service.status(blocker) == arteria_state.STARTED
+        assert [
+                checksum_service.details(job_id)["queue_position"]
+                for job_id in (blocker, low, normal, high)
+                ] == [None, 3, 2, 1]
+        assert checksum_service.status(low) == arteria_state.PENDING
+
+        checksum_service.stop(blocker)
+
+        assert checksum_service.status(high) != arteria_state.PENDING
+        assert checksum_service.status(normal) == arteria_state.PENDING
+        checksum_service.stop_all()
+
+    @pytest.mark.asyncio
+    async def test_aging(self):
+        """
+        Test a low priority job that waited long enough goes first.
+        """
+        checksum_service = RunnerService(
+                10, max_running_jobs=1, priority_aging=10)
+        await checksum_service.start(["sleep", "10"])
+        low = await checksum_service.start(["true"], priority="low")
+        normal = await checksum_service.start(["true"])
+
+        checksum_service._get_job(low).queued_at -= 11
+
+        assert checksum_service.details(low)["queue_position"] == 1
+        assert checksum_service.details(normal)["queue_position"] == 2
+        checksum_service.stop_all()
+
+    @pytest.mark.asyncio
+    async def test_dispatch_when_slot_frees(self):
+        """
+        Test waiting jobs are started once running jobs are done, without
+        anyone polling.
+        """
+        checksum_service = RunnerService(
+                10, max_running_jobs=1, poll_interval=0.01)
+        first = await checksum_service.start(["sleep", "0.05"])
+        second = await checksum_service.start(["true"])
+
+        assert checksum_service.status(second) == arteria_state.PENDING
+        await asyncio.wait_for(checksum_service._monitor, 5)
+
+        checksum_service._get_job(second).wait()
+        assert checksum_service.status(first) == arteria_state.DONE
+        assert checksum_service.status(second) == arteria_state.DONE
+
+    @pytest.mark.asyncio
+    async def test_preempt(self):
+        """
+        Test low priority jobs are suspended for more urgent ones, and
+        resumed afterwards.
+        """
+        checksum_service = RunnerService(
+                10, max_running_jobs=1, preempt=True)
+        low = await checksum_service.start(["sleep", "10"], priority="low")
+        high = await checksum_service.start(["sleep", "10"], priority="high")
+
+        assert checksum_service.status(high) == arteria_state.STARTED
+        assert checksum_service.details(low) == {
+                "priority": "low", "queue_position": 1, "suspended": True,
+                "resources": None}
+
+        checksum_service.stop(high)
+
+        assert checksum_service.status(low) == arteria_state.STARTED
+        assert not checksum_service.details(low)["suspended"]
+        checksum_service.stop_all()
+
+    @pytest.mark.asyncio
+    async def test_cancel_suspended(self):
+        """
+        Test suspended and pending jobs can be cancelled.
+        """
+        checksum_service = RunnerService(
+                10, max_running_jobs=1, preempt=True)
+        low = await checksum_service.start(["sleep", "10"], priority="low")
+        high = await checksum_service.start(["sleep", "10"], priority="high")
+        pending = await checksum_service.start(["sleep", "10"])
+
+        checksum_service.stop_all()
+
+        for job_id in (low, high, pending):
+            assert checksum_service.status(job_id) == arteria_state.CANCELLED
+
+    @pytest.mark.asyncio
+    async def test_unknown_priority(self):
+        checksum_service = RunnerService(10)
+        with pytest.raises(ValueError):
+            await checksum_service.start(["true"], priority="whenever")
+
+
+class TestMemoryBudget:
+    @pytest.mark.asyncio
+    async def test_dispatch_within_budget(self):
+        """
+        Test jobs wait until their memory fits in the budget, and that the
+        usage is reported.
+        """
+        checksum_service = RunnerService(10, memory_budget=100)
+        first = await checksum_service.start(["sleep", "10"], memory=60)
+        second = await checksum_service.start(["true"], memory=60)
+
+        assert checksum_service.status(first) == arteria_state.STARTED
+        assert checksum_service.status(second) == arteria_state.PENDING
+        assert checksum_service.details(first)["memory_lease"] == 60
+        assert checksum_service.metrics()["memory"] == {
+                "budget": 100, "in_use": 60, "leases": 1}
+
+        checksum_service.stop(first)
+
+        assert checksum_service.status(second) != arteria_state.PENDING
+        checksum_service._get_job(second).wait()
+        metrics = checksum_service.metrics()
+        assert metrics["jobs"] == {
+                arteria_state.CANCELLED: 1, arteria_state.DONE: 1}
+        assert metrics["memory"] == {
+                "budget": 100, "in_use": 0, "leases": 0}
+
+    @pytest.mark.asyncio
+    async def test_preempt_within_budget(self):
+        """
+        Test urgent jobs preempt others only if they fit in the memory left
+        by the suspended jobs, which keep their lease.
+        """
+        checksum_service = RunnerService(
+                10, max_running_jobs=1, preempt=True, memory_budget=100)
+        low = await checksum_service.start(
+                ["sleep", "10"], priority="low", memory=60)
+        large = await checksum_service.start(
+                ["sleep", "10"], priority="high", memory=60)
+
+        assert checksum_service.status(large) == arteria_state.PENDING
+        assert not checksum_service.details(low)["suspended"]
+
+        small = await checksum_service.start(
+                ["sleep", "10"], priority="high", memory=40)
+
+        # The first urgent job does not fit, and the ones behind it wait.
+        assert checksum_service.status(small) == arteria_state.PENDING
+        checksum_service.stop(large)
+
+        assert checksum_service.status(small) == arteria_state.STARTED
+        assert checksum_service.details(low)["suspended"]
+        assert checksum_service.metrics()["memory"]["in_use"] == 100
+        checksum_service.stop_all()
+
+    @pytest.mark.asyncio
+    async def test_job_larger_than_budget(self):
+        checksum_service = RunnerService(10, memory_budget=100)
+        with pytest.raises(ValueError):
+            await checksum_service.start(["true"], memory=101)
+
+    @pytest.mark.asyncio
+    async def test_metrics_without_budget(self):
+        checksum_service = RunnerService(10)
+        job_id = await checksum_service.start(["true"])
+        checksum_service._get_job(job_id).wait()
+
+        metrics = checksum_service.metrics()
+        assert metrics["jobs"] == {arteria_state.DONE: 1}
+        assert metrics["memory"] is None
+
+
+
+class TestListJobs:
+    @pytest.mark.asyncio
+    async def test_filters(self):
+        """
+        Test jobs are listed by state and tag, newest first.
+        """
+        checksum_service = RunnerService(10, max_running_jobs=1)
+        done = await checksum_service.start(["true"], tags={"runfolder": "a"})
+        checksum_service._get_job(done).wait()
+        running = await checksum_service.start(
+                ["sleep", "10"], tags={"runfolder": "b"})
+        pending = await checksum_service.start(
+                ["true"], tags={"runfolder": "a"})
+
+        def listed(**kwargs):
+            jobs, _ = checksum_service.list_jobs(**kwargs)
+            return [job["job_id"] for job in jobs]
+
+        try:
+            assert listed() == [pending, running, done]
+            assert listed(states=[arteria_state.DONE]) == [done]
+            assert listed(
+                    states=[arteria_state.PENDING, arteria_state.STARTED]) == [
+                    pending, running]
+            assert listed(tags={"runfolder": "a"}) == [pending, done]
+            assert listed(
+                    states=[arteria_state.DONE], tags={"runfolder": "b"}) == []
+            assert listed(tags={"runfolder": "c"}) == []
+
+            jobs, _ = checksum_service.list_jobs(states=[arteria_state.PENDING])
+            assert jobs[0]["runfolder"] == "a"
+            assert jobs[0]["queue_position"] == 1
+            assert jobs[0]["finished_at"] is None
+        finally:
+            await checksum_service.async_stop_all()
+
+        assert listed(states=[arteria_state.CANCELLED]) == [pending, running]
+
+    @pytest.mark.asyncio
+    async def test_time_range(self):
+        checksum_service = RunnerService(10)
+        first = await checksum_service.start(["true"])
+        second = await checksum_service.start(["true"])
+        created_at = checksum_service._get_job(second).created_at
+
+        jobs, _ = checksum_service.list_jobs(since=created_at)
+        assert [job["job_id"] for job in jobs] == [second]
+        jobs, _ = checksum_service.list_jobs(until=created_at)
+        assert [job["job_id"] for job in jobs] == [first]
+
+    @pytest.mark.asyncio
+    async def test_pagination(self):
+        checksum_service = RunnerService(10)
+        for _ in range(5):
+            await checksum_service.start(["true"])
+
+        pages = []
+        cursor = None
+        while True:
+            jobs, cursor = checksum_service.list_jobs(cursor=cursor, limit=2)
+            pages.append([job["job_id"] for job in jobs])
+            if cursor is None:
+                break
+        assert pages == [[5, 4], [3, 2], [1]]
+
+    @pytest.mark.asyncio
+    async def test_index_follows_history(self):
+        """
+        Test jobs dropped from the history are dropped from the index.
+        """
+        checksum_service = RunnerService(2)
+        for runfolder in ("a", "b", "c"):
+            job_id = await checksum_service.start(
+                    ["true"], tags={"runfolder": runfolder})
+            checksum_service._get_job(job_id).wait()
+
+        jobs, _ = checksum_service.list_jobs()
+        assert [job["job_id"] for job in jobs] == [3, 2]
+        jobs, _ = checksum_service.list_jobs(tags={"runfolder": "a"})
+        assert jobs == []
+        assert checksum_service.status(1) == arteria_state.NONE
+        assert checksum_service.metrics()["jobs"] == {arteria_state.DONE: 2}
+
+
+class TestGroups:
+    @pytest.mark.asyncio
+    async def test_submit_group(self):
+        """
+        Test the jobs of a group are dispatched in order, and the group is
+        followed and stopped as a whole.
+        """
+        checksum_service = RunnerService(10, max_running_jobs=1)
+        group_id, submitted = await checksum_service.submit_group(
+                [
+                    (["sleep", "10"], {"tags": {"runfolder": "a"}}),
+                    (["sleep", "10"], {"tags": {"runfolder": "b"}}),
+                ],
+                tags={"origin": "batch"})
+        (first, first_created), (second, _) = submitted
+        assert first_created
+
+        try:
+            status = checksum_service.group_status(group_id)
+            assert status["state"] == arteria_state.STARTED
+            assert status["counts"] == {
+                    arteria_state.STARTED: 1, arteria_state.PENDING: 1}
+            assert [job["job_id"] for job in status["jobs"]] == [
+                    first, second]
+            assert status["jobs"][1]["runfolder"] == "b"
+            assert status["jobs"][1]["group"] == group_id
+            assert status["jobs"][1]["origin"] == "batch"
+            jobs, _ = checksum_service.list_jobs(tags={"group": group_id})
+            assert len(jobs) == 2
+        finally:
+            await checksum_service.async_stop_group(group_id)
+
+        status = checksum_service.group_status(group_id)
+        assert status["state"] == arteria_state.CANCELLED
+        assert status["counts"] == {arteria_state.CANCELLED: 2}
+        assert checksum_service.group_status(group_id + 1) is None
+
+    @pytest.mark.asyncio
+    async def test_group_done(self):
+        checksum_service = RunnerService(10)
+        group_id, submitted = await checksum_service.submit_group(
+                [(["true"], {}), (["true"], {})])
+        for job_id, _ in submitted:
+            checksum_service._get_job(job_id).wait()
+        assert checksum_service.group_status(group_id)["state"] == \
+            arteria_state.DONE
+
+        group_id, submitted = await checksum_service.submit_group(
+                [(["true"], {}), (["false"], {})])
+        for job_id, _ in submitted:
+            checksum_service._get_job(job_id).wait()
+        assert checksum_service.group_status(group_id)["state"] == \
+            arteria_state.ERROR
+
+    @pytest.mark.asyncio
+    async def test_group_all_or_none(self):
+        """
+        Test no job of a group is submitted if one of them cannot be.
+        """
+        checksum_service = RunnerService(2)
+        with pytest.raises(ValueError):
+            await checksum_service.submit_group(
+                    [(["true"], {}), (["true"], {"priority": "whenever"})])
+        with pytest.raises(RuntimeError):
+            await checksum_service.submit_group(
+                    [(["sleep", "10"], {}) for _ in range(3)])
+        assert checksum_service.status_all() == {}
+
+    @pytest.mark.asyncio
+    async def test_group_coalesced(self):
+        """
+        Test jobs coalesced with a job in flight are part of the group.
+        """
+        checksum_service = RunnerService(10)
+        job_id, _ = await checksum_service.submit(["sleep", "10"], key="a")
+        try:
+            group_id, submitted = await checksum_service.submit_group(
+                    [(["sleep", "10"], {"key": "a"}), (["true"], {})])
+            assert submitted[0] == (job_id, False)
+            assert submitted[1][1]
+            status = checksum_service.group_status(group_id)
+            assert [job["job_id"] for job in status["jobs"]] == [
+                    job_id, submitted[1][0]]
+        finally:
+            await checksum_service.async_stop_all()
+
+    @pytest.mark.asyncio
+    async def test_group_forgotten(self):
+        """
+        Test groups are forgotten once all their jobs left the history.
+        """
+        checksum_service = RunnerService(2)
+        group_id, submitted = await checksum_service.submit_group(
+                [(["true"], {})])
+        checksum_service._get_job(submitted[0][0]).wait()
+        checksum_service._get_job(
+                await checksum_service.start(["true"])).wait()
+        assert len(checksum_service.group_status(group_id)["jobs"]) == 1
+
+        await checksum_service.submit_group([(["true"], {}), (["true"], {})])
+        assert checksum_service.group_status(group_id) is None
+
+
+class TestCoalescing:
+    @pytest.mark.asyncio
+    async def test_submit_same_key(self):
+        """
+        Test a request identical to a job in flight joins it, and raises its
+        priority if needed.
+        """
+        checksum_service = RunnerService(10, max_running_jobs=1)
+        await checksum_service.start(["sleep", "10"])
+        job_id, created = await checksum_service.submit(
+                ["true"], key="a", priority="low")
+        other_id, other_created = await checksum_service.submit(
+                ["true"], key="b")
+        same_id, same_created = await checksum_service.submit(
+                ["true"], key="a", priority="high")
+
+        assert created and other_created and not same_created
+        assert same_id == job_id
+        assert other_id != job_id
+        assert checksum_service.details(job_id)["priority"] == "high"
+        checksum_service.stop_all()
+
+    @pytest.mark.asyncio
+    async def test_raised_job_not_preempted(self):
+        """
+        Test a running job whose priority was raised by a coalesced request
+        is not preempted by jobs of lower priority than the new one.
+        """
+        checksum_service = RunnerService(
+                10, max_running_jobs=1, preempt=True)
+        job_id, _ = await checksum_service.submit(
+                ["sleep", "10"], key="a", priority="low")
+        await checksum_service.submit(
+                ["sleep", "10"], key="a", priority="high")
+        normal = await checksum_service.start(["sleep", "10"])
+
+        assert checksum_service.status(normal) == arteria_state.PENDING
+        assert not checksum_service.details(job_id)["suspended"]
+        checksum_service.stop_all()
+
+    @pytest.mark.asyncio
+    async def test_submit_same_key_done(self):
+        """
+        Test a request identical to a finished job starts a new job.
+        """
+        checksum_service = RunnerService(10)
+        job_id, _ = await checksum_service.submit(["true"], key="a")
+        checksum_service._get_job(job_id).wait()
+
+        new_id, created = await checksum_service.submit(["true"], key="a")
+
+        assert created
+        assert new_id != job_id
+
+    @pytest.mark.asyncio
+    async def test_submit_no_key(self):
+        checksum_service = RunnerService(10)
+        ids = [
+                (await checksum_service.submit(["sleep", "10"]))[0]
+                for _ in range(2)]
+
+        assert ids[0] != ids[1]
+        checksum_service.stop_all()
+
+
+class TestWaitForChange:
+    @pytest.mark.asyncio
+    async def test_wait_for_change(self):
+        """
+        Test waiting clients are woken up when the job finishes.
+        """
+        checksum_service = RunnerService(10, poll_interval=0.01)
+        job_id = await checksum_service.start(["sleep", "0.1"])
+        version = checksum_service.version(job_id)
+
+        assert await checksum_service.wait_for_change(job_id, version, 5)
+        assert checksum_service.status(job_id) == arteria_state.DONE
+        assert checksum_service.version(job_id) != version
+        assert not checksum_service._watchers
+
+    @pytest.mark.asyncio
+    async def test_wait_for_change_timeout(self):
+        checksum_service = RunnerService(10, poll_interval=0.01)
+        job_id = await checksum_service.start(["sleep", "10"])
+        version = checksum_service.version(job_id)
+
+        assert not await checksum_service.wait_for_change(
+                job_id, version, 0.05)
+        checksum_service.stop_all()
+
+    @pytest.mark.asyncio
+    async def test_wait_for_change_outdated(self):
+        checksum_service = RunnerService(10)
+        job_id = await checksum_service.start(["sleep", "10"])
+
+        assert await checksum_service.wait_for_change(job_id, -1, 5)
+        assert checksum_service.version(10000) is None
+        checksum_service.stop_all()
+
+
+class TestDoneCallbacks:
+    @pytest.mark.asyncio
+    async def test_callback_on_finish(self):
+        """
+        Test callbacks are run once the job finishes, without anyone asking
+        for its status.
+        """
+        checksum_service = RunnerService(10, poll_interval=0.01)
+        finished = asyncio.get_running_loop().create_future()
+        job_id, _ = await checksum_service.submit(
+                ["sleep", "0.1"], on_finished=finished.set_result)
+
+        job = await asyncio.wait_for(finished, 5)
+        assert job.job_id == job_id
+        assert job.get_status() == arteria_state.DONE
+        assert job.returncode == 0
+
+    @pytest.mark.asyncio
+    async def test_callback_on_cancel_and_coalesce(self):
+        checksum_service = RunnerService(10)
+        finished = []
+        for _ in range(2):
+            job_id, _ = await checksum_service.submit(
+                    ["sleep", "10"],
+                    key="key",
+                    on_finished=lambda job: finished.append(job.job_id))
+
+        checksum_service.stop(job_id)
+        assert finished == [job_id, job_id]
+
+        # Callbacks added to finished jobs are run right away.
+        checksum_service._get_job(job_id).add_done_callback(
+                lambda job: finished.append(job.get_status()))
+        assert finished[-1] == arteria_state.CANCELLED
+
+    @pytest.mark.asyncio
+    async def test_finished_callback(self):
+        """
+        Test the service-wide callback is run for every job, including the
+        jobs of groups.
+        """
+        finished = asyncio.Queue()
+        checksum_service = RunnerService(
+                10, poll_interval=0.01,
+                finished_callback=lambda job: finished.put_nowait(job.job_id))
+        job_id, _ = await checksum_service.submit(["true"])
+        _, jobs = await checksum_service.submit_group([(["true"], {})])
+
+        assert {
+            await asyncio.wait_for(finished.get(), 5) for _ in range(2)
+            } == {job_id, jobs[0][0]}
+
+
+class TestResourceAccounting:
+    @pytest.mark.asyncio
+    async def test_usage(self):
+        """
+        Test the resources used by finished jobs are returned with their
+        status, and added to the service-wide totals.
+        """
+        checksum_service = RunnerService(10)
+        job_id = await checksum_service.start(
+                [sys.executable, "-c", "sum(range(10 ** 6))"])
+        checksum_service._get_job(job_id).wait()
+
+        usage = checksum_service.details(job_id)["resources"]
+        assert usage["user_seconds"] > 0
+        assert usage["peak_rss"] > 0
+        assert usage["wall_seconds"] > 0
+        totals = checksum_service.metrics()["resources"]
+        assert totals["n_jobs"] == 1
+        assert totals["user_seconds"] == usage["user_seconds"]
+        assert totals["peak_rss"] == usage["peak_rss"]
+
+    def test_usage_of_cancelled_job(self):
+        job = Job(1, ["sleep", "10"])
+        usages = []
+        job.usage_listener = usages.append
+
+        job.cancel()
+
+        assert usages == [job.usage]
+        assert job.usage.wall_seconds > 0
+
+    @pytest.mark.asyncio
+    async def test_running(self):
+        checksum_service = RunnerService(10)
+        job_id = await checksum_service.start(["sleep", "10"])
+        assert checksum_service.details(job_id)["resources"] is None
+        assert checksum_service.metrics()["resources"]["n_jobs"] == 0
+        checksum_service.stop_all()
+
+
+class TestNonBlocking:
+    @pytest.mark.asyncio
+    async def test_async_stop(self):
+        checksum_service = RunnerService(10)
+        first = await checksum_service.start(["sleep", "10"])
+        second = await checksum_service.start(["sleep", "10"])
+
+        await checksum_service.async_stop(first)
+        assert checksum_service.status(first) == arteria_state.CANCELLED
+        assert checksum_service.status(second) == arteria_state.STARTED
+
+        await checksum_service.async_stop_all()
+        assert checksum_service.status(second) == arteria_state.CANCELLED
+
+    @pytest.mark.asyncio
+    async def test_cancel_while_spawning(self):
+        """
+        Test a job cancelled before its process is created is terminated
+        once the process exists.
+        """
+        job = Job(1, ["sleep", "10"], queued=True)
+        started = job.start_in_executor()
+        assert job.get_status() == arteria_state.STARTED
+
+        assert job.cancel() == arteria_state.CANCELLED
+        await started
+        job.wait()
+        assert job._proc.returncode == -signal.SIGTERM
+        assert job.get_status() == arteria_state.CANCELLED
+
+    @pytest.mark.asyncio
+    async def test_start_in_executor_error(self):
+        job = Job(1, ["non_existent_command"], queued=True)
+        with pytest.raises(FileNotFoundError):
+            await job.start_in_executor()
+        assert job.get_status() == arteria_state.ERROR
@@ -0,0 +1,187 @@
+import hashlib
+import os
+import tempfile
+
+import pytest
+
+from arteria.web.state import State
+
+from checksum.checksum_cache import ChecksumCache
+from checksum.runner_service import RunnerService
+from checksum.scrub import ScrubScheduler, SCRUB_TAGS
+from checksum.verifier import parse_manifest
+
+
+@pytest.fixture
+def monitored_dir(request):
+    """
+    Monitored directory with an "archive" root holding two runfolders of
+    two files each, listed in md5sum files in the algorithm of the test's
+    parameter, md5 if it has none.
+    """
+    algorithm = getattr(request, "param", "md5")
+    with tempfile.TemporaryDirectory() as monitored_dir:
+        for runfolder in ("rf1", "rf2"):
+            path = os.path.join(monitored_dir, "archive", runfolder)
+            os.makedirs(path)
+            lines = []
+            for name, size in (("small", 10), ("large", 100)):
+                content = os.urandom(size)
+                with open(os.path.join(path, name), "wb") as f:
+                    f.write(content)
+                lines.append(
+                    f"{hashlib.new(algorithm, content).hexdigest()}  "
+                    f"archive/{runfolder}/{name}\n")
+            with open(os.path.join(path, "md5_checksums"), "w") as f:
+                f.writelines(lines)
+        yield monitored_dir
+
+
+def scheduler(monitored_dir, runner_service=None, **kwargs):
+    return ScrubScheduler(
+            runner_service or RunnerService(),
+            monitored_dir,
+            ["archive"],
+            os.path.join(monitored_dir, "cache.db"),
+            monitored_dir,
+            **kwargs)
+
+
+def finish(runner_service, job_id):
+    runner_service._get_job(job_id).wait()
+    runner_service.status(job_id)
+
+
+class TestPlanSlice:
+    def test_least_recently_verified_first(self, monitored_dir):
+        scrub = scheduler(monitored_dir, bytes_per_day=1000)
+        abspath = os.path.abspath(monitored_dir)
+        with ChecksumCache(os.path.join(monitored_dir, "cache.db")) as cache:
+            cache.record(
+                f"{abspath}/archive/rf1/large", "", 0, 0, "OK", verified_at=2)
+            cache.record(
+                f"{abspath}/archive/rf1/small", "", 0, 0, "OK", verified_at=1)
+            cache.record(
+                f"{abspath}/archive/rf2/small", "", 0, 0, "OK", verified_at=3)
+
+        manifest = os.path.join(monitored_dir, "slice.md5")
+        assert scrub._plan_slice(120, manifest) == (2, 110)
+        entries, _ = parse_manifest(manifest)
+        assert [entry.path for entry in entries] == [
+                "archive/rf2/large", "archive/rf1/small"]
+
+    def test_at_least_one_file(self, monitored_dir):
+        scrub = scheduler(monitored_dir, bytes_per_day=1000)
+        manifest = os.path.join(monitored_dir, "slice.md5")
+        assert scrub._plan_slice(1, manifest) == (1, 100)
+
+    def test_nothing_to_scrub(self, monitored_dir):
+        scrub = scheduler(
+                monitored_dir, bytes_per_day=1000, manifest_pattern="none")
+        assert scrub._plan_slice(
+                1000, os.path.join(monitored_dir, "slice.md5")) is None
+
+
+class TestScrubScheduler:
+    @pytest.mark.asyncio
+    async def test_scrub(self, monitored_dir):
+        """
+        Test slices are run as low priority jobs, and drift is reported.
+        """
+        runner_service = RunnerService()
+        scrub = scheduler(
+                monitored_dir, runner_service,
+                bytes_per_day=1000 * 86400, slice_seconds=1)
+
+        await scrub.tick()
+        job_id = scrub.status()["current"]["job_id"]
+        assert scrub.status()["state"] == "running"
+        jobs, _ = runner_service.list_jobs()
+        assert jobs[0]["origin"] == SCRUB_TAGS["origin"]
+        assert jobs[0]["priority"] == "low"
+        finish(runner_service, job_id)
+
+        await scrub.tick()
+        status = scrub.status()
+        assert status["slices"][0]["state"] == State.DONE
+        assert status["slices"][0]["files"] == 4
+        assert status["slices"][0]["failed"] == 0
+        assert status["drift"]["n_files"] == 0
+
+        # Rot a file, keeping its size and modification time.
+        path = os.path.join(monitored_dir, "archive", "rf1", "small")
+        stat = os.stat(path)
+        with open(path, "r+b") as f:
+            f.write(b"rotten")
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+        # Make the next slice due.
+        scrub._allowance = 1000
+        await scrub.tick()
+        finish(runner_service, scrub.status()["current"]["job_id"])
+        await scrub.tick()
+        status = scrub.status()
+        assert status["slices"][0]["failed"] == 1
+        assert status["drift"]["n_files"] == 1
+        assert status["drift"]["files"][0]["path"] == "archive/rf1/small"
+        assert not status["drift"]["files"][0]["modified"]
+        await scrub.stop()
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("monitored_dir", ["sha256"], indirect=True)
+    async def test_algorithm(self, monitored_dir):
+        """
+        Test slices are verified in the algorithm of the md5sum files.
+        """
+        runner_service = RunnerService()
+        scrub = scheduler(
+                monitored_dir, runner_service,
+                bytes_per_day=1000 * 86400, slice_seconds=1,
+                algorithm="sha256")
+
+        await scrub.tick()
+        finish(runner_service, scrub.status()["current"]["job_id"])
+        await scrub.tick()
+        status = scrub.status()
+        assert status["slices"][0]["files"] == 4
+        assert status["slices"][0]["failed"] == 0
+        assert status["drift"]["n_files"] == 0
+        await scrub.stop()
+
+    @pytest.mark.asyncio
+    async def test_pause(self, monitored_dir):
+        """
+        Test scrubbing pauses while other jobs run.
+        """
+        runner_service = RunnerService()
+        scrub = scheduler(
+                monitored_dir, runner_service, bytes_per_day=1000)
+        scrub._plan_slice = lambda budget, manifest_path: (1, 100)
+        allowance = scrub._allowance
+
+        # Stand-in for a long slice.
+        async def start_slice():
+            job_id, _ = await runner_service.submit(
+                    ["sleep", "10"], tags=SCRUB_TAGS)
+            scrub._slice = {
+                "job_id": job_id, "bytes": 100, "md5sum_file": "slice"}
+            scrub._allowance -= 100
+        scrub._start_slice = start_slice
+
+        await scrub.tick()
+        slice_id = scrub.status()["current"]["job_id"]
+
+        user_job = await runner_service.start(["sleep", "10"])
+        await scrub.tick()
+        status = scrub.status()
+        assert status["state"] == "paused"
+        assert status["current"] is None
+        assert status["slices"][0]["state"] == State.CANCELLED
+        assert runner_service.status(slice_id) == State.CANCELLED
+        # The bytes of the stopped slice are due again.
+        assert status["allowance"] >= int(allowance)
+
+        await runner_service.async_stop(user_job)
+        await scrub.tick()
+        assert scrub.status()["state"] == "running"
+        await scrub.stop()
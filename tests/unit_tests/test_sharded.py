@@ -0,0 +1,148 @@
+import hashlib
+import io
+import json
+import os
+import tempfile
+
+import pytest
+
+from checksum import sharded
+from checksum.verifier import ManifestEntry, ManifestResults
+
+
+@pytest.fixture
+def folder():
+    with tempfile.TemporaryDirectory() as folder:
+        cwd = os.getcwd()
+        os.chdir(folder)
+        try:
+            yield folder
+        finally:
+            os.chdir(cwd)
+
+
+def write_files(sizes):
+    entries = []
+    for i, size in enumerate(sizes):
+        content = os.urandom(size)
+        name = f"file_{i}"
+        with open(name, "wb") as f:
+            f.write(content)
+        entries.append(ManifestEntry(hashlib.md5(content).hexdigest(), name))
+    return entries
+
+
+class TestPlanShards:
+    def test_balanced(self):
+        sizes = [10, 60, 20, 50, 30, 40]
+        shards = sharded.plan_shards(sizes, 3)
+        assert [sum(sizes[i] for i in shard) for shard in shards] == [
+                70, 70, 70]
+        assert sorted(i for shard in shards for i in shard) == list(range(6))
+        assert all(shard == sorted(shard) for shard in shards)
+
+    def test_fewer_files_than_shards(self):
+        assert sharded.plan_shards([1, 2], 4) == [[1], [0]]
+        assert sharded.plan_shards([], 4) == []
+
+
+class TestCheck:
+    def test_check(self, folder):
+        """
+        Test files are checked in shards, and the outputs of the checkers
+        merged into one summary.
+        """
+        entries = write_files([1000, 2000, 3000, 10, 0])
+        entries.append(ManifestEntry("0" * 32, "file_0"))
+        entries.append(ManifestEntry(entries[1].digest, "missing"))
+        # Listed twice, checked once.
+        entries.append(entries[2])
+        results = ManifestResults(["a", "b"])
+        out = io.StringIO()
+        err = io.StringIO()
+
+        return_code, shards = sharded.check(
+                entries, n_shards=3, out=out, err=err, n_improper=1,
+                manifests=["a"] * 7 + ["b"], results=results)
+
+        assert return_code == 1
+        assert len(shards) == 3
+        assert sum(shard["files"] for shard in shards) == 7
+        assert sum(shard["bytes"] for shard in shards) == 7010
+        lines = out.getvalue().splitlines()
+        assert sorted(lines) == [
+                "file_0: FAILED", "file_0: OK", "file_1: OK", "file_2: OK",
+                "file_3: OK", "file_4: OK", "missing: FAILED open or read"]
+        assert err.getvalue().splitlines()[-3:] == [
+                "md5sum: WARNING: 1 line is improperly formatted",
+                "md5sum: WARNING: 1 listed file could not be read",
+                "md5sum: WARNING: 1 computed checksum did NOT match"]
+        report = results.to_dict()
+        assert report["a"]["ok"] == 5
+        assert report["a"]["failed"] == 1
+        assert report["a"]["unreadable"] == 1
+        assert report["b"]["ok"] == 1
+
+    def test_check_ok(self, folder):
+        entries = write_files([10, 20, 30])
+        out = io.StringIO()
+        err = io.StringIO()
+        return_code, shards = sharded.check(
+                entries, n_shards=2, out=out, err=err)
+        assert return_code == 0
+        assert len(out.getvalue().splitlines()) == 3
+        assert err.getvalue() == ""
+
+    def test_escaped_path(self, folder):
+        entries = write_files([10])
+        os.rename("file_0", "back\\slash")
+        entries = [ManifestEntry(entries[0].digest, "back\\slash")]
+        results = ManifestResults(["a"])
+        return_code, _ = sharded.check(
+                entries, n_shards=2, out=io.StringIO(), err=io.StringIO(),
+                manifests=["a"], results=results)
+        assert return_code == 0
+        assert results.to_dict()["a"]["ok"] == 1
+
+    def test_no_entries(self, folder):
+        err = io.StringIO()
+        assert sharded.check([], err=err) == (1, [])
+        assert "no properly formatted" in err.getvalue()
+
+
+class TestMain:
+    def test_main(self, folder, capsys):
+        entries = write_files([100, 200])
+        with open("manifest", "w") as f:
+            for entry in entries:
+                f.write(f"{entry.digest}  {entry.path}\n")
+
+        assert sharded.main([
+            "--shards", "2", "--report", "report.json", "manifest"]) == 0
+        with open("report.json") as f:
+            report = json.load(f)
+        assert report["manifests"]["manifest"]["ok"] == 2
+        assert len(report["shards"]) == 2
+
+        assert sharded.main(["--shards", "2", "missing_manifest"]) == 1
+        assert sharded.main(["--tool", "no-such-checker", "manifest"]) == 1
+        assert "no-such-checker" in capsys.readouterr().err
+
+    def test_main_non_utf8_path(self, folder, capsysbinary):
+        """
+        Test files whose name is not valid UTF-8 are handed to the checkers
+        and reported as they were listed.
+        """
+        entries = write_files([100, 200])
+        name = b"f\xe9"
+        os.rename("file_0", name)
+        with open("manifest", "wb") as f:
+            f.write(entries[0].digest.encode() + b"  " + name + b"\n")
+            f.write(f"{entries[1].digest}  {entries[1].path}\n".encode())
+
+        assert sharded.main([
+            "--shards", "2", "--report", "report.json", "manifest"]) == 0
+        assert sorted(capsysbinary.readouterr().out.splitlines()) == [
+                b"file_1: OK", b"f\xe9: OK"]
+        with open("report.json") as f:
+            assert json.load(f)["manifests"]["manifest"]["ok"] == 2
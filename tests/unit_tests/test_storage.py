@@ -0,0 +1,117 @@
+import gzip
+import hashlib
+import os
+import socket
+import tempfile
+
+import pytest
+
+from checksum.decompress import Inflater
+from checksum.storage import HTTPStorage, http_buffer_memory
+from tests.test_utils import ObjectStore
+
+
+@pytest.fixture
+def root():
+    with tempfile.TemporaryDirectory() as root:
+        os.makedirs(os.path.join(root, "rf", "data"))
+        yield root
+
+
+def write_object(root, name, content):
+    with open(os.path.join(root, name), "wb") as f:
+        f.write(content)
+    return hashlib.md5(content).hexdigest()
+
+
+def gets(store):
+    return [headers for method, _, headers in store.requests
+            if method == "GET"]
+
+
+class TestHTTPStorage:
+    def test_invalid_url(self):
+        with pytest.raises(ValueError):
+            HTTPStorage("ftp://host/bucket")
+
+    def test_stat(self, root):
+        write_object(root, "rf/data/a b", b"0" * 10)
+        os.utime(os.path.join(root, "rf/data/a b"), (0, 86400))
+        with ObjectStore(root) as store, HTTPStorage(store.url) as storage:
+            st = storage.stat("rf/data/a b")
+            assert (st.st_size, st.st_mtime) == (10, 86400)
+            with pytest.raises(FileNotFoundError):
+                storage.stat("rf/missing")
+            assert storage.location("./rf/data/a b") == \
+                f"{store.url}/rf/data/a b"
+
+    def test_small_object(self, root):
+        """
+        Test objects fitting in one range are fetched with a single GET.
+        """
+        digest = write_object(root, "rf/small", os.urandom(1000))
+        with ObjectStore(root) as store, \
+                HTTPStorage(store.url, range_size=1000) as storage:
+            assert storage.hash_file("rf/small") == digest
+        assert [h["Range"] for h in gets(store)] == ["bytes=0-999"]
+
+    def test_ranges(self, root):
+        """
+        Test large objects are fetched in concurrent ranges, and hashed in
+        order.
+        """
+        digest = write_object(root, "rf/large", os.urandom(10 * 1000 + 3))
+        with ObjectStore(root) as store, HTTPStorage(
+                store.url, connections=3, range_size=1000) as storage:
+            assert storage.hash_file("rf/large") == digest
+            assert len(storage._pool._idle) <= 3
+        assert sorted(h["Range"] for h in gets(store)) == sorted(
+            [f"bytes={i}-{i + 999}" for i in range(0, 10000, 1000)]
+            + ["bytes=10000-10002"])
+
+    def test_ranges_ignored(self, root):
+        """
+        Test objects are hashed whole from servers ignoring ranges.
+        """
+        digest = write_object(root, "rf/large", os.urandom(10 * 1000))
+        with ObjectStore(root, ranges=False) as store, \
+                HTTPStorage(store.url, range_size=1000) as storage:
+            assert storage.hash_file("rf/large", buf=bytearray(300)) == digest
+        assert len(gets(store)) == 1
+
+    def test_empty_object(self, root):
+        digest = write_object(root, "rf/empty", b"")
+        with ObjectStore(root) as store, HTTPStorage(store.url) as storage:
+            assert storage.hash_file("rf/empty") == digest
+
+    def test_missing_object(self, root):
+        with ObjectStore(root) as store, HTTPStorage(store.url) as storage:
+            with pytest.raises(FileNotFoundError):
+                storage.hash_file("rf/missing")
+
+    def test_decompress(self, root):
+        content = os.urandom(5000)
+        write_object(root, "rf/data.gz", gzip.compress(content))
+        inflater = Inflater(2)
+        try:
+            with ObjectStore(root) as store, \
+                    HTTPStorage(store.url, range_size=1000) as storage:
+                assert storage.hash_file(
+                        "rf/data.gz", inflater=inflater) == \
+                    hashlib.md5(content).hexdigest()
+        finally:
+            inflater.close()
+
+    def test_broken_connection(self, root):
+        """
+        Test requests on connections closed while idle are sent again.
+        """
+        digest = write_object(root, "rf/small", os.urandom(10))
+        with ObjectStore(root) as store, \
+                HTTPStorage(store.url, connections=1) as storage:
+            assert storage.hash_file("rf/small") == digest
+            storage._pool._idle[0].sock.shutdown(socket.SHUT_RDWR)
+            assert storage.hash_file("rf/small") == digest
+
+    def test_buffer_memory(self):
+        assert http_buffer_memory(4, 1000) == 8000
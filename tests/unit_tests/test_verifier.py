@@ -0,0 +1,874 @@
+import errno
+import functools
+import gzip
+import hashlib
+import io
+import json
+import os
+import pstats
+import tempfile
+import threading
+
+import mock
+import pytest
+
+from checksum import verifier
+from checksum.checksum_cache import ChecksumCache
+from checksum.merkle import MerkleTree
+from checksum.profiling import Profile
+from checksum.storage import HTTPStorage
+from checksum.verifier import (
+        ManifestEntry, ManifestFormatError, READ_MODE_CACHED,
+        READ_MODE_UNCACHED)
+from checksum.walker import CompletenessReport
+from tests.test_utils import ObjectStore, bgzf_compress
+
+
+@pytest.fixture
+def folder():
+    with tempfile.TemporaryDirectory() as folder:
+        yield folder
+
+
+def write_file(folder, name, content):
+    path = os.path.join(folder, name)
+    with open(path, "wb") as f:
+        f.write(content)
+    return path
+
+
+class TestParseManifest:
+    def test_parse_line(self):
+        """
+        Test text and binary mode lines are parsed.
+        """
+        digest = "d41d8cd98f00b204e9800998ecf8427e"
+        assert verifier.parse_manifest_line(f"{digest}  a/b c") == \
+            ManifestEntry(digest, "a/b c")
+        assert verifier.parse_manifest_line(f"{digest} *a/b") == \
+            ManifestEntry(digest, "a/b")
+
+    def test_parse_escaped_line(self):
+        """
+        Test escaped file names are unescaped.
+        """
+        digest = "d41d8cd98f00b204e9800998ecf8427e"
+        assert verifier.parse_manifest_line(f"\\{digest}  a\\nb\\\\c") == \
+            ManifestEntry(digest, "a\nb\\c")
+
+    @pytest.mark.parametrize("path", ["a/b c", "a\nb\\c"])
+    def test_format_line(self, path):
+        """
+        Test formatted lines are parsed back to the same entry.
+        """
+        entry = ManifestEntry("d41d8cd98f00b204e9800998ecf8427e", path)
+        assert verifier.parse_manifest_line(
+                verifier.format_manifest_line(entry)) == entry
+
+    @pytest.mark.parametrize("line", [
+        "garbage",
+        "d41d8cd98f00b204e9800998ecf8427e",
+        "d41d8cd98f00b204e9800998ecf8427e -file",
+        "not_a_digest  file",
+        ])
+    def test_parse_improper_line(self, line):
+        """
+        Test improperly formatted lines are rejected.
+        """
+        with pytest.raises(ManifestFormatError):
+            verifier.parse_manifest_line(line)
+
+    def test_parse_manifest(self, folder):
+        """
+        Test improper lines are counted and empty lines ignored.
+        """
+        manifest = write_file(
+                folder, "manifest",
+                b"d41d8cd98f00b204e9800998ecf8427e  a\n\ngarbage\n")
+        entries, n_improper = verifier.parse_manifest(manifest)
+
+        assert entries == [
+                ManifestEntry("d41d8cd98f00b204e9800998ecf8427e", "a")]
+        assert n_improper == 1
+
+
+class TestHashFile:
+    @pytest.mark.parametrize("read_mode", verifier.READ_MODES)
+    @pytest.mark.parametrize("size", [0, 10, 4096, 3 * 4096 + 7])
+    def test_hash_file(self, folder, read_mode, size):
+        """
+        Test all read modes give the right digest, whatever the file size.
+        """
+        content = os.urandom(size)
+        path = write_file(folder, "file", content)
+
+        assert verifier.hash_file(
+                path, read_mode=read_mode, block_size=4096) == \
+            hashlib.md5(content).hexdigest()
+
+    def test_hash_file_without_direct_io(self, folder):
+        """
+        Test uncached reads fall back on fadvise when O_DIRECT is not
+        supported.
+        """
+        content = os.urandom(10000)
+        path = write_file(folder, "file", content)
+
+        with mock.patch(
+                "checksum.verifier._open_direct", return_value=None), \
+                mock.patch("os.posix_fadvise") as fadvise:
+            digest = verifier.hash_file(
+                    path, read_mode=READ_MODE_UNCACHED, block_size=4096)
+
+        assert digest == hashlib.md5(content).hexdigest()
+        assert fadvise.call_count == 3
+        assert fadvise.call_args[0][1:] == (
+                8192, 10000 - 8192, os.POSIX_FADV_DONTNEED)
+
+    def test_hash_file_direct_read_rejected(self, folder):
+        """
+        Test uncached reads start over without O_DIRECT when the reads are
+        rejected.
+        """
+        content = os.urandom(10000)
+        path = write_file(folder, "file", content)
+        hash_blocks = verifier._hash_blocks
+
+        def reject_direct_reads(fd, digest, buf, direct=False, **kwargs):
+            if direct:
+                raise OSError(errno.EINVAL, "Invalid argument")
+            return hash_blocks(fd, digest, buf, **kwargs)
+
+        with mock.patch(
+                "checksum.verifier._hash_blocks",
+                side_effect=reject_direct_reads):
+            digest = verifier.hash_file(path, read_mode=READ_MODE_UNCACHED)
+
+        assert digest == hashlib.md5(content).hexdigest()
+
+    def test_hash_file_unknown_read_mode(self, folder):
+        path = write_file(folder, "file", b"")
+
+        with pytest.raises(ValueError):
+            verifier.hash_file(path, read_mode="psychic")
+
+
+class TestVerify:
+    def test_verify(self, folder):
+        """
+        Test results are reported like `md5sum -c` does.
+        """
+        ok = write_file(folder, "ok", b"ok")
+        corrupt = write_file(folder, "corrupt", b"corrupt")
+        missing = os.path.join(folder, "missing")
+        entries = [
+                ManifestEntry(hashlib.md5(b"ok").hexdigest(), ok),
+                ManifestEntry(hashlib.md5(b"ok").hexdigest(), corrupt),
+                ManifestEntry(hashlib.md5(b"").hexdigest(), missing),
+                ]
+        out = io.StringIO()
+        err = io.StringIO()
+
+        assert verifier.verify(entries, out=out, err=err) == 1
+        assert out.getvalue().splitlines() == [
+                f"{ok}: OK",
+                f"{corrupt}: FAILED",
+                f"{missing}: FAILED open or read",
+                ]
+        assert err.getvalue().splitlines()[1:] == [
+                f"{verifier.PROG}: WARNING: 1 listed file could not be read",
+                f"{verifier.PROG}: WARNING: 1 computed checksum did NOT match",
+                ]
+
+    @pytest.mark.parametrize("read_mode", verifier.READ_MODES)
+    def test_main(self, folder, read_mode, capsys):
+        """
+        Test checking a manifest relative to the current directory.
+        """
+        write_file(folder, "file", b"content")
+        write_file(
+                folder, "manifest",
+                f"{hashlib.md5(b'content').hexdigest()}  file\n".encode())
+
+        cwd = os.getcwd()
+        os.chdir(folder)
+        try:
+            assert verifier.main(
+                    ["--read-mode", read_mode, "manifest"]) == 0
+        finally:
+            os.chdir(cwd)
+
+        assert capsys.readouterr().out == "file: OK\n"
+
+    def test_main_empty_manifest(self, folder, capsys):
+        manifest = write_file(folder, "manifest", b"garbage\n")
+
+        assert verifier.main([manifest]) == 1
+        assert "no properly formatted" in capsys.readouterr().err
+
+    def test_main_non_utf8_path(self, folder, capsysbinary):
+        """
+        Test files whose name is not valid UTF-8 are checked, and reported
+        by their name as listed, like `md5sum -c` does.
+        """
+        name = b"f\xe9"
+        with open(os.path.join(os.fsencode(folder), name), "wb") as f:
+            f.write(b"content")
+        write_file(
+                folder, "manifest",
+                hashlib.md5(b"content").hexdigest().encode() + b"  " + name
+                + b"\n")
+        cache = os.path.join(folder, "cache.db")
+
+        cwd = os.getcwd()
+        os.chdir(folder)
+        try:
+            assert verifier.main(
+                    ["--read-mode", "uncached", "--cache", cache,
+                     "manifest"]) == 0
+        finally:
+            os.chdir(cwd)
+
+        assert capsysbinary.readouterr().out == name + b": OK\n"
+        with ChecksumCache(cache) as checksum_cache:
+            assert checksum_cache.get(
+                    os.path.join(folder, os.fsdecode(name)))["result"] == "OK"
+
+    def test_main_default_read_mode(self):
+        assert verifier._parse_args(["m"]).read_mode == READ_MODE_CACHED
+
+
+class TestProfiling:
+    def test_verify_profile(self, folder):
+        """
+        Test every phase is timed when profiling.
+        """
+        content = os.urandom(10000)
+        path = write_file(folder, "file", content)
+        entries = [
+                ManifestEntry(hashlib.md5(content).hexdigest(), path),
+                ManifestEntry(hashlib.md5(b"").hexdigest(), path + "_"),
+                ]
+        profile = Profile()
+
+        verifier.verify(
+                entries, out=io.StringIO(), err=io.StringIO(),
+                block_size=4096, profile=profile)
+
+        phases = profile.to_dict()["phases"]
+        assert phases["stat"]["count"] == 2
+        assert phases["open"]["count"] == 2
+        assert phases["read"]["count"] == 4
+        assert phases["hash"]["count"] == 3
+        assert phases["write"]["count"] == 2
+        assert sorted(
+                (f["path"], f["bytes"])
+                for f in profile.to_dict()["slowest_files"]) == [
+                    (path, 10000), (path + "_", None)]
+
+    def test_main_report(self, folder):
+        """
+        Test the profile is written to the report, and cProfile statistics
+        are dumped.
+        """
+        path = write_file(folder, "file", b"content")
+        manifest = write_file(
+                folder, "manifest",
+                f"{hashlib.md5(b'content').hexdigest()}  {path}\n".encode())
+        report = os.path.join(folder, "report.json")
+        dump = os.path.join(folder, "dump.prof")
+
+        with mock.patch("sys.stdout", io.StringIO()):
+            assert verifier.main([
+                "--report", report, "--profile", "--cprofile", dump,
+                manifest]) == 0
+
+        with open(report) as f:
+            profile = json.load(f)["profile"]
+        assert profile["slowest_files"][0]["path"] == path
+        assert profile["slowest_files"][0]["bytes"] == len(b"content")
+        assert pstats.Stats(dump).total_calls > 0
+
+    def test_profile_requires_report(self):
+        with pytest.raises(SystemExit):
+            verifier._parse_args(["--profile", "m"])
+
+
+class TestDecompress:
+    @pytest.mark.parametrize("read_mode", verifier.READ_MODES)
+    def test_verify_decompressed(self, folder, read_mode):
+        """
+        Test gzip files are checked against their decompressed content, and
+        other files as they are.
+        """
+        content = b"@read\nACGT\n+\nIIII\n" * 1000
+        compressed = write_file(
+                folder, "reads.fastq.gz", gzip.compress(content))
+        bgzf = write_file(folder, "reads.bam", bgzf_compress(content))
+        plain = write_file(folder, "SampleSheet.csv", b"plain")
+        corrupt = write_file(
+                folder, "corrupt.gz", gzip.compress(content)[:-10])
+        entries = [
+                ManifestEntry(hashlib.md5(content).hexdigest(), compressed),
+                ManifestEntry(hashlib.md5(content).hexdigest(), bgzf),
+                ManifestEntry(hashlib.md5(b"plain").hexdigest(), plain),
+                ManifestEntry(hashlib.md5(content).hexdigest(), corrupt),
+                ]
+        out = io.StringIO()
+        err = io.StringIO()
+
+        assert verifier.verify(
+                entries, out=out, err=err, read_mode=read_mode,
+                decompress=True, inflate_threads=2) == 1
+        assert out.getvalue().splitlines() == [
+                f"{compressed}: OK",
+                f"{bgzf}: OK",
+                f"{plain}: OK",
+                f"{corrupt}: FAILED open or read",
+                ]
+        assert "truncated gzip data" in err.getvalue()
+
+        # Without decompression, the compressed files do not match.
+        assert verifier.verify(entries[:2], out=out, err=err) == 1
+
+    def test_main_decompress(self):
+        args = verifier._parse_args(
+                ["--decompress", "--inflate-threads", "3", "m"])
+        assert args.decompress
+        assert args.inflate_threads == 3
+        assert not verifier._parse_args(["m"]).decompress
+
+
+class TestSeveralManifests:
+    def test_files_read_once(self, folder):
+        """
+        Test files listed by several manifests are read once, and the
+        results of each manifest are recorded.
+        """
+        shared = write_file(folder, "shared", b"shared")
+        corrupt = write_file(folder, "corrupt", b"corrupt")
+        entries = [
+                ManifestEntry(hashlib.md5(b"shared").hexdigest(), shared),
+                ManifestEntry(hashlib.md5(b"shared").hexdigest(), corrupt),
+                ManifestEntry(
+                    hashlib.md5(b"shared").hexdigest(),
+                    os.path.join(folder, ".", "shared")),
+                ManifestEntry(hashlib.md5(b"shared").hexdigest(), corrupt),
+                ]
+        manifests = ["all", "all", "project", "project"]
+        results = verifier.ManifestResults(["all", "project"])
+        out = io.StringIO()
+
+        with mock.patch.object(
+                verifier, "hash_file", wraps=verifier.hash_file) as m:
+            assert verifier.verify(
+                    entries, out=out, err=io.StringIO(),
+                    manifests=manifests, results=results) == 1
+        assert m.call_count == 2
+        assert out.getvalue().splitlines() == [
+                f"{shared}: OK",
+                f"{corrupt}: FAILED",
+                f"{os.path.join(folder, '.', 'shared')}: OK",
+                f"{corrupt}: FAILED",
+                ]
+        assert results.to_dict() == {
+                manifest: {
+                    "ok": 1, "failed": 1, "unreadable": 0,
+                    "not_ok": [corrupt]}
+                for manifest in ("all", "project")}
+
+    def test_main(self, folder, capsys):
+        path = write_file(folder, "file", b"content")
+        line = f"{hashlib.md5(b'content').hexdigest()}  {path}\n".encode()
+        first = write_file(folder, "first", line)
+        second = write_file(folder, "second", line + b"0" * 32 + b"  x\n")
+        missing = os.path.join(folder, "missing")
+        report = os.path.join(folder, "report.json")
+
+        assert verifier.main(
+                ["--report", report, first, second, missing]) == 1
+
+        with open(report) as f:
+            manifests = json.load(f)["manifests"]
+        assert manifests[first] == {
+                "ok": 1, "failed": 0, "unreadable": 0, "not_ok": []}
+        assert manifests[second]["unreadable"] == 1
+        assert manifests[missing]["ok"] == 0
+        captured = capsys.readouterr()
+        assert captured.out.count(f"{path}: OK") == 2
+        assert f"{missing}: No such file or directory" in captured.err
+
+
+class TestCache:
+    def test_drift(self, folder):
+        """
+        Test verified files are recorded in the cache, and files whose digest
+        changed since they were last verified are reported.
+        """
+        stable = write_file(folder, "stable", b"stable")
+        rotten = write_file(folder, "rotten", b"rotten")
+        entries = [
+                ManifestEntry(hashlib.md5(b"stable").hexdigest(), stable),
+                ManifestEntry(hashlib.md5(b"rotten").hexdigest(), rotten),
+                ]
+
+        with ChecksumCache(os.path.join(folder, "cache.db")) as cache:
+            drift = verifier.DriftReport()
+            assert verifier.verify(
+                    entries, out=io.StringIO(), err=io.StringIO(),
+                    cache=cache, drift=drift) == 0
+            assert drift.to_dict() == {"n_files": 0, "files": []}
+            assert cache.get(stable)["digest"] == entries[0].digest
+            assert cache.get(stable)["result"] == "OK"
+
+            # Same size and modification time, different content.
+            stat = os.stat(rotten)
+            write_file(folder, "rotten", b"rottex")
+            os.utime(rotten, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+            drift = verifier.DriftReport()
+            err = io.StringIO()
+            assert verifier.verify(
+                    entries, out=io.StringIO(), err=err,
+                    cache=cache, drift=drift) == 1
+            report = drift.to_dict()
+            assert report["n_files"] == 1
+            assert report["files"][0]["path"] == rotten
+            assert report["files"][0]["previous_digest"] == entries[1].digest
+            assert report["files"][0]["digest"] == \
+                hashlib.md5(b"rottex").hexdigest()
+            assert not report["files"][0]["modified"]
+            assert "digest changed" in err.getvalue()
+            assert cache.get(rotten)["result"] == "FAILED"
+
+    def test_main_cache(self, folder):
+        path = write_file(folder, "file", b"content")
+        manifest = write_file(
+                folder, "manifest",
+                f"{hashlib.md5(b'content').hexdigest()}  {path}\n".encode())
+        cache_path = os.path.join(folder, "cache.db")
+        report = os.path.join(folder, "report.json")
+
+        assert verifier.main(
+                ["--cache", cache_path, "--report", report, manifest]) == 0
+
+        with open(report) as f:
+            assert json.load(f)["drift"] == {"n_files": 0, "files": []}
+        with ChecksumCache(cache_path) as cache:
+            assert cache.get(path)["size"] == len(b"content")
+
+
+class TestCompleteness:
+    def test_completeness(self, folder):
+        """
+        Test files are hashed without waiting for the walk, and files that
+        are not listed are reported without failing the verification.
+        """
+        listed = write_file(folder, "listed", b"listed")
+        os.mkdir(os.path.join(folder, "sub"))
+        untracked = write_file(folder, "sub/untracked", b"untracked")
+        entries = [ManifestEntry(hashlib.md5(b"listed").hexdigest(), listed)]
+        completeness = CompletenessReport(folder)
+        err = io.StringIO()
+
+        # The walk only lists the root once the listed file was checked.
+        checked = threading.Event()
+        list_directory = completeness.walker._list
+
+        def list_after_check(directory):
+            if not checked.wait(5):
+                raise OSError(errno.ETIMEDOUT, "file was not checked")
+            return list_directory(directory)
+
+        class Out(io.StringIO):
+            def write(self, text):
+                checked.set()
+                return super().write(text)
+
+        with mock.patch.object(
+                completeness.walker, "_list", side_effect=list_after_check):
+            assert verifier.verify(
+                    entries, out=Out(), err=err,
+                    completeness=completeness) == 0
+        assert completeness.walker.errors == []
+        assert completeness.untracked == [untracked]
+        assert completeness.missing == []
+        assert "1 file under" in err.getvalue()
+
+    def test_main_completeness(self, folder):
+        path = write_file(folder, "file", b"content")
+        manifest = write_file(
+                folder, "manifest",
+                f"{hashlib.md5(b'content').hexdigest()}  {path}\n"
+                f"{'0' * 32}  {folder}/missing\n".encode())
+        write_file(folder, "untracked", b"")
+        report = os.path.join(folder, "report.json")
+
+        assert verifier.main(
+                ["--completeness", folder, "--report", report,
+                 manifest]) == 1
+
+        with open(report) as f:
+            completeness = json.load(f)["completeness"]
+        # The manifest is not expected to be listed.
+        assert completeness["untracked"] == [f"{folder}/untracked"]
+        assert completeness["missing"] == [f"{folder}/missing"]
+        assert completeness["n_files"] == 3
+
+
+class TestMerkle:
+    def test_merkle(self, folder):
+        """
+        Test the digests computed are added to the tree, whether they match
+        or not, and files that cannot be read or are outside of its root
+        are left out.
+        """
+        os.mkdir(os.path.join(folder, "rf"))
+        ok = write_file(folder, "rf/ok", b"ok")
+        changed = write_file(folder, "rf/changed", b"changed")
+        outside = write_file(folder, "outside", b"outside")
+        entries = [
+            ManifestEntry(hashlib.md5(b"ok").hexdigest(), ok),
+            ManifestEntry("0" * 32, changed),
+            ManifestEntry("0" * 32, os.path.join(folder, "rf/missing")),
+            ManifestEntry(hashlib.md5(b"outside").hexdigest(), outside),
+            ManifestEntry(hashlib.md5(b"ok").hexdigest(), ok),
+            ]
+        merkle = MerkleTree(os.path.join(folder, "rf"))
+        err = io.StringIO()
+
+        assert verifier.verify(
+                entries, out=io.StringIO(), err=err, merkle=merkle) == 1
+
+        subtree = merkle.subtree()
+        assert subtree["n_files"] == 2
+        assert [
+            (child["name"], child["digest"])
+            for child in subtree["children"]] == [
+                ("changed", hashlib.md5(b"changed").hexdigest()),
+                ("ok", hashlib.md5(b"ok").hexdigest())]
+        assert "not added to the Merkle tree" in err.getvalue()
+
+    def test_main_merkle(self, folder):
+        os.makedirs(os.path.join(folder, "rf/sub"))
+        lines = []
+        for name in ("rf/a", "rf/sub/b"):
+            write_file(folder, name, name.encode())
+            lines.append(f"{hashlib.md5(name.encode()).hexdigest()}  {name}")
+        manifest = write_file(
+                folder, "manifest", "\n".join(lines).encode() + b"\n")
+        path = os.path.join(folder, "merkle.json")
+
+        cwd = os.getcwd()
+        os.chdir(folder)
+        try:
+            assert verifier.main(
+                    ["--merkle", path, "--merkle-root", "rf", manifest]) == 0
+        finally:
+            os.chdir(cwd)
+
+        merkle = MerkleTree.load(path)
+        assert merkle.root == "rf"
+        assert merkle.algorithm == "md5"
+        assert merkle.subtree("sub/b")["digest"] == (
+                hashlib.md5(b"rf/sub/b").hexdigest())
+        assert merkle.subtree()["n_files"] == 2
+
+
+class TestSmallFiles:
+    def test_batches(self, folder):
+        """
+        Test small regular files are batched by directory and inode.
+        """
+        paths = []
+        for directory in ("b", "a"):
+            os.mkdir(os.path.join(folder, directory))
+            for name in ("y", "x"):
+                paths.append(write_file(
+                    folder, os.path.join(directory, name), b"small"))
+        large = write_file(folder, "large", b"0" * 100)
+        stats = {path: os.stat(path) for path in paths + [large]}
+        stats[os.path.join(folder, "missing")] = None
+        stats[folder] = os.stat(folder)
+
+        with mock.patch.object(verifier, "SMALL_FILE_BATCH", 3):
+            batches = verifier._small_file_batches(stats, 10)
+
+        def by_inode(directory):
+            return sorted(
+                (path for path in paths
+                 if os.path.dirname(path) == os.path.join(folder, directory)),
+                key=lambda path: stats[path].st_ino)
+
+        assert sum(batches, []) == by_inode("a") + by_inode("b")
+        assert [len(batch) for batch in batches] == [3, 1]
+
+    @pytest.mark.parametrize("workers", [1, 3])
+    def test_verify(self, folder, workers):
+        """
+        Test small and large files are reported in manifest order.
+        """
+        entries = []
+        for i in range(20):
+            content = os.urandom(10 if i % 5 else 10000)
+            path = write_file(folder, f"file{i}", content)
+            digest = hashlib.md5(content).hexdigest()
+            if i == 7:
+                digest = "0" * 32
+            entries.append(ManifestEntry(digest, path))
+        entries.append(ManifestEntry("0" * 32, os.path.join(folder, "none")))
+        entries.append(entries[3])
+        out = io.StringIO()
+
+        with mock.patch.object(verifier, "SMALL_FILE_BATCH", 4):
+            assert verifier.verify(
+                    entries, out=out, err=io.StringIO(), block_size=4096,
+                    workers=workers) == 1
+
+        expected = [
+            f"{entry.path}: {'FAILED' if i == 7 else 'OK'}"
+            for i, entry in enumerate(entries[:20])]
+        expected += [
+            f"{entries[20].path}: FAILED open or read",
+            f"{entries[3].path}: OK"]
+        assert out.getvalue().splitlines() == expected
+
+    def test_stat_in_parallel(self, folder):
+        """
+        Test files are stat'ed on several threads at once.
+        """
+        entries = [
+            ManifestEntry(
+                hashlib.md5(name.encode()).hexdigest(),
+                write_file(folder, name, name.encode()))
+            for name in ("a", "b")]
+        # Each stat waits for the other one, so that they only complete if
+        # they run at the same time.
+        barrier = threading.Barrier(2, timeout=5)
+
+        def stat(path):
+            barrier.wait()
+            return os.stat(path)
+
+        with mock.patch.object(verifier, "STAT_BATCH", 1), \
+                mock.patch.object(
+                    verifier.LocalStorage, "stat", side_effect=stat):
+            assert verifier.verify(
+                    entries, out=io.StringIO(), err=io.StringIO(),
+                    workers=2) == 0
+
+    def test_open_without_noatime(self, folder):
+        """
+        Test files not owned by the user are opened all the same.
+        """
+        path = write_file(folder, "file", b"content")
+        o_noatime = getattr(os, "O_NOATIME", 0)
+        if not o_noatime:
+            pytest.skip("O_NOATIME is not supported")
+        real_open = os.open
+
+        def fake_open(path, flags):
+            if flags & o_noatime:
+                raise PermissionError(errno.EPERM, "Operation not permitted")
+            return real_open(path, flags)
+
+        with mock.patch.object(os, "open", side_effect=fake_open):
+            assert verifier.hash_file(path) == \
+                hashlib.md5(b"content").hexdigest()
+
+
+class TestScheduling:
+    def test_plan_tasks(self, folder):
+        """
+        Test large files are hashed first, by decreasing size, then small
+        files in batches.
+        """
+        sizes = {"a": 300, "b": 5, "c": 1000, "d": 300, "e": 5}
+        stats = {
+            write_file(folder, name, b"0" * size): None for name, size in
+            sizes.items()}
+        stats = {path: os.stat(path) for path in stats}
+        missing = os.path.join(folder, "missing")
+        stats[missing] = None
+
+        tasks = verifier._plan_tasks(stats, 10)
+        path = functools.partial(os.path.join, folder)
+        assert tasks[:4] == [[path("c")], [path("a")], [path("d")], [missing]]
+        assert sorted(tasks[4]) == [path("b"), path("e")]
+
+    def test_largest_first(self, folder):
+        """
+        Test files are hashed largest first, and reported in manifest order.
+        """
+        entries = []
+        for name, size in (("small", 10), ("medium", 5000), ("large", 9000)):
+            content = os.urandom(size)
+            entries.append(ManifestEntry(
+                hashlib.md5(content).hexdigest(),
+                write_file(folder, name, content)))
+        out = io.StringIO()
+
+        with mock.patch.object(
+                verifier, "hash_file", wraps=verifier.hash_file) as m:
+            assert verifier.verify(
+                    entries, out=out, err=io.StringIO(), block_size=4096) == 0
+
+        assert [c[0][0] for c in m.call_args_list] == [
+            entries[2].path, entries[1].path, entries[0].path]
+        assert out.getvalue().splitlines() == [
+            f"{entry.path}: OK" for entry in entries]
+
+
+class TestStorage:
+    @pytest.mark.parametrize("workers", [1, 3])
+    def test_verify(self, folder, workers):
+        """
+        Test files are read from an object store, large ones in ranges.
+        """
+        entries = []
+        for name, size in (("small", 10), ("large", 10000)):
+            content = os.urandom(size)
+            write_file(folder, name, content)
+            entries.append(
+                ManifestEntry(hashlib.md5(content).hexdigest(), f"rf/{name}"))
+        entries.append(ManifestEntry("0" * 32, "rf/small"))
+        entries.append(ManifestEntry("0" * 32, "rf/missing"))
+        out = io.StringIO()
+        err = io.StringIO()
+
+        with ObjectStore(folder, prefix="/bucket/rf") as store:
+            with HTTPStorage(
+                    store.url.rsplit("/", 1)[0], range_size=1000) as storage:
+                assert verifier.verify(
+                        entries, out=out, err=err, block_size=4096,
+                        workers=workers, storage=storage) == 1
+
+        assert out.getvalue().splitlines() == [
+            "rf/small: OK", "rf/large: OK", "rf/small: FAILED",
+            "rf/missing: FAILED open or read"]
+        assert "rf/missing: No such file or directory" in err.getvalue()
+
+    def test_main_cache(self, folder):
+        """
+        Test files read from an object store are cached by URL.
+        """
+        write_file(folder, "file", b"content")
+        manifest = write_file(
+                folder, "manifest",
+                f"{hashlib.md5(b'content').hexdigest()}  file\n".encode())
+        cache_path = os.path.join(folder, "cache.db")
+
+        with ObjectStore(folder) as store:
+            assert verifier.main([
+                "--storage", store.url, "--storage-connections", "2",
+                "--cache", cache_path, manifest]) == 0
+
+        with ChecksumCache(cache_path) as cache:
+            assert cache.get(f"{store.url}/file")["size"] == len(b"content")
+
+    def test_main_invalid_storage(self, folder):
+        manifest = write_file(folder, "manifest", b"")
+        assert verifier.main(["--storage", "ftp://host/bucket", manifest]) == 1
+
+
+class TestProcesses:
+    @pytest.mark.parametrize("start_method", ["fork", "forkserver"])
+    def test_verify(self, folder, start_method):
+        """
+        Test files are hashed by worker processes, and reported in manifest
+        order.
+        """
+        entries = []
+        for i in range(20):
+            content = os.urandom(10 if i % 5 else 10000)
+            digest = hashlib.md5(content).hexdigest() if i != 7 else "0" * 32
+            entries.append(
+                ManifestEntry(digest, write_file(folder, f"file{i}", content)))
+        entries.append(ManifestEntry("0" * 32, os.path.join(folder, "none")))
+        out = io.StringIO()
+        err = io.StringIO()
+
+        assert verifier.verify(
+                entries, out=out, err=err, block_size=4096, workers=3,
+                executor=verifier.EXECUTOR_PROCESSES,
+                start_method=start_method) == 1
+
+        expected = [
+            f"{entry.path}: {'FAILED' if i == 7 else 'OK'}"
+            for i, entry in enumerate(entries[:20])]
+        expected.append(f"{entries[20].path}: FAILED open or read")
+        assert out.getvalue().splitlines() == expected
+        assert f"{entries[20].path}: No such file or directory" in \
+            err.getvalue()
+
+    def test_verify_profile_decompressed(self, folder):
+        """
+        Test gzip files are inflated by worker processes, and the timings
+        of the workers added to the profile.
+        """
+        content = b"@read\nACGT\n+\nIIII\n" * 1000
+        entries = [
+            ManifestEntry(
+                hashlib.md5(content).hexdigest(),
+                write_file(folder, "reads.fastq.gz", gzip.compress(content))),
+            ManifestEntry(
+                hashlib.md5(content).hexdigest(),
+                write_file(folder, "reads.bam", bgzf_compress(content))),
+            ManifestEntry(
+                hashlib.md5(content).hexdigest(),
+                write_file(
+                    folder, "corrupt.gz", gzip.compress(content)[:-10])),
+            ]
+        profile = Profile()
+        out = io.StringIO()
+        err = io.StringIO()
+
+        assert verifier.verify(
+                entries, out=out, err=err, profile=profile, workers=2,
+                decompress=True, inflate_threads=4,
+                executor=verifier.EXECUTOR_PROCESSES) == 1
+
+        assert out.getvalue().splitlines() == [
+            f"{entries[0].path}: OK",
+            f"{entries[1].path}: OK",
+            f"{entries[2].path}: FAILED open or read"]
+        assert "truncated gzip data" in err.getvalue()
+        phases = profile.to_dict()["phases"]
+        assert phases["stat"]["count"] == 3
+        assert phases["open"]["count"] == 3
+        assert phases["write"]["count"] == 3
+
+    def test_verify_storage(self, folder):
+        """
+        Test each worker process reads from the object store through
+        connections of its own.
+        """
+        content = os.urandom(10000)
+        write_file(folder, "large", content)
+        entries = [
+            ManifestEntry(hashlib.md5(content).hexdigest(), "rf/large")]
+        out = io.StringIO()
+
+        with ObjectStore(folder, prefix="/bucket/rf") as store:
+            with HTTPStorage(
+                    store.url.rsplit("/", 1)[0], range_size=1000) as storage:
+                assert verifier.verify(
+                        entries, out=out, err=io.StringIO(), workers=2,
+                        storage=storage,
+                        executor=verifier.EXECUTOR_PROCESSES) == 0
+
+        assert out.getvalue() == "rf/large: OK\n"
+
+    def test_main(self, folder, capsys):
+        path = write_file(folder, "file", b"content")
+        manifest = write_file(
+                folder, "manifest",
+                f"{hashlib.md5(b'content').hexdigest()}  {path}\n".encode())
+
+        assert verifier.main([
+            "--workers", "2", "--executor", "processes", "--start-method",
+            "fork", manifest]) == 0
+        assert capsys.readouterr().out == f"{path}: OK\n"
+
+        with pytest.raises(SystemExit):
+            verifier._parse_args(["--executor", "greenlets", "m"])
@@ -0,0 +1,120 @@
+import os
+import tempfile
+import threading
+
+import mock
+import pytest
+
+from checksum.walker import CompletenessReport, TreeWalker
+
+
+@pytest.fixture
+def folder():
+    """
+    Current directory holding a runfolder "rf" with nested directories.
+    """
+    with tempfile.TemporaryDirectory() as folder:
+        cwd = os.getcwd()
+        os.chdir(folder)
+        try:
+            for directory in ("rf/a/b", "rf/c", "other"):
+                os.makedirs(directory)
+            for path in ("rf/x", "rf/a/y", "rf/a/b/z", "rf/c/w", "other/v"):
+                with open(path, "w") as f:
+                    f.write(path)
+            os.symlink("../other", "rf/linked_dir")
+            os.symlink("/nonexistent", "rf/dangling")
+            yield folder
+        finally:
+            os.chdir(cwd)
+
+
+class TestTreeWalker:
+    def test_walk(self, folder):
+        walker = TreeWalker("./rf/", workers=3)
+        walker.start()
+        walker.join()
+        files = walker.files()
+        assert set(files) == {
+                "rf/x", "rf/a/y", "rf/a/b/z", "rf/c/w", "rf/dangling"}
+        assert files["rf/a/b/z"].st_size == len("rf/a/b/z")
+        assert files["rf/dangling"] is None
+        assert walker.linked_directories == ["rf/linked_dir"]
+        assert walker.errors == []
+
+    def test_stat(self, folder):
+        walker = TreeWalker("rf")
+        walker.start()
+        assert walker.stat("rf/a/b/z").st_size == len("rf/a/b/z")
+        assert walker.stat("rf/a/missing") is None
+        # Not walked: outside of the root, or behind a symbolic link.
+        for path in ("other/v", "rf/linked_dir/v", "rf/gone/file"):
+            with pytest.raises(KeyError):
+                walker.stat(path)
+        walker.join()
+
+    def test_stat_without_blocking(self, folder):
+        walker = TreeWalker("rf")
+        with pytest.raises(KeyError):
+            walker.stat("rf/x", block=False)
+        walker.start()
+        walker.join()
+        assert walker.stat("rf/x", block=False).st_size == len("rf/x")
+
+    def test_stat_not_walked(self, folder):
+        """
+        Test files under directories the walk will not list are known
+        right away, without waiting for the rest of the walk.
+        """
+        walker = TreeWalker("rf", workers=2)
+        released = threading.Event()
+        list_directory = walker._list
+
+        def slow_list(directory):
+            if directory == "rf/c":
+                released.wait(5)
+            return list_directory(directory)
+
+        with mock.patch.object(walker, "_list", side_effect=slow_list):
+            walker.start()
+            try:
+                for path in ("rf/linked_dir/v", "rf/x/y", "rf/a/gone/z"):
+                    with pytest.raises(KeyError):
+                        walker.stat(path)
+                assert not walker._done
+            finally:
+                released.set()
+            walker.join()
+
+    def test_covers(self):
+        assert TreeWalker("rf").covers("rf/a")
+        assert not TreeWalker("rf").covers("rf")
+        assert not TreeWalker("rf").covers("rf2/a")
+        assert TreeWalker(".").covers("rf/a")
+        assert not TreeWalker(".").covers("../rf/a")
+        assert not TreeWalker(".").covers("/rf/a")
+
+    def test_missing_root(self, folder):
+        walker = TreeWalker("nonexistent")
+        walker.start()
+        walker.join()
+        assert walker.files() == {}
+        assert walker.errors == [("nonexistent", "No such file or directory")]
+
+
+class TestCompletenessReport:
+    def test_report(self, folder):
+        completeness = CompletenessReport("rf", workers=2)
+        completeness.start()
+        stats = {
+            path: completeness.stat(path)
+            for path in ("rf/x", "rf/a/y", "rf/a/gone")}
+        completeness.finish(stats, exclude=["rf/c/w"])
+        report = completeness.to_dict()
+        assert report["root"] == "rf"
+        assert report["n_files"] == 5
+        assert report["untracked"] == ["rf/a/b/z", "rf/dangling"]
+        assert report["n_untracked"] == 2
+        assert report["missing"] == ["rf/a/gone"]
+        assert report["unreadable_directories"] == []
+        assert report["linked_directories"] == ["rf/linked_dir"]
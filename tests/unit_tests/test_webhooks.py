@@ -0,0 +1,135 @@
+import asyncio
+import json
+import os
+import tempfile
+
+from tornado.testing import AsyncHTTPTestCase, gen_test
+from tornado.web import Application, RequestHandler
+
+from checksum.webhooks import WebhookService
+
+
+class Receiver(RequestHandler):
+    """
+    Stand-in for a webhook receiver, failing the first `n_failures` requests.
+    """
+
+    def initialize(self, received, n_failures):
+        self.received = received
+        self.n_failures = n_failures
+
+    def post(self):
+        self.received.append(json.loads(self.request.body))
+        if len(self.received) <= self.n_failures:
+            self.set_status(503)
+
+
+class WebhookTestCase(AsyncHTTPTestCase):
+    n_failures = 0
+
+    def get_app(self):
+        self.received = []
+        return Application([
+            (r"/hook", Receiver, {
+                "received": self.received, "n_failures": self.n_failures}),
+            ])
+
+    def setUp(self):
+        super().setUp()
+        self.spool = tempfile.TemporaryDirectory()
+        self.spool_path = os.path.join(self.spool.name, "spool.json")
+
+    def tearDown(self):
+        self.spool.cleanup()
+        super().tearDown()
+
+    def _read_spool(self):
+        try:
+            with open(self.spool_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+
+class TestWebhookService(WebhookTestCase):
+
+    @gen_test
+    async def test_notify(self):
+        webhooks = WebhookService(spool_path=self.spool_path)
+        webhooks.notify(self.get_url("/hook"), {"job_id": 1})
+        webhooks.notify(self.get_url("/hook"), {"job_id": 2})
+        await webhooks.join()
+
+        # Notifications queued together are sent in one request.
+        assert self.received == [
+            {"notifications": [{"job_id": 1}, {"job_id": 2}]}]
+        assert webhooks.pending() == 0
+        assert self._read_spool() == []
+
+    @gen_test
+    async def test_batch_size(self):
+        webhooks = WebhookService(batch_size=2)
+        for job_id in range(3):
+            webhooks.notify(self.get_url("/hook"), {"job_id": job_id})
+        await webhooks.join()
+
+        assert sorted(
+            len(body["notifications"]) for body in self.received) == [1, 2]
+
+    @gen_test
+    async def test_give_up(self):
+        webhooks = WebhookService(max_attempts=2, retry_delay=0.01)
+        webhooks.notify(self.get_url("/nowhere"), {"job_id": 1})
+        await webhooks.join()
+
+        assert webhooks.pending() == 0
+        assert self.received == []
+
+    def test_resume_from_spool(self):
+        with open(self.spool_path, mode='w') as f:
+            json.dump([{
+                "url": self.get_url("/hook"),
+                "payload": {"job_id": 1},
+                "attempts": 3,
+                "due": 0,
+                }], f)
+
+        webhooks = WebhookService(spool_path=self.spool_path)
+        assert webhooks.pending() == 1
+
+        async def resume():
+            webhooks.resume()
+            await webhooks.join()
+
+        self.io_loop.run_sync(resume)
+        assert self.received == [{"notifications": [{"job_id": 1}]}]
+
+
+class TestWebhookServiceRetry(WebhookTestCase):
+    n_failures = 1
+
+    @gen_test
+    async def test_notify(self):
+        webhooks = WebhookService(
+                spool_path=self.spool_path, retry_delay=0.01)
+        webhooks.notify(self.get_url("/hook"), {"job_id": 1})
+        await webhooks.join()
+
+        assert self.received == [
+            {"notifications": [{"job_id": 1}]},
+            {"notifications": [{"job_id": 1}]}]
+        assert webhooks.pending() == 0
+
+    @gen_test
+    async def test_spool_pending(self):
+        webhooks = WebhookService(
+                spool_path=self.spool_path, retry_delay=60)
+        webhooks.notify(self.get_url("/hook"), {"job_id": 1})
+
+        while not self._read_spool() or self._read_spool()[0]["attempts"] < 1:
+            await asyncio.sleep(0.01)
+        webhooks._sender.cancel()
+
+        pending = self._read_spool()
+        assert [delivery["payload"] for delivery in pending] == [{"job_id": 1}]
+        assert len(self.received) == 1